@@ -35,6 +35,9 @@ kumo.on("init", function()
 		-- configuration; this lower value makes it quicker to see
 		-- logs while you are first getting set up.
 		max_segment_duration = "10s",
+		-- Unique token set by the perf scripts (tests/kumoload): Reception records
+		-- carry it so that end-to-end latency can be joined with acceptance times
+		headers = { "X-Test-ID" },
 	})
 	
 	-- Enable debug logging for sink component
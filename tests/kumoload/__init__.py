@@ -0,0 +1,6 @@
+"""
+Briques communes aux scripts de test de performance KumoMTA
+
+Les scripts test_performance_*.py importent ces modules depuis le répertoire tests/.
+Tous les modules n'utilisent que la bibliothèque standard.
+"""
@@ -0,0 +1,228 @@
+"""
+Corpus de messages pré-rendus
+
+Les messages sont rendus en octets une seule fois, avant le run, selon une distribution de
+tailles (ex. "2KB-2MB"). Au moment de l'envoi, seul un jeton unique de largeur fixe est
+inséré: les segments du message sont des memoryview écrites telles quelles, sans
+ré-encodage ni copie du corps, pour que le CPU du driver ne pollue pas les mesures.
+
+Formats de distribution (unités B, KB, MB, base 1024):
+    4KB                      taille fixe
+    2KB-2MB                  log-uniforme entre les deux bornes
+    2KB:70,50KB:25,2MB:5     mélange pondéré (chaque élément peut être une plage)
+"""
+
+import os
+import re
+import json
+import math
+import time
+import random
+from email.utils import formatdate
+from typing import List, Optional, Sequence, Tuple
+
+from kumoload.smtp_async import PreparedData, normalize_eols, prepare_data
+
+# ============================================================================
+# JETON
+# ============================================================================
+
+# Jeton unique par message: <run 8 hex>-<numéro sur 11 chiffres>, largeur fixe
+TOKEN_WIDTH = 20
+PLACEHOLDER = b"~" * TOKEN_WIDTH
+
+# Identifiant du run, partagé par les processus workers créés par fork
+RUN_TOKEN = os.urandom(4).hex()
+
+
+def make_token(message_num: int, run_token: str = RUN_TOKEN) -> bytes:
+    """Jeton unique d'un message (en-têtes Message-ID, X-Test-ID et Subject)"""
+    return f"{run_token}-{message_num:011d}".encode("ascii")
+
+# ============================================================================
+# DISTRIBUTION DES TAILLES
+# ============================================================================
+
+_UNITS = {"": 1, "B": 1, "K": 1024, "KB": 1024, "KIB": 1024, "M": 1024 ** 2, "MB": 1024 ** 2, "MIB": 1024 ** 2}
+_SIZE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([A-Za-z]*)\s*$")
+
+
+def parse_size(text: str) -> int:
+    """Convertit '512', '4KB', '1.5MB' en octets"""
+    match = _SIZE_RE.match(text)
+    unit = match.group(2).upper() if match else None
+    if not match or unit not in _UNITS:
+        raise ValueError(f"Taille invalide: {text!r} (exemples: 512, 4KB, 2MB)")
+    return int(float(match.group(1)) * _UNITS[unit])
+
+
+def parse_size_distribution(spec: str) -> List[Tuple[int, int, float]]:
+    """Analyse une distribution de tailles: liste de (min, max, poids)"""
+    distribution = []
+    for item in spec.split(","):
+        sizes, _, weight = item.partition(":")
+        low, _, high = sizes.partition("-")
+        low = parse_size(low)
+        high = parse_size(high) if high else low
+        if high < low:
+            raise ValueError(f"Plage de tailles inversée: {sizes!r}")
+        distribution.append((low, high, float(weight) if weight else 1.0))
+    return distribution
+
+
+def sample_size(distribution: Sequence[Tuple[int, int, float]], rng: random.Random) -> int:
+    """Tire une taille: élément pondéré, puis log-uniforme dans sa plage"""
+    low, high, _ = rng.choices(distribution, weights=[w for _, _, w in distribution])[0]
+    if low == high:
+        return low
+    return int(math.exp(rng.uniform(math.log(max(1, low)), math.log(high))))
+
+
+def format_size(size: float) -> str:
+    for unit, factor in (("Mo", 1024 ** 2), ("Ko", 1024)):
+        if size >= factor:
+            return f"{size / factor:.1f} {unit}"
+    return f"{size:.0f} o"
+
+# ============================================================================
+# RENDU
+# ============================================================================
+
+_WORDS = ("kumomta queue spool egress tenant campaign throughput latency delivery "
+          "message listener inject sink metrics shaping domain bounce retry").split()
+
+
+def _filler_lines(rng: random.Random, count: int = 4096) -> List[bytes]:
+    """Lignes de texte 7 bits (jamais de '.' en début de ligne, donc pas de dot-stuffing)"""
+    lines = []
+    for _ in range(count):
+        words, length = [], 0
+        while length < 60:
+            word = rng.choice(_WORDS)
+            words.append(word)
+            length += len(word) + 1
+        lines.append(" ".join(words).encode("ascii") + b"\r\n")
+    return lines
+
+
+class Rendered:
+    """Octets rendus et positions du jeton; segments() découpe en vues sans copie"""
+
+    __slots__ = ("data", "view", "offsets")
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.view = memoryview(data)
+        self.offsets = [m.start() for m in re.finditer(re.escape(PLACEHOLDER), data)]
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def segments(self, token: bytes) -> list:
+        parts, pos = [], 0
+        for offset in self.offsets:
+            parts.append(self.view[pos:offset])
+            parts.append(token)
+            pos = offset + TOKEN_WIDTH
+        parts.append(self.view[pos:])
+        return parts
+
+    def render(self, token: bytes) -> bytes:
+        """Copie complète avec le jeton (chemins synchrones: smtplib, requests)"""
+        return b"".join(self.segments(token))
+
+
+class CorpusEntry:
+    """Un message du corpus: contenu MIME (CRLF), variante dot-stuffée et/ou chaîne JSON"""
+
+    __slots__ = ("size", "mime", "stuffed", "json")
+
+    def __init__(self, size: int, mime: Optional[Rendered], stuffed: Optional[Rendered],
+                 json_content: Optional[Rendered]):
+        self.size = size
+        self.mime = mime
+        self.stuffed = stuffed
+        self.json = json_content
+
+    def smtp_data(self, token: bytes) -> PreparedData:
+        """Contenu prêt pour DATA ou BDAT, jeton inséré"""
+        segments = self.mime.segments(token)
+        stuffed = segments if self.stuffed is self.mime else self.stuffed.segments(token)
+        return PreparedData(segments, stuffed)
+
+
+class Corpus:
+    """
+    Ensemble de `count` messages rendus selon `size_spec` (ou une entrée par taille de `sizes`)
+
+    encoding="smtp" conserve le MIME en CRLF (et sa variante dot-stuffée si elle diffère),
+    encoding="http" la chaîne JSON échappée du MIME, à placer dans "content" de /api/inject/v1.
+    """
+
+    def __init__(self, count: int, size_spec: str = "4KB", encoding: str = "smtp",
+                 from_header: str = "Performance Test <perf-test@talk.stir.com>",
+                 seed: Optional[int] = None, sizes: Optional[Sequence[int]] = None):
+        if encoding not in ("smtp", "http"):
+            raise ValueError(f"Encodage de corpus inconnu: {encoding}")
+        self.size_spec = size_spec
+        self.encoding = encoding
+        self.from_header = from_header
+        rng = random.Random(seed)
+        distribution = parse_size_distribution(size_spec)
+        filler = _filler_lines(rng)
+
+        start = time.perf_counter()
+        if sizes:
+            # Tailles imposées (classes de tailles d'une trace), une entrée par taille
+            self.entries = [self._render(size, filler, rng) for size in sizes]
+        else:
+            self.entries = [self._render(sample_size(distribution, rng), filler, rng) for _ in range(max(1, count))]
+        self.render_seconds = time.perf_counter() - start
+
+    def _render(self, size: int, filler: List[bytes], rng: random.Random) -> CorpusEntry:
+        token = PLACEHOLDER.decode("ascii")
+        head = (
+            f"From: {self.from_header}\r\n"
+            f"To: undisclosed-recipients:;\r\n"
+            f"Subject: Performance Test {token}\r\n"
+            f"Date: {formatdate(localtime=True)}\r\n"
+            f"Message-ID: <{token}@kumoload.test>\r\n"
+            f"X-Test-ID: {token}\r\n"
+            f"MIME-Version: 1.0\r\n"
+            f"Content-Type: text/plain; charset=\"us-ascii\"\r\n"
+            f"Content-Transfer-Encoding: 7bit\r\n"
+            f"\r\n"
+            f"Performance test message {token}\r\n"
+            f"This message is used to test queues, spools and generate metrics.\r\n"
+            f"Mode: SINK (messages will not be delivered)\r\n"
+            f"\r\n"
+        ).encode("ascii")
+
+        # Remplissage par lignes complètes jusqu'à la taille cible (dernière ligne tronquée)
+        parts, total = [head], len(head)
+        index = rng.randrange(len(filler))
+        while total < size:
+            line = filler[index % len(filler)]
+            if total + len(line) > size:
+                line = line[:max(0, size - total - 2)] + b"\r\n"
+            parts.append(line)
+            total += len(line)
+            index += 1
+        mime = normalize_eols(b"".join(parts))
+
+        if self.encoding == "http":
+            return CorpusEntry(len(mime), None, None, Rendered(json.dumps(mime.decode("ascii"))[1:-1].encode("ascii")))
+        stuffed = prepare_data(mime)
+        rendered = Rendered(mime)
+        return CorpusEntry(len(mime), rendered, rendered if stuffed == mime else Rendered(stuffed), None)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def entry(self, message_num: int) -> CorpusEntry:
+        return self.entries[message_num % len(self.entries)]
+
+    def describe(self) -> str:
+        sizes = [entry.size for entry in self.entries]
+        return (f"{len(sizes)} messages de {format_size(min(sizes))} à {format_size(max(sizes))} "
+                f"(moyenne {format_size(sum(sizes) / len(sizes))}), rendus en {self.render_seconds:.2f} s")
@@ -0,0 +1,306 @@
+"""
+Latence de bout en bout: de l'acceptation par kumod à l'arrivée sur le sink
+
+Chaque message généré porte un jeton unique dans l'en-tête X-Test-ID (voir corpus.make_token).
+Le driver note l'instant d'acceptation de chaque jeton (AcceptanceLog); les livraisons viennent
+de fichiers JSONL:
+    - journal du sink local (python3 -m kumoload.sink --delivery-log FICHIER):
+          {"id": "<jeton>", "t": <epoch s>, "queue": "<domaine>"}
+    - enregistrements de kumod (configure_local_logs avec headers = { "X-Test-ID" }): type
+      Delivery (kumod testé) ou Reception (kumod sink), champs timestamp, queue et headers.
+      Les segments compressés (.zst) nécessitent le module zstandard.
+
+Le collecteur joint acceptation et livraison par jeton et produit un histogramme par queue.
+
+Usage:
+    python3 -m kumoload.e2e ACCEPTATIONS.jsonl LIVRAISONS.jsonl [LIVRAISONS...] [--histogram-out FICHIER]
+"""
+
+import io
+import sys
+import json
+import time
+import array
+import argparse
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from kumoload.corpus import RUN_TOKEN, make_token
+from kumoload.histogram import LatencyHistogram, format_summary
+
+TEST_ID_HEADER = "X-Test-ID"
+
+# Types d'enregistrements kumod qui marquent l'arrivée d'un message à destination
+KUMOD_DELIVERY_TYPES = ("Delivery", "Reception")
+
+# ============================================================================
+# ACCEPTATIONS (DRIVER)
+# ============================================================================
+
+class AcceptanceLog:
+    """
+    Instants d'acceptation par numéro de message, dans un tableau typé (3 doubles par message)
+
+    array.extend() d'un tuple est atomique sous le GIL: les threads et la boucle asyncio
+    écrivent sans verrou; seul l'ajout d'une nouvelle queue prend un verrou.
+    """
+
+    def __init__(self, run_token: str = RUN_TOKEN):
+        self.run_token = run_token
+        self._data = array.array("d")
+        self.queues: List[str] = []
+        self._queue_index: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data) // 3
+
+    def _queue(self, name: str) -> int:
+        index = self._queue_index.get(name)
+        if index is None:
+            with self._lock:
+                index = self._queue_index.get(name)
+                if index is None:
+                    index = self._queue_index[name] = len(self.queues)
+                    self.queues.append(name)
+        return index
+
+    def record(self, message_num: int, queue: str, timestamp: Optional[float] = None):
+        self._data.extend((message_num, time.time() if timestamp is None else timestamp, self._queue(queue)))
+
+    def entries(self) -> Iterator[Tuple[str, float, str]]:
+        """(jeton, instant d'acceptation, queue)"""
+        data = self._data
+        for i in range(0, len(data), 3):
+            yield make_token(int(data[i]), self.run_token).decode("ascii"), data[i + 1], self.queues[int(data[i + 2])]
+
+    def merge(self, other: "AcceptanceLog"):
+        mapping = [self._queue(name) for name in other.queues]
+        data = other._data
+        for i in range(0, len(data), 3):
+            self._data.extend((data[i], data[i + 1], mapping[int(data[i + 2])]))
+
+    def to_dict(self) -> dict:
+        return {"run": self.run_token, "data": self._data.tobytes(), "queues": self.queues}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "AcceptanceLog":
+        log = cls(data["run"])
+        log._data.frombytes(data["data"])
+        log.queues = list(data["queues"])
+        log._queue_index = {name: index for index, name in enumerate(log.queues)}
+        return log
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            for token, timestamp, queue in self.entries():
+                f.write(json.dumps({"id": token, "t": round(timestamp, 6), "queue": queue}) + "\n")
+
+# ============================================================================
+# LECTURE DES LIVRAISONS
+# ============================================================================
+
+def open_text(path: str):
+    """Ouvre un fichier JSONL, décompressé à la volée si .zst (module zstandard optionnel)"""
+    if not path.endswith(".zst"):
+        return open(path, "r", encoding="utf-8", errors="replace")
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError(f"{path}: le module zstandard est requis pour lire les segments compressés "
+                           f"(pip install zstandard)")
+    return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb")),
+                            encoding="utf-8", errors="replace")
+
+
+def parse_event(line: str) -> Optional[Tuple[str, float, str]]:
+    """(jeton, instant, queue) d'une ligne du sink local ou d'un enregistrement kumod, sinon None"""
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(record, dict):
+        return None
+    if "id" in record and "t" in record:
+        return str(record["id"]), float(record["t"]), record.get("queue") or "?"
+    if record.get("type") in KUMOD_DELIVERY_TYPES:
+        headers = record.get("headers") or {}
+        token = next((value for name, value in headers.items() if name.lower() == TEST_ID_HEADER.lower()), None)
+        if token is None or "timestamp" not in record:
+            return None
+        if isinstance(token, list):
+            token = token[0] if token else None
+        return (str(token).strip(), float(record["timestamp"]), record.get("queue") or "?") if token else None
+    return None
+
+
+class DeliveryReader:
+    """Lit les fichiers de livraisons de façon incrémentale (reprise à la dernière position)"""
+
+    def __init__(self, paths: Sequence[str]):
+        self.paths = list(paths)
+        self._offsets = {path: 0 for path in self.paths if not path.endswith(".zst")}
+        self._read_compressed = False
+
+    def read_new(self) -> Iterator[Tuple[str, float, str]]:
+        for path in self.paths:
+            if path.endswith(".zst"):
+                # Segments compressés: lus une seule fois (kumod ne les modifie plus une fois fermés)
+                if self._read_compressed:
+                    continue
+                with open_text(path) as f:
+                    for line in f:
+                        event = parse_event(line)
+                        if event:
+                            yield event
+                continue
+            try:
+                with open(path, "rb") as f:
+                    f.seek(self._offsets[path])
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            # Ne consommer que les lignes complètes (le sink peut être en train d'écrire)
+            end = data.rfind(b"\n") + 1
+            self._offsets[path] += end
+            for line in data[:end].decode("utf-8", "replace").splitlines():
+                event = parse_event(line)
+                if event:
+                    yield event
+        self._read_compressed = True
+
+# ============================================================================
+# JOINTURE
+# ============================================================================
+
+class EndToEndCollector:
+    """Joint acceptations et livraisons par jeton: un histogramme de latence par queue"""
+
+    def __init__(self, accepted: Iterable[Tuple[str, float, str]], histogram_digits: int = 3):
+        self.histogram_digits = histogram_digits
+        self.accepted: Dict[str, Tuple[float, str]] = {token: (timestamp, queue) for token, timestamp, queue in accepted}
+        self.delivered = set()
+        self.by_queue: Dict[str, LatencyHistogram] = {}
+        self.total = LatencyHistogram(histogram_digits)
+        # Préfixes de run des jetons acceptés: les livraisons d'autres runs (journal partagé) sont ignorées
+        self.runs = {token.rpartition("-")[0] for token in self.accepted}
+        self.unknown = 0
+        self.other_runs = 0
+        self.duplicates = 0
+        self.negative = 0
+
+    def add(self, events: Iterable[Tuple[str, float, str]]):
+        for token, timestamp, queue in events:
+            accepted = self.accepted.get(token)
+            if accepted is None:
+                if token.rpartition("-")[0] in self.runs:
+                    self.unknown += 1
+                else:
+                    self.other_runs += 1
+                continue
+            if token in self.delivered:
+                # Lot à jeton partagé (corpus HTTP) ou relivraison: chaque livraison compte
+                self.duplicates += 1
+            self.delivered.add(token)
+            latency_ms = (timestamp - accepted[0]) * 1000
+            if latency_ms < 0:
+                # Livré avant que le driver lise la réponse, horloges décalées ou horodatage kumod à la seconde
+                self.negative += 1
+                latency_ms = 0.0
+            histogram = self.by_queue.get(queue)
+            if histogram is None:
+                histogram = self.by_queue[queue] = LatencyHistogram(self.histogram_digits)
+            histogram.record(latency_ms)
+            self.total.record(latency_ms)
+
+    @property
+    def pending(self) -> int:
+        return len(self.accepted) - len(self.delivered)
+
+    def wait(self, reader: DeliveryReader, timeout: float, poll: float = 1.0) -> bool:
+        """Lit les livraisons jusqu'à ce que tous les jetons acceptés soient arrivés, au plus `timeout` s"""
+        deadline = time.time() + timeout
+        while True:
+            self.add(reader.read_new())
+            if not self.pending or time.time() >= deadline:
+                return not self.pending
+            time.sleep(poll)
+
+    def undelivered_by_queue(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for token, (_, queue) in self.accepted.items():
+            if token not in self.delivered:
+                counts[queue] = counts.get(queue, 0) + 1
+        return counts
+
+    def format_report(self, queues: int = 10) -> str:
+        lines = [
+            f"  Acceptés:               {len(self.accepted)}",
+            f"  Livrés:                 {len(self.delivered)} ({self.total.count} livraisons)",
+            f"  Non livrés:             {self.pending}",
+        ]
+        if self.unknown:
+            lines.append(f"  Livraisons inconnues:   {self.unknown} (jeton du run absent des acceptations)")
+        if self.other_runs:
+            lines.append(f"  Autres runs:            {self.other_runs} livraisons ignorées")
+        if self.negative:
+            lines.append(f"  Latences négatives:     {self.negative} (livrés avant la lecture de la réponse, "
+                         f"ou horloges décalées: ramenées à 0)")
+        if not self.total.count:
+            return "\n".join(lines)
+        lines.append("")
+        lines.append("  Toutes queues:")
+        lines.append(format_summary(self.total, indent="    "))
+        ranked = sorted(self.by_queue.items(), key=lambda item: -item[1].count)
+        lines.append("")
+        lines.append(f"  {'queue':<40} {'messages':>9} {'P50 ms':>10} {'P99 ms':>10} {'max ms':>10}")
+        for queue, histogram in ranked[:queues]:
+            lines.append(f"  {queue[:40]:<40} {histogram.count:>9} {histogram.percentile(50):>10.1f} "
+                         f"{histogram.percentile(99):>10.1f} {histogram.max:>10.1f}")
+        if len(ranked) > queues:
+            lines.append(f"  ... {len(ranked) - queues} autres queues (voir --e2e-histogram-out)")
+        return "\n".join(lines)
+
+    def save(self, path: str):
+        """Exporte les histogrammes par queue (fusionnables) en JSON"""
+        with open(path, "w") as f:
+            json.dump({"total": self.total.to_dict(),
+                       "queues": {queue: histogram.to_dict() for queue, histogram in self.by_queue.items()}}, f)
+
+
+def load_accepted(path: str) -> Iterator[Tuple[str, float, str]]:
+    with open(path) as f:
+        for line in f:
+            event = parse_event(line)
+            if event:
+                yield event
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Latence de bout en bout: jointure acceptations / livraisons")
+    parser.add_argument("accepted", help="Acceptations écrites par le driver (--e2e-log)")
+    parser.add_argument("deliveries", nargs="+",
+                        help="Livraisons: journal du sink (--delivery-log) ou enregistrements kumod (.jsonl, .zst)")
+    parser.add_argument("--histogram-out", help="Exporte les histogrammes par queue en JSON")
+    parser.add_argument("--queues", type=int, default=10, help="Nombre de queues affichées (défaut: 10)")
+    args = parser.parse_args(argv)
+
+    try:
+        collector = EndToEndCollector(load_accepted(args.accepted))
+        collector.add(DeliveryReader(args.deliveries).read_new())
+    except (OSError, RuntimeError) as e:
+        print(f"✗ Erreur: {e}")
+        return 1
+    print("Latence de bout en bout (acceptation → livraison):")
+    print(collector.format_report(args.queues))
+    if args.histogram_out:
+        collector.save(args.histogram_out)
+        print(f"✓ Histogrammes par queue exportés: {args.histogram_out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
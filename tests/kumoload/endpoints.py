@@ -0,0 +1,241 @@
+"""
+Injection directe vers plusieurs endpoints (pods kumod), sans port-forward
+
+Un `kubectl port-forward` vers le Service fait passer tout le trafic par un seul tunnel: il plafonne
+le débit et masque la répartition entre réplicas. Ici, le driver se connecte directement aux IP des
+pods (découvertes par kubectl) ou à une liste explicite d'endpoints, avec un pool de connexions par
+endpoint, et mesure débit et latence de chacun pour repérer un réplica déséquilibré ou lent.
+
+Spécification des endpoints (--endpoints):
+    pods                                 IP des pods Running et prêts du sélecteur (kubectl get pods)
+    10.0.0.11,10.0.0.12:2525             liste explicite (port par défaut: celui du listener)
+    @endpoints.txt                       un endpoint par ligne
+
+Répartition (--endpoint-policy):
+    round-robin     message n vers l'endpoint n mod N: parts égales, un réplica lent se voit à sa latence
+    least-loaded    endpoint ayant le moins d'envois en cours: un réplica lent reçoit moins de messages
+"""
+
+import json
+import socket
+import asyncio
+import subprocess
+from statistics import median
+from typing import Any, Awaitable, Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+from kumoload.stats import RunStats
+from kumoload.workers import split_evenly
+
+POLICIES = ("round-robin", "least-loaded")
+
+# Sélecteur des pods kumod (labels du chart Helm)
+DEFAULT_POD_SELECTOR = "app.kubernetes.io/name=kumomta"
+
+# Seuils des alertes du rapport: part de messages vs part égale, P99 vs médiane des endpoints
+IMBALANCE_RATIO = 1.2
+SLOW_FACTOR = 2.0
+
+
+class Endpoint(NamedTuple):
+    """Adresse d'un listener kumod (IP de pod ou hôte), avec le nom du pod s'il est connu"""
+    host: str
+    port: int
+    name: str = ""
+
+    @property
+    def address(self) -> str:
+        return f"[{self.host}]:{self.port}" if ":" in self.host else f"{self.host}:{self.port}"
+
+    @property
+    def label(self) -> str:
+        return f"{self.name} ({self.address})" if self.name else self.address
+
+
+def parse_endpoint(text: str, default_port: int) -> Endpoint:
+    """host, host:port ou [ipv6]:port"""
+    text = text.strip()
+    try:
+        if text.startswith("["):
+            host, _, rest = text[1:].partition("]")
+            port = int(rest[1:]) if rest.startswith(":") else default_port
+        elif text.count(":") == 1:
+            host, port_text = text.split(":")
+            port = int(port_text)
+        else:
+            host, port = text, default_port
+    except ValueError:
+        raise ValueError(f"Endpoint invalide: {text!r} (attendu: hôte, hôte:port ou [ipv6]:port)")
+    if not host or not 0 < port < 65536:
+        raise ValueError(f"Endpoint invalide: {text!r} (attendu: hôte, hôte:port ou [ipv6]:port)")
+    return Endpoint(host, port)
+
+
+def discover_pod_endpoints(namespace: str, selector: str, port: int) -> List[Endpoint]:
+    """IP des pods Running (et prêts) du sélecteur, via kubectl"""
+    try:
+        result = subprocess.run(["kubectl", "get", "pods", "-n", namespace, "-l", selector, "-o", "json"],
+                                capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise RuntimeError(f"kubectl indisponible: {e}")
+    if result.returncode != 0:
+        raise RuntimeError(f"kubectl get pods a échoué: {result.stderr.strip()}")
+    endpoints = []
+    for pod in json.loads(result.stdout).get("items", []):
+        status = pod.get("status", {})
+        ready = all(condition.get("status") == "True" for condition in status.get("conditions", [])
+                    if condition.get("type") == "Ready")
+        if status.get("phase") == "Running" and status.get("podIP") and ready:
+            endpoints.append(Endpoint(status["podIP"], port, pod["metadata"]["name"]))
+    if not endpoints:
+        raise RuntimeError(f"Aucun pod Running et prêt pour {selector} dans le namespace {namespace}")
+    return sorted(endpoints, key=lambda endpoint: endpoint.name)
+
+
+def resolve_endpoints(spec: str, default_port: int, namespace: str = "kumomta",
+                      selector: str = DEFAULT_POD_SELECTOR) -> List[Endpoint]:
+    """Endpoints d'une spécification: pods (découverte kubectl), liste explicite ou @fichier"""
+    if spec.strip() == "pods":
+        return discover_pod_endpoints(namespace, selector, default_port)
+    if spec.startswith("@"):
+        with open(spec[1:]) as f:
+            items = [line for line in (line.split("#")[0].strip() for line in f) if line]
+    else:
+        items = [item for item in spec.split(",") if item.strip()]
+    endpoints = [parse_endpoint(item, default_port) for item in items]
+    if not endpoints:
+        raise ValueError(f"Aucun endpoint dans {spec!r}")
+    return endpoints
+
+
+def check_endpoints(endpoints: Sequence[Endpoint], timeout: float = 5.0) -> List[Tuple[Endpoint, str]]:
+    """Endpoints injoignables (connexion TCP) et leur erreur"""
+    unreachable = []
+    for endpoint in endpoints:
+        try:
+            socket.create_connection((endpoint.host, endpoint.port), timeout=timeout).close()
+        except OSError as e:
+            unreachable.append((endpoint, str(e)))
+    return unreachable
+
+# ============================================================================
+# POOLS PAR ENDPOINT
+# ============================================================================
+
+class EndpointPools:
+    """
+    Un pool de connexions (SMTPSessionPool, HTTPConnectionPool) par endpoint
+
+    `size` (sessions ou connexions du processus) est partagé entre les endpoints, au moins une
+    connexion chacun. call() choisit l'endpoint d'un message selon la politique de répartition.
+    """
+
+    def __init__(self, endpoints: Sequence[Endpoint], make_pool: Callable[[Endpoint, int], Any], size: int,
+                 policy: str = "round-robin"):
+        if policy not in POLICIES:
+            raise ValueError(f"Politique de répartition inconnue: {policy!r} ({', '.join(POLICIES)})")
+        self.endpoints = list(endpoints)
+        self.policy = policy
+        count = len(self.endpoints)
+        self.pools = [make_pool(endpoint, split_evenly(size, count, index))
+                      for index, endpoint in enumerate(self.endpoints)]
+        self.in_flight = [0] * count
+
+    def pick(self, message_num: int) -> int:
+        count = len(self.pools)
+        first = (message_num - 1) % count
+        if self.policy == "round-robin" or count == 1:
+            return first
+        # Moins d'envois en cours; à égalité, rotation à partir de l'endpoint du round-robin
+        return min(((first + offset) % count for offset in range(count)), key=self.in_flight.__getitem__)
+
+    async def call(self, message_num: int, send: Callable[[Any], Awaitable[Any]]) -> Tuple[int, Any]:
+        """Exécute send(pool) sur le pool de l'endpoint choisi, retourne (index de l'endpoint, résultat)"""
+        index = self.pick(message_num)
+        self.in_flight[index] += 1
+        try:
+            return index, await send(self.pools[index])
+        finally:
+            self.in_flight[index] -= 1
+
+    async def close(self):
+        await asyncio.gather(*(pool.close() for pool in self.pools), return_exceptions=True)
+
+# ============================================================================
+# COMPTEURS ET RAPPORT PAR ENDPOINT
+# ============================================================================
+
+class EndpointStats:
+    """Compteurs (RunStats) de chaque endpoint, fusionnables entre processus"""
+
+    def __init__(self, endpoints: Sequence[Endpoint], histogram_digits: int = 3):
+        self.endpoints = list(endpoints)
+        self.stats = [RunStats(histogram_digits) for _ in self.endpoints]
+
+    def record(self, index: int, success: bool, elapsed_ms: Optional[float], error: Optional[str] = None,
+               messages: int = 1, accepted: Optional[int] = None):
+        self.stats[index].record(success, elapsed_ms, error, messages, accepted)
+
+    def merge(self, other: "EndpointStats"):
+        for mine, theirs in zip(self.stats, other.stats):
+            mine.merge(theirs)
+
+    def to_dict(self) -> dict:
+        return {"endpoints": [list(endpoint) for endpoint in self.endpoints],
+                "stats": [stats.to_dict() for stats in self.stats]}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "EndpointStats":
+        endpoint_stats = cls([Endpoint(*endpoint) for endpoint in data["endpoints"]])
+        endpoint_stats.stats = [RunStats.from_dict(stats) for stats in data["stats"]]
+        return endpoint_stats
+
+    def warnings(self) -> List[str]:
+        """Réplicas déséquilibrés (part de messages) ou lents (P99 vs médiane des endpoints)"""
+        active = [(endpoint, stats) for endpoint, stats in zip(self.endpoints, self.stats) if stats.requests]
+        if len(active) < 2:
+            return []
+        alerts = []
+        total = sum(stats.messages for _, stats in active)
+        fair = total / len(self.endpoints)
+        for endpoint, stats in zip(self.endpoints, self.stats):
+            if fair and not fair / IMBALANCE_RATIO <= stats.messages <= fair * IMBALANCE_RATIO:
+                alerts.append(f"Déséquilibre: {endpoint.label} a reçu {stats.messages * 100 / total:.1f}% des messages "
+                              f"(part égale: {100 / len(self.endpoints):.1f}%)")
+        p99_median = median(stats.latency.percentile(99) for _, stats in active)
+        for endpoint, stats in active:
+            p99 = stats.latency.percentile(99)
+            if p99_median and p99 > p99_median * SLOW_FACTOR:
+                alerts.append(f"Réplica lent: {endpoint.label}, P99 {p99:.1f} ms > {SLOW_FACTOR:g} × la médiane "
+                              f"des endpoints ({p99_median:.1f} ms)")
+            failed = stats.failed / stats.messages if stats.messages else 0.0
+            if failed > 0.01:
+                alerts.append(f"Erreurs: {endpoint.label}, {failed * 100:.2f}% des messages")
+        return alerts
+
+    def format_report(self, duration: float) -> str:
+        total = sum(stats.messages for stats in self.stats)
+        width = max(8, *(len(endpoint.label) for endpoint in self.endpoints))
+        lines = [f"  {'endpoint':<{width}} {'messages':>9} {'part':>6} {'msg/s':>9} {'erreurs':>8} {'P50 ms':>9} "
+                 f"{'P99 ms':>9} {'max ms':>9}"]
+        for endpoint, stats in zip(self.endpoints, self.stats):
+            hist = stats.latency
+            error_rate = stats.failed / stats.messages if stats.messages else 0.0
+            lines.append(f"  {endpoint.label:<{width}} {stats.messages:>9} "
+                         f"{stats.messages * 100 / total if total else 0:>5.1f}% "
+                         f"{stats.messages / duration if duration else 0:>9.1f} {error_rate * 100:>7.2f}% "
+                         f"{hist.percentile(50):>9.2f} {hist.percentile(99):>9.2f} {hist.max:>9.2f}")
+        for alert in self.warnings():
+            lines.append(f"  ⚠ {alert}")
+        return "\n".join(lines)
+
+    def records(self, duration: float) -> List[dict]:
+        """Résultat par endpoint (--result-json)"""
+        records = []
+        for endpoint, stats in zip(self.endpoints, self.stats):
+            hist = stats.latency
+            records.append({"endpoint": endpoint.address, "name": endpoint.name, "messages": stats.messages,
+                            "success": stats.success, "failed": stats.failed,
+                            "throughput": round(stats.messages / duration, 1) if duration else 0.0,
+                            "p50_ms": hist.percentile(50), "p99_ms": hist.percentile(99), "max_ms": hist.max,
+                            "histogram": hist.to_dict()})
+        return records
@@ -0,0 +1,238 @@
+"""
+Histogramme de latences à mémoire constante (schéma HdrHistogram)
+
+Les valeurs sont rangées dans des buckets logarithmiques subdivisés linéairement: la
+mémoire est fixe quel que soit le nombre de messages, la précision relative est de
+`significant_digits` chiffres, et les percentiles sont disponibles à tout moment.
+Deux histogrammes de même configuration fusionnent exactement (addition des compteurs),
+ce qui permet d'agréger les exports JSON de plusieurs workers.
+
+Usage (fusion d'exports):
+    python3 -m kumoload.histogram worker1.json worker2.json [-o fusion.json]
+"""
+
+import sys
+import json
+import argparse
+from array import array
+from typing import Dict, Iterable, Optional
+
+FORMAT = "kumoload-histogram-v1"
+
+# Percentiles affichés par défaut
+DEFAULT_PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+
+class LatencyHistogram:
+    """
+    Histogramme de latences en millisecondes (résolution interne: la microseconde)
+
+    highest_ms borne la plage suivie; les valeurs au-delà sont comptées dans le dernier
+    bucket, mais le maximum exact reste connu.
+    """
+
+    def __init__(self, significant_digits: int = 3, highest_ms: float = 3_600_000.0):
+        if not 1 <= significant_digits <= 5:
+            raise ValueError("significant_digits doit être compris entre 1 et 5")
+        self.significant_digits = significant_digits
+        self.highest_ms = highest_ms
+        self._highest = int(highest_ms * 1000)
+
+        largest_single_unit = 2 * 10 ** significant_digits
+        self._sub_bucket_count_magnitude = max(1, (largest_single_unit - 1).bit_length())
+        self._sub_bucket_half_count_magnitude = self._sub_bucket_count_magnitude - 1
+        self._sub_bucket_count = 1 << self._sub_bucket_count_magnitude
+        self._sub_bucket_half_count = self._sub_bucket_count >> 1
+        self._sub_bucket_mask = self._sub_bucket_count - 1
+
+        bucket_count = 1
+        while (self._sub_bucket_count << (bucket_count - 1)) <= self._highest:
+            bucket_count += 1
+        self._counts = array("q", bytes(8 * (bucket_count + 1) * self._sub_bucket_half_count))
+
+        self.count = 0
+        self._sum = 0
+        self._min: Optional[int] = None
+        self._max = 0
+
+    # ------------------------------------------------------------------------
+    # Indexation
+    # ------------------------------------------------------------------------
+
+    def _index_of(self, value: int) -> int:
+        bucket_index = (value | self._sub_bucket_mask).bit_length() - self._sub_bucket_count_magnitude
+        sub_bucket_index = value >> bucket_index
+        return ((bucket_index + 1) << self._sub_bucket_half_count_magnitude) + sub_bucket_index - self._sub_bucket_half_count
+
+    def _value_range(self, index: int):
+        """Bornes [basse, haute] des valeurs (µs) rangées à cet index"""
+        bucket_index = (index >> self._sub_bucket_half_count_magnitude) - 1
+        sub_bucket_index = (index & (self._sub_bucket_half_count - 1)) + self._sub_bucket_half_count
+        if bucket_index < 0:
+            sub_bucket_index -= self._sub_bucket_half_count
+            bucket_index = 0
+        low = sub_bucket_index << bucket_index
+        return low, low + (1 << bucket_index) - 1
+
+    def _check_compatible(self, other: "LatencyHistogram"):
+        if (other.significant_digits, other._highest) != (self.significant_digits, self._highest):
+            raise ValueError("Histogrammes incompatibles (précision ou plage différente)")
+
+    # ------------------------------------------------------------------------
+    # Enregistrement et fusion
+    # ------------------------------------------------------------------------
+
+    def record(self, value_ms: float, count: int = 1):
+        """Enregistre une latence (ms)"""
+        value = max(0, int(value_ms * 1000))
+        self._counts[self._index_of(min(value, self._highest))] += count
+        self.count += count
+        self._sum += value * count
+        if self._min is None or value < self._min:
+            self._min = value
+        if value > self._max:
+            self._max = value
+
+    def merge(self, other: "LatencyHistogram"):
+        """Ajoute les compteurs d'un autre histogramme (fusion exacte)"""
+        self._check_compatible(other)
+        if not other.count:
+            return
+        counts = self._counts
+        for index, value in enumerate(other._counts):
+            if value:
+                counts[index] += value
+        self.count += other.count
+        self._sum += other._sum
+        if self._min is None or (other._min is not None and other._min < self._min):
+            self._min = other._min
+        self._max = max(self._max, other._max)
+
+    def copy(self) -> "LatencyHistogram":
+        clone = LatencyHistogram(self.significant_digits, self.highest_ms)
+        clone.merge(self)
+        return clone
+
+    def reset(self):
+        for index in range(len(self._counts)):
+            self._counts[index] = 0
+        self.count = 0
+        self._sum = 0
+        self._min = None
+        self._max = 0
+
+    # ------------------------------------------------------------------------
+    # Lecture
+    # ------------------------------------------------------------------------
+
+    @property
+    def min(self) -> float:
+        return (self._min or 0) / 1000
+
+    @property
+    def max(self) -> float:
+        return self._max / 1000
+
+    @property
+    def mean(self) -> float:
+        return self._sum / self.count / 1000 if self.count else 0.0
+
+    def percentile(self, percentile: float) -> float:
+        """Valeur (ms) sous laquelle se trouvent `percentile` % des mesures"""
+        if not self.count:
+            return 0.0
+        target = max(1, int(self.count * min(percentile, 100.0) / 100.0 + 0.5))
+        if target >= self.count:
+            return self.max
+        running = 0
+        for index, value in enumerate(self._counts):
+            if value:
+                running += value
+                if running >= target:
+                    return min(self._value_range(index)[1], self._max) / 1000
+        return self.max
+
+    def summary(self, percentiles: Iterable[float] = DEFAULT_PERCENTILES) -> Dict[str, float]:
+        """Résumé: count, min, mean, pXX, max"""
+        result = {"count": self.count, "min": self.min, "mean": self.mean}
+        for p in percentiles:
+            result[f"p{p:g}"] = self.percentile(p)
+        result["max"] = self.max
+        return result
+
+    # ------------------------------------------------------------------------
+    # Export / import
+    # ------------------------------------------------------------------------
+
+    def to_dict(self) -> dict:
+        """Export JSON: compteurs non nuls par index de bucket"""
+        return {
+            "format": FORMAT,
+            "significant_digits": self.significant_digits,
+            "highest_ms": self.highest_ms,
+            "count": self.count,
+            "sum_us": self._sum,
+            "min_us": self._min,
+            "max_us": self._max,
+            "counts": [[index, value] for index, value in enumerate(self._counts) if value],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LatencyHistogram":
+        if data.get("format") != FORMAT:
+            raise ValueError(f"Format d'histogramme inconnu: {data.get('format')}")
+        hist = cls(data["significant_digits"], data["highest_ms"])
+        for index, value in data["counts"]:
+            hist._counts[index] = value
+        hist.count = data["count"]
+        hist._sum = data["sum_us"]
+        hist._min = data["min_us"]
+        hist._max = data["max_us"]
+        return hist
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path: str) -> "LatencyHistogram":
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def format_summary(hist: LatencyHistogram, indent: str = "  ") -> str:
+    """Bloc texte aligné avec les statistiques des scripts de performance"""
+    lines = [
+        f"{indent}{'Minimum:':<22}{hist.min:.2f} ms",
+        f"{indent}{'Maximum:':<22}{hist.max:.2f} ms",
+        f"{indent}{'Moyenne:':<22}{hist.mean:.2f} ms",
+        f"{indent}{'Médiane:':<22}{hist.percentile(50):.2f} ms",
+    ]
+    if hist.count > 1:
+        for p in (90, 95, 99, 99.9):
+            lines.append(f"{indent}{f'P{p:g}:':<22}{hist.percentile(p):.2f} ms")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fusionne des exports d'histogrammes de latence")
+    parser.add_argument("files", nargs="+", help="Exports JSON (--histogram-out des scripts de performance)")
+    parser.add_argument("-o", "--output", help="Écrit l'histogramme fusionné dans ce fichier")
+    args = parser.parse_args()
+
+    merged = None
+    for path in args.files:
+        hist = LatencyHistogram.load(path)
+        if merged is None:
+            merged = hist
+        else:
+            merged.merge(hist)
+    print(f"Mesures: {merged.count} ({len(args.files)} fichier(s))")
+    print(format_summary(merged))
+    if args.output:
+        merged.save(args.output)
+        print(f"✓ Histogramme fusionné écrit dans {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
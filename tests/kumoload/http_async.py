@@ -0,0 +1,278 @@
+"""
+Client HTTP/1.1 asyncio avec connexions keep-alive
+
+Un pool de connexions persistantes par endpoint permet de garder plusieurs milliers
+d'injections /api/inject/v1 en vol depuis un seul processus.
+"""
+
+import time
+import base64
+import asyncio
+from typing import Dict, Iterable, NamedTuple, Optional, Sequence, Union
+
+from kumoload.phases import PhaseTimings
+
+# ============================================================================
+# PROTOCOLE
+# ============================================================================
+
+CRLF = b"\r\n"
+
+class StreamedBody(NamedTuple):
+    """Corps produit à la volée (--stream), envoyé en Transfer-Encoding: chunked"""
+    chunks: Iterable
+
+
+# Corps de requête: octets, segments (memoryview d'un corpus pré-rendu) écrits sans copie, ou flux
+Body = Union[bytes, Sequence, StreamedBody]
+
+
+class HTTPResponse(NamedTuple):
+    """Réponse HTTP (statut, en-têtes en minuscules, corps)"""
+    status: int
+    reason: str
+    headers: Dict[str, str]
+    body: bytes
+
+    @property
+    def text(self) -> str:
+        return self.body.decode("utf-8", "replace")
+
+
+class HTTPProtocolError(Exception):
+    """Réponse invalide ou connexion coupée: la connexion n'est plus réutilisable"""
+
+
+def basic_auth_header(user: str, password: str) -> str:
+    """Construit (une seule fois) la valeur de l'en-tête Authorization Basic"""
+    token = base64.b64encode(f"{user}:{password}".encode("utf-8")).decode("ascii")
+    return f"Basic {token}"
+
+
+async def read_response(reader: asyncio.StreamReader, status_line: Optional[bytes] = None) -> HTTPResponse:
+    """Lit une réponse HTTP/1.1 (Content-Length, chunked ou jusqu'à la fermeture), ligne de statut comprise si absente"""
+    try:
+        return await _parse_response(reader, status_line)
+    except ValueError as e:
+        # Taille de bloc ou Content-Length invalide, ligne au-delà de la limite du StreamReader
+        raise HTTPProtocolError(f"Réponse invalide: {e}") from None
+
+
+async def _parse_response(reader: asyncio.StreamReader, status_line: Optional[bytes]) -> HTTPResponse:
+    if status_line is None:
+        status_line = await reader.readline()
+    if not status_line:
+        raise HTTPProtocolError("Connexion fermée par le serveur")
+    parts = status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/") or not parts[1].isdigit():
+        raise HTTPProtocolError(f"Ligne de statut invalide: {status_line[:100]!r}")
+    status, reason = int(parts[1]), parts[2] if len(parts) > 2 else ""
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise HTTPProtocolError("Connexion fermée pendant les en-têtes")
+        if line in (b"\r\n", b"\n"):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size_line = await reader.readline()
+            size = int(size_line.split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                # Trailers éventuels jusqu'à la ligne vide
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        body = b"".join(chunks)
+    elif "content-length" in headers:
+        body = await reader.readexactly(int(headers["content-length"]))
+    elif status in (204, 304) or 100 <= status < 200:
+        body = b""
+    else:
+        body = await reader.read()
+        headers["connection"] = "close"
+    return HTTPResponse(status, reason, headers, body)
+
+# ============================================================================
+# CONNEXION
+# ============================================================================
+
+class AsyncHTTPConnection:
+    """Connexion HTTP/1.1 persistante vers un endpoint"""
+
+    def __init__(self, host: str, port: int, timeout: float = 30.0, phases: Optional[PhaseTimings] = None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.phases = phases
+        self.requests = 0
+        self.keep_alive = True
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    @property
+    def closed(self) -> bool:
+        # at_eof(): le serveur a fermé la connexion inactive (timeout keep-alive)
+        return (self.writer is None or self.writer.is_closing() or not self.keep_alive
+                or self.reader.at_eof())
+
+    def _mark(self, phase: str, start: float) -> float:
+        """Enregistre la durée de la phase depuis start (si --phases) et retourne l'instant courant"""
+        now = time.perf_counter()
+        if self.phases is not None:
+            self.phases.record(phase, (now - start) * 1000)
+        return now
+
+    async def connect(self):
+        start = time.perf_counter()
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout
+        )
+        self._mark("connect", start)
+
+    async def _drain(self):
+        if self.writer.transport.get_write_buffer_size():
+            # Tampon d'émission non vidé d'un coup: attente de la socket (contenu volumineux)
+            await asyncio.wait_for(self.writer.drain(), self.timeout)
+
+    async def _read_response(self) -> HTTPResponse:
+        start = time.perf_counter()
+        try:
+            status_line = await self.reader.readline()
+        except ValueError as e:
+            raise HTTPProtocolError(f"Réponse invalide: {e}") from None
+        self._mark("ttfb", start)
+        return await read_response(self.reader, status_line)
+
+    async def request(self, method: str, path: str, headers: Dict[str, str], body: Body = b"") -> HTTPResponse:
+        """Envoie une requête et lit la réponse complète"""
+        streamed = isinstance(body, StreamedBody)
+        segments = [body] if isinstance(body, (bytes, bytearray)) else () if streamed else body
+        head = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}",
+                "Transfer-Encoding: chunked" if streamed
+                else f"Content-Length: {sum(len(segment) for segment in segments)}"]
+        head.extend(f"{name}: {value}" for name, value in headers.items())
+        start = time.perf_counter()
+        self.writer.writelines(["\r\n".join(head).encode("latin-1") + CRLF + CRLF, *segments])
+        self.requests += 1
+        try:
+            if streamed:
+                # Un bloc à la fois: le tampon d'émission ne dépasse jamais un bloc
+                for chunk in body.chunks:
+                    if chunk:
+                        self.writer.writelines([b"%x\r\n" % len(chunk), chunk, CRLF])
+                        await self._drain()
+                self.writer.write(b"0\r\n\r\n")
+            await self._drain()
+            self._mark("upload", start)
+            response = await asyncio.wait_for(self._read_response(), self.timeout)
+        except asyncio.TimeoutError:
+            raise HTTPProtocolError(f"Pas de réponse du serveur après {self.timeout}s")
+        except asyncio.IncompleteReadError:
+            raise HTTPProtocolError("Réponse tronquée")
+        self.keep_alive = response.headers.get("connection", "").lower() != "close"
+        return response
+
+    def abort(self):
+        """Ferme la connexion sans attendre (réponse lue à moitié, requête annulée)"""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+            self.writer = None
+
+# ============================================================================
+# POOL DE CONNEXIONS
+# ============================================================================
+
+class HTTPConnectionPool:
+    """
+    Pool de connexions keep-alive vers un endpoint
+
+    Au plus `size` connexions sont ouvertes ; une requête attend qu'une connexion se libère.
+    Les en-têtes communs (Authorization, Content-Type) sont construits une seule fois.
+    """
+
+    def __init__(self, host: str, port: int, size: int, timeout: float = 30.0,
+                 default_headers: Optional[Dict[str, str]] = None, phases: Optional[PhaseTimings] = None):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self.default_headers = dict(default_headers or {})
+        self.phases = phases
+        self.connections_opened = 0
+        self._slots: "asyncio.Queue[Optional[AsyncHTTPConnection]]" = asyncio.Queue()
+        for _ in range(size):
+            self._slots.put_nowait(None)
+
+    async def request(self, method: str, path: str, body: Body = b"") -> HTTPResponse:
+        """Envoie une requête sur une connexion libre du pool (ré-ouverte si le serveur l'a fermée)"""
+        conn = await self._slots.get()
+        start = time.perf_counter()
+        try:
+            if conn is not None and conn.closed:
+                await conn.close()
+                conn = None
+            if conn is None:
+                conn = AsyncHTTPConnection(self.host, self.port, self.timeout, self.phases)
+                await conn.connect()
+                self.connections_opened += 1
+            response = await conn.request(method, path, self.default_headers, body)
+            if self.phases is not None:
+                self.phases.record("total", (time.perf_counter() - start) * 1000)
+            return response
+        except BaseException:
+            # Toute erreur, annulation comprise, peut laisser une réponse à moitié lue: la
+            # connexion ne retourne pas au pool
+            if conn is not None:
+                conn.abort()
+                conn = None
+            raise
+        finally:
+            self._slots.put_nowait(conn)
+
+    async def close(self):
+        """Ferme toutes les connexions inactives du pool"""
+        conns = []
+        while not self._slots.empty():
+            conn = self._slots.get_nowait()
+            if conn is not None:
+                conns.append(conn.close())
+        await asyncio.gather(*conns, return_exceptions=True)
+
+
+async def request_with_timing(pool: HTTPConnectionPool, method: str, path: str, body: Body):
+    """Requête via le pool, retourne (réponse ou None, temps_ms, erreur réseau/protocole)"""
+    start_time = time.perf_counter()
+    try:
+        response = await pool.request(method, path, body)
+        return response, (time.perf_counter() - start_time) * 1000, None
+    except HTTPProtocolError as e:
+        return None, (time.perf_counter() - start_time) * 1000, f"HTTP error: {e}"
+    except (ConnectionRefusedError, OSError, asyncio.TimeoutError) as e:
+        return None, (time.perf_counter() - start_time) * 1000, f"Connection error: {e!r}"
+
+
+async def post_with_timing(pool: HTTPConnectionPool, path: str, body: Body):
+    """POST via le pool et retourne (succès, temps_ms, erreur)"""
+    response, elapsed_ms, error = await request_with_timing(pool, "POST", path, body)
+    if response is None:
+        return False, elapsed_ms, error
+    if 200 <= response.status < 300:
+        return True, elapsed_ms, None
+    return False, elapsed_ms, f"HTTP {response.status}: {response.text[:200]}"
@@ -0,0 +1,163 @@
+"""
+Injection simultanée SMTP + HTTP: répartition des messages et rapport d'interférence
+
+Les deux listeners de kumod (ESMTP et /api/inject/v1) alimentent le même spool et les mêmes
+queues. ProtocolSplit attribue chaque numéro de message à un protocole selon un ratio, de façon
+déterministe et régulière (les deux protocoles sont entrelacés tout au long du run, identiques
+dans tous les processus).
+
+L'interférence se mesure en comparant chaque protocole seul (à sa part du débit ou avec sa propre
+concurrence) au même protocole dans le run mixte: format_interference donne l'écart des
+percentiles entre les deux phases.
+
+Spécification du ratio (--ratio):
+    smtp:70,http:30     parts pondérées (normalisées)
+    70:30               parts SMTP:HTTP
+    0.7                 part du SMTP
+"""
+
+import math
+from typing import Dict, Iterable, Iterator
+
+from kumoload.stats import RunStats
+
+PROTOCOLS = ("smtp", "http")
+
+# Percentiles comparés entre phase isolée et phase mixte
+COMPARED_PERCENTILES = (50, 90, 99, 99.9)
+
+
+def parse_ratio(spec: str) -> Dict[str, float]:
+    """Parts de chaque protocole (somme 1) d'une spécification smtp:70,http:30, 70:30 ou 0.7"""
+    try:
+        if "," in spec or any(name in spec.lower() for name in PROTOCOLS):
+            weights = {name: 0.0 for name in PROTOCOLS}
+            for part in spec.split(","):
+                name, _, weight = part.partition(":")
+                name = name.strip().lower()
+                if name not in weights:
+                    raise ValueError
+                weights[name] = float(weight)
+        elif ":" in spec:
+            smtp, http = spec.split(":")
+            weights = {"smtp": float(smtp), "http": float(http)}
+        else:
+            share = float(spec)
+            if not 0 <= share <= 1:
+                raise ValueError
+            weights = {"smtp": share, "http": 1 - share}
+    except ValueError:
+        raise ValueError(f"Ratio invalide: {spec!r} (attendu: smtp:70,http:30, 70:30 ou 0.7)")
+    total = sum(weights.values())
+    if any(weight < 0 or math.isnan(weight) for weight in weights.values()) or total <= 0:
+        raise ValueError(f"Ratio invalide: {spec!r} (poids positifs attendus)")
+    return {name: weight / total for name, weight in weights.items()}
+
+
+class ProtocolSplit:
+    """
+    Protocole de chaque numéro de message (1..N)
+
+    Le message n est SMTP si floor(n × part) > floor((n - 1) × part): sur toute plage de numéros,
+    l'écart au ratio reste inférieur à un message, sans rafale d'un seul protocole.
+    """
+
+    def __init__(self, shares: Dict[str, float]):
+        self.shares = shares
+        self.smtp_share = shares.get("smtp", 0.0)
+
+    @classmethod
+    def from_spec(cls, spec: str) -> "ProtocolSplit":
+        return cls(parse_ratio(spec))
+
+    def protocol_of(self, message_num: int) -> str:
+        share = self.smtp_share
+        return "smtp" if math.floor(message_num * share) > math.floor((message_num - 1) * share) else "http"
+
+    def count(self, message_nums: range) -> Dict[str, int]:
+        """Messages de chaque protocole dans une plage contiguë (sans la parcourir)"""
+        smtp = (math.floor((message_nums.stop - 1) * self.smtp_share)
+                - math.floor((message_nums.start - 1) * self.smtp_share)) if len(message_nums) else 0
+        return {"smtp": smtp, "http": len(message_nums) - smtp}
+
+    def select(self, message_nums: Iterable[int], protocols: Iterable[str]) -> Iterator[int]:
+        """Numéros des messages des protocoles donnés (itérateur paresseux)"""
+        wanted = set(protocols)
+        if wanted.issuperset(PROTOCOLS):
+            return iter(message_nums)
+        return (num for num in message_nums if self.protocol_of(num) in wanted)
+
+    @property
+    def active(self):
+        """Protocoles de part non nulle"""
+        return [name for name in PROTOCOLS if self.shares.get(name)]
+
+    def describe(self) -> str:
+        return ", ".join(f"{name.upper()} {self.shares.get(name, 0.0) * 100:.0f}%" for name in PROTOCOLS)
+
+# ============================================================================
+# RAPPORTS
+# ============================================================================
+
+def combine(per_protocol: Dict[str, RunStats]) -> RunStats:
+    """Compteurs et histogramme combinés de tous les protocoles"""
+    digits = next((stats.latency.significant_digits for stats in per_protocol.values()), 3)
+    stats = RunStats(digits)
+    for protocol_stats in per_protocol.values():
+        stats.merge(protocol_stats)
+    return stats
+
+
+def format_protocol_table(per_protocol: Dict[str, RunStats], duration: float) -> str:
+    """Une ligne par protocole et une ligne combinée: messages, débit, erreurs et percentiles"""
+    rows = [(name.upper(), stats) for name, stats in per_protocol.items() if stats.requests]
+    if len(rows) > 1:
+        rows.append(("Combiné", combine(per_protocol)))
+    lines = [f"  {'':<9} {'messages':>9} {'msg/s':>9} {'erreurs':>8} {'P50 ms':>9} {'P90 ms':>9} {'P99 ms':>9} "
+             f"{'P99.9 ms':>9} {'max ms':>9}"]
+    for label, stats in rows:
+        hist = stats.latency
+        error_rate = stats.failed / stats.messages if stats.messages else 0.0
+        lines.append(f"  {label:<9} {stats.messages:>9} {stats.messages / duration if duration else 0:>9.1f} "
+                     f"{error_rate * 100:>7.2f}% {hist.percentile(50):>9.2f} {hist.percentile(90):>9.2f} "
+                     f"{hist.percentile(99):>9.2f} {hist.percentile(99.9):>9.2f} {hist.max:>9.2f}")
+    return "\n".join(lines)
+
+
+def _delta(solo: float, mixed: float) -> str:
+    if not solo:
+        return "-"
+    return f"{(mixed - solo) * 100 / solo:+.0f}%"
+
+
+def format_interference(solo: Dict[str, RunStats], mixed: Dict[str, RunStats]) -> str:
+    """Écart des percentiles de chaque protocole entre sa phase isolée et la phase mixte"""
+    lines = [f"  {'':<6} {'':<9}" + "".join(f" {f'P{p:g} ms':>9}" for p in COMPARED_PERCENTILES)
+             + f" {'erreurs':>8}"]
+    for name in PROTOCOLS:
+        alone, together = solo.get(name), mixed.get(name)
+        if alone is None or together is None or not alone.requests or not together.requests:
+            continue
+        for label, stats in (("seul", alone), ("mixte", together)):
+            error_rate = stats.failed / stats.messages if stats.messages else 0.0
+            lines.append(f"  {name.upper() if label == 'seul' else '':<6} {label:<9}"
+                         + "".join(f" {stats.latency.percentile(p):>9.2f}" for p in COMPARED_PERCENTILES)
+                         + f" {error_rate * 100:>7.2f}%")
+        lines.append(f"  {'':<6} {'écart':<9}"
+                     + "".join(f" {_delta(alone.latency.percentile(p), together.latency.percentile(p)):>9}"
+                               for p in COMPARED_PERCENTILES))
+    return "\n".join(lines)
+
+
+def interference_record(solo: Dict[str, RunStats], mixed: Dict[str, RunStats]) -> Dict[str, dict]:
+    """Percentiles seul/mixte par protocole (--result-json)"""
+    record = {}
+    for name in PROTOCOLS:
+        alone, together = solo.get(name), mixed.get(name)
+        if alone is None or together is None or not alone.requests or not together.requests:
+            continue
+        record[name] = {
+            label: {f"p{p:g}": stats.latency.percentile(p) for p in COMPARED_PERCENTILES}
+            for label, stats in (("solo", alone), ("mixed", together))
+        }
+    return record
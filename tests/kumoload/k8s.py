@@ -0,0 +1,232 @@
+"""
+Préparation de l'environnement et accès Kubernetes communs aux scripts de test
+
+setup_environment (ré)exécute le script dans le venv tests/.venv et installe ses dépendances.
+Les fonctions kubectl trouvent le service KumoMTA et ouvrent les port-forwards locaux: un
+port-forward kubectl déjà ouvert sur le port est réutilisé (et laissé ouvert), ceux ouverts ici
+sont arrêtés par cleanup_port_forwards.
+"""
+
+import os
+import sys
+import time
+import signal
+import importlib
+import subprocess
+from typing import List, Optional, Tuple
+
+# Port-forwards ouverts par le script courant (les port-forwards existants ne sont pas arrêtés)
+port_forward_processes: List[subprocess.Popen] = []
+
+
+def setup_environment(script_file: str, requirements: Optional[str] = None, module: Optional[str] = None,
+                      ready: Optional[str] = None):
+    """
+    Configure l'environnement virtuel et installe les dépendances
+
+    Hors venv, crée tests/.venv au besoin et réexécute le script avec son Python. `requirements`
+    (relatif au script) est installé si `module` n'est pas importable; `ready` est affiché sinon.
+    """
+    script_dir = os.path.dirname(os.path.abspath(script_file))
+    venv_dir = os.path.join(script_dir, '.venv')
+
+    # Vérifier si on est déjà dans un venv
+    in_venv = hasattr(sys, 'real_prefix') or (hasattr(sys, 'base_prefix') and sys.base_prefix != sys.prefix)
+
+    if not in_venv:
+        # Créer un venv si nécessaire
+        if not os.path.exists(venv_dir):
+            print("⏳ Création de l'environnement virtuel...")
+            subprocess.run([sys.executable, '-m', 'venv', venv_dir], check=True)
+            print("✓ Environnement virtuel créé")
+
+        # Activer le venv
+        if sys.platform == 'win32':
+            python_exe = os.path.join(venv_dir, 'Scripts', 'python.exe')
+        else:
+            python_exe = os.path.join(venv_dir, 'bin', 'python')
+
+        # Réexécuter le script avec le Python du venv
+        if os.path.exists(python_exe) and sys.executable != python_exe:
+            print("⏳ Activation de l'environnement virtuel...")
+            os.execv(python_exe, [python_exe] + sys.argv)
+            return  # Ne revient jamais ici car execv remplace le processus
+        elif not os.path.exists(python_exe):
+            print("⚠ Impossible de trouver le Python du venv, utilisation du Python système")
+
+    # Installer les dépendances
+    requirements_file = os.path.join(script_dir, requirements) if requirements else None
+    if requirements_file and os.path.exists(requirements_file):
+        print("⏳ Vérification des dépendances...")
+        try:
+            importlib.import_module(module)
+            print("✓ Dépendances déjà installées")
+        except ImportError:
+            print("⏳ Installation des dépendances...")
+            pip_cmd = [sys.executable, '-m', 'pip', 'install', '-q', '-r', requirements_file]
+            subprocess.run(pip_cmd, check=True)
+            print("✓ Dépendances installées")
+    elif ready:
+        print(ready)
+
+
+def check_kubectl() -> bool:
+    """Vérifie que kubectl est disponible"""
+    try:
+        subprocess.run(['kubectl', 'version', '--client'],
+                       capture_output=True, check=True)
+        return True
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return False
+
+
+def find_service(namespace: str, release_name: str, service_name: str) -> Optional[str]:
+    """Trouve le service Kubernetes: `service_name`, sinon <release> ou <release>-kumomta"""
+    try:
+        # Essayer d'abord avec le nom exact
+        result = subprocess.run(
+            ['kubectl', 'get', 'service', service_name, '-n', namespace],
+            capture_output=True, text=True
+        )
+        if result.returncode == 0:
+            return service_name
+
+        # Chercher automatiquement
+        result = subprocess.run(
+            ['kubectl', 'get', 'services', '-n', namespace, '-o', 'jsonpath={.items[*].metadata.name}'],
+            capture_output=True, text=True
+        )
+        if result.returncode == 0:
+            services = result.stdout.strip().split()
+            for svc in services:
+                if svc == release_name or svc == f"{release_name}-kumomta":
+                    return svc
+    except Exception:
+        pass
+    return None
+
+
+def require_service(namespace: str, release_name: str, service_name: str) -> str:
+    """Vérifie kubectl et trouve le service, quitte le script en cas d'échec"""
+    if not check_kubectl():
+        print("✗ Erreur: kubectl n'est pas installé ou n'est pas dans le PATH")
+        sys.exit(1)
+
+    print("⏳ Vérification du service Kubernetes...")
+    service = find_service(namespace, release_name, service_name)
+    if not service:
+        print(f"✗ Erreur: Le service {service_name} n'existe pas dans le namespace {namespace}")
+        sys.exit(1)
+    print(f"✓ Service trouvé: {service}")
+    return service
+
+
+def check_port_in_use(port: int) -> Tuple[bool, Optional[int], bool]:
+    """Vérifie si le port est utilisé et si c'est un port-forward kubectl"""
+    try:
+        result = subprocess.run(
+            ['lsof', '-ti', f':{port}'],
+            capture_output=True, text=True
+        )
+        if result.returncode == 0:
+            pid = int(result.stdout.strip().split()[0])
+            # Vérifier si c'est un port-forward kubectl
+            ps_result = subprocess.run(
+                ['ps', '-p', str(pid), '-o', 'command='],
+                capture_output=True, text=True
+            )
+            is_kubectl_pf = 'kubectl' in ps_result.stdout and 'port-forward' in ps_result.stdout
+            return True, pid, is_kubectl_pf
+    except Exception:
+        pass
+    return False, None, False
+
+
+def start_port_forward(namespace: str, service: str, local_port: int, remote_port: int) -> Optional[subprocess.Popen]:
+    """Lance `kubectl port-forward` et attend qu'il soit prêt; le processus est arrêté par cleanup_port_forwards"""
+    process = subprocess.Popen(
+        ['kubectl', 'port-forward', '-n', namespace, f'service/{service}', f'{local_port}:{remote_port}'],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    time.sleep(3)  # Attendre que le port-forward soit prêt
+
+    # Vérifier que le processus est toujours actif
+    if process.poll() is None:
+        port_forward_processes.append(process)
+        return process
+    stdout, stderr = process.communicate()
+    print(f"  Erreur: {stderr.decode().strip()}")
+    return None
+
+
+def setup_port_forward(namespace: str, service: str, local_port: int, remote_port: int, port_variable: str) -> bool:
+    """
+    Ouvre (ou réutilise) le port-forward local_port -> remote_port, retourne False en cas d'échec
+
+    Si le port est pris par un autre processus, propose de l'arrêter, sinon quitte le script
+    en indiquant la variable (`port_variable`) qui choisit un autre port.
+    """
+    # Vérifier si le port est déjà utilisé
+    in_use, pid, is_kubectl = check_port_in_use(local_port)
+
+    if in_use and is_kubectl:
+        print(f"✓ Réutilisation du port-forward existant sur le port {local_port} (PID: {pid})")
+        return True
+    elif in_use:
+        response = input(f"⚠ Le port {local_port} est utilisé par un autre processus (PID: {pid}). Voulez-vous le tuer? (y/N): ")
+        if response.lower() == 'y':
+            try:
+                os.kill(pid, signal.SIGTERM)
+                time.sleep(1)
+                print(f"✓ Ancien processus arrêté")
+            except Exception as e:
+                print(f"✗ Erreur lors de l'arrêt du processus: {e}")
+                return False
+        else:
+            print(f"Test annulé. Utilisez un autre port avec: {port_variable}=<autre-port>")
+            sys.exit(0)
+
+    # Démarrer le port-forward
+    print(f"⏳ Démarrage du port-forward (port {local_port})...")
+    try:
+        process = start_port_forward(namespace, service, local_port, remote_port)
+    except Exception as e:
+        print(f"✗ Erreur lors du démarrage du port-forward: {e}")
+        return False
+    if process is None:
+        print(f"✗ Le port-forward a échoué")
+        return False
+    print(f"✓ Port-forward actif (PID: {process.pid})")
+    return True
+
+
+def setup_metrics_port_forward(namespace: str, service: str, local_port: int, remote_port: int):
+    """Port-forward vers le listener HTTP de kumod pour /metrics (réutilise un port déjà ouvert, échec non bloquant)"""
+    in_use, pid, _ = check_port_in_use(local_port)
+    if in_use:
+        print(f"✓ Port {local_port} déjà ouvert (PID: {pid}), utilisé pour les métriques")
+        return
+    print(f"⏳ Démarrage du port-forward des métriques (port {local_port})...")
+    try:
+        process = start_port_forward(namespace, service, local_port, remote_port)
+    except Exception as e:
+        print(f"⚠ Le port-forward des métriques a échoué: {e}")
+        return
+    if process is None:
+        print(f"⚠ Le port-forward des métriques a échoué")
+    else:
+        print(f"✓ Port-forward des métriques actif (PID: {process.pid})")
+
+
+def cleanup_port_forwards():
+    """Arrête les port-forwards ouverts par ce script"""
+    if port_forward_processes:
+        print("\n⏳ Nettoyage des port-forwards...")
+    while port_forward_processes:
+        process = port_forward_processes.pop()
+        try:
+            process.terminate()
+            process.wait(timeout=5)
+        except Exception:
+            process.kill()
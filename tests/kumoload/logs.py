@@ -0,0 +1,430 @@
+"""
+Analyse des segments de logs locaux de kumod (configure_local_logs)
+
+kumod écrit dans log_dir (/var/log/kumomta dans init.lua) un segment compressé zstd par
+max_segment_duration. Chaque segment est décompressé en flux (jamais chargé en entier) et
+plusieurs segments sont analysés en parallèle, un par processus. Les agrégats de chaque
+segment (comptes par type, queue, tenant, source d'egress, codes de réponse, histogrammes
+des délais de livraison) sont fusionnés par le processus principal.
+
+Formats reconnus:
+    - enregistrements JSON de kumod (format par défaut): tous les agrégats, dont le délai
+      création → événement (timestamp - created) et la source d'egress
+    - lignes des templates per_record d'init.lua ("[DELIVERY] ... | Queue: ... | Code: ..."):
+      type, queue, tenant et code uniquement (ni délai ni source dans le texte)
+
+Décompression: module zstandard si installé, sinon la commande zstd (flux via un pipe).
+
+Usage:
+    python3 -m kumoload.logs [/var/log/kumomta | SEGMENT...] [--processes N] [--follow]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import signal
+import argparse
+import subprocess
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from kumoload.histogram import LatencyHistogram
+from kumoload.workers import process_context
+
+DEFAULT_LOG_DIR = "/var/log/kumomta"
+
+# Types d'enregistrements agrégés, dans l'ordre des colonnes des tableaux
+RECORD_TYPES = ("Delivery", "Bounce", "TransientFailure", "Expiration")
+TYPE_INDEX = {name: index for index, name in enumerate(RECORD_TYPES)}
+TYPE_COLUMNS = ("livrés", "bounces", "tempfail", "expirés")
+
+# Préfixes des templates per_record d'init.lua
+TEMPLATE_TYPES = {"DELIVERY": "Delivery", "BOUNCE": "Bounce", "TRANSIENT_FAILURE": "TransientFailure",
+                  "EXPIRATION": "Expiration"}
+TEMPLATE_RE = re.compile(rb"^\[([A-Z_]+)\] .*?\| Queue: ([^|]*?)\s*(?:\| Code: (\d+))?\s*(?:\||$)")
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Taille des lectures du flux décompressé
+READ_SIZE = 1 << 20
+
+# Délais suivis jusqu'à 7 jours (expirations), au-delà comptés dans le dernier bucket
+DELAY_HIGHEST_MS = 7 * 86_400_000.0
+
+# ============================================================================
+# LECTURE DES SEGMENTS
+# ============================================================================
+
+class _ZstdPipe:
+    """Flux décompressé par la commande zstd (repli sans le module zstandard)"""
+
+    def __init__(self, path: str):
+        self.process = subprocess.Popen(["zstd", "-dcq", path], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def read(self, size: int = -1) -> bytes:
+        return self.process.stdout.read(size)
+
+    def close(self) -> bool:
+        """Ferme le flux; retourne False si le segment était incomplet (zstd en erreur)"""
+        self.process.stdout.close()
+        return self.process.wait() == 0
+
+
+def open_segment(path: str):
+    """Flux binaire d'un segment, décompressé à la volée s'il commence par l'en-tête zstd"""
+    with open(path, "rb") as f:
+        compressed = f.read(4) == ZSTD_MAGIC
+    if not compressed:
+        return open(path, "rb")
+    try:
+        import zstandard
+    except ImportError:
+        zstandard = None
+    if zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_size=READ_SIZE)
+    if shutil.which("zstd"):
+        return _ZstdPipe(path)
+    raise RuntimeError(f"{path}: segment compressé, installer le module zstandard (pip install zstandard) "
+                       f"ou la commande zstd")
+
+
+def iter_lines(stream) -> Iterator[bytes]:
+    """Lignes d'un flux binaire, lu par blocs de READ_SIZE"""
+    rest = b""
+    while True:
+        chunk = stream.read(READ_SIZE)
+        if not chunk:
+            break
+        lines = (rest + chunk).split(b"\n")
+        rest = lines.pop()
+        yield from lines
+    if rest:
+        yield rest
+
+
+def list_segments(paths: Sequence[str], closed_only: bool = False) -> List[str]:
+    """
+    Segments désignés par `paths` (fichiers, ou contenu des répertoires), triés par nom (= par date)
+
+    Avec `closed_only`, le segment le plus récent de chaque répertoire (en cours d'écriture par
+    kumod) est écarté; les fichiers désignés directement sont toujours retenus.
+    """
+    segments = []
+    for path in paths:
+        if os.path.isdir(path):
+            names = [name for name in sorted(os.listdir(path))
+                     if not name.startswith(".") and os.path.isfile(os.path.join(path, name))]
+            segments.extend(os.path.join(path, name) for name in (names[:-1] if closed_only else names))
+        else:
+            segments.append(path)
+    return segments
+
+
+def parse_queue(queue: str) -> Tuple[str, str, str]:
+    """(campagne, tenant, domaine) d'un nom de queue kumod: [campagne:][tenant@]domaine[!routage]"""
+    campaign, _, rest = queue.rpartition(":")
+    tenant, _, domain = rest.rpartition("@")
+    return campaign, tenant, domain.partition("!")[0]
+
+# ============================================================================
+# AGRÉGATS
+# ============================================================================
+
+class LogSummary:
+    """Agrégats fusionnables d'un ou plusieurs segments"""
+
+    def __init__(self):
+        self.segments = 0
+        self.truncated = 0
+        self.bytes = 0
+        self.records = [0] * len(RECORD_TYPES)
+        self.text_records = 0
+        self.other = 0
+        self.invalid = 0
+        # Nom -> comptes par type (ordre de RECORD_TYPES)
+        self.queues: Dict[str, List[int]] = {}
+        self.tenants: Dict[str, List[int]] = {}
+        self.sources: Dict[str, List[int]] = {}
+        # (type, code) -> nombre
+        self.responses: Dict[Tuple[str, int], int] = {}
+        self.delays = {name: LatencyHistogram(highest_ms=DELAY_HIGHEST_MS) for name in RECORD_TYPES}
+        self.first: Optional[float] = None
+        self.last: Optional[float] = None
+
+    @property
+    def total(self) -> int:
+        return sum(self.records)
+
+    def _count(self, table: Dict[str, List[int]], key: str, index: int):
+        counts = table.get(key)
+        if counts is None:
+            counts = table[key] = [0] * len(RECORD_TYPES)
+        counts[index] += 1
+
+    def add(self, kind: str, queue: str, tenant: str, source: str, code: Optional[int],
+            timestamp: Optional[float] = None, created: Optional[float] = None):
+        index = TYPE_INDEX[kind]
+        self.records[index] += 1
+        self._count(self.queues, queue, index)
+        self._count(self.tenants, tenant, index)
+        self._count(self.sources, source, index)
+        if code is not None:
+            key = (kind, code)
+            self.responses[key] = self.responses.get(key, 0) + 1
+        if timestamp is not None:
+            if self.first is None or timestamp < self.first:
+                self.first = timestamp
+            if self.last is None or timestamp > self.last:
+                self.last = timestamp
+            if created is not None:
+                self.delays[kind].record(max(0.0, (timestamp - created) * 1000))
+
+    def add_line(self, line: bytes):
+        if line.startswith(b"{"):
+            # Filtre sur le type avant le décodage JSON: Reception et les autres types sont écartés à bas coût
+            start = line.find(b'"type":')
+            if start >= 0:
+                start = line.find(b'"', start + 7) + 1
+                kind = line[start:line.find(b'"', start)].decode("ascii", "replace")
+                if kind not in TYPE_INDEX:
+                    self.other += 1
+                    return
+            try:
+                record = json.loads(line)
+                kind = record["type"]
+            except (ValueError, KeyError, TypeError):
+                self.invalid += 1
+                return
+            if kind not in TYPE_INDEX:
+                self.other += 1
+                return
+            queue = record.get("queue") or "?"
+            _, tenant, _ = parse_queue(queue)
+            if not tenant:
+                tenant = (record.get("meta") or {}).get("tenant") or "-"
+            response = record.get("response") or {}
+            code = response.get("code")
+            self.add(kind, queue, str(tenant), record.get("egress_source") or "-",
+                     code if isinstance(code, int) else None, record.get("timestamp"), record.get("created"))
+            return
+        match = TEMPLATE_RE.match(line)
+        if match is None or match.group(1).decode() not in TEMPLATE_TYPES:
+            if line.strip():
+                self.invalid += 1
+            return
+        queue = match.group(2).decode("utf-8", "replace") or "?"
+        code = match.group(3)
+        self.text_records += 1
+        self.add(TEMPLATE_TYPES[match.group(1).decode()], queue, parse_queue(queue)[1] or "-", "?",
+                 int(code) if code else None)
+
+    def merge(self, other: "LogSummary"):
+        self.segments += other.segments
+        self.truncated += other.truncated
+        self.bytes += other.bytes
+        self.records = [a + b for a, b in zip(self.records, other.records)]
+        self.text_records += other.text_records
+        self.other += other.other
+        self.invalid += other.invalid
+        for mine, theirs in ((self.queues, other.queues), (self.tenants, other.tenants),
+                             (self.sources, other.sources)):
+            for key, counts in theirs.items():
+                current = mine.get(key)
+                mine[key] = counts[:] if current is None else [a + b for a, b in zip(current, counts)]
+        for key, count in other.responses.items():
+            self.responses[key] = self.responses.get(key, 0) + count
+        for name in RECORD_TYPES:
+            self.delays[name].merge(other.delays[name])
+        for timestamp in (other.first, other.last):
+            if timestamp is not None:
+                self.first = timestamp if self.first is None else min(self.first, timestamp)
+                self.last = timestamp if self.last is None else max(self.last, timestamp)
+
+    def to_dict(self) -> dict:
+        return {
+            "segments": self.segments, "truncated": self.truncated, "bytes": self.bytes,
+            "records": dict(zip(RECORD_TYPES, self.records)), "text_records": self.text_records,
+            "other": self.other, "invalid": self.invalid, "first": self.first, "last": self.last,
+            "queues": {key: dict(zip(RECORD_TYPES, counts)) for key, counts in self.queues.items()},
+            "tenants": {key: dict(zip(RECORD_TYPES, counts)) for key, counts in self.tenants.items()},
+            "sources": {key: dict(zip(RECORD_TYPES, counts)) for key, counts in self.sources.items()},
+            "responses": [{"type": kind, "code": code, "count": count}
+                          for (kind, code), count in sorted(self.responses.items())],
+            "delays": {name: hist.to_dict() for name, hist in self.delays.items() if hist.count},
+        }
+
+    # ------------------------------------------------------------------------
+    # Rapport
+    # ------------------------------------------------------------------------
+
+    def _table(self, title: str, table: Dict[str, List[int]], top: int) -> List[str]:
+        ranked = sorted(table.items(), key=lambda item: -sum(item[1]))
+        lines = ["", f"  {title:<40} " + " ".join(f"{column:>9}" for column in TYPE_COLUMNS) + f" {'total':>10}"]
+        for key, counts in ranked[:top]:
+            lines.append(f"  {key[:40]:<40} " + " ".join(f"{count:>9}" for count in counts) + f" {sum(counts):>10}")
+        if len(ranked) > top:
+            lines.append(f"  ... {len(ranked) - top} autres (voir --json-out)")
+        return lines
+
+    def format_report(self, top: int = 10) -> str:
+        size = self.bytes / (1024 * 1024)
+        lines = [
+            f"  Segments:               {self.segments} ({size:.1f} Mo sur disque, {self.truncated} incomplet(s))",
+            f"  Enregistrements:        {self.total} ({self.text_records} textuels, {self.other} d'autres types, "
+            f"{self.invalid} lignes non reconnues)",
+        ]
+        if self.first is not None and self.last > self.first:
+            hours = (self.last - self.first) / 3600
+            lines.append(f"  Période:                {datetime.fromtimestamp(self.first):%Y-%m-%d %H:%M:%S} → "
+                         f"{datetime.fromtimestamp(self.last):%H:%M:%S} ({self.total / hours:.0f} enr/h)")
+        lines.append("  " + ", ".join(f"{name}: {count}" for name, count in zip(RECORD_TYPES, self.records)))
+        if self.text_records:
+            lines.append("  ⚠ Enregistrements textuels (templates per_record): ni délai ni source d'egress; "
+                         "retirer les templates d'init.lua pour des enregistrements JSON complets")
+        if not self.total:
+            return "\n".join(lines)
+
+        lines.append("")
+        lines.append(f"  {'Délai création → événement':<28} {'mesures':>9} {'P50 s':>9} {'P90 s':>9} "
+                     f"{'P99 s':>9} {'max s':>9}")
+        for name, hist in self.delays.items():
+            if hist.count:
+                lines.append(f"  {name:<28} {hist.count:>9} {hist.percentile(50) / 1000:>9.1f} "
+                             f"{hist.percentile(90) / 1000:>9.1f} {hist.percentile(99) / 1000:>9.1f} "
+                             f"{hist.max / 1000:>9.1f}")
+
+        lines.append("")
+        lines.append(f"  {'Codes de réponse':<28} {'code':>6} {'nombre':>10}")
+        ranked = sorted(self.responses.items(), key=lambda item: -item[1])
+        for (kind, code), count in ranked[:top]:
+            lines.append(f"  {kind:<28} {code:>6} {count:>10}")
+        if len(ranked) > top:
+            lines.append(f"  ... {len(ranked) - top} autres (voir --json-out)")
+
+        lines += self._table("queue", self.queues, top)
+        lines += self._table("tenant", self.tenants, top)
+        lines += self._table("source d'egress", self.sources, top)
+        return "\n".join(lines)
+
+
+def analyze_segment(path: str) -> LogSummary:
+    """Agrégats d'un segment, lu en flux (exécuté dans un processus du pool)"""
+    summary = LogSummary()
+    summary.segments = 1
+    summary.bytes = os.path.getsize(path)
+    stream = open_segment(path)
+    try:
+        for line in iter_lines(stream):
+            summary.add_line(line)
+    except Exception as e:
+        # Segment en cours d'écriture ou tronqué: les lignes lues avant l'erreur sont conservées
+        if type(e).__name__ != "ZstdError":
+            raise
+        summary.truncated = 1
+    finally:
+        if stream.close() is False:
+            summary.truncated = 1
+    return summary
+
+
+def _ignore_sigint():
+    # Ctrl+C est géré par le processus principal (rapport final), pas par les processus du pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class SegmentAnalyzer:
+    """Pool de processus qui analyse les segments en parallèle et fusionne leurs agrégats"""
+
+    def __init__(self, processes: int):
+        self.processes = max(1, processes)
+        self.summary = LogSummary()
+        self.done = set()
+        self._pool = process_context().Pool(self.processes, _ignore_sigint) if self.processes > 1 else None
+
+    def analyze(self, segments: Sequence[str]) -> LogSummary:
+        """Analyse les segments pas encore vus; retourne les agrégats de ce lot (déjà fusionnés au total)"""
+        pending = [path for path in segments if path not in self.done]
+        batch = LogSummary()
+        if self._pool is None:
+            results = map(analyze_segment, pending)
+        else:
+            results = self._pool.imap_unordered(analyze_segment, pending)
+        for result in results:
+            batch.merge(result)
+        self.done.update(pending)
+        self.summary.merge(batch)
+        return batch
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def follow(analyzer: SegmentAnalyzer, paths: Sequence[str], poll: float):
+    """Analyse les nouveaux segments au fil de l'eau jusqu'à Ctrl+C"""
+    # Le segment le plus récent de chaque répertoire est en cours d'écriture: il est lu quand kumod
+    # en ouvre un suivant
+    print(f"⏳ Suivi des nouveaux segments (toutes les {poll:g} s, Ctrl+C pour le rapport final)", flush=True)
+    while True:
+        batch = analyzer.analyze(list_segments(paths, closed_only=True))
+        if batch.segments:
+            print(f"[{datetime.now():%H:%M:%S}] +{batch.segments} segment(s): "
+                  + ", ".join(f"{name} {count}" for name, count in zip(RECORD_TYPES, batch.records))
+                  + f" | P99 délai Delivery {batch.delays['Delivery'].percentile(99) / 1000:.1f} s"
+                  + f" | total {analyzer.summary.total}", flush=True)
+        time.sleep(poll)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Analyse des segments de logs locaux de kumod")
+    parser.add_argument("paths", nargs="*", default=[DEFAULT_LOG_DIR],
+                        help=f"Répertoires de logs ou segments (défaut: {DEFAULT_LOG_DIR})")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="Segments analysés en parallèle (défaut: nombre de cœurs)")
+    parser.add_argument("--follow", action="store_true", help="Analyse ensuite les nouveaux segments jusqu'à Ctrl+C")
+    parser.add_argument("--poll", type=float, default=5.0, help="Intervalle de recherche des segments en --follow (s)")
+    parser.add_argument("--top", type=int, default=10, help="Lignes affichées par tableau (défaut: 10)")
+    parser.add_argument("--json-out", help="Exporte tous les agrégats en JSON")
+    args = parser.parse_args(argv)
+
+    analyzer = SegmentAnalyzer(args.processes)
+    started = time.time()
+    try:
+        segments = list_segments(args.paths, closed_only=args.follow)
+        if not segments and not args.follow:
+            print(f"✗ Aucun segment dans {', '.join(args.paths)}")
+            return 1
+        analyzer.analyze(segments)
+        elapsed = time.time() - started
+        print(f"✓ {analyzer.summary.segments} segment(s), {analyzer.summary.total} enregistrements analysés en "
+              f"{elapsed:.1f} s ({analyzer.summary.total / max(elapsed, 1e-6):.0f} enr/s, "
+              f"{analyzer.processes} processus)", flush=True)
+        if args.follow:
+            follow(analyzer, args.paths, args.poll)
+    except KeyboardInterrupt:
+        print("\n⚠ Interruption: rapport sur les segments déjà analysés")
+    except (OSError, RuntimeError) as e:
+        print(f"✗ Erreur: {e}")
+        return 1
+    finally:
+        analyzer.close()
+
+    print("")
+    print("Logs kumod:")
+    print(analyzer.summary.format_report(args.top))
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(analyzer.summary.to_dict(), f)
+        print(f"✓ Agrégats exportés: {args.json_out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
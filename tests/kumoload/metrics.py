@@ -0,0 +1,252 @@
+"""
+Relevé des métriques Prometheus de kumod pendant et après un run
+
+Un thread interroge l'endpoint /metrics (kumod via port-forward, ou le sink local) à
+intervalle régulier. Les gauges suivies sont celles des dashboards: profondeur des
+queues (ready_count, scheduled_queue_count), messages en mémoire (message_count,
+message_data_resident_count) et connexions (connection_count), sommées sur tous leurs
+labels. Après l'injection, le relevé continue jusqu'au retour des queues à leur niveau
+initial: le temps de vidage donne le débit réel de bout en bout.
+"""
+
+import csv
+import json
+import time
+import bisect
+import threading
+import urllib.request
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Gauges relevées (somme sur tous les labels)
+METRICS = ("ready_count", "scheduled_queue_count", "message_count", "message_data_resident_count",
+           "connection_count")
+
+# Profondeur des queues = messages en attente de livraison
+QUEUE_METRICS = ("ready_count", "scheduled_queue_count")
+
+# Nombre maximal de lignes de la chronologie affichée (la série complète va dans --metrics-out)
+TIMELINE_ROWS = 20
+
+METRICS_FIELDS = ("elapsed_s", "timestamp", "injected", "injection_rate") + METRICS + ("queue_depth",)
+
+
+def parse_prometheus(text: str, names: Sequence[str] = METRICS) -> Dict[str, float]:
+    """Somme, par nom de métrique, des échantillons du format texte Prometheus"""
+    wanted = set(names)
+    values: Dict[str, float] = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        brace = line.find("{")
+        if brace >= 0:
+            name = line[:brace]
+            rest = line[line.rfind("}") + 1:]
+        else:
+            name, _, rest = line.partition(" ")
+        if name not in wanted:
+            continue
+        try:
+            value = float(rest.split()[0])
+        except (IndexError, ValueError):
+            continue
+        values[name] = values.get(name, 0.0) + value
+    return values
+
+
+class MetricsSample:
+    """Un relevé: instant (time.time()) et valeur de chaque gauge"""
+
+    __slots__ = ("timestamp", "values")
+
+    def __init__(self, timestamp: float, values: Dict[str, float]):
+        self.timestamp = timestamp
+        self.values = values
+
+    @property
+    def queue_depth(self) -> float:
+        return sum(self.values.get(name, 0.0) for name in QUEUE_METRICS)
+
+
+class MetricsScraper:
+    """Relève `url` toutes les `interval` secondes dans un thread, jusqu'à stop()"""
+
+    def __init__(self, url: str, interval: float = 1.0, timeout: float = 5.0,
+                 headers: Optional[Dict[str, str]] = None):
+        self.url = url
+        self.interval = interval
+        self.timeout = timeout
+        self.headers = headers or {}
+        self.samples: List[MetricsSample] = []
+        self.baseline: Optional[MetricsSample] = None
+        self.started = 0.0
+        self.injection_end: Optional[float] = None
+        self.drained_at: Optional[float] = None
+        self.drain_resolution: Optional[float] = None
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def scrape(self) -> MetricsSample:
+        request = urllib.request.Request(self.url, headers=self.headers)
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            text = response.read().decode("utf-8", "replace")
+        return MetricsSample(time.time(), parse_prometheus(text))
+
+    def start(self) -> "MetricsScraper":
+        """Relevé initial (niveau de référence des queues), puis relevés périodiques; lève OSError si injoignable"""
+        self.baseline = self.scrape()
+        self.started = self.baseline.timestamp
+        self.samples.append(self.baseline)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                sample = self.scrape()
+            except (OSError, ValueError) as e:
+                self.errors += 1
+                self.last_error = str(e)
+                continue
+            self.samples.append(sample)
+            if (self.injection_end is not None and self.drained_at is None
+                    and sample.queue_depth <= self.baseline.queue_depth):
+                self._mark_drained()
+
+    def _mark_drained(self):
+        """
+        Instant de vidage estimé entre le dernier relevé au-dessus du niveau initial et le premier
+        revenu à ce niveau, sinon un vidage quasi immédiat compterait pour un intervalle entier.
+        Le niveau est souvent atteint exactement (queues vides): l'instant de passage est alors
+        extrapolé au débit de vidage des deux relevés précédents, ou pris au milieu de l'intervalle.
+        """
+        before, previous, sample = ([None] + self.samples[-3:])[-3:]
+        start = max(previous.timestamp, self.injection_end)
+        self.drain_resolution = sample.timestamp - start
+        baseline = self.baseline.queue_depth
+        above = previous.queue_depth - baseline
+        if above <= 0:
+            self.drained_at = start
+            return
+        if sample.queue_depth < baseline:
+            # Passage sous le niveau: interpolation linéaire
+            rate = (previous.queue_depth - sample.queue_depth) / (sample.timestamp - previous.timestamp)
+        elif before is not None and before.queue_depth > previous.queue_depth:
+            rate = (before.queue_depth - previous.queue_depth) / (previous.timestamp - before.timestamp)
+        else:
+            rate = 0.0
+        if rate > 0:
+            drained_at = previous.timestamp + above / rate
+        else:
+            drained_at = (start + sample.timestamp) / 2
+        self.drained_at = min(max(drained_at, start), sample.timestamp)
+
+    def mark_injection_end(self):
+        self.injection_end = time.time()
+
+    def wait_drained(self, timeout: float, progress_every: float = 5.0) -> Optional[float]:
+        """Attend le retour des queues au niveau initial; retourne le temps de vidage (s) ou None"""
+        if self.injection_end is None:
+            self.mark_injection_end()
+        deadline = self.injection_end + timeout
+        next_progress = time.time() + progress_every
+        while self.drained_at is None and time.time() < deadline:
+            time.sleep(min(self.interval, 0.2))
+            if time.time() >= next_progress and self.samples:
+                print(f"⏳ Vidage des queues: {self.samples[-1].queue_depth:.0f} messages en attente", flush=True)
+                next_progress += progress_every
+        return self.drain_seconds
+
+    @property
+    def drain_seconds(self) -> Optional[float]:
+        if self.drained_at is None or self.injection_end is None:
+            return None
+        return max(0.0, self.drained_at - self.injection_end)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    # ------------------------------------------------------------------------
+    # Corrélation avec l'injection et rapport
+    # ------------------------------------------------------------------------
+
+    def rows(self, injection: Sequence[Tuple[float, int, float]] = ()) -> List[dict]:
+        """Relevés alignés sur la chronologie d'injection [(timestamp, total injecté, débit)] du reporter"""
+        # Total injecté interpolé entre deux intervalles du reporter, débit de l'intervalle en cours
+        points = [(self.started, 0, 0.0)] + [entry for entry in injection if entry[0] > self.started]
+        times = [point[0] for point in points]
+        rows = []
+        for sample in self.samples:
+            index = bisect.bisect_right(times, sample.timestamp)
+            if index >= len(points):
+                injected, rate = points[-1][1], 0.0
+            else:
+                (t0, total0, _), (t1, total1, rate) = points[index - 1], points[index]
+                injected = round(total0 + (total1 - total0) * (sample.timestamp - t0) / (t1 - t0))
+            if self.injection_end is not None and sample.timestamp > self.injection_end:
+                rate = 0.0
+            row = {"elapsed_s": round(sample.timestamp - self.started, 3), "timestamp": round(sample.timestamp, 3),
+                   "injected": injected, "injection_rate": rate}
+            for name in METRICS:
+                row[name] = sample.values.get(name, 0.0)
+            row["queue_depth"] = sample.queue_depth
+            rows.append(row)
+        return rows
+
+    def save(self, path: str, injection: Sequence[Tuple[float, int, float]] = ()):
+        """Exporte les relevés en JSONL, ou en CSV si le fichier finit par .csv"""
+        rows = self.rows(injection)
+        with open(path, "w", newline="") as f:
+            if path.endswith(".csv"):
+                writer = csv.DictWriter(f, fieldnames=METRICS_FIELDS)
+                writer.writeheader()
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    f.write(json.dumps(row) + "\n")
+
+    def format_report(self, messages: int, injection: Sequence[Tuple[float, int, float]] = ()) -> str:
+        rows = self.rows(injection)
+        if not rows:
+            return "  Aucun relevé"
+        peak = max(rows, key=lambda row: row["queue_depth"])
+        resident = max(rows, key=lambda row: row["message_data_resident_count"])
+        lines = [
+            f"  Relevés:                {len(rows)} (toutes les {self.interval:g} s, {self.errors} en erreur)",
+            f"  Profondeur initiale:    {self.baseline.queue_depth:.0f} messages (ready + scheduled)",
+            f"  Profondeur max:         {peak['queue_depth']:.0f} messages à {peak['elapsed_s']:.1f} s",
+            f"  Résidents max:          {resident['message_data_resident_count']:.0f} messages à "
+            f"{resident['elapsed_s']:.1f} s (message_data_resident_count)",
+            f"  Connexions max:         {max(row['connection_count'] for row in rows):.0f}",
+        ]
+        if self.injection_end is not None:
+            injection_seconds = self.injection_end - self.started
+            lines.append(f"  Fin de l'injection:     {injection_seconds:.1f} s")
+            if self.drain_seconds is not None:
+                total = injection_seconds + self.drain_seconds
+                lines.append(f"  Vidage des queues:      {self.drain_seconds:.1f} s (± {self.drain_resolution:.1f} s) "
+                             f"après la fin de l'injection")
+                if total > 0:
+                    lines.append(f"  Débit de bout en bout:  {messages / total:.1f} msg/s (injection + vidage)")
+            else:
+                lines.append(f"  Vidage des queues:      non terminé ({rows[-1]['queue_depth']:.0f} messages "
+                             f"en attente au dernier relevé)")
+        if self.last_error:
+            lines.append(f"  Dernière erreur:        {self.last_error[:150]}")
+
+        # Chronologie sous-échantillonnée: injection vs queues et mémoire
+        step = max(1, -(-len(rows) // TIMELINE_ROWS))
+        shown = rows[::step]
+        if shown[-1] is not rows[-1]:
+            shown.append(rows[-1])
+        lines.append("")
+        lines.append(f"  {'t':>7} {'injectés':>10} {'msg/s':>9} {'ready':>9} {'scheduled':>9} "
+                     f"{'messages':>9} {'résidents':>9} {'connexions':>10}")
+        for row in shown:
+            lines.append(f"  {row['elapsed_s']:>6.1f}s {row['injected']:>10} {row['injection_rate']:>9.0f} "
+                         f"{row['ready_count']:>9.0f} {row['scheduled_queue_count']:>9.0f} "
+                         f"{row['message_count']:>9.0f} {row['message_data_resident_count']:>9.0f} "
+                         f"{row['connection_count']:>10.0f}")
+        return "\n".join(lines)
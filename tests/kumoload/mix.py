@@ -0,0 +1,424 @@
+"""
+Mix de trafic: modèles de payload, tenants, campagnes et domaines pondérés
+
+Chaque message tire, de façon déterministe à partir de son numéro (même résultat dans tous
+les processus et d'un run à l'autre pour une même graine):
+    - un modèle parmi les fichiers tests/test_payload_*.json (expéditeur, sujet, corps, en-têtes)
+    - un tenant (en-tête X-Tenant) et une campagne (en-tête X-Campaign), cf. queues.toml
+    - un domaine destinataire parmi `domains` domaines synthétiques, avec une asymétrie de Zipf
+      (le domaine de rang k reçoit une part proportionnelle à 1/k^s), ou à défaut le domaine du
+      to_email du modèle
+
+kumod crée une queue planifiée par (campagne, tenant, domaine): 10000 domaines et quelques
+tenants/campagnes font monter le nombre de queues actives bien au-delà des 3 domaines du mode
+par défaut.
+
+Spécification (--mix): fichier JSON ou forme en ligne, sections séparées par ';':
+    templates=generic:50,gmail.com:30,yahoo.fr:20;tenants=StirTalk:30,default-tenant:70;
+    campaigns=20;domains=10000;zipf=1.1
+
+    {"templates": {"generic": 50, "gmail.com": 30}, "tenants": {"StirTalk": 30, "-": 70},
+     "campaigns": {"newsletter": 80, "transactional": 20}, "domains": 10000, "zipf": 1.1,
+     "domain_suffix": "kumoload.test", "seed": 0}
+
+campaigns=N génère N campagnes équiprobables (c01 à c20 pour 20). Le nom '-' n'envoie pas l'en-tête
+(kumod applique alors default_tenant, ou StirTalk selon stir_talk.lua). Sans section templates,
+tous les modèles trouvés sont équiprobables.
+
+Usage (aperçu de la distribution, sans envoi):
+    python3 -m kumoload.mix SPEC [--messages N] [--group N]
+"""
+
+import os
+import sys
+import json
+import glob
+import argparse
+from bisect import bisect_right
+from datetime import datetime
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+TEMPLATES_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE_GLOB = "test_payload*"
+
+TENANT_HEADER = "X-Tenant"
+CAMPAIGN_HEADER = "X-Campaign"
+NO_HEADER = "-"
+
+DEFAULT_DOMAIN_SUFFIX = "kumoload.test"
+DEFAULT_ZIPF = 1.0
+
+# Sels des tirages indépendants d'un même message
+_SALT_TEMPLATE, _SALT_TENANT, _SALT_CAMPAIGN, _SALT_DOMAIN = 1, 2, 3, 4
+_MASK = (1 << 64) - 1
+
+# Nombre maximal de messages retirés pour la répartition effective d'un run (tirages régulièrement espacés)
+TALLY_SAMPLES = 100000
+
+# ============================================================================
+# TIRAGES DÉTERMINISTES
+# ============================================================================
+
+def _uniform(message_num: int, salt: int) -> float:
+    """Flottant uniforme dans [0, 1) dérivé du numéro de message (splitmix64)"""
+    z = (message_num * 0x9E3779B97F4A7C15 + salt * 0xD1B54A32D192ED03) & _MASK
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK
+    return ((z ^ (z >> 31)) >> 11) * (1.0 / (1 << 53))
+
+
+class WeightedChoice:
+    """Choix pondéré par bisection sur les poids cumulés"""
+
+    def __init__(self, items: Sequence, weights: Sequence[float]):
+        if not items or len(items) != len(weights) or any(w < 0 for w in weights) or sum(weights) <= 0:
+            raise ValueError("Choix pondéré invalide: au moins un élément et des poids positifs attendus")
+        self.items = list(items)
+        self.weights = [float(w) for w in weights]
+        total, self.cumulative = 0.0, []
+        for weight in self.weights:
+            total += weight
+            self.cumulative.append(total)
+        self.total = total
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def pick(self, u: float):
+        return self.items[min(bisect_right(self.cumulative, u * self.total), len(self.items) - 1)]
+
+    def share(self, index: int) -> float:
+        return self.weights[index] / self.total
+
+
+def zipf_weights(count: int, s: float) -> List[float]:
+    """Poids 1/k^s des rangs 1..count"""
+    return [1.0 / rank ** s for rank in range(1, count + 1)]
+
+# ============================================================================
+# MODÈLES DE PAYLOAD
+# ============================================================================
+
+class PayloadTemplate:
+    """Un fichier test_payload_*.json: expéditeur, sujet, corps texte/HTML et en-têtes"""
+
+    def __init__(self, name: str, data: dict):
+        self.name = name
+        self.from_email = data["from_email"]
+        self.from_name = data.get("from_name", "")
+        self.to_email = data.get("to_email", "")
+        self.subject = data.get("subject", "")
+        self.text_body = data.get("text_body", "")
+        self.html_body = data.get("html_body")
+        self.reply_to_email = data.get("reply_to_email")
+        self.reply_to_name = data.get("reply_to_name", "")
+        # X-Test-ID est remplacé par le jeton du message (latence de bout en bout)
+        self.headers = {name: value for name, value in (data.get("headers") or {}).items()
+                        if name.lower() != "x-test-id"}
+
+    @property
+    def domain(self) -> str:
+        return self.to_email.rpartition("@")[2]
+
+    def content(self, test_id: str, headers: Dict[str, str], timestamp: Optional[str] = None) -> dict:
+        """Contenu de /api/inject/v1; sans timestamp, {{TIMESTAMP}} reste une substitution kumod"""
+        def fill(text):
+            return text.replace("{{TIMESTAMP}}", timestamp) if timestamp and text else text
+        content = {
+            "from": {"email": self.from_email, "name": self.from_name},
+            "subject": fill(self.subject),
+            "text_body": fill(self.text_body),
+            "headers": {**{name: fill(value) for name, value in self.headers.items()},
+                        **headers, "X-Test-ID": test_id},
+        }
+        if self.html_body:
+            content["html_body"] = fill(self.html_body)
+        if self.reply_to_email:
+            content["reply_to"] = {"email": self.reply_to_email, "name": self.reply_to_name}
+        return content
+
+    def mime(self, to_email: str, test_id: str, headers: Dict[str, str]) -> str:
+        """Message MIME complet (texte, et HTML en alternative si le modèle en a un)"""
+        timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        text = self.text_body.replace("{{TIMESTAMP}}", timestamp)
+        if self.html_body:
+            msg = MIMEMultipart("alternative")
+            msg.attach(MIMEText(text, "plain"))
+            msg.attach(MIMEText(self.html_body.replace("{{TIMESTAMP}}", timestamp), "html"))
+        else:
+            msg = MIMEText(text)
+        msg["From"] = f"{self.from_name} <{self.from_email}>" if self.from_name else self.from_email
+        msg["To"] = to_email
+        msg["Subject"] = self.subject.replace("{{TIMESTAMP}}", timestamp)
+        if self.reply_to_email:
+            msg["Reply-To"] = (f"{self.reply_to_name} <{self.reply_to_email}>" if self.reply_to_name
+                               else self.reply_to_email)
+        for name, value in {**self.headers, **headers}.items():
+            msg[name] = value.replace("{{TIMESTAMP}}", timestamp)
+        msg["X-Test-ID"] = test_id
+        return msg.as_string()
+
+
+def template_name(path: str) -> str:
+    """test_payload_gmail.com.json -> gmail.com, test_payload.json -> default"""
+    name = os.path.basename(path)[len("test_payload"):].lstrip("_")
+    if name.endswith(".json"):
+        name = name[:-len(".json")]
+    return name or "default"
+
+
+def load_templates(directory: str = TEMPLATES_DIR) -> Dict[str, PayloadTemplate]:
+    templates = {}
+    for path in sorted(glob.glob(os.path.join(directory, TEMPLATE_GLOB))):
+        try:
+            with open(path) as f:
+                templates[template_name(path)] = PayloadTemplate(template_name(path), json.load(f))
+        except (OSError, ValueError, KeyError) as e:
+            raise ValueError(f"Modèle de payload illisible: {path}: {e}")
+    return templates
+
+# ============================================================================
+# SPÉCIFICATION
+# ============================================================================
+
+def _parse_weights(text: str) -> Dict[str, float]:
+    weights = {}
+    for item in text.split(","):
+        name, _, weight = item.strip().rpartition(":")
+        if not name:
+            name, weight = weight, "1"
+        weights[name] = float(weight)
+    return weights
+
+
+def parse_mix_spec(spec: str) -> dict:
+    """Spécification du mix: chemin d'un fichier JSON ou forme en ligne clé=valeur;..."""
+    if os.path.isfile(spec):
+        with open(spec) as f:
+            return json.load(f)
+    config = {}
+    try:
+        for section in spec.split(";"):
+            if not section.strip():
+                continue
+            key, _, value = section.partition("=")
+            key, value = key.strip(), value.strip()
+            if key in ("templates", "tenants"):
+                config[key] = _parse_weights(value)
+            elif key == "campaigns":
+                config[key] = int(value) if value.isdigit() else _parse_weights(value)
+            elif key in ("domains", "seed"):
+                config[key] = int(value)
+            elif key == "zipf":
+                config[key] = float(value)
+            elif key == "domain_suffix":
+                config[key] = value
+            else:
+                raise ValueError(f"section inconnue {key!r}")
+    except ValueError as e:
+        raise ValueError(f"Mix invalide: {spec!r} ({e})")
+    return config
+
+
+class Draw(NamedTuple):
+    """Tirage d'un message: modèle, tenant et campagne ('-' = pas d'en-tête)"""
+    template: PayloadTemplate
+    tenant: str
+    campaign: str
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.tenant != NO_HEADER:
+            headers[TENANT_HEADER] = self.tenant
+        if self.campaign != NO_HEADER:
+            headers[CAMPAIGN_HEADER] = self.campaign
+        return headers
+
+    def queue_name(self, domain: str) -> str:
+        """Nom de la queue planifiée kumod: [campagne:][tenant@]domaine"""
+        queue = domain if self.tenant == NO_HEADER else f"{self.tenant}@{domain}"
+        return queue if self.campaign == NO_HEADER else f"{self.campaign}:{queue}"
+
+
+class TrafficMix:
+    """
+    Tirages déterministes d'un mix de trafic
+
+    `group` messages consécutifs (un lot HTTP) partagent modèle, tenant et campagne, puisque le
+    contenu d'un lot est commun à tous ses destinataires; chaque destinataire garde son domaine.
+    """
+
+    def __init__(self, config: dict, group: int = 1, templates: Optional[Dict[str, PayloadTemplate]] = None):
+        templates = load_templates() if templates is None else templates
+        weights = config.get("templates") or {name: 1.0 for name in templates}
+        unknown = sorted(set(weights) - set(templates))
+        if unknown:
+            raise ValueError(f"Modèle(s) inconnu(s): {', '.join(unknown)} (disponibles: {', '.join(templates)})")
+        self.templates = WeightedChoice([templates[name] for name in weights], list(weights.values()))
+        tenants = config.get("tenants") or {NO_HEADER: 1.0}
+        self.tenants = WeightedChoice(list(tenants), list(tenants.values()))
+        campaigns = config.get("campaigns") or {NO_HEADER: 1.0}
+        if isinstance(campaigns, int):
+            width = len(str(campaigns))
+            campaigns = {f"c{index:0{width}d}": 1.0 for index in range(1, campaigns + 1)}
+        self.campaigns = WeightedChoice(list(campaigns), list(campaigns.values()))
+        self.domain_count = int(config.get("domains", 0))
+        self.zipf = float(config.get("zipf", DEFAULT_ZIPF))
+        self.domain_suffix = config.get("domain_suffix", DEFAULT_DOMAIN_SUFFIX)
+        self.seed = int(config.get("seed", 0)) & _MASK
+        self.group = max(1, group)
+        if self.domain_count < 0 or self.zipf < 0:
+            raise ValueError("Mix invalide: domains et zipf doivent être positifs")
+        width = len(str(self.domain_count))
+        self.domains = (WeightedChoice([f"d{rank:0{width}d}.{self.domain_suffix}"
+                                        for rank in range(1, self.domain_count + 1)],
+                                       zipf_weights(self.domain_count, self.zipf))
+                        if self.domain_count else None)
+        # Multi-processus: tout est déterministe, aucun état partagé à synchroniser
+        self._salt = self.seed * 8
+
+    @classmethod
+    def from_spec(cls, spec: str, group: int = 1) -> "TrafficMix":
+        return cls(parse_mix_spec(spec), group)
+
+    def draw(self, message_num: int) -> Draw:
+        key = (message_num - 1) // self.group * self.group + 1
+        return Draw(self.templates.pick(_uniform(key, self._salt + _SALT_TEMPLATE)),
+                    self.tenants.pick(_uniform(key, self._salt + _SALT_TENANT)),
+                    self.campaigns.pick(_uniform(key, self._salt + _SALT_CAMPAIGN)))
+
+    def domain(self, message_num: int, draw: Optional[Draw] = None) -> str:
+        if self.domains is None:
+            return (draw or self.draw(message_num)).template.domain
+        return self.domains.pick(_uniform(message_num, self._salt + _SALT_DOMAIN))
+
+    def recipient(self, message_num: int) -> str:
+        return f"u{message_num}@{self.domain(message_num)}"
+
+    def queue_name(self, message_num: int, to_email: str) -> str:
+        return self.draw(message_num).queue_name(to_email.rpartition("@")[2])
+
+    def describe(self) -> str:
+        def top(choice: WeightedChoice, limit: int = 4) -> str:
+            names = [getattr(item, "name", item) for item in choice.items]
+            ranked = sorted(range(len(choice)), key=lambda i: -choice.weights[i])
+            text = ", ".join(f"{names[i]} {choice.share(i) * 100:.0f}%" for i in ranked[:limit])
+            return text + (f", ... ({len(choice)} au total)" if len(choice) > limit else "")
+        domains = (f"{self.domain_count} domaines synthétiques (Zipf s={self.zipf:g}, "
+                   f"rang 1: {self.domains.share(0) * 100:.1f}%)" if self.domains
+                   else "domaine du to_email de chaque modèle")
+        return (f"modèles: {top(self.templates)}\n"
+                f"  tenants: {top(self.tenants)}\n"
+                f"  campagnes: {top(self.campaigns)}\n"
+                f"  domaines: {domains}")
+
+# ============================================================================
+# RÉPARTITION OBSERVÉE
+# ============================================================================
+
+class MixTally:
+    """
+    Répartition effective d'un ensemble de messages (recomptée après le run: tirages déterministes)
+
+    Au-delà de `samples` messages, seuls des messages régulièrement espacés sont retirés: les parts
+    sont celles de l'échantillon, le nombre de queues et de domaines distincts un minimum.
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.sampled = 0
+        self.templates: Dict[str, int] = {}
+        self.tenants: Dict[str, int] = {}
+        self.campaigns: Dict[str, int] = {}
+        self.domains: Dict[str, int] = {}
+        self.queues = set()
+
+    @classmethod
+    def count(cls, mix: TrafficMix, message_ranges: Sequence[range], samples: Optional[int] = None) -> "MixTally":
+        """Répartition des messages des plages `message_ranges`, sur au plus `samples` messages (None: tous)"""
+        tally = cls()
+        templates, tenants, campaigns, domains = tally.templates, tally.tenants, tally.campaigns, tally.domains
+        tally.messages = sum(len(message_nums) for message_nums in message_ranges)
+        step = max(1, tally.messages // samples) if samples else 1
+        skip = 0
+        for message_nums in message_ranges:
+            # Espacement régulier d'une plage à l'autre: tranches de processus, paliers de rampe
+            sampled = message_nums[skip::step]
+            skip = (skip - len(message_nums)) % step
+            for message_num in sampled:
+                draw = mix.draw(message_num)
+                domain = mix.domain(message_num, draw)
+                templates[draw.template.name] = templates.get(draw.template.name, 0) + 1
+                tenants[draw.tenant] = tenants.get(draw.tenant, 0) + 1
+                campaigns[draw.campaign] = campaigns.get(draw.campaign, 0) + 1
+                domains[domain] = domains.get(domain, 0) + 1
+                tally.queues.add((draw.campaign, draw.tenant, domain))
+                tally.sampled += 1
+        return tally
+
+    def _shares(self, counts: Dict[str, int], limit: int) -> str:
+        ranked = sorted(counts.items(), key=lambda item: -item[1])
+        text = ", ".join(f"{name} {count * 100 / self.sampled:.1f}%" for name, count in ranked[:limit])
+        return text + (f", ... ({len(ranked)} au total)" if len(ranked) > limit else "")
+
+    def top_domains_share(self, ranks: int) -> float:
+        counts = sorted(self.domains.values(), reverse=True)
+        return sum(counts[:ranks]) / self.sampled if self.sampled else 0.0
+
+    def format_report(self, limit: int = 4) -> str:
+        if not self.sampled:
+            return "  Aucun message"
+        domains = len(self.domains)
+        at_least = "au moins " if self.sampled < self.messages else ""
+        lines = [
+            f"  Queues planifiées:      {at_least}{len(self.queues)} (campagne, tenant, domaine) distinctes",
+            f"  Domaines actifs:        {at_least}{domains} (top 1: {self.top_domains_share(1) * 100:.1f}%, "
+            f"top 10: {self.top_domains_share(10) * 100:.1f}%, top 1%: "
+            f"{self.top_domains_share(max(1, domains // 100)) * 100:.1f}%)",
+            f"  Modèles:                {self._shares(self.templates, limit)}",
+            f"  Tenants:                {self._shares(self.tenants, limit)}",
+            f"  Campagnes:              {self._shares(self.campaigns, limit)}",
+        ]
+        if at_least:
+            lines.append(f"  Échantillon:            {self.sampled} messages sur {self.messages}")
+        return "\n".join(lines)
+
+    def to_dict(self) -> dict:
+        return {"messages": self.messages, "sampled": self.sampled, "queues": len(self.queues), "domains": len(self.domains),
+                "templates": self.templates, "tenants": self.tenants, "campaigns": self.campaigns,
+                "top_domains": dict(sorted(self.domains.items(), key=lambda item: -item[1])[:20])}
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Aperçu d'un mix de trafic (tirages sans envoi)")
+    parser.add_argument("spec", help="Fichier JSON ou spécification en ligne (voir l'aide du module)")
+    parser.add_argument("--messages", type=int, default=100000, help="Nombre de messages tirés (défaut: 100000)")
+    parser.add_argument("--group", type=int, default=1,
+                        help="Messages partageant modèle/tenant/campagne (taille de lot HTTP, défaut: 1)")
+    parser.add_argument("--json-out", help="Exporte la répartition en JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        mix = TrafficMix.from_spec(args.spec, args.group)
+    except (OSError, ValueError) as e:
+        print(f"✗ Erreur: {e}")
+        return 1
+    print(f"Mix de trafic:\n  {mix.describe()}")
+    tally = MixTally.count(mix, [range(1, args.messages + 1)])
+    print(f"\nRépartition sur {tally.messages} messages:")
+    print(tally.format_report())
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(tally.to_dict(), f)
+        print(f"✓ Répartition exportée: {args.json_out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""
+Décomposition de la latence par phase du protocole (--phases)
+
+La latence d'un message couvre tout l'échange; un histogramme par phase indique d'où vient
+un ralentissement: réseau (connect, upload), hooks Lua de kumod (réponses à EHLO, MAIL, RCPT,
+exécutés par la politique) ou écriture du spool (réponse finale après la fin des données).
+
+Avec PIPELINING, les commandes d'une transaction partent en un seul groupe: la durée d'une
+phase est alors l'écart entre l'arrivée de sa réponse et celle de la réponse précédente.
+Les durées sont vues du client: un driver saturé (CPU) les allonge toutes, d'où l'intérêt
+de comparer les phases entre elles plutôt qu'à une référence absolue.
+"""
+
+from typing import Dict, Iterable, Sequence
+
+from kumoload.histogram import LatencyHistogram
+
+# Phases SMTP, dans l'ordre d'une session
+SMTP_PHASES = ("connect", "banner", "ehlo", "starttls", "tls_full", "tls_resumed", "rset", "mail", "rcpt", "data", "body", "final", "data_total")
+
+# Phases HTTP d'une requête
+HTTP_PHASES = ("connect", "upload", "ttfb", "total")
+
+PHASE_LABELS = {
+    "connect": "connexion TCP",
+    "banner": "bannière 220",
+    "ehlo": "EHLO → 250",
+    "starttls": "STARTTLS → 220",
+    "tls_full": "handshake TLS complet",
+    "tls_resumed": "handshake TLS repris (session en cache)",
+    "rset": "RSET → 250 (session réutilisée)",
+    "mail": "MAIL FROM → 250",
+    "rcpt": "RCPT TO → 250 (par destinataire)",
+    "data": "DATA → 354",
+    "body": "écriture du contenu",
+    "final": "fin des données → 250 (spool)",
+    "data_total": "DATA + contenu + réponse finale",
+    "upload": "envoi de la requête",
+    "ttfb": "attente du premier octet",
+    "total": "requête complète (hors attente du pool)",
+}
+
+# Percentiles du tableau des phases
+PHASE_PERCENTILES = (50, 90, 99, 99.9)
+
+
+class PhaseTimings:
+    """Un histogramme par phase, fusionnable entre processus"""
+
+    def __init__(self, phases: Sequence[str], histogram_digits: int = 3):
+        self.phases = tuple(phases)
+        self.histograms: Dict[str, LatencyHistogram] = {
+            phase: LatencyHistogram(histogram_digits) for phase in self.phases
+        }
+
+    def record(self, phase: str, elapsed_ms: float):
+        self.histograms[phase].record(elapsed_ms)
+
+    def merge(self, other: "PhaseTimings"):
+        for phase, hist in other.histograms.items():
+            self.histograms[phase].merge(hist)
+
+    def to_dict(self) -> dict:
+        return {"phases": list(self.phases),
+                "histograms": {phase: hist.to_dict() for phase, hist in self.histograms.items()}}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PhaseTimings":
+        timings = cls(data["phases"])
+        timings.histograms = {phase: LatencyHistogram.from_dict(hist) for phase, hist in data["histograms"].items()}
+        return timings
+
+    def _measured(self) -> Iterable[str]:
+        return (phase for phase in self.phases if self.histograms[phase].count)
+
+    def format_report(self) -> str:
+        """Tableau des phases mesurées: mesures, moyenne, percentiles et maximum"""
+        lines = [f"  {'phase':<11} {'mesures':>9} {'moy. ms':>9}"
+                 + "".join(f" {f'P{p:g} ms':>9}" for p in PHASE_PERCENTILES) + f" {'max ms':>9}  détail"]
+        for phase in self._measured():
+            hist = self.histograms[phase]
+            lines.append(f"  {phase:<11} {hist.count:>9} {hist.mean:>9.2f}"
+                         + "".join(f" {hist.percentile(p):>9.2f}" for p in PHASE_PERCENTILES)
+                         + f" {hist.max:>9.2f}  {PHASE_LABELS.get(phase, '')}")
+        return "\n".join(lines)
+
+    def records(self) -> Dict[str, dict]:
+        """Résumé et histogramme de chaque phase mesurée (--result-json)"""
+        return {phase: {**self.histograms[phase].summary(), "histogram": self.histograms[phase].to_dict()}
+                for phase in self._measured()}
+
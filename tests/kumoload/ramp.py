@@ -0,0 +1,204 @@
+"""
+Recherche du point de saturation par paliers de débit (rampe)
+
+Le débit offert (boucle ouverte) monte par paliers, chacun tenu `step_duration` secondes.
+Après chaque palier, les SLO sont vérifiés: P99 de la latence depuis l'instant prévu, taux
+d'erreur, et débit effectivement écoulé (un palier que ni kumod ni le driver ne tiennent
+s'étire dans le temps). La rampe s'arrête au premier palier hors SLO; le coude est le dernier
+palier conforme: débit soutenable maximal et sa distribution de latence.
+
+Spécification des paliers (--ramp):
+    1000:500:5000     de 1000 à 5000 msg/s par pas de 500
+    1000:x2:16000     de 1000 à 16000 msg/s en doublant à chaque palier
+    500,1000,2000     liste explicite
+"""
+
+import json
+import time
+from typing import Callable, List, Optional
+
+from kumoload.histogram import format_summary
+from kumoload.stats import RunStats
+
+# Part minimale du débit offert effectivement écoulée pendant un palier
+MIN_THROUGHPUT_RATIO = 0.9
+
+# Nombre maximal de paliers d'une rampe
+MAX_STEPS = 1000
+
+
+def parse_ramp(spec: str) -> List[float]:
+    """Débits des paliers (msg/s) d'une spécification début:pas:fin, début:xfacteur:fin ou d'une liste"""
+    try:
+        if ":" not in spec:
+            rates = [float(part) for part in spec.split(",") if part.strip()]
+        else:
+            start, step, end = spec.split(":")
+            rate, end = float(start), float(end)
+            factor = float(step[1:]) if step.startswith("x") else None
+            increment = None if factor else float(step)
+            if (factor is not None and factor <= 1) or (increment is not None and increment <= 0):
+                raise ValueError
+            rates = []
+            while rate <= end * (1 + 1e-9) and len(rates) < MAX_STEPS:
+                rates.append(rate)
+                rate = rate * factor if factor else rate + increment
+    except ValueError:
+        raise ValueError(f"Rampe invalide: {spec!r} (attendu: 1000:500:5000, 1000:x2:16000 ou 500,1000,2000)")
+    if not rates or any(rate <= 0 for rate in rates):
+        raise ValueError(f"Rampe invalide: {spec!r} (débits strictement positifs attendus)")
+    return rates
+
+
+class RampStep:
+    """Un palier: débit offert, unités de travail (messages ou lots) et résultats une fois exécuté"""
+
+    def __init__(self, rate: float, work_items: range, messages: int):
+        self.rate = rate
+        self.work_items = work_items
+        self.messages = messages
+        self.stats: Optional[RunStats] = None
+        self.duration = 0.0
+        self.breaches: List[str] = []
+
+    @property
+    def achieved_rate(self) -> float:
+        return self.stats.messages / self.duration if self.stats and self.duration else 0.0
+
+    @property
+    def error_rate(self) -> float:
+        return self.stats.failed / self.stats.messages if self.stats and self.stats.messages else 0.0
+
+    @property
+    def passed(self) -> bool:
+        return self.stats is not None and not self.breaches
+
+    def to_dict(self) -> dict:
+        hist = self.stats.latency
+        return {
+            "rate": self.rate, "messages": self.stats.messages, "success": self.stats.success,
+            "failed": self.stats.failed, "duration_s": round(self.duration, 3),
+            "achieved_rate": round(self.achieved_rate, 1), "error_rate": round(self.error_rate, 5),
+            "p50_ms": hist.percentile(50), "p90_ms": hist.percentile(90), "p99_ms": hist.percentile(99),
+            "p999_ms": hist.percentile(99.9), "max_ms": hist.max, "passed": self.passed,
+            "breaches": self.breaches, "latency": hist.to_dict(),
+        }
+
+
+class SaturationFinder:
+    """
+    Exécute les paliers jusqu'au premier dépassement de SLO
+
+    `unit` est le nombre de messages par unité de travail (taille de lot HTTP, 1 en SMTP): chaque
+    palier couvre une plage contiguë d'unités, numérotées à partir de 1 sur toute la rampe.
+    """
+
+    def __init__(self, rates: List[float], step_duration: float, slo_p99_ms: float, slo_error_rate: float,
+                 unit: int = 1):
+        self.step_duration = step_duration
+        self.slo_p99_ms = slo_p99_ms
+        self.slo_error_rate = slo_error_rate
+        self.unit = unit
+        self.steps: List[RampStep] = []
+        first = 1
+        for rate in rates:
+            units = max(1, -(-round(rate * step_duration) // unit))
+            self.steps.append(RampStep(rate, range(first, first + units), units * unit))
+            first += units
+
+    @property
+    def total_messages(self) -> int:
+        """Messages de la rampe complète (borne haute: la rampe s'arrête au premier palier hors SLO)"""
+        return sum(step.messages for step in self.steps)
+
+    @property
+    def executed(self) -> List[RampStep]:
+        return [step for step in self.steps if step.stats is not None]
+
+    @property
+    def knee(self) -> Optional[RampStep]:
+        """Dernier palier conforme avant le premier dépassement"""
+        knee = None
+        for step in self.executed:
+            if not step.passed:
+                break
+            knee = step
+        return knee
+
+    def evaluate(self, step: RampStep):
+        p99 = step.stats.latency.percentile(99)
+        if p99 > self.slo_p99_ms:
+            step.breaches.append(f"P99 {p99:.1f} ms > {self.slo_p99_ms:g} ms")
+        if step.error_rate > self.slo_error_rate:
+            step.breaches.append(f"erreurs {step.error_rate * 100:.2f}% > {self.slo_error_rate * 100:g}%")
+        if step.achieved_rate < step.rate * MIN_THROUGHPUT_RATIO:
+            step.breaches.append(f"débit écoulé {step.achieved_rate:.0f} msg/s < "
+                                 f"{MIN_THROUGHPUT_RATIO * 100:.0f}% du débit offert")
+
+    def run(self, run_step: Callable[[float, range], RunStats],
+            interrupted: Callable[[], bool] = lambda: False) -> Optional[RampStep]:
+        """
+        run_step(débit, unités) exécute un palier en boucle ouverte et retourne ses compteurs
+
+        Un palier interrompu (Ctrl+C, voir `interrupted`) arrête la rampe sans être évalué.
+        """
+        for index, step in enumerate(self.steps, 1):
+            print(f"\n⏳ Palier {index}/{len(self.steps)}: {step.rate:g} msg/s pendant {self.step_duration:g} s "
+                  f"({step.messages} messages)", flush=True)
+            started = time.time()
+            step.stats = run_step(step.rate, step.work_items)
+            step.duration = time.time() - started
+            if interrupted():
+                step.breaches.append("palier interrompu")
+                print(f"⚠ Palier {index} interrompu après {step.stats.messages} messages", flush=True)
+                break
+            self.evaluate(step)
+            hist = step.stats.latency
+            summary = (f"{step.achieved_rate:.1f} msg/s écoulés, P50 {hist.percentile(50):.1f} ms, "
+                       f"P99 {hist.percentile(99):.1f} ms, erreurs {step.error_rate * 100:.2f}%")
+            if step.passed:
+                print(f"✓ Palier {index}: {summary}", flush=True)
+            else:
+                print(f"✗ Palier {index}: {summary}", flush=True)
+                print(f"  SLO dépassé: {'; '.join(step.breaches)}", flush=True)
+                break
+        return self.knee
+
+    def format_report(self) -> str:
+        lines = [f"  SLO:                    P99 ≤ {self.slo_p99_ms:g} ms, erreurs ≤ {self.slo_error_rate * 100:g}%, "
+                 f"débit écoulé ≥ {MIN_THROUGHPUT_RATIO * 100:.0f}% du débit offert",
+                 "",
+                 f"  {'offert':>9} {'écoulé':>9} {'messages':>9} {'P50 ms':>9} {'P99 ms':>9} {'max ms':>9} "
+                 f"{'erreurs':>8}"]
+        for step in self.executed:
+            hist = step.stats.latency
+            lines.append(f"  {step.rate:>9g} {step.achieved_rate:>9.1f} {step.stats.messages:>9} "
+                         f"{hist.percentile(50):>9.1f} {hist.percentile(99):>9.1f} {hist.max:>9.1f} "
+                         f"{step.error_rate * 100:>7.2f}% {'✓' if step.passed else '✗'}")
+        lines.append("")
+        knee = self.knee
+        executed = self.executed
+        if knee is None:
+            lines.append(f"  ✗ Aucun palier conforme: saturation sous {executed[0].rate:g} msg/s"
+                         if executed else "  Aucun palier exécuté")
+            return "\n".join(lines)
+        if knee is executed[-1] and knee is self.steps[-1]:
+            lines.append(f"  ⚠ Aucun dépassement jusqu'au dernier palier: la saturation est au-delà de "
+                         f"{knee.rate:g} msg/s")
+        lines.append(f"  Coude:                  {knee.rate:g} msg/s offerts, {knee.achieved_rate:.1f} msg/s écoulés "
+                     f"(dernier palier conforme)")
+        if knee is not executed[-1]:
+            lines.append(f"  Premier dépassement:    {executed[-1].rate:g} msg/s ({'; '.join(executed[-1].breaches)})")
+        lines.append("  Latence au coude:")
+        lines.append(format_summary(knee.stats.latency, indent="    "))
+        return "\n".join(lines)
+
+    def save(self, path: str):
+        """Exporte les paliers (compteurs, percentiles, histogrammes fusionnables) et le coude en JSON"""
+        knee = self.knee
+        with open(path, "w") as f:
+            json.dump({"slo": {"p99_ms": self.slo_p99_ms, "error_rate": self.slo_error_rate,
+                               "min_throughput_ratio": MIN_THROUGHPUT_RATIO},
+                       "step_duration_s": self.step_duration,
+                       "knee_rate": knee.rate if knee else None,
+                       "steps": [step.to_dict() for step in self.executed]}, f)
@@ -0,0 +1,410 @@
+"""
+Détail par message (--records): colonnes typées en mémoire, vidées par blocs dans un fichier colonnaire
+
+Un run de 10 millions de messages ne peut pas garder un dict Python par message. Ici, chaque
+résultat occupe une ligne de colonnes typées (array): numéro du message, statut, code de
+réponse SMTP/HTTP, latence, instant de fin, endpoint et index d'erreur dans une table de
+messages internés, soit 29 octets par requête. Au-delà de `spill_rows` lignes, les colonnes
+sont ajoutées au fichier sous forme d'un bloc et la mémoire est libérée.
+
+Format du fichier: une suite de blocs indépendants (les processus d'un run --processes
+ajoutent leurs blocs au même fichier, sous verrou flock):
+    b"KLRB" | longueur de l'en-tête (uint32 LE) | en-tête JSON | colonnes brutes, dans l'ordre
+L'en-tête donne le nombre de lignes, l'ordre des octets, le type et la taille de chaque
+colonne, la table des erreurs du bloc et le jeton du run (X-Test-ID = jeton + numéro).
+
+Les destinataires (tirés au hasard) ne sont pas conservés; le jeton X-Test-ID se recalcule.
+
+Usage (après le run):
+    python3 -m kumoload.records FICHIER                         # résumé par statut, code et erreur
+    python3 -m kumoload.records FICHIER --failed --limit 50     # détail des échecs
+    python3 -m kumoload.records FICHIER --code 451 --endpoint 2 --csv 451.csv
+    python3 -m kumoload.records FICHIER --slowest 20            # requêtes les plus lentes
+    python3 -m kumoload.records FICHIER --message 123456        # un message (ou son lot HTTP)
+"""
+
+import re
+import sys
+import csv
+import json
+import time
+import array
+import heapq
+import itertools
+import struct
+import argparse
+import threading
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from kumoload.corpus import RUN_TOKEN, make_token
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Ajouts concurrents de plusieurs processus au même fichier (verrou flock, absent sous Windows)
+SHARED_APPEND = fcntl is not None
+
+MAGIC = b"KLRB"
+
+DEFAULT_SPILL_ROWS = 1_000_000
+
+# (colonne, type array), dans l'ordre du fichier
+COLUMNS = (
+    ("message_num", "I"),   # numéro du message (premier du lot en HTTP par lots)
+    ("messages", "H"),      # destinataires de la requête
+    ("accepted", "H"),      # destinataires acceptés
+    ("status", "B"),        # STATUSES
+    ("code", "H"),          # code de réponse SMTP/HTTP lu dans l'erreur (0: inconnu ou succès)
+    ("latency_ms", "f"),
+    ("timestamp", "d"),     # fin de la requête (epoch)
+    ("endpoint", "H"),
+    ("error", "I"),         # index dans la table des erreurs du bloc (0: aucune)
+)
+
+STATUSES = ("accepted", "rejected", "failed", "partial")
+STATUS_LABELS = {"accepted": "acceptées", "rejected": "refusées", "failed": "échecs réseau",
+                 "partial": "lots partiels"}
+ACCEPTED, REJECTED, FAILED, PARTIAL = range(len(STATUSES))
+
+# Longueur conservée des messages d'erreur internés
+MAX_ERROR_LENGTH = 150
+
+# Code de réponse dans les erreurs des moteurs: "HTTP 500: ...", "Data error: 451 ...",
+# "Data error: (451, b'...')", "Recipients refused: {'a@b': '550 ...'}"
+_CODE_RE = re.compile(r"(?:HTTP |: '?|\()([2-5]\d\d)\b")
+
+
+def reply_code(error: Optional[str]) -> int:
+    match = _CODE_RE.search(error) if error else None
+    return int(match.group(1)) if match else 0
+
+
+class MessageRecords:
+    """
+    Résultats par requête du processus courant, en colonnes typées vidées dans `path`
+
+    Une ligne s'ajoute colonne par colonne: un verrou (non disputé avec le moteur asyncio)
+    garde les colonnes alignées entre les threads du moteur threads.
+    """
+
+    def __init__(self, path: str, spill_rows: int = DEFAULT_SPILL_ROWS, run_token: str = RUN_TOKEN):
+        self.path = path
+        self.spill_rows = max(1, spill_rows)
+        self.run_token = run_token
+        self.written = 0
+        self.blocks = 0
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._columns = {name: array.array(typecode) for name, typecode in COLUMNS}
+        self.errors: List[str] = [""]
+        self._error_index: Dict[str, int] = {"": 0}
+
+    def __len__(self) -> int:
+        return self.written + len(self._columns["message_num"])
+
+    def record(self, message_num: int, success: bool, elapsed_ms: Optional[float], error: Optional[str] = None,
+               endpoint: int = 0, messages: int = 1, accepted: Optional[int] = None):
+        if accepted is None:
+            accepted = messages if success else 0
+        code = reply_code(error)
+        if accepted == messages:
+            status = ACCEPTED
+        elif accepted:
+            status = PARTIAL
+        else:
+            status = REJECTED if code else FAILED
+        key = error[:MAX_ERROR_LENGTH] if error else ""
+        with self._lock:
+            index = self._error_index.get(key)
+            if index is None:
+                index = self._error_index[key] = len(self.errors)
+                self.errors.append(key)
+            columns = self._columns
+            columns["message_num"].append(message_num)
+            columns["messages"].append(messages)
+            columns["accepted"].append(accepted)
+            columns["status"].append(status)
+            columns["code"].append(code)
+            columns["latency_ms"].append(elapsed_ms or 0.0)
+            columns["timestamp"].append(time.time())
+            columns["endpoint"].append(endpoint)
+            columns["error"].append(index)
+            if len(columns["message_num"]) >= self.spill_rows:
+                self._spill()
+
+    def _spill(self):
+        """Ajoute les lignes en mémoire au fichier (un bloc) et repart de colonnes vides"""
+        rows = len(self._columns["message_num"])
+        if not rows:
+            return
+        header = json.dumps({
+            "rows": rows,
+            "byteorder": sys.byteorder,
+            "run": self.run_token,
+            "columns": [[name, typecode, len(self._columns[name]) * self._columns[name].itemsize]
+                        for name, typecode in COLUMNS],
+            "errors": self.errors,
+        }).encode("utf-8")
+        with open(self.path, "ab") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(MAGIC + struct.pack("<I", len(header)) + header)
+            for name, _ in COLUMNS:
+                self._columns[name].tofile(f)
+            f.flush()
+        self.written += rows
+        self.blocks += 1
+        self._reset()
+
+    def flush(self):
+        with self._lock:
+            self._spill()
+
+
+def truncate(path: str):
+    """Vide le fichier avant le run (les processus workers y ajoutent ensuite leurs blocs)"""
+    open(path, "wb").close()
+
+# ============================================================================
+# LECTURE
+# ============================================================================
+
+class RecordBlock:
+    """Colonnes d'un bloc lu depuis le fichier, et sa table d'erreurs"""
+
+    def __init__(self, columns: Dict[str, array.array], errors: List[str], run_token: str):
+        self.columns = columns
+        self.errors = errors
+        self.run_token = run_token
+
+    def __len__(self) -> int:
+        return len(self.columns["message_num"])
+
+    def row(self, i: int) -> dict:
+        columns = self.columns
+        return {
+            "message_num": columns["message_num"][i],
+            "token": make_token(columns["message_num"][i], self.run_token).decode("ascii"),
+            "messages": columns["messages"][i],
+            "accepted": columns["accepted"][i],
+            "status": STATUSES[columns["status"][i]],
+            "code": columns["code"][i],
+            "latency_ms": round(columns["latency_ms"][i], 3),
+            "timestamp": columns["timestamp"][i],
+            "endpoint": columns["endpoint"][i],
+            "error": self.errors[columns["error"][i]],
+        }
+
+
+def read_blocks(path: str) -> Iterator[RecordBlock]:
+    """Blocs du fichier, un à la fois (mémoire bornée par la taille d'un bloc)"""
+    with open(path, "rb") as f:
+        while True:
+            prefix = f.read(8)
+            if not prefix:
+                return
+            if len(prefix) < 8 or prefix[:4] != MAGIC:
+                raise RuntimeError(f"{path}: bloc invalide à l'octet {f.tell() - len(prefix)}")
+            header = json.loads(f.read(struct.unpack("<I", prefix[4:])[0]))
+            columns = {}
+            for name, typecode, size in header["columns"]:
+                column = array.array(typecode)
+                column.frombytes(f.read(size))
+                if header["byteorder"] != sys.byteorder:
+                    column.byteswap()
+                columns[name] = column
+            yield RecordBlock(columns, header["errors"], header["run"])
+
+
+class RecordFilter:
+    """Critères de sélection des lignes (tous optionnels, combinés par ET)"""
+
+    def __init__(self, failed: bool = False, status: Optional[str] = None, code: Optional[int] = None,
+                 error: Optional[str] = None, message: Optional[int] = None, endpoint: Optional[int] = None,
+                 min_latency_ms: Optional[float] = None):
+        self.failed = failed
+        self.status = STATUSES.index(status) if status is not None else None
+        self.code = code
+        self.error = error
+        self.message = message
+        self.endpoint = endpoint
+        self.min_latency_ms = min_latency_ms
+
+    def matches(self, block: RecordBlock) -> Iterator[int]:
+        """Index des lignes du bloc qui satisfont les critères"""
+        columns = block.columns
+        errors = None
+        if self.error is not None:
+            errors = {index for index, text in enumerate(block.errors) if index and self.error in text}
+            if not errors:
+                return
+        for i in range(len(block)):
+            if self.failed and columns["status"][i] == ACCEPTED:
+                continue
+            if self.status is not None and columns["status"][i] != self.status:
+                continue
+            if self.code is not None and columns["code"][i] != self.code:
+                continue
+            if errors is not None and columns["error"][i] not in errors:
+                continue
+            if self.endpoint is not None and columns["endpoint"][i] != self.endpoint:
+                continue
+            if self.min_latency_ms is not None and columns["latency_ms"][i] < self.min_latency_ms:
+                continue
+            if self.message is not None:
+                first = columns["message_num"][i]
+                if not first <= self.message < first + max(1, columns["messages"][i]):
+                    continue
+            yield i
+
+
+class RecordSummary:
+    """Agrégats des lignes sélectionnées: statuts, codes, erreurs, endpoints, période"""
+
+    def __init__(self):
+        self.requests = 0
+        self.messages = 0
+        self.accepted = 0
+        self.statuses: Dict[str, int] = {}
+        self.codes: Dict[int, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.endpoints: Dict[int, int] = {}
+        self.first: Optional[float] = None
+        self.last: Optional[float] = None
+
+    def add(self, block: RecordBlock, rows: Sequence[int]):
+        columns = block.columns
+        for i in rows:
+            self.requests += 1
+            self.messages += columns["messages"][i]
+            self.accepted += columns["accepted"][i]
+            status = STATUSES[columns["status"][i]]
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if columns["code"][i]:
+                self.codes[columns["code"][i]] = self.codes.get(columns["code"][i], 0) + 1
+            if columns["error"][i]:
+                error = block.errors[columns["error"][i]]
+                self.errors[error] = self.errors.get(error, 0) + 1
+            self.endpoints[columns["endpoint"][i]] = self.endpoints.get(columns["endpoint"][i], 0) + 1
+            timestamp = columns["timestamp"][i]
+            self.first = timestamp if self.first is None else min(self.first, timestamp)
+            self.last = timestamp if self.last is None else max(self.last, timestamp)
+
+    def format_report(self, top: int = 10) -> str:
+        if not self.requests:
+            return "  Aucune requête sélectionnée"
+        lines = [f"  Requêtes:               {self.requests} ({self.messages} messages, {self.accepted} acceptés)",
+                 f"  Période:                {self.last - self.first:.1f} s "
+                 f"(de {time.strftime('%H:%M:%S', time.localtime(self.first))} "
+                 f"à {time.strftime('%H:%M:%S', time.localtime(self.last))})"]
+        for status in STATUSES:
+            if status in self.statuses:
+                lines.append(f"  {STATUS_LABELS[status] + ':':<23} {self.statuses[status]}")
+        if self.codes:
+            lines.append("  Codes de réponse:       " + ", ".join(
+                f"{code} × {count}" for code, count in sorted(self.codes.items(), key=lambda item: -item[1])[:top]))
+        if len(self.endpoints) > 1:
+            lines.append("  Endpoints:              " + ", ".join(
+                f"#{endpoint} × {count}" for endpoint, count in sorted(self.endpoints.items())))
+        if self.errors:
+            lines.append("  Erreurs:")
+            for error, count in sorted(self.errors.items(), key=lambda item: -item[1])[:top]:
+                lines.append(f"    {count:>9} × {error}")
+        return "\n".join(lines)
+
+
+def select(path: str, record_filter: RecordFilter, limit: int = 20,
+           slowest: int = 0) -> Tuple[RecordSummary, List[dict]]:
+    """Résumé des lignes sélectionnées et leur détail (les `limit` premières, ou les `slowest` plus lentes)"""
+    summary = RecordSummary()
+    rows: List[dict] = []
+    heap: List[Tuple[float, int, dict]] = []
+    order = itertools.count()
+    for block in read_blocks(path):
+        matched = list(record_filter.matches(block))
+        summary.add(block, matched)
+        if slowest:
+            latency = block.columns["latency_ms"]
+            for i in heapq.nlargest(slowest, matched, key=latency.__getitem__):
+                entry = (latency[i], next(order), block.row(i))
+                if len(heap) < slowest:
+                    heapq.heappush(heap, entry)
+                else:
+                    heapq.heappushpop(heap, entry)
+        elif len(rows) < limit:
+            rows.extend(block.row(i) for i in matched[:limit - len(rows)])
+    if slowest:
+        rows = [row for _, _, row in sorted(heap, key=lambda entry: -entry[0])]
+    return summary, rows
+
+
+def format_rows(rows: Sequence[dict]) -> str:
+    lines = [f"  {'message':>10} {'jeton X-Test-ID':<22} {'statut':<9} {'code':>4} {'acc.':>9} {'ms':>9} "
+             f"{'heure':<12} {'ep.':>3}  erreur"]
+    for row in rows:
+        clock = time.strftime("%H:%M:%S", time.localtime(row["timestamp"])) + f".{int(row['timestamp'] % 1 * 1000):03d}"
+        lines.append(f"  {row['message_num']:>10} {row['token']:<22} {row['status']:<9} {row['code'] or '-':>4} "
+                     f"{row['accepted']:>4}/{row['messages']:<4} {row['latency_ms']:>9.2f} {clock:<12} "
+                     f"{row['endpoint']:>3}  {row['error'][:80]}")
+    return "\n".join(lines)
+
+
+def export_csv(path: str, records_path: str, record_filter: RecordFilter) -> int:
+    """Exporte toutes les lignes sélectionnées en CSV, retourne leur nombre"""
+    count = 0
+    with open(path, "w", newline="") as f:
+        writer = None
+        for block in read_blocks(records_path):
+            for i in record_filter.matches(block):
+                row = block.row(i)
+                if writer is None:
+                    writer = csv.DictWriter(f, fieldnames=list(row))
+                    writer.writeheader()
+                writer.writerow(row)
+                count += 1
+    return count
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Détail par message d'un run (fichier écrit avec --records)")
+    parser.add_argument("path", help="Fichier écrit par le driver (--records)")
+    parser.add_argument("--failed", action="store_true", help="Requêtes non entièrement acceptées")
+    parser.add_argument("--status", choices=STATUSES, help="Statut des requêtes")
+    parser.add_argument("--code", type=int, help="Code de réponse SMTP/HTTP (ex. 451)")
+    parser.add_argument("--error", help="Texte contenu dans le message d'erreur")
+    parser.add_argument("--message", type=int, help="Numéro de message (lot HTTP qui le contient)")
+    parser.add_argument("--endpoint", type=int, help="Index de l'endpoint (--endpoints)")
+    parser.add_argument("--min-latency", type=float, help="Latence minimale en ms")
+    parser.add_argument("--slowest", type=int, default=0, help="Affiche les N requêtes les plus lentes")
+    parser.add_argument("--limit", type=int, default=20, help="Lignes de détail affichées (défaut: 20)")
+    parser.add_argument("--top", type=int, default=10, help="Codes et erreurs affichés dans le résumé (défaut: 10)")
+    parser.add_argument("--csv", help="Exporte toutes les lignes sélectionnées en CSV")
+    args = parser.parse_args(argv)
+
+    record_filter = RecordFilter(args.failed, args.status, args.code, args.error, args.message, args.endpoint,
+                                 args.min_latency)
+    try:
+        summary, rows = select(args.path, record_filter, args.limit, args.slowest)
+        print("Requêtes sélectionnées:")
+        print(summary.format_report(args.top))
+        if rows:
+            print("")
+            print(f"{len(rows)} requêtes les plus lentes:" if args.slowest else "Détail:")
+            print(format_rows(rows))
+            if not args.slowest and summary.requests > len(rows):
+                print(f"  ... {summary.requests - len(rows)} autres (--limit, --csv)")
+        if args.csv:
+            count = export_csv(args.csv, args.path, record_filter)
+            print(f"✓ {count} lignes exportées: {args.csv}")
+    except (OSError, RuntimeError, ValueError) as e:
+        print(f"✗ Erreur: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
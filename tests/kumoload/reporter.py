@@ -0,0 +1,286 @@
+"""
+Compteurs par worker et rapport d'intervalle en direct
+
+Chaque worker (thread du moteur threads, boucle du moteur async) écrit seul dans ses
+propres compteurs: aucun verrou global sur le chemin d'un message, seulement le verrou du
+worker, que le reporter ne prend que le temps d'échanger son histogramme d'intervalle. Un thread reporter
+agrège les workers une fois par intervalle (débit, taux d'erreur, percentiles de
+l'intervalle) et écrit la série temporelle en JSONL ou CSV.
+
+Avec --processes, chaque processus publie ses intervalles dans une file
+multiprocessing (ProgressChannel); le reporter du processus principal les fusionne.
+"""
+
+import csv
+import json
+import time
+import queue
+import threading
+from typing import Callable, List, Optional, Tuple
+
+from kumoload.histogram import LatencyHistogram
+from kumoload.stats import RunStats
+
+TIMESERIES_FIELDS = ("elapsed_s", "timestamp", "messages", "success", "failed", "requests",
+                     "rate", "error_rate", "p50_ms", "p90_ms", "p99_ms", "p999_ms", "max_ms", "total")
+
+# ============================================================================
+# COMPTEURS PAR WORKER
+# ============================================================================
+
+class WorkerCounters:
+    """
+    Compteurs d'un worker: écrits par lui seul, lus par le reporter
+
+    Le verrou du worker n'est disputé qu'au moment où le reporter échange l'histogramme
+    d'intervalle: aucune latence enregistrée ne tombe dans un histogramme déjà collecté.
+    """
+
+    __slots__ = ("stats", "interval", "lock")
+
+    def __init__(self, histogram_digits: int):
+        self.stats = RunStats(histogram_digits)
+        self.interval = LatencyHistogram(histogram_digits)
+        self.lock = threading.Lock()
+
+    def record(self, success: bool, elapsed_ms: Optional[float], error: Optional[str] = None,
+               messages: int = 1, accepted: Optional[int] = None):
+        with self.lock:
+            self.stats.record(success, elapsed_ms, error, messages, accepted)
+            if elapsed_ms is not None:
+                self.interval.record(elapsed_ms)
+
+    def swap_interval(self, histogram_digits: int) -> LatencyHistogram:
+        """Remplace l'histogramme d'intervalle et retourne l'ancien, complet"""
+        with self.lock:
+            interval, self.interval = self.interval, LatencyHistogram(histogram_digits)
+        return interval
+
+
+class IntervalSample:
+    """Deltas d'un intervalle (jusqu'à l'instant `end`): messages, requêtes et histogramme des latences"""
+
+    def __init__(self, histogram_digits: int = 3):
+        self.success = 0
+        self.failed = 0
+        self.requests = 0
+        self.latency = LatencyHistogram(histogram_digits)
+        self.end = time.time()
+
+    def merge(self, other: "IntervalSample"):
+        self.success += other.success
+        self.failed += other.failed
+        self.requests += other.requests
+        self.latency.merge(other.latency)
+        self.end = max(self.end, other.end)
+
+    def to_dict(self) -> dict:
+        return {"success": self.success, "failed": self.failed, "requests": self.requests,
+                "latency": self.latency.to_dict(), "end": self.end}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "IntervalSample":
+        sample = cls()
+        sample.success = data["success"]
+        sample.failed = data["failed"]
+        sample.requests = data["requests"]
+        sample.latency = LatencyHistogram.from_dict(data["latency"])
+        sample.end = data["end"]
+        return sample
+
+
+class CounterRegistry:
+    """Compteurs des workers du processus courant, créés au premier message de chaque thread"""
+
+    def __init__(self, histogram_digits: int = 3):
+        self.histogram_digits = histogram_digits
+        self._local = threading.local()
+        self._workers: List[WorkerCounters] = []
+        # Verrou pris uniquement à l'enregistrement d'un nouveau worker
+        self._register_lock = threading.Lock()
+        # collect() (thread reporter) et checkpoint() (entre deux paliers) ne se croisent pas
+        self._collect_lock = threading.Lock()
+        self._last = (0, 0, 0)
+        # Cumul des checkpoints précédents: les deltas d'intervalle restent continus
+        self._base = (0, 0, 0)
+
+    def worker(self) -> WorkerCounters:
+        counters = getattr(self._local, "counters", None)
+        if counters is None:
+            counters = self._local.counters = WorkerCounters(self.histogram_digits)
+            with self._register_lock:
+                self._workers.append(counters)
+        return counters
+
+    def collect(self) -> IntervalSample:
+        """Échange les histogrammes d'intervalle des workers et retourne les deltas depuis le dernier appel"""
+        workers = list(self._workers)
+        swapped = [counters.swap_interval(self.histogram_digits) for counters in workers]
+
+        sample = IntervalSample(self.histogram_digits)
+        sample.end = time.time()
+        with self._collect_lock:
+            totals = (self._base[0] + sum(c.stats.success for c in workers),
+                      self._base[1] + sum(c.stats.failed for c in workers),
+                      self._base[2] + sum(c.stats.requests for c in workers))
+        sample.success, sample.failed, sample.requests = (now - last for now, last in zip(totals, self._last))
+        self._last = totals
+        for hist in swapped:
+            sample.latency.merge(hist)
+        return sample
+
+    def checkpoint(self) -> RunStats:
+        """
+        Fusion des compteurs des workers depuis le checkpoint précédent (fin de run ou d'un palier de rampe)
+
+        À appeler sans envoi en cours: les compteurs des workers repartent de zéro.
+        """
+        stats = RunStats(self.histogram_digits)
+        with self._collect_lock:
+            for counters in self._workers:
+                stats.merge(counters.stats)
+                counters.stats = RunStats(self.histogram_digits)
+            self._base = (self._base[0] + stats.success, self._base[1] + stats.failed,
+                          self._base[2] + stats.requests)
+        return stats
+
+# ============================================================================
+# PUBLICATION ET RAPPORT
+# ============================================================================
+
+class _Ticker:
+    """
+    Thread qui appelle tick() aux instants epoch + k × interval (+ offset), puis une dernière fois à l'arrêt
+
+    Les processus workers et le reporter partagent le même epoch: leurs intervalles sont alignés.
+    """
+
+    def __init__(self, interval: float, epoch: Optional[float] = None, offset: float = 0.0):
+        self.interval = interval
+        self.epoch = time.time() if epoch is None else epoch
+        self.offset = offset
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        k = int((time.time() - self.epoch) / self.interval) + 1
+        while not self._stop.wait(max(0.0, self.epoch + k * self.interval + self.offset - time.time())):
+            self.tick()
+            k += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.tick()
+
+    def tick(self):
+        raise NotImplementedError
+
+
+class ProgressChannel:
+    """File multiprocessing + horloge commune, transmise aux processus workers"""
+
+    def __init__(self, context, interval: float):
+        self.queue = context.Queue()
+        self.interval = interval
+        self.epoch = time.time()
+
+    def drain(self) -> List[IntervalSample]:
+        samples = []
+        while True:
+            try:
+                samples.append(IntervalSample.from_dict(self.queue.get_nowait()))
+            except queue.Empty:
+                return samples
+
+
+class IntervalPublisher(_Ticker):
+    """Côté processus worker: publie ses intervalles dans le canal de progression"""
+
+    def __init__(self, registry: CounterRegistry, channel: ProgressChannel):
+        super().__init__(channel.interval, channel.epoch)
+        self.registry = registry
+        self.channel = channel
+
+    def tick(self):
+        self.channel.queue.put(self.registry.collect().to_dict())
+
+
+class LiveReporter(_Ticker):
+    """Affiche une ligne par intervalle et écrit la série temporelle (JSONL, ou CSV si le fichier finit par .csv)"""
+
+    def __init__(self, source: Callable[[], List[IntervalSample]], interval: float = 1.0,
+                 timeseries_path: Optional[str] = None, histogram_digits: int = 3, quiet: bool = False,
+                 epoch: Optional[float] = None, offset: float = 0.0):
+        super().__init__(interval, epoch, offset)
+        self.source = source
+        self.histogram_digits = histogram_digits
+        self.quiet = quiet
+        self.last = self.epoch
+        self.total = 0
+        self.rows = 0
+        # Chronologie d'injection (timestamp, total, débit) pour la corrélation avec les métriques kumod
+        self.history: List[Tuple[float, int, float]] = []
+        self._file = None
+        self._csv = None
+        if timeseries_path:
+            self._file = open(timeseries_path, "w", newline="")
+            if timeseries_path.endswith(".csv"):
+                self._csv = csv.DictWriter(self._file, fieldnames=TIMESERIES_FIELDS)
+                self._csv.writeheader()
+
+    @classmethod
+    def for_channel(cls, channel: ProgressChannel, **kwargs) -> "LiveReporter":
+        """Reporter du processus principal: tick décalé pour laisser arriver les intervalles des workers"""
+        return cls(channel.drain, channel.interval, epoch=channel.epoch, offset=channel.interval / 4, **kwargs)
+
+    def tick(self):
+        samples = self.source()
+        if not samples:
+            return
+        sample = IntervalSample(self.histogram_digits)
+        for part in samples:
+            sample.merge(part)
+        messages = sample.success + sample.failed
+        if not messages and not sample.requests:
+            return
+        # Durée couverte par les intervalles reçus (alignés sur l'epoch commun)
+        duration = sample.end - self.last
+        self.last = sample.end
+        self.total += messages
+        hist = sample.latency
+        row = {
+            "elapsed_s": round(sample.end - self.epoch, 3),
+            "timestamp": round(sample.end, 3),
+            "messages": messages,
+            "success": sample.success,
+            "failed": sample.failed,
+            "requests": sample.requests,
+            "rate": round(messages / duration, 1) if duration > 0 else 0.0,
+            "error_rate": round(sample.failed / messages, 5) if messages else 0.0,
+            "p50_ms": hist.percentile(50),
+            "p90_ms": hist.percentile(90),
+            "p99_ms": hist.percentile(99),
+            "p999_ms": hist.percentile(99.9),
+            "max_ms": hist.max,
+            "total": self.total,
+        }
+        if not self.quiet:
+            print(f"[{row['elapsed_s']:7.1f}s] {row['rate']:>9.1f} msg/s | erreurs {row['error_rate'] * 100:5.2f}% | "
+                  f"P50 {row['p50_ms']:.2f} ms, P99 {row['p99_ms']:.2f} ms, max {row['max_ms']:.2f} ms | "
+                  f"total {self.total}", flush=True)
+        if self._csv is not None:
+            self._csv.writerow(row)
+        elif self._file is not None:
+            self._file.write(json.dumps(row) + "\n")
+        self.rows += 1
+        self.history.append((row["timestamp"], self.total, row["rate"]))
+
+    def stop(self):
+        super().stop()
+        if self._file is not None:
+            self._file.close()
@@ -0,0 +1,317 @@
+"""
+Ordonnancement des envois asyncio
+
+run_closed_loop lance `concurrency` workers qui consomment un itérateur de numéros
+de message (ou de lots): chaque worker n'envoie le suivant qu'après la fin du précédent.
+
+run_open_loop déclenche les envois à débit constant, indépendamment des réponses: la latence
+est mesurée depuis l'instant prévu de chaque envoi (correction du "coordinated omission").
+
+run_trace_loop déclenche chaque envoi à l'instant que lui donne une trace (rejeu de production),
+avec la même mesure de latence, et relève l'écart entre départs effectifs et instants prévus.
+
+run_bounded (moteur threads) soumet les envois au pool au fil de l'eau, avec une fenêtre bornée
+de tâches en vol: la mémoire ne dépend pas du nombre de messages du run.
+
+RunLimit arrête la production des envois (durée atteinte ou Ctrl+C): les moteurs cessent de
+consommer leur itérateur et terminent les envois en cours.
+"""
+
+import time
+import asyncio
+import threading
+from concurrent.futures import FIRST_COMPLETED, Executor, wait
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from kumoload.histogram import LatencyHistogram
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def raise_nofile_limit(wanted: int) -> int:
+    """Augmente la limite de descripteurs ouverts (soft -> hard) pour tenir `wanted` connexions"""
+    if resource is None:
+        return wanted
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft >= wanted:
+        return soft
+    target = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        return target
+    except (ValueError, OSError):
+        return soft
+
+
+# Plafond du nombre de messages d'un run --duration sans nombre de messages (numéros sur 32 bits)
+UNBOUNDED_MESSAGES = 2 ** 32 - 1
+
+
+class RunLimit:
+    """
+    Fin anticipée d'un run: durée maximale (--duration) ou interruption (Ctrl+C)
+
+    L'échéance est absolue (horloge time.time) et l'événement d'arrêt peut être partagé entre
+    processus (process_context().Event()): créé avant le fork, il est vu par tous les workers.
+    """
+
+    def __init__(self, duration: float = 0.0, event=None):
+        self.duration = duration
+        self.deadline: Optional[float] = None
+        # Injection en cours (entre start et finish): Ctrl+C arrête alors les envois sans quitter
+        self.running = False
+        self.cut_short = False
+        self._stopped = event if event is not None else threading.Event()
+
+    def start(self, now: Optional[float] = None):
+        """Début de l'injection: fait partir la durée maximale"""
+        self.running = True
+        if self.duration > 0:
+            self.deadline = (time.time() if now is None else now) + self.duration
+
+    def finish(self):
+        """Fin de l'injection: note si le run a été écourté (échéance atteinte ou interruption)"""
+        self.running = False
+        self.cut_short = self.expired()
+
+    def stop(self):
+        self._stopped.set()
+
+    @property
+    def interrupted(self) -> bool:
+        return self._stopped.is_set()
+
+    def expired(self) -> bool:
+        return self._stopped.is_set() or (self.deadline is not None and time.time() >= self.deadline)
+
+    def take(self, items: range) -> "LimitedItems":
+        return LimitedItems(items, self)
+
+
+class LimitedItems:
+    """Éléments d'une plage tirés jusqu'à l'expiration du RunLimit (itérateur partageable entre workers)"""
+
+    def __init__(self, items: range, limit: RunLimit):
+        self.items = items
+        self.taken = 0
+        self._iterator = iter(items)
+        self._limit = limit
+
+    def __len__(self) -> int:
+        """Nombre d'éléments prévus (plage complète)"""
+        return len(self.items)
+
+    def __iter__(self) -> Iterator[Any]:
+        return self
+
+    def __next__(self):
+        if self._limit.expired():
+            raise StopIteration
+        item = next(self._iterator)
+        self.taken += 1
+        return item
+
+    @property
+    def sent(self) -> range:
+        """Éléments effectivement tirés (début de la plage si le run a été écourté)"""
+        return self.items[:self.taken]
+
+
+def run_bounded(executor: Executor, fn: Callable[[Any], Any], items: Iterable[Any], window: int,
+                on_error: Callable[[Any, BaseException], None]):
+    """
+    Exécute fn(item) dans le pool pour chaque élément, avec au plus `window` tâches soumises
+
+    Les éléments sont tirés de l'itérateur à mesure que des tâches se terminent: aucune file de
+    futures proportionnelle au run. on_error(item, exception) reçoit les exceptions de fn.
+    """
+    iterator = iter(items)
+    pending = {}
+
+    def refill():
+        for item in iterator:
+            pending[executor.submit(fn, item)] = item
+            if len(pending) >= window:
+                return
+
+    refill()
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            item = pending.pop(future)
+            try:
+                future.result()
+            except Exception as e:
+                on_error(item, e)
+        refill()
+
+
+async def run_closed_loop(send_one: Callable[[Any], Awaitable[None]], items: Iterable[Any],
+                          concurrency: int):
+    """Envoie chaque élément (numéro de message ou de lot) avec au plus `concurrency` envois simultanés"""
+    iterator = iter(items)
+
+    async def worker():
+        for item in iterator:
+            await send_one(item)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+
+
+class OpenLoopStats:
+    """Compteurs de l'ordonnanceur en boucle ouverte"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.scheduled = 0
+        self.max_lag_ms = 0.0
+        self.duration = 0.0
+
+
+async def run_open_loop(send_one: Callable[[Any, float], Awaitable[None]], items: Iterable[Any],
+                        rate: float, max_in_flight: int = 10000) -> OpenLoopStats:
+    """
+    Déclenche `rate` envois par seconde, sans attendre la fin des envois précédents
+
+    send_one(item, scheduled) reçoit l'instant prévu (horloge time.perf_counter) et doit
+    mesurer la latence depuis cet instant. Les envois sont faits par au plus `max_in_flight`
+    workers, qui prennent les éléments dans une file bornée: si le serveur cale, l'ordonnanceur
+    attend une place dans la file (la mémoire reste bornée) et le retard pris reste compté dans
+    la latence des envois suivants, mesurée depuis leur instant prévu.
+    """
+    stats = OpenLoopStats(rate)
+    interval = 1.0 / rate
+    max_in_flight = max(1, max_in_flight)
+    pending: "asyncio.Queue[Optional[Tuple[Any, float]]]" = asyncio.Queue(max_in_flight)
+    workers = []
+    errors = []
+    idle = 0
+
+    async def worker():
+        nonlocal idle
+        while True:
+            idle += 1
+            entry = await pending.get()
+            idle -= 1
+            if entry is None:
+                return
+            try:
+                await send_one(*entry)
+            except Exception as e:
+                # Comme un envoi isolé: les autres continuent, la première erreur est levée à la fin
+                errors.append(e)
+
+    start = time.perf_counter()
+    try:
+        for index, item in enumerate(items):
+            scheduled = start + index * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                # En retard sur le planning: on rattrape sans dormir, en laissant tourner les envois en cours
+                stats.max_lag_ms = max(stats.max_lag_ms, -delay * 1000)
+                await asyncio.sleep(0)
+            if pending.qsize() >= idle and len(workers) < max_in_flight:
+                # Workers créés à la demande: autant que d'envois simultanés observés
+                workers.append(asyncio.ensure_future(worker()))
+            await pending.put((item, scheduled))
+            stats.scheduled += 1
+        for _ in workers:
+            await pending.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+    if errors:
+        raise errors[0]
+    stats.duration = time.perf_counter() - start
+    return stats
+
+
+class TraceLoopStats:
+    """Précision du rejeu: retard des départs effectifs sur les instants de la trace (fusionnable)"""
+
+    # Seuils de retard comptés (ms)
+    LATE_THRESHOLDS = (1.0, 10.0, 100.0)
+
+    def __init__(self, speed: float, histogram_digits: int = 3):
+        self.speed = speed
+        self.scheduled = 0
+        self.duration = 0.0
+        self.lateness = LatencyHistogram(histogram_digits)
+        self.late: Dict[float, int] = {threshold: 0 for threshold in self.LATE_THRESHOLDS}
+
+    def record(self, lateness_ms: float):
+        self.lateness.record(lateness_ms)
+        for threshold in self.LATE_THRESHOLDS:
+            if lateness_ms > threshold:
+                self.late[threshold] += 1
+
+    def merge(self, other: "TraceLoopStats"):
+        self.scheduled += other.scheduled
+        self.duration = max(self.duration, other.duration)
+        self.lateness.merge(other.lateness)
+        for threshold, count in other.late.items():
+            self.late[threshold] = self.late.get(threshold, 0) + count
+
+    def to_dict(self) -> dict:
+        return {"speed": self.speed, "scheduled": self.scheduled, "duration": self.duration,
+                "lateness": self.lateness.to_dict(), "late": [[threshold, count] for threshold, count in self.late.items()]}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TraceLoopStats":
+        stats = cls(data["speed"])
+        stats.scheduled = data["scheduled"]
+        stats.duration = data["duration"]
+        stats.lateness = LatencyHistogram.from_dict(data["lateness"])
+        stats.late = {threshold: count for threshold, count in data["late"]}
+        return stats
+
+
+async def run_trace_loop(send_one: Callable[[Any, float], Awaitable[None]], items: Iterable[Any],
+                         offset_of: Callable[[Any], float], speed: float = 1.0, max_in_flight: int = 10000,
+                         start_at: Optional[float] = None, spin_ms: float = 1.0,
+                         histogram_digits: int = 3) -> TraceLoopStats:
+    """
+    Déclenche chaque élément à l'instant début + offset_of(item) / speed (éléments triés par instant)
+
+    Les instants sont absolus: un envoi en retard part immédiatement sans décaler les suivants, le
+    rejeu rattrape au lieu de dériver. asyncio.sleep se réveille avec ~1 ms d'imprécision: l'attente
+    s'arrête `spin_ms` avant l'instant prévu, puis la boucle cède la main (sleep(0), les envois en
+    cours continuent) jusqu'à l'instant exact. `start_at` (horloge time.time) aligne les processus
+    workers sur un même début. send_one(item, scheduled) mesure sa latence depuis l'instant prévu.
+    """
+    stats = TraceLoopStats(speed, histogram_digits)
+    in_flight = asyncio.Semaphore(max(1, max_in_flight))
+    spin = spin_ms / 1000
+    tasks = set()
+
+    async def fire(item, scheduled: float):
+        async with in_flight:
+            # Retard mesuré au départ effectif (attente d'un créneau comprise)
+            stats.record(max(0.0, (time.perf_counter() - scheduled) * 1000))
+            await send_one(item, scheduled)
+
+    start = time.perf_counter() + (max(0.0, start_at - time.time()) if start_at is not None else 0.0)
+    for item in items:
+        scheduled = start + offset_of(item) / speed
+        delay = scheduled - time.perf_counter()
+        if delay > spin:
+            await asyncio.sleep(delay - spin)
+        elif delay <= 0:
+            # Rafale ou retard: départ immédiat, en laissant démarrer les envois déjà déclenchés
+            await asyncio.sleep(0)
+        while time.perf_counter() < scheduled:
+            await asyncio.sleep(0)
+        task = asyncio.ensure_future(fire(item, scheduled))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        stats.scheduled += 1
+    if tasks:
+        await asyncio.gather(*tasks)
+    stats.duration = time.perf_counter() - start
+    return stats
@@ -0,0 +1,218 @@
+"""
+Envois programmés (--schedule): en-tête X-Schedule et mesure de la libération des messages
+
+queues.toml déclare `scheduling_header = "X-Schedule"`: kumod lit dans cet en-tête un objet JSON
+({"first_attempt": "2026-01-01T10:00:00+00:00"}) et garde le message dans sa queue programmée
+(scheduled_queue_count) jusqu'à l'échéance. Ici, chaque message reçoit une échéance tirée d'une
+distribution, comptée depuis un instant de référence commun (début du run, identique dans tous
+les processus); le tirage dépend du numéro du message et se recalcule après le run.
+
+Avec --metrics, format_release compare la libération observée (baisse de scheduled_queue_count,
+montée de ready_count) aux échéances prévues: retard de la libération et durée de la vague.
+
+Distributions (--schedule):
+    herd:10m            « thundering herd »: tous les messages dus à la même seconde, à +10 min
+    herd:10m:60s        tous dus dans la même minute (répartis sur 60 s à partir de +10 min)
+    uniform:5m:30m      échéances uniformes entre +5 min et +30 min
+    normal:20m:5m       loi normale de moyenne 20 min et d'écart-type 5 min (bornée à +0)
+    exp:10m             loi exponentielle de moyenne 10 min (échéances d'un processus de Poisson)
+
+Durées: 90, 90s, 10m, 2h (secondes par défaut).
+"""
+
+import json
+import random
+import re
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from kumoload.metrics import MetricsSample
+
+DISTRIBUTIONS = ("herd", "uniform", "normal", "exp")
+
+SCHEDULE_HEADER = "X-Schedule"
+
+# Nombre maximal de numéros de message tirés pour estimer la courbe des échéances
+CDF_SAMPLES = 10000
+
+# Parts des messages libérés comparées à leur échéance prévue
+RELEASE_QUANTILES = (0.01, 0.5, 0.9, 0.99, 1.0)
+
+_DURATION_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(s|m|h|)\s*$", re.IGNORECASE)
+_DURATION_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(text: str) -> float:
+    """Durée en secondes: 90, 90s, 10m, 2h"""
+    match = _DURATION_RE.match(text)
+    if not match:
+        raise ValueError(f"Durée invalide: {text!r} (attendu: 90, 90s, 10m, 2h)")
+    return float(match.group(1)) * _DURATION_UNITS[match.group(2).lower()]
+
+
+def format_offset(seconds: float) -> str:
+    """Décalage lisible: +42.0s, +10m05s, +2h03m"""
+    sign = "-" if seconds < 0 else "+"
+    seconds = abs(seconds)
+    if seconds < 60:
+        return f"{sign}{seconds:.1f}s"
+    if seconds < 3600:
+        return f"{sign}{int(seconds // 60)}m{int(seconds % 60):02d}s"
+    return f"{sign}{int(seconds // 3600)}h{int(seconds % 3600 // 60):02d}m"
+
+
+def parse_schedule_header(value: str) -> Optional[float]:
+    """Échéance (epoch) d'une valeur X-Schedule, None si absente ou invalide"""
+    try:
+        first_attempt = json.loads(value).get("first_attempt")
+        return datetime.fromisoformat(first_attempt.replace("Z", "+00:00")).timestamp() if first_attempt else None
+    except (ValueError, AttributeError, TypeError):
+        return None
+
+
+class SendSchedule:
+    """Échéance de chaque numéro de message: instant de référence + décalage tiré de la distribution"""
+
+    def __init__(self, spec: str, seed: int = 0):
+        name, _, params = spec.strip().partition(":")
+        name = name.lower()
+        try:
+            values = [parse_duration(param) for param in params.split(":")] if params else []
+        except ValueError as e:
+            raise ValueError(f"Distribution --schedule invalide: {spec!r} ({e})")
+        expected = {"herd": (1, 2), "uniform": (2, 2), "normal": (2, 2), "exp": (1, 1)}
+        if name not in expected:
+            raise ValueError(f"Distribution --schedule inconnue: {name!r} ({', '.join(DISTRIBUTIONS)})")
+        low, high = expected[name]
+        if not low <= len(values) <= high:
+            raise ValueError(f"Distribution --schedule invalide: {spec!r} (voir python3 -m pydoc kumoload.schedule)")
+        if name == "uniform" and values[0] > values[1]:
+            raise ValueError(f"Distribution --schedule invalide: {spec!r} (début après la fin)")
+        self.spec = spec
+        self.name = name
+        self.values = values
+        self.seed = seed
+        # Instant de référence (epoch): fixé au début du run, avant le fork des processus workers
+        self.anchor = 0.0
+
+    def offset_of(self, message_num: int) -> float:
+        """Décalage de l'échéance (s) depuis l'instant de référence, déterministe"""
+        rng = random.Random(self.seed * 1_000_003 + message_num)
+        if self.name == "herd":
+            width = self.values[1] if len(self.values) > 1 else 0.0
+            return self.values[0] + (int(rng.random() * width) if width else 0.0)
+        if self.name == "uniform":
+            return rng.uniform(*self.values)
+        if self.name == "normal":
+            return max(0.0, rng.gauss(*self.values))
+        return rng.expovariate(1 / self.values[0]) if self.values[0] else 0.0
+
+    def due_at(self, message_num: int) -> float:
+        """Échéance (epoch) à la seconde près, comme dans l'en-tête"""
+        return float(int(self.anchor + self.offset_of(message_num)))
+
+    def header_value(self, message_num: int) -> str:
+        due = datetime.fromtimestamp(self.due_at(message_num), timezone.utc)
+        return json.dumps({"first_attempt": due.isoformat()})
+
+    def headers(self, message_num: int) -> Dict[str, str]:
+        return {SCHEDULE_HEADER: self.header_value(message_num)}
+
+    def sample_offsets(self, message_nums: range) -> List[float]:
+        """Échéances (s depuis la référence) triées d'au plus CDF_SAMPLES messages régulièrement espacés"""
+        step = max(1, len(message_nums) // CDF_SAMPLES)
+        return sorted(self.due_at(num) - self.anchor for num in message_nums[::step])
+
+    def describe(self) -> str:
+        text = {
+            "herd": lambda: (f"thundering herd à {format_offset(self.values[0])}"
+                             + (f", réparti sur {self.values[1]:g} s" if len(self.values) > 1 else "")),
+            "uniform": lambda: f"uniforme entre {format_offset(self.values[0])} et {format_offset(self.values[1])}",
+            "normal": lambda: f"normale, moyenne {format_offset(self.values[0])}, écart-type {self.values[1]:g} s",
+            "exp": lambda: f"exponentielle de moyenne {format_offset(self.values[0])}",
+        }[self.name]()
+        return f"{text} ({self.spec})"
+
+# ============================================================================
+# LIBÉRATION
+# ============================================================================
+
+def _quantile(values: Sequence[float], q: float) -> float:
+    return values[min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))]
+
+
+def release_points(samples: Sequence[MetricsSample], baseline: MetricsSample,
+                   injection_end: Optional[float]) -> Tuple[float, List[Tuple[float, float]]]:
+    """
+    (messages programmés au pic, [(instant, messages libérés)]) d'après scheduled_queue_count
+
+    Les messages libérés sont mesurés à partir du pic de la queue programmée atteint après la
+    fin de l'injection (ou du dernier pic si l'injection n'est pas marquée).
+    """
+    base = baseline.values.get("scheduled_queue_count", 0.0)
+    parked = [(sample.timestamp, sample.values.get("scheduled_queue_count", 0.0) - base) for sample in samples]
+    if not parked:
+        return 0.0, []
+    ended = [point for point in parked if injection_end is None or point[0] >= injection_end] or parked[-1:]
+    peak_index = parked.index(max(ended, key=lambda point: point[1]))
+    peak = max(value for _, value in parked[:peak_index + 1])
+    return peak, [(timestamp, peak - value) for timestamp, value in parked[peak_index:]]
+
+
+def format_release(schedule: SendSchedule, message_nums: range, samples: Sequence[MetricsSample],
+                   baseline: MetricsSample, injection_end: Optional[float], late: int = 0) -> str:
+    """Vague de libération: pic programmé, montée de ready_count, retard par part des messages"""
+    offsets = schedule.sample_offsets(message_nums)
+    peak, points = release_points(samples, baseline, injection_end)
+    lines = [f"  Échéances prévues:      {format_offset(offsets[0])} à {format_offset(offsets[-1])} "
+             f"(médiane {format_offset(_quantile(offsets, 0.5))})"]
+    if late:
+        lines.append(f"  ⚠ {late} messages injectés après leur échéance (libérés à l'acceptation)")
+    if peak <= 0:
+        lines.append("  Aucun message dans la queue programmée (scheduled_queue_count): en-tête X-Schedule "
+                     "ignoré par la cible?")
+        return "\n".join(lines)
+    lines.append(f"  Messages programmés:    {peak:.0f} au pic (scheduled_queue_count)")
+    ready_base = baseline.values.get("ready_count", 0.0)
+    first_due = schedule.anchor + offsets[0]
+    after = [sample for sample in samples if sample.timestamp >= first_due]
+    if after:
+        ready_peak = max(after, key=lambda sample: sample.values.get("ready_count", 0.0))
+        lines.append(f"  Pic ready_count:        {ready_peak.values.get('ready_count', 0.0) - ready_base:.0f} messages "
+                     f"à {format_offset(ready_peak.timestamp - schedule.anchor)}")
+
+    lines.append("")
+    lines.append(f"  {'libérés':>8} {'échéance':>10} {'observé':>10} {'retard':>9}")
+    released_at = {}
+    for q in RELEASE_QUANTILES:
+        expected = schedule.anchor + _quantile(offsets, q)
+        observed = next((timestamp for timestamp, released in points if released >= q * peak), None)
+        released_at[q] = observed
+        if observed is None:
+            lines.append(f"  {q * 100:>7g}% {format_offset(expected - schedule.anchor):>10} {'-':>10} {'-':>9}")
+        else:
+            lines.append(f"  {q * 100:>7g}% {format_offset(expected - schedule.anchor):>10} "
+                         f"{format_offset(observed - schedule.anchor):>10} {max(0.0, observed - expected):>8.1f}s")
+    start, end = released_at[RELEASE_QUANTILES[0]], released_at[1.0]
+    if start is not None and end is not None:
+        duration = end - start
+        lines.append("")
+        lines.append(f"  Durée de la vague:      {duration:.1f} s de {RELEASE_QUANTILES[0] * 100:g}% à 100% libérés"
+                     + (f" ({peak / duration:.0f} messages/s vers les queues ready)" if duration > 0 else ""))
+    elif end is None:
+        lines.append(f"  ⚠ Libération non terminée au dernier relevé "
+                     f"({peak - (points[-1][1] if points else 0):.0f} messages encore programmés)")
+    return "\n".join(lines)
+
+
+def release_record(schedule: SendSchedule, message_nums: range, samples: Sequence[MetricsSample],
+                   baseline: MetricsSample, injection_end: Optional[float]) -> dict:
+    """Échéance prévue et instant observé de chaque part des messages libérés (--result-json)"""
+    offsets = schedule.sample_offsets(message_nums)
+    peak, points = release_points(samples, baseline, injection_end)
+    quantiles = {}
+    for q in RELEASE_QUANTILES:
+        observed = next((timestamp for timestamp, released in points if released >= q * peak), None) if peak > 0 else None
+        quantiles[f"{q * 100:g}"] = {"due_s": round(_quantile(offsets, q), 3),
+                                     "released_s": round(observed - schedule.anchor, 3) if observed else None}
+    return {"spec": schedule.spec, "parked": peak, "release": quantiles}
@@ -0,0 +1,740 @@
+"""
+Sink local asyncio: remplaçant de kumod + sink.lua pour les benchmarks hors cluster
+
+Parle assez d'ESMTP (EHLO, PIPELINING, CHUNKING/BDAT, DATA, RSET, STARTTLS) et du contrat
+/api/inject/v1 pour servir de cible aux scripts de performance sur un poste ou en CI.
+Les messages sont acceptés puis jetés, comme avec sink.lua. Avec --delivery-rate, ils
+passent d'abord par une queue simulée vidée à débit fixe, exposée comme les gauges de
+kumod (ready_count, message_count...) sur GET /metrics. Avec --delivery-log, chaque livraison
+(sortie de la queue simulée, ou acceptation sans queue) est journalisée avec le jeton X-Test-ID
+du message, pour la mesure de bout en bout (python3 -m kumoload.e2e). Comme kumod avec
+scheduling_header, un message portant un en-tête X-Schedule futur reste dans une queue
+programmée (scheduled_queue_count) jusqu'à son échéance.
+
+Usage:
+    python3 -m kumoload.sink [--smtp-port 2500] [--http-port 8000] [options]
+
+Options:
+    --latency SPEC: Délai par commande en ms, ex. EHLO=1,RCPT=0.5,DATA=2-10,INJECT=5
+                    (commandes: CONNECT, EHLO, MAIL, RCPT, DATA, BDAT, RSET, INJECT)
+    --rate-4xx R: Fraction des messages refusés temporairement (SMTP 451, HTTP 429)
+    --rate-5xx R: Fraction des messages refusés définitivement (SMTP 554, HTTP 500)
+    --max-connections N: Connexions simultanées par listener (au-delà: SMTP 421, HTTP 503)
+    --delivery-rate R: Vide la queue simulée à R messages/s (défaut: 0 = messages jetés immédiatement)
+    --delivery-log FICHIER: Journal JSONL des livraisons {"id": X-Test-ID, "t": epoch, "queue": domaine}
+    --starttls: Annonce STARTTLS (certificat auto-signé généré par openssl, ou --tls-cert/--tls-key)
+    --report-interval S: Affiche les compteurs toutes les S secondes (défaut: 10, 0 = jamais)
+
+Puis, dans un autre terminal:
+    python3 test_performance_smtp.py 10000 --engine async --local
+    LOCAL_HTTP_PORT=8000 python3 test_performance_http.py 10000 --engine async --local
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import ssl
+import signal
+import asyncio
+import heapq
+import argparse
+import itertools
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from kumoload.schedule import SCHEDULE_HEADER, parse_schedule_header
+from kumoload.tls import generate_self_signed, server_context
+
+CRLF = b"\r\n"
+
+# Commandes dont la latence est configurable
+LATENCY_COMMANDS = ("CONNECT", "EHLO", "MAIL", "RCPT", "DATA", "BDAT", "RSET", "INJECT")
+
+MAX_LINE = 64 * 1024
+
+# En-tête portant le jeton unique du message (mesure de bout en bout)
+TEST_ID_RE = re.compile(rb"^X-Test-ID:[ \t]*([^\r\n]+)", re.IGNORECASE | re.MULTILINE)
+
+# En-tête d'envoi programmé (scheduling_header de queues.toml)
+SCHEDULE_RE = re.compile(rb"^X-Schedule:[ \t]*([^\r\n]+)", re.IGNORECASE | re.MULTILINE)
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+def parse_latency(spec: str) -> Dict[str, Tuple[float, float]]:
+    """Analyse 'EHLO=1,DATA=2-10' en {commande: (min_s, max_s)}"""
+    latency = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        command, _, value = item.partition("=")
+        command = command.strip().upper()
+        if command not in LATENCY_COMMANDS:
+            raise ValueError(f"Commande inconnue dans --latency: {command} (attendu: {', '.join(LATENCY_COMMANDS)})")
+        low, _, high = value.partition("-")
+        low = float(low) / 1000
+        latency[command] = (low, float(high) / 1000 if high else low)
+    return latency
+
+
+class SinkConfig:
+    """Comportement du sink: latences, taux d'erreurs injectées, plafond de connexions, débit de livraison"""
+
+    def __init__(self, latency: Optional[Dict[str, Tuple[float, float]]] = None, rate_4xx: float = 0.0,
+                 rate_5xx: float = 0.0, max_connections: int = 0, max_message_size: int = 64 * 1024 * 1024,
+                 hostname: str = "kumoload-sink", delivery_rate: float = 0.0, tls: Optional[ssl.SSLContext] = None):
+        self.latency = latency or {}
+        self.rate_4xx = rate_4xx
+        self.rate_5xx = rate_5xx
+        self.max_connections = max_connections
+        self.max_message_size = max_message_size
+        self.hostname = hostname
+        self.delivery_rate = delivery_rate
+        self.tls = tls
+
+    async def delay(self, command: str):
+        bounds = self.latency.get(command)
+        if bounds:
+            await asyncio.sleep(random.uniform(*bounds))
+
+    def injected_failure(self) -> Optional[str]:
+        """'4xx', '5xx' ou None selon les taux configurés"""
+        draw = random.random()
+        if draw < self.rate_5xx:
+            return "5xx"
+        if draw < self.rate_5xx + self.rate_4xx:
+            return "4xx"
+        return None
+
+
+def extract_test_id(message: bytes) -> Optional[str]:
+    """Jeton X-Test-ID des en-têtes d'un message MIME (None si absent)"""
+    end = message.find(b"\r\n\r\n", 2)
+    match = TEST_ID_RE.search(message, 0, end if end >= 0 else MAX_LINE)
+    return match.group(1).strip().decode("ascii", "replace") if match else None
+
+
+def extract_schedule(message: bytes) -> Optional[float]:
+    """Échéance (epoch) de l'en-tête X-Schedule d'un message MIME (None si absent)"""
+    end = message.find(b"\r\n\r\n", 2)
+    match = SCHEDULE_RE.search(message, 0, end if end >= 0 else MAX_LINE)
+    return parse_schedule_header(match.group(1).decode("utf-8", "replace")) if match else None
+
+
+def recipient_domain(address: str) -> str:
+    """Domaine d'un destinataire ('<a@b>' ou 'a@b'), nom de queue comme kumod sans tenant ni campagne"""
+    return address.strip().strip("<>").rpartition("@")[2].lower() or "?"
+
+
+class DeliveryLog:
+    """Journal JSONL des livraisons, écrit par lots (flush() appelé à chaque tick de livraison)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a")
+        self._pending: List[str] = []
+        self.count = 0
+
+    def record(self, token: Optional[str], queue: str):
+        if token:
+            self._pending.append(json.dumps({"id": token, "t": round(time.time(), 6), "queue": queue}))
+            self.count += 1
+
+    def flush(self):
+        if self._pending:
+            self._file.write("\n".join(self._pending) + "\n")
+            self._file.flush()
+            self._pending.clear()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+class SinkStats:
+    """Compteurs du sink (une seule boucle asyncio: pas de verrou)"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.connections = {"smtp": 0, "http": 0}
+        self.active = {"smtp": 0, "http": 0}
+        self.refused = {"smtp": 0, "http": 0}
+        self.messages = 0
+        self.recipients = 0
+        self.bytes = 0
+        self.requests = 0
+        self.rejected_4xx = 0
+        self.rejected_5xx = 0
+        # Handshakes STARTTLS (complets / repris)
+        self.tls_handshakes = 0
+        self.tls_resumed = 0
+        # Queue simulée (--delivery-rate): un message par destinataire, comme kumod
+        self.queued = 0
+        self.queued_bytes = 0
+        self.delivered = 0
+        # Journal des livraisons (--delivery-log): (jeton, queue) des messages en queue
+        self.delivery_log: Optional[DeliveryLog] = None
+        self._pending = deque()
+        # Queue programmée (X-Schedule): tas de (échéance, ordre, livraisons, taille, queue simulée)
+        self.scheduled = 0
+        self._scheduled = []
+        self._order = itertools.count()
+
+    def accept(self, messages: int, deliveries: List[Tuple[Optional[str], str]], size: int, queue: bool,
+               due: Optional[float] = None):
+        """Messages acceptés; `deliveries` contient un (jeton, queue) par destinataire, `due` l'échéance X-Schedule"""
+        self.messages += messages
+        self.recipients += len(deliveries)
+        self.bytes += size
+        if due is not None and due > time.time():
+            heapq.heappush(self._scheduled, (due, next(self._order), deliveries, size, queue))
+            self.scheduled += len(deliveries)
+        else:
+            self._enqueue(deliveries, size, queue)
+
+    def release(self, now: float):
+        """Sort de la queue programmée les messages arrivés à échéance"""
+        while self._scheduled and self._scheduled[0][0] <= now:
+            _, _, deliveries, size, queue = heapq.heappop(self._scheduled)
+            self.scheduled -= len(deliveries)
+            self._enqueue(deliveries, size, queue)
+
+    def _enqueue(self, deliveries: List[Tuple[Optional[str], str]], size: int, queue: bool):
+        if queue:
+            self.queued += len(deliveries)
+            self.queued_bytes += size * len(deliveries)
+            if self.delivery_log is not None:
+                self._pending.extend(deliveries)
+        else:
+            self.delivered += len(deliveries)
+            if self.delivery_log is not None:
+                for token, queue_name in deliveries:
+                    self.delivery_log.record(token, queue_name)
+
+    def deliver(self, count: int):
+        """Sort `count` messages de la queue simulée (taille moyenne pour les octets)"""
+        count = min(count, self.queued)
+        if count:
+            self.queued_bytes -= self.queued_bytes * count // self.queued
+            self.queued -= count
+            self.delivered += count
+            if self.delivery_log is not None:
+                for _ in range(count):
+                    self.delivery_log.record(*self._pending.popleft())
+
+    def prometheus(self) -> str:
+        """Gauges au format texte Prometheus, nommées comme celles de kumod"""
+        lines = []
+        for name, labels, value in (
+            ("ready_count", '{service="smtp_client:sink.kumoload"}', self.queued),
+            ("scheduled_queue_count", '{queue="sink.kumoload"}', self.scheduled),
+            ("message_count", "", self.queued + self.scheduled),
+            ("message_data_resident_count", "", self.queued),
+            ("message_data_resident_bytes", "", self.queued_bytes),
+            ("connection_count", '{service="esmtp_listener"}', self.active["smtp"]),
+            ("connection_count", '{service="http_listener"}', self.active["http"]),
+            ("total_messages_received", "", self.recipients),
+            ("total_messages_delivered", "", self.delivered),
+        ):
+            lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+    def count_failure(self, failure: str):
+        if failure == "4xx":
+            self.rejected_4xx += 1
+        else:
+            self.rejected_5xx += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "messages": self.messages,
+            "recipients": self.recipients,
+            "bytes": self.bytes,
+            "requests": self.requests,
+            "rejected_4xx": self.rejected_4xx,
+            "rejected_5xx": self.rejected_5xx,
+        }
+
+    def format_line(self, previous: dict, interval: float) -> str:
+        now = self.snapshot()
+        rate = (now["messages"] - previous["messages"]) / interval if interval else 0
+        mb = (now["bytes"] - previous["bytes"]) / interval / 1024 / 1024 if interval else 0
+        return (f"[sink] {rate:.0f} msg/s, {mb:.1f} Mo/s | total {now['messages']} messages | "
+                f"connexions SMTP {self.active['smtp']}, HTTP {self.active['http']} | "
+                f"4xx {now['rejected_4xx']}, 5xx {now['rejected_5xx']}, refusées "
+                f"{self.refused['smtp'] + self.refused['http']}"
+                + (f" | en queue {self.queued}" if self.queued else "")
+                + (f" | programmés {self.scheduled}" if self.scheduled else ""))
+
+# ============================================================================
+# LECTURE BUFFERISÉE
+# ============================================================================
+
+class BufferedInput:
+    """Lecture par lignes, jusqu'à un séparateur ou par taille, en gardant le surplus (pipelining)"""
+
+    def __init__(self, reader: asyncio.StreamReader):
+        self.reader = reader
+        self.buffer = bytearray()
+
+    async def _fill(self):
+        chunk = await self.reader.read(256 * 1024)
+        if not chunk:
+            raise EOFError
+        self.buffer += chunk
+
+    async def readline(self) -> bytes:
+        start = 0
+        while True:
+            index = self.buffer.find(b"\n", start)
+            if index >= 0:
+                line = bytes(self.buffer[:index + 1])
+                del self.buffer[:index + 1]
+                return line
+            if len(self.buffer) > MAX_LINE:
+                raise ValueError("Ligne trop longue")
+            start = len(self.buffer)
+            await self._fill()
+
+    async def read_until(self, separator: bytes, limit: int) -> bytes:
+        """Lit jusqu'au séparateur (exclu, consommé)"""
+        start = 0
+        while True:
+            index = self.buffer.find(separator, start)
+            if index >= 0:
+                data = bytes(self.buffer[:index])
+                del self.buffer[:index + len(separator)]
+                return data
+            if len(self.buffer) > limit:
+                raise ValueError("Message trop volumineux")
+            start = max(0, len(self.buffer) - len(separator) + 1)
+            await self._fill()
+
+    async def readexactly(self, size: int) -> bytes:
+        while len(self.buffer) < size:
+            await self._fill()
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+async def close_writer(writer: asyncio.StreamWriter):
+    """Envoie les réponses en attente puis ferme la connexion"""
+    try:
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+    except (ConnectionError, OSError):
+        pass
+
+# ============================================================================
+# SMTP
+# ============================================================================
+
+class SMTPSink:
+    """Listener ESMTP minimal: accepte et jette les messages"""
+
+    def __init__(self, config: SinkConfig, stats: SinkStats):
+        self.config = config
+        self.stats = stats
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        config, stats = self.config, self.stats
+        if config.max_connections and stats.active["smtp"] >= config.max_connections:
+            stats.refused["smtp"] += 1
+            writer.write(b"421 4.3.2 Too many connections, try again later" + CRLF)
+            await close_writer(writer)
+            return
+        stats.connections["smtp"] += 1
+        stats.active["smtp"] += 1
+        try:
+            await config.delay("CONNECT")
+            writer.write(f"220 {config.hostname} ESMTP kumoload sink".encode() + CRLF)
+            await self._session(BufferedInput(reader), writer)
+        except (EOFError, ConnectionError, ValueError):
+            pass
+        finally:
+            stats.active["smtp"] -= 1
+            await close_writer(writer)
+
+    async def _session(self, data_in: BufferedInput, writer: asyncio.StreamWriter):
+        config = self.config
+        sender = None
+        recipients: List[str] = []
+        bdat_size = 0
+        bdat_head = b""
+        tls_active = False
+
+        def reply(text: str):
+            writer.write(text.encode() + CRLF)
+
+        while True:
+            # Réponses groupées (PIPELINING): on n'attend l'envoi que si plus rien n'est en attente
+            if not data_in.buffer:
+                await writer.drain()
+            line = (await data_in.readline()).rstrip(b"\r\n").decode("utf-8", "replace")
+            verb, _, arg = line.partition(" ")
+            verb = verb.upper()
+
+            if verb in ("EHLO", "HELO"):
+                await config.delay("EHLO")
+                sender, recipients, bdat_size = None, [], 0
+                if verb == "HELO":
+                    reply(f"250 {config.hostname}")
+                else:
+                    starttls = "250-STARTTLS\r\n" if config.tls is not None and not tls_active else ""
+                    reply(f"250-{config.hostname}\r\n250-PIPELINING\r\n250-CHUNKING\r\n250-8BITMIME\r\n{starttls}"
+                          f"250-SIZE {config.max_message_size}\r\n250 SMTPUTF8")
+            elif verb == "STARTTLS":
+                if config.tls is None or tls_active:
+                    reply("503 5.5.1 STARTTLS not available")
+                    continue
+                reply("220 2.0.0 Ready to start TLS")
+                await writer.drain()
+                # RFC 3207: rien de ce qui précède le handshake n'est conservé, EHLO à refaire
+                data_in.buffer.clear()
+                await writer.start_tls(config.tls)
+                tls_active = True
+                self.stats.tls_handshakes += 1
+                self.stats.tls_resumed += writer.get_extra_info("ssl_object").session_reused
+                sender, recipients, bdat_size = None, [], 0
+            elif verb == "MAIL":
+                await config.delay("MAIL")
+                sender, recipients, bdat_size = arg, [], 0
+                reply("250 2.1.0 OK")
+            elif verb == "RCPT":
+                await config.delay("RCPT")
+                if sender is None:
+                    reply("503 5.5.1 MAIL first")
+                else:
+                    recipients.append(recipient_domain(arg.partition(":")[2].split(" ")[0]))
+                    reply("250 2.1.5 OK")
+            elif verb == "DATA":
+                if not recipients:
+                    reply("503 5.5.1 RCPT first")
+                    continue
+                reply("354 Send message, end with <CRLF>.<CRLF>")
+                await writer.drain()
+                # CRLF virtuel en tête: le séparateur <CRLF>.<CRLF> couvre aussi le message vide
+                data_in.buffer[:0] = CRLF
+                message = await data_in.read_until(CRLF + b"." + CRLF, config.max_message_size)
+                await config.delay("DATA")
+                reply(self._accept(recipients, len(message), message))
+                sender, recipients = None, []
+            elif verb == "BDAT":
+                parts = arg.split()
+                if not parts or not parts[0].isdigit():
+                    reply("501 5.5.4 Syntax: BDAT <size> [LAST]")
+                    continue
+                chunk = await data_in.readexactly(int(parts[0]))
+                if not bdat_size:
+                    bdat_head = chunk[:MAX_LINE]
+                bdat_size += int(parts[0])
+                if not recipients:
+                    reply("503 5.5.1 RCPT first")
+                elif len(parts) > 1 and parts[1].upper() == "LAST":
+                    await config.delay("BDAT")
+                    reply(self._accept(recipients, bdat_size, b"\r\n" + bdat_head))
+                    sender, recipients, bdat_size = None, [], 0
+                else:
+                    reply(f"250 2.0.0 {parts[0]} octets received")
+            elif verb == "RSET":
+                await config.delay("RSET")
+                sender, recipients, bdat_size = None, [], 0
+                reply("250 2.0.0 OK")
+            elif verb == "NOOP":
+                reply("250 2.0.0 OK")
+            elif verb == "QUIT":
+                reply("221 2.0.0 Bye")
+                return
+            else:
+                reply("502 5.5.2 Command not implemented")
+
+    def _accept(self, recipients: List[str], size: int, message: bytes) -> str:
+        """Réponse finale d'une transaction (erreur injectée ou acceptation), `message` précédé d'un CRLF"""
+        failure = self.config.injected_failure()
+        if failure:
+            self.stats.count_failure(failure)
+            if failure == "4xx":
+                return "451 4.3.0 Temporary failure (injected by sink)"
+            return "554 5.6.0 Message rejected (injected by sink)"
+        token = extract_test_id(message) if self.stats.delivery_log is not None else None
+        self.stats.accept(1, [(token, domain) for domain in recipients], size, queue=self.config.delivery_rate > 0,
+                          due=extract_schedule(message))
+        return "250 2.0.0 OK queued"
+
+# ============================================================================
+# HTTP
+# ============================================================================
+
+class HTTPSink:
+    """Listener HTTP/1.1 keep-alive minimal: POST /api/inject/v1 et GET /metrics"""
+
+    INJECT_PATH = "/api/inject/v1"
+    METRICS_PATH = "/metrics"
+
+    def __init__(self, config: SinkConfig, stats: SinkStats):
+        self.config = config
+        self.stats = stats
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        config, stats = self.config, self.stats
+        if config.max_connections and stats.active["http"] >= config.max_connections:
+            stats.refused["http"] += 1
+            self._respond(writer, 503, {"error": "too many connections"}, keep_alive=False)
+            await close_writer(writer)
+            return
+        stats.connections["http"] += 1
+        stats.active["http"] += 1
+        data_in = BufferedInput(reader)
+        try:
+            keep_alive = True
+            while keep_alive:
+                keep_alive = await self._request(data_in, writer)
+                if not data_in.buffer:
+                    await writer.drain()
+        except (EOFError, ConnectionError, ValueError):
+            pass
+        finally:
+            stats.active["http"] -= 1
+            await close_writer(writer)
+
+    async def _request(self, data_in: BufferedInput, writer: asyncio.StreamWriter) -> bool:
+        request_line = (await data_in.readline()).decode("latin-1").strip()
+        if not request_line:
+            return True
+        method, path, version = (request_line.split(" ") + ["", ""])[:3]
+        headers = {}
+        while True:
+            line = await data_in.readline()
+            if line in (b"\r\n", b"\n"):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await data_in.readline()).split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    while (await data_in.readline()) not in (b"\r\n", b"\n"):
+                        pass
+                    break
+                chunks.append(await data_in.readexactly(size))
+                await data_in.readexactly(2)
+            body = b"".join(chunks)
+        else:
+            body = await data_in.readexactly(int(headers.get("content-length", 0) or 0))
+
+        keep_alive = headers.get("connection", "").lower() != "close" and version != "HTTP/1.0"
+        if method == "GET" and path.split("?")[0] == self.METRICS_PATH:
+            self._respond_raw(writer, 200, "text/plain; version=0.0.4", self.stats.prometheus().encode(), keep_alive)
+            return keep_alive
+        self.stats.requests += 1
+        if method != "POST" or path.split("?")[0] != self.INJECT_PATH:
+            self._respond(writer, 404, {"error": f"no route for {method} {path}"}, keep_alive)
+            return keep_alive
+
+        await self.config.delay("INJECT")
+        try:
+            payload = json.loads(body)
+            recipients = payload["recipients"]
+            if not payload.get("envelope_sender") or "content" not in payload or not recipients:
+                raise KeyError("envelope_sender, content et recipients sont requis")
+        except (ValueError, KeyError, TypeError) as e:
+            self._respond(writer, 400, {"error": f"invalid request: {e}"}, keep_alive)
+            return keep_alive
+
+        failure = self.config.injected_failure()
+        if failure:
+            self.stats.count_failure(failure)
+            status = 429 if failure == "4xx" else 500
+            self._respond(writer, status, {"error": f"{failure} injected by sink"}, keep_alive)
+            return keep_alive
+
+        deliveries = [(self._test_id(payload, recipient) if self.stats.delivery_log is not None else None,
+                       recipient_domain(str(recipient.get("email", ""))))
+                      for recipient in recipients]
+        self.stats.accept(len(recipients), deliveries, len(body), queue=self.config.delivery_rate > 0,
+                          due=self._schedule(payload))
+        self._respond(writer, 200, {"success_count": len(recipients), "fail_count": 0,
+                                    "failed_recipients": [], "errors": []}, keep_alive)
+        return keep_alive
+
+    @staticmethod
+    def _test_id(payload: dict, recipient: dict) -> Optional[str]:
+        """Jeton d'un destinataire: substitution test_id, en-tête du contenu construit ou MIME brut"""
+        token = (recipient.get("substitutions") or {}).get("test_id")
+        if token:
+            return str(token)
+        content = payload["content"]
+        if isinstance(content, str):
+            return extract_test_id(b"\r\n" + content[:MAX_LINE].encode("utf-8", "replace"))
+        headers = content.get("headers") or {}
+        return next((str(value) for name, value in headers.items() if name.lower() == "x-test-id"), None)
+
+    @staticmethod
+    def _schedule(payload: dict) -> Optional[float]:
+        """Échéance X-Schedule du contenu (MIME brut ou en-têtes du contenu construit)"""
+        content = payload["content"]
+        if isinstance(content, str):
+            return extract_schedule(b"\r\n" + content[:MAX_LINE].encode("utf-8", "replace"))
+        headers = content.get("headers") or {}
+        value = next((str(value) for name, value in headers.items() if name.lower() == SCHEDULE_HEADER.lower()), None)
+        return parse_schedule_header(value) if value else None
+
+    @classmethod
+    def _respond(cls, writer: asyncio.StreamWriter, status: int, payload: dict, keep_alive: bool):
+        cls._respond_raw(writer, status, "application/json", json.dumps(payload).encode(), keep_alive)
+
+    @staticmethod
+    def _respond_raw(writer: asyncio.StreamWriter, status: int, content_type: str, body: bytes, keep_alive: bool):
+        reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests",
+                   500: "Internal Server Error", 503: "Service Unavailable"}
+        writer.write(f"HTTP/1.1 {status} {reasons[status]}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body)
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+async def deliver_queued(rate: float, stats: SinkStats, stop: asyncio.Event, tick: float = 0.05):
+    """Vide la queue simulée à `rate` messages/s (reliquat fractionnaire reporté d'un tick à l'autre)"""
+    budget, last = 0.0, time.monotonic()
+    while not stop.is_set():
+        await asyncio.sleep(tick)
+        now = time.monotonic()
+        budget = min(budget + (now - last) * rate, max(rate * tick, 1.0)) if stats.queued else 0.0
+        last = now
+        count = int(budget)
+        stats.deliver(count)
+        budget -= count
+        if stats.delivery_log is not None:
+            stats.delivery_log.flush()
+
+
+async def release_scheduled(stats: SinkStats, stop: asyncio.Event, tick: float = 0.05):
+    """Libère les messages programmés (X-Schedule) arrivés à échéance"""
+    while not stop.is_set():
+        await asyncio.sleep(tick)
+        stats.release(time.time())
+
+
+async def flush_deliveries(log: DeliveryLog, stop: asyncio.Event, tick: float = 0.2):
+    """Sans queue simulée: écrit le journal des livraisons à intervalle régulier"""
+    while not stop.is_set():
+        await asyncio.sleep(tick)
+        log.flush()
+
+
+async def serve(host: str, smtp_port: int, http_port: int, config: SinkConfig, report_interval: float,
+                delivery_log: Optional[str] = None):
+    stats = SinkStats()
+    if delivery_log:
+        stats.delivery_log = DeliveryLog(delivery_log)
+        print(f"✓ Journal des livraisons: {delivery_log}")
+    servers = []
+    if smtp_port:
+        servers.append(await asyncio.start_server(SMTPSink(config, stats).handle, host, smtp_port, backlog=4096))
+        print(f"✓ Listener SMTP: {host}:{smtp_port}")
+    if http_port:
+        servers.append(await asyncio.start_server(HTTPSink(config, stats).handle, host, http_port, backlog=4096))
+        print(f"✓ Listener HTTP: {host}:{http_port} (POST {HTTPSink.INJECT_PATH}, GET {HTTPSink.METRICS_PATH})")
+    if not servers:
+        print("✗ Erreur: aucun listener (--smtp-port et --http-port à 0)")
+        return 1
+
+    stop = asyncio.Event()
+    delivery = None
+    if config.delivery_rate > 0:
+        delivery = asyncio.ensure_future(deliver_queued(config.delivery_rate, stats, stop))
+        print(f"✓ Queue simulée: livraison à {config.delivery_rate:g} messages/s")
+    elif stats.delivery_log is not None:
+        delivery = asyncio.ensure_future(flush_deliveries(stats.delivery_log, stop))
+    release = asyncio.ensure_future(release_scheduled(stats, stop))
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    previous, last = stats.snapshot(), time.monotonic()
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), report_interval or None)
+        except asyncio.TimeoutError:
+            now = time.monotonic()
+            print(stats.format_line(previous, now - last), flush=True)
+            previous, last = stats.snapshot(), now
+
+    for server in servers:
+        server.close()
+    if delivery is not None:
+        await delivery
+    await release
+    if stats.delivery_log is not None:
+        stats.delivery_log.close()
+    elapsed = time.monotonic() - stats.started
+    print(f"\n✓ Sink arrêté après {elapsed:.1f} s: {stats.messages} messages, "
+          f"{stats.bytes / 1024 / 1024:.1f} Mo, {stats.connections['smtp']} connexions SMTP, "
+          f"{stats.connections['http']} connexions HTTP, 4xx {stats.rejected_4xx}, 5xx {stats.rejected_5xx}"
+          + (f", {stats.tls_handshakes} handshakes TLS ({stats.tls_resumed} repris)" if stats.tls_handshakes else ""))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sink SMTP/HTTP local pour les tests de performance (remplace sink.lua)")
+    parser.add_argument("--host", default="127.0.0.1", help="Adresse d'écoute (défaut: 127.0.0.1)")
+    parser.add_argument("--smtp-port", type=int, default=2500, help="Port SMTP, 0 pour désactiver (défaut: 2500)")
+    parser.add_argument("--http-port", type=int, default=8000, help="Port HTTP, 0 pour désactiver (défaut: 8000)")
+    parser.add_argument("--latency", default="", help="Délais par commande en ms, ex. EHLO=1,DATA=2-10,INJECT=5")
+    parser.add_argument("--rate-4xx", type=float, default=0.0, help="Fraction de refus temporaires (SMTP 451, HTTP 429)")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="Fraction de refus définitifs (SMTP 554, HTTP 500)")
+    parser.add_argument("--max-connections", type=int, default=0,
+                        help="Connexions simultanées par listener, 0 = illimité (au-delà: SMTP 421, HTTP 503)")
+    parser.add_argument("--max-message-size", type=int, default=64 * 1024 * 1024,
+                        help="Taille maximale d'un message en octets (défaut: 64 Mo)")
+    parser.add_argument("--delivery-rate", type=float, default=0.0,
+                        help="Vide une queue simulée à N messages/s, visible sur GET /metrics (défaut: 0 = immédiat)")
+    parser.add_argument("--delivery-log", help="Journal JSONL des livraisons avec le jeton X-Test-ID (mesure de bout en bout)")
+    parser.add_argument("--starttls", action="store_true",
+                        help="Annonce STARTTLS; certificat auto-signé généré par openssl sans --tls-cert/--tls-key")
+    parser.add_argument("--tls-cert", help="Certificat PEM du listener SMTP (avec --starttls)")
+    parser.add_argument("--tls-key", help="Clé privée PEM du certificat (avec --starttls)")
+    parser.add_argument("--report-interval", type=float, default=10.0,
+                        help="Affiche les compteurs toutes les N secondes, 0 = jamais (défaut: 10)")
+    args = parser.parse_args()
+
+    try:
+        latency = parse_latency(args.latency)
+    except ValueError as e:
+        print(f"✗ Erreur: {e}")
+        return 1
+    if not 0 <= args.rate_4xx + args.rate_5xx <= 1:
+        print("✗ Erreur: --rate-4xx + --rate-5xx doit être compris entre 0 et 1")
+        return 1
+
+    tls = None
+    if args.starttls:
+        try:
+            if args.tls_cert:
+                cert, key = args.tls_cert, args.tls_key or args.tls_cert
+            else:
+                cert, key = generate_self_signed()
+                print(f"✓ Certificat auto-signé: {cert}")
+            tls = server_context(cert, key)
+        except (OSError, RuntimeError, ssl.SSLError) as e:
+            print(f"✗ Erreur: {e}")
+            return 1
+
+    config = SinkConfig(latency, args.rate_4xx, args.rate_5xx, args.max_connections, args.max_message_size,
+                        delivery_rate=args.delivery_rate, tls=tls)
+    return asyncio.run(serve(args.host, args.smtp_port, args.http_port, config, args.report_interval,
+                             args.delivery_log))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,470 @@
+"""
+Client ESMTP asyncio avec sessions persistantes
+
+Une session reste ouverte pour plusieurs transactions MAIL/RCPT/DATA (séparées par RSET),
+ce qui permet de mesurer le listener ESMTP de kumod sans payer TCP + EHLO à chaque message.
+Avec un contexte TLS, la session passe en STARTTLS juste après le premier EHLO.
+"""
+
+import re
+import ssl
+import time
+import asyncio
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Union
+
+from kumoload.phases import PhaseTimings
+from kumoload.tls import ResumingSSLContext
+
+# ============================================================================
+# PROTOCOLE
+# ============================================================================
+
+CRLF = b"\r\n"
+
+_EOL_RE = re.compile(rb"\r\n|\r|\n")
+_LEADING_DOT_RE = re.compile(rb"(?m)^\.")
+
+# Phase mesurée (--phases) pour la réponse à chaque commande; BDAT LAST porte la réponse finale
+COMMAND_PHASES = {"EHLO": "ehlo", "STARTTLS": "starttls", "RSET": "rset", "MAIL": "mail", "RCPT": "rcpt", "DATA": "data", "BDAT": "final"}
+DATA_PHASES = ("data", "body", "final")
+
+
+class SMTPReply(NamedTuple):
+    """Réponse SMTP (code + lignes de texte)"""
+    code: int
+    lines: List[str]
+
+    @property
+    def text(self) -> str:
+        return " ".join(self.lines)
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.code < 400
+
+    def __str__(self) -> str:
+        return f"{self.code} {self.text}"
+
+
+class SMTPProtocolError(Exception):
+    """Réponse inattendue ou connexion coupée: la session n'est plus réutilisable"""
+
+
+class TransactionResult(NamedTuple):
+    """Résultat d'une transaction MAIL/RCPT/DATA"""
+    success: bool
+    reply: Optional[SMTPReply]
+    error: Optional[str]
+    round_trips_saved: int = 0
+
+
+class PreparedData(NamedTuple):
+    """Contenu déjà normalisé en CRLF, en segments (memoryview) écrits tels quels sur la socket"""
+    segments: Sequence  # contenu BDAT (sans dot-stuffing)
+    stuffed: Sequence   # contenu DATA (dot-stuffing appliqué)
+
+    @property
+    def size(self) -> int:
+        return sum(len(segment) for segment in self.segments)
+
+
+class StreamedData(NamedTuple):
+    """Contenu produit à la volée (--stream): blocs CRLF sans '.' en début de ligne, écrits un à un"""
+    size: int
+    chunks: Iterable
+
+
+MessageData = Union[bytes, PreparedData, StreamedData]
+
+
+def normalize_eols(data: bytes) -> bytes:
+    """Normalise les fins de ligne en CRLF (contenu BDAT, sans dot-stuffing)"""
+    data = _EOL_RE.sub(CRLF, data)
+    if not data.endswith(CRLF):
+        data += CRLF
+    return data
+
+
+def prepare_data(data: bytes) -> bytes:
+    """Normalise les fins de ligne en CRLF et applique le dot-stuffing (RFC 5321 §4.5.2)"""
+    return _LEADING_DOT_RE.sub(b"..", normalize_eols(data))
+
+
+async def read_reply(reader: asyncio.StreamReader) -> SMTPReply:
+    """Lit une réponse SMTP, éventuellement multi-lignes (250-... / 250 ...)"""
+    lines = []
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise SMTPProtocolError("Connexion fermée par le serveur")
+        line = line.rstrip(b"\r\n").decode("utf-8", "replace")
+        if len(line) < 3 or not line[:3].isdigit():
+            raise SMTPProtocolError(f"Réponse SMTP invalide: {line[:100]!r}")
+        lines.append(line[4:])
+        if len(line) == 3 or line[3] != "-":
+            return SMTPReply(int(line[:3]), lines)
+
+# ============================================================================
+# SESSION
+# ============================================================================
+
+class AsyncSMTPSession:
+    """Session ESMTP persistante: connexion + EHLO une fois, puis N transactions"""
+
+    def __init__(self, host: str, port: int, helo_name: str = "localhost", timeout: float = 30.0,
+                 pipelining: bool = False, chunking: bool = False, phases: Optional[PhaseTimings] = None,
+                 tls: Optional[ssl.SSLContext] = None):
+        self.host = host
+        self.port = port
+        self.helo_name = helo_name
+        self.timeout = timeout
+        self.pipelining = pipelining
+        self.chunking = chunking
+        self.phases = phases
+        self.tls = tls
+        self.tls_resumed = False
+        self.extensions: Dict[str, str] = {}
+        self.transactions = 0
+        self.round_trips = 0
+        # Durée cumulée des phases DATA de la transaction en cours (data_total)
+        self._data_ms = 0.0
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    @property
+    def closed(self) -> bool:
+        return self.writer is None or self.writer.is_closing()
+
+    async def connect(self) -> SMTPReply:
+        """Ouvre la connexion TCP, lit la bannière et envoie EHLO (puis STARTTLS et EHLO si TLS)"""
+        start = time.perf_counter()
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout
+        )
+        start = self._mark("connect", start)
+        banner = await self._read()
+        self._mark("banner", start)
+        if banner.code != 220:
+            raise SMTPProtocolError(f"Bannière refusée: {banner}")
+        await self.ehlo()
+        if self.tls is not None:
+            await self.starttls()
+        return banner
+
+    async def starttls(self):
+        """STARTTLS, handshake (repris si le contexte a une session en cache), puis nouvel EHLO"""
+        if not self.has_extension("STARTTLS"):
+            raise SMTPProtocolError("STARTTLS non annoncé par le serveur")
+        reply = await self.command("STARTTLS")
+        if reply.code != 220:
+            raise SMTPProtocolError(f"STARTTLS refusé: {reply}")
+        start = time.perf_counter()
+        await self.writer.start_tls(self.tls, server_hostname=self.host, ssl_handshake_timeout=self.timeout)
+        ssl_object = self.writer.get_extra_info("ssl_object")
+        self.tls_resumed = ssl_object.session_reused
+        self._mark("tls_resumed" if self.tls_resumed else "tls_full", start)
+        await self.ehlo()
+        if isinstance(self.tls, ResumingSSLContext):
+            # Après l'EHLO: en TLS 1.3, le ticket de session arrive après le handshake
+            self.tls.remember(self.host, ssl_object)
+
+    async def ehlo(self) -> SMTPReply:
+        """Envoie EHLO et enregistre les extensions annoncées par le serveur"""
+        reply = await self.command(f"EHLO {self.helo_name}")
+        if reply.code != 250:
+            raise SMTPProtocolError(f"EHLO refusé: {reply}")
+        self.extensions = {}
+        for line in reply.lines[1:]:
+            name, _, params = line.partition(" ")
+            self.extensions[name.upper()] = params
+        return reply
+
+    def has_extension(self, name: str) -> bool:
+        return name.upper() in self.extensions
+
+    async def command(self, line: str) -> SMTPReply:
+        """Envoie une commande et attend sa réponse"""
+        return (await self._exchange([line]))[0]
+
+    def _mark(self, phase: Optional[str], start: float) -> float:
+        """Enregistre la durée de la phase depuis start (si --phases) et retourne l'instant courant"""
+        now = time.perf_counter()
+        if self.phases is not None and phase:
+            elapsed_ms = (now - start) * 1000
+            self.phases.record(phase, elapsed_ms)
+            if phase in DATA_PHASES:
+                self._data_ms += elapsed_ms
+        return now
+
+    async def _read(self) -> SMTPReply:
+        try:
+            return await asyncio.wait_for(read_reply(self.reader), self.timeout)
+        except asyncio.TimeoutError:
+            raise SMTPProtocolError(f"Pas de réponse du serveur après {self.timeout}s")
+
+    async def _drain(self):
+        if self.writer.transport.get_write_buffer_size():
+            # Tampon d'émission non vidé d'un coup: attente de la socket (contenu volumineux)
+            await asyncio.wait_for(self.writer.drain(), self.timeout)
+
+    async def _exchange(self, commands: Sequence[str], payload: Sequence = ()) -> List[SMTPReply]:
+        """Écrit un groupe de commandes (et éventuellement un bloc BDAT) en un seul aller-retour"""
+        start = time.perf_counter()
+        self.writer.writelines([b"".join(cmd.encode("utf-8") + CRLF for cmd in commands), *payload])
+        self.round_trips += 1
+        if payload:
+            await self._drain()
+            start = self._mark("body", start)
+        replies = []
+        for cmd in commands:
+            replies.append(await self._read())
+            start = self._mark(COMMAND_PHASES.get(cmd.partition(" ")[0]), start)
+        return replies
+
+    async def _end_data(self, payload: Iterable) -> SMTPReply:
+        """Envoie le contenu après 354 suivi de <CRLF>.<CRLF> et lit la réponse finale"""
+        start = time.perf_counter()
+        if isinstance(payload, StreamedData):
+            # Un bloc à la fois: le tampon d'émission ne dépasse jamais un bloc
+            for chunk in payload.chunks:
+                self.writer.write(chunk)
+                await self._drain()
+            self.writer.write(b"." + CRLF)
+        else:
+            self.writer.writelines([*payload, b"." + CRLF])
+        self.round_trips += 1
+        await self._drain()
+        start = self._mark("body", start)
+        reply = await self._read()
+        self._mark("final", start)
+        return reply
+
+    async def _bdat_stream(self, data: StreamedData, pipelining: bool) -> SMTPReply:
+        """
+        Envoie le contenu en une commande BDAT par bloc (la dernière avec LAST)
+
+        Avec PIPELINING, les réponses intermédiaires sont lues à la fin (RFC 3030 §4.2); sinon
+        chaque bloc attend sa réponse 250 avant le suivant.
+        """
+        start = time.perf_counter()
+        chunks = iter(data.chunks)
+        chunk = next(chunks, b"")
+        pending = 0
+        error = None
+        while True:
+            following = next(chunks, None)
+            last = following is None
+            self.writer.writelines([f"BDAT {len(chunk)}{' LAST' if last else ''}".encode("ascii") + CRLF, chunk])
+            await self._drain()
+            pending += 1
+            if not pipelining and not last:
+                reply = await self._read()
+                pending -= 1
+                self.round_trips += 1
+                if reply.code != 250:
+                    return reply
+            if last:
+                break
+            chunk = following
+        start = self._mark("body", start)
+        self.round_trips += 1
+        for _ in range(pending):
+            reply = await self._read()
+            if reply.code != 250 and error is None:
+                error = reply
+        self._mark("final", start)
+        return error or reply
+
+    async def send_message(self, sender: str, recipients: Sequence[str], data: MessageData) -> TransactionResult:
+        """
+        Exécute une transaction MAIL/RCPT/DATA (précédée de RSET si la session a déjà servi)
+
+        Avec PIPELINING, RSET/MAIL/RCPT/DATA partent en un seul groupe ; avec CHUNKING, le contenu
+        part en un seul BDAT LAST. Les extensions ne sont utilisées que si le serveur les annonce.
+        `data` peut être un PreparedData (corpus pré-rendu) écrit sans copie ni ré-encodage, ou un
+        StreamedData (--stream) écrit bloc par bloc, en BDAT successifs avec CHUNKING.
+        """
+        pipelining = self.pipelining and self.has_extension("PIPELINING")
+        chunking = self.chunking and self.has_extension("CHUNKING")
+        envelope = ["RSET"] if self.transactions else []
+        envelope.append(f"MAIL FROM:<{sender}>")
+        envelope.extend(f"RCPT TO:<{rcpt}>" for rcpt in recipients)
+        start_round_trips = self.round_trips
+        self.transactions += 1
+        self._data_ms = 0.0
+
+        prepared = isinstance(data, PreparedData)
+        streamed = isinstance(data, StreamedData)
+        body = ()
+        final_command = "DATA"
+        if chunking and streamed:
+            # Les BDAT partent après l'enveloppe, par _bdat_stream
+            final_command = None
+        elif chunking:
+            body = data.segments if prepared else [normalize_eols(data)]
+            final_command = f"BDAT {sum(len(segment) for segment in body)} LAST"
+
+        final_reply = None
+        if pipelining and final_command:
+            replies = await self._exchange(envelope + [final_command], body)
+            final_reply = replies.pop()
+        elif pipelining:
+            replies = await self._exchange(envelope)
+        else:
+            replies = []
+            for cmd in envelope:
+                replies.extend(await self._exchange([cmd]))
+                if cmd.startswith("MAIL") and replies[-1].code != 250:
+                    break
+        # Sans extension: un aller-retour par commande réellement envoyée (MAIL refusé: RCPT sautés)
+        baseline = len(replies)
+
+        if self.transactions > 1:
+            reply = replies.pop(0)
+            if reply.code != 250:
+                raise SMTPProtocolError(f"RSET refusé: {reply}")
+        error = None
+        reply = replies[0]
+        refused = {}
+        if reply.code != 250:
+            error = f"Sender refused: {reply}"
+        else:
+            for rcpt, reply in zip(recipients, replies[1:]):
+                if reply.code not in (250, 251):
+                    refused[rcpt] = str(reply)
+            if len(refused) == len(recipients):
+                error = f"Recipients refused: {refused}"
+
+        if final_reply is None and error is None:
+            if final_command is None:
+                final_reply = await self._bdat_stream(data, pipelining)
+            else:
+                final_reply = (await self._exchange([final_command], body))[0]
+        if final_reply is not None:
+            # DATA et la fin de données (ou leur équivalent BDAT), DATA seul s'il est refusé
+            baseline += 1 if final_command == "DATA" and final_reply.code != 354 else 2
+        if final_reply is not None and final_command == "DATA" and final_reply.code == 354:
+            # Le serveur attend le contenu: on l'envoie (ou un message vide si l'enveloppe a échoué)
+            if error:
+                final_reply = await self._end_data(())
+            elif streamed:
+                final_reply = await self._end_data(data)
+            else:
+                final_reply = await self._end_data(data.stuffed if prepared else [prepare_data(data)])
+
+        if self.phases is not None and self._data_ms:
+            self.phases.record("data_total", self._data_ms)
+        saved = baseline - (self.round_trips - start_round_trips)
+        if error is None and final_reply.code != 250:
+            error = f"Data error: {final_reply}"
+        if error is None and refused:
+            error = f"Recipients refused: {refused}"
+        return TransactionResult(error is None, final_reply or reply, error, saved)
+
+    async def quit(self):
+        """Termine proprement la session (QUIT), puis ferme la connexion"""
+        if not self.closed:
+            try:
+                await self.command("QUIT")
+            except (OSError, SMTPProtocolError):
+                pass
+        await self.close()
+
+    async def close(self):
+        """Ferme la connexion sans QUIT"""
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+            self.writer = None
+
+# ============================================================================
+# POOL DE SESSIONS
+# ============================================================================
+
+class SMTPSessionPool:
+    """
+    Pool de sessions ESMTP longues
+
+    Chaque session envoie au plus `transactions_per_session` messages avant d'être
+    fermée (QUIT) et recréée. Une session en erreur protocolaire ou réseau est jetée.
+    """
+
+    def __init__(self, host: str, port: int, size: int, transactions_per_session: int = 10,
+                 helo_name: str = "localhost", timeout: float = 30.0,
+                 pipelining: bool = False, chunking: bool = False, phases: Optional[PhaseTimings] = None,
+                 tls: Optional[ssl.SSLContext] = None):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.transactions_per_session = max(1, transactions_per_session)
+        self.helo_name = helo_name
+        self.timeout = timeout
+        self.pipelining = pipelining
+        self.chunking = chunking
+        self.phases = phases
+        self.tls = tls
+        self.sessions_opened = 0
+        self.tls_resumed = 0
+        self.server_extensions: Dict[str, str] = {}
+        self.transactions = 0
+        self.round_trips_saved = 0
+        self._slots: "asyncio.Queue[Optional[AsyncSMTPSession]]" = asyncio.Queue()
+        for _ in range(size):
+            self._slots.put_nowait(None)
+
+    async def _open_session(self) -> AsyncSMTPSession:
+        session = AsyncSMTPSession(self.host, self.port, self.helo_name, self.timeout,
+                                   self.pipelining, self.chunking, self.phases, self.tls)
+        await session.connect()
+        self.sessions_opened += 1
+        self.tls_resumed += session.tls_resumed
+        self.server_extensions = session.extensions
+        return session
+
+    async def send_message(self, sender: str, recipients: Sequence[str], data: MessageData) -> TransactionResult:
+        """Envoie un message sur une session libre du pool (attend si toutes sont occupées)"""
+        session = await self._slots.get()
+        try:
+            if session is not None and (session.closed or session.transactions >= self.transactions_per_session):
+                await session.quit()
+                session = None
+            if session is None:
+                session = await self._open_session()
+            result = await session.send_message(sender, recipients, data)
+            self.transactions += 1
+            self.round_trips_saved += result.round_trips_saved
+            return result
+        except (OSError, asyncio.TimeoutError, SMTPProtocolError):
+            if session is not None:
+                await session.close()
+                session = None
+            raise
+        finally:
+            self._slots.put_nowait(session)
+
+    async def close(self):
+        """Ferme toutes les sessions inactives du pool"""
+        sessions = []
+        while not self._slots.empty():
+            session = self._slots.get_nowait()
+            if session is not None:
+                sessions.append(session.quit())
+        await asyncio.gather(*sessions, return_exceptions=True)
+
+
+async def send_with_timing(pool: SMTPSessionPool, sender: str, recipients: Sequence[str], data: MessageData):
+    """Envoie un message via le pool et retourne (succès, temps_ms, erreur)"""
+    start_time = time.perf_counter()
+    try:
+        result = await pool.send_message(sender, recipients, data)
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        return result.success, elapsed_ms, result.error
+    except SMTPProtocolError as e:
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        return False, elapsed_ms, f"SMTP error: {e}"
+    except (ConnectionRefusedError, OSError, asyncio.TimeoutError) as e:
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        return False, elapsed_ms, f"Connection error: {e!r}"
@@ -0,0 +1,116 @@
+"""
+Compteurs d'un run de performance, fusionnables entre workers
+
+Chaque processus (ou worker) remplit son propre RunStats; le processus principal
+fusionne les exports to_dict() pour produire un rapport unique.
+"""
+
+from typing import Dict, Optional
+
+from kumoload.histogram import LatencyHistogram
+
+# Nombre de messages d'erreur distincts conservés (les suivants sont regroupés)
+MAX_DISTINCT_ERRORS = 20
+OTHER_ERRORS = "(autres erreurs)"
+
+
+class RunStats:
+    """Succès/échecs, latences (histogramme) et compteurs libres du moteur d'envoi"""
+
+    def __init__(self, histogram_digits: int = 3):
+        self.success = 0
+        self.failed = 0
+        self.requests = 0
+        self.latency = LatencyHistogram(histogram_digits)
+        # Compteurs additionnés à la fusion (sessions ouvertes, allers-retours économisés...)
+        self.counters: Dict[str, float] = {}
+        # Valeurs dont on garde le maximum à la fusion (retard de l'ordonnanceur...)
+        self.maxima: Dict[str, float] = {}
+        self.errors: Dict[str, int] = {}
+
+    @property
+    def messages(self) -> int:
+        return self.success + self.failed
+
+    def record(self, success: bool, elapsed_ms: Optional[float], error: Optional[str] = None,
+               messages: int = 1, accepted: Optional[int] = None):
+        """Enregistre une requête (un message SMTP ou un lot HTTP de `messages` destinataires)"""
+        if accepted is None:
+            accepted = messages if success else 0
+        self.requests += 1
+        self.success += accepted
+        self.failed += messages - accepted
+        if elapsed_ms is not None:
+            self.latency.record(elapsed_ms)
+        if error:
+            self.add_error(error)
+
+    def add_error(self, error: str, count: int = 1):
+        key = error[:150]
+        if key not in self.errors and len(self.errors) >= MAX_DISTINCT_ERRORS:
+            key = OTHER_ERRORS
+        self.errors[key] = self.errors.get(key, 0) + count
+
+    def add_counter(self, name: str, value: float):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_max(self, name: str, value: float):
+        self.maxima[name] = max(self.maxima.get(name, value), value)
+
+    def merge(self, other: "RunStats"):
+        self.success += other.success
+        self.failed += other.failed
+        self.requests += other.requests
+        self.latency.merge(other.latency)
+        for name, value in other.counters.items():
+            self.add_counter(name, value)
+        for name, value in other.maxima.items():
+            self.set_max(name, value)
+        for error, count in other.errors.items():
+            self.add_error(error, count)
+
+    def top_errors(self, limit: int = 5):
+        return sorted(self.errors.items(), key=lambda item: -item[1])[:limit]
+
+    def to_dict(self) -> dict:
+        return {
+            "success": self.success,
+            "failed": self.failed,
+            "requests": self.requests,
+            "latency": self.latency.to_dict(),
+            "counters": self.counters,
+            "maxima": self.maxima,
+            "errors": self.errors,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "RunStats":
+        stats = cls()
+        stats.success = data["success"]
+        stats.failed = data["failed"]
+        stats.requests = data["requests"]
+        stats.latency = LatencyHistogram.from_dict(data["latency"])
+        stats.counters = dict(data["counters"])
+        stats.maxima = dict(data["maxima"])
+        stats.errors = dict(data["errors"])
+        return stats
+
+
+def run_record(stats: RunStats, duration: float, **config) -> dict:
+    """Résultat structuré d'un run (--result-json): configuration, débit, percentiles et histogramme fusionnable"""
+    hist = stats.latency
+    return {
+        "config": config,
+        "messages": stats.messages,
+        "success": stats.success,
+        "failed": stats.failed,
+        "requests": stats.requests,
+        "duration_s": round(duration, 3),
+        "throughput": round(stats.messages / duration, 1) if duration else 0.0,
+        "error_rate": round(stats.failed / stats.messages, 5) if stats.messages else 0.0,
+        "latency_ms": {"min": hist.min, "mean": hist.mean, "p50": hist.percentile(50), "p90": hist.percentile(90),
+                       "p99": hist.percentile(99), "p999": hist.percentile(99.9), "max": hist.max},
+        "counters": stats.counters,
+        "errors": stats.errors,
+        "histogram": hist.to_dict(),
+    }
@@ -0,0 +1,197 @@
+"""
+Messages volumineux générés à la volée (--stream), sans les garder en mémoire
+
+Le spool de kumod (data et meta sur RocksDB) n'est sollicité qu'avec des messages de
+plusieurs mégaoctets. Ici, le contenu d'un message de 1 à 50 Mo est produit par un
+générateur, bloc par bloc: chaque bloc est une vue d'un bloc de remplissage rendu une seule
+fois, si bien que la mémoire du driver ne dépend pas de la taille des messages. Les blocs
+partent en DATA, en commandes BDAT successives (CHUNKING) ou en HTTP chunked.
+
+La taille de chaque message est tirée de la distribution (même syntaxe que --message-size)
+avec une graine dérivée de son numéro: identique dans tous les processus et recalculable
+pour compter les octets ingérés.
+
+Usage (vérification du découpage: CRLF seuls, taille exacte, aux frontières de blocs):
+    python3 -m kumoload.stream [--chunk-size 4KB] [--blocks 64] [--random 200]
+"""
+
+import sys
+import json
+import random
+import argparse
+from email.utils import formatdate
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from kumoload.corpus import _filler_lines, format_size, parse_size, parse_size_distribution, sample_size
+from kumoload.http_async import StreamedBody
+from kumoload.smtp_async import StreamedData
+
+DEFAULT_CHUNK_SIZE = 256 * 1024
+
+# Plus petit message en streaming: en-têtes + une ligne de remplissage
+MIN_STREAM_SIZE = 1024
+
+
+def _end_line(view: memoryview) -> bytes:
+    """Fin du message: ligne tronquée terminée par CRLF (sans CR orphelin si la coupe tombe dans un CRLF)"""
+    data = bytes(view)
+    if data.endswith(b"\r"):
+        data = data[:-1] + b" "
+    return data + b"\r\n"
+
+
+class MessageStream:
+    """
+    Générateur de messages MIME de taille donnée, en blocs de `chunk_size` octets
+
+    Le remplissage est un bloc de lignes 7 bits (jamais de '.' en début de ligne: pas de
+    dot-stuffing) rendu une fois et doublé, pour découper n'importe quelle fenêtre sans copie.
+    """
+
+    def __init__(self, size_spec: str, chunk_size: int = DEFAULT_CHUNK_SIZE, seed: int = 0):
+        self.size_spec = size_spec
+        self.distribution = parse_size_distribution(size_spec)
+        if min(low for low, _, _ in self.distribution) < MIN_STREAM_SIZE:
+            raise ValueError(f"Taille minimale en streaming: {format_size(MIN_STREAM_SIZE)}")
+        self.chunk_size = max(4096, chunk_size)
+        self.seed = seed
+        lines = _filler_lines(random.Random(seed))
+        block = b"".join(lines)
+        while len(block) < self.chunk_size:
+            block += block
+        self._block_size = len(block)
+        self._filler = memoryview(block + block)
+
+    @classmethod
+    def from_spec(cls, size_spec: str, chunk_spec: str) -> "MessageStream":
+        return cls(size_spec, parse_size(chunk_spec))
+
+    def size_of(self, message_num: int) -> int:
+        """Taille (octets MIME) du message, déterministe"""
+        return sample_size(self.distribution, random.Random(self.seed * 1_000_003 + message_num))
+
+    def head(self, token: str, from_header: str, extra_headers: Sequence[Tuple[str, str]] = ()) -> bytes:
+        """En-têtes MIME du message (jeton dans X-Test-ID), suivis de la ligne vide"""
+        extra = "".join(f"{name}: {value}\r\n" for name, value in extra_headers)
+        return (
+            f"From: {from_header}\r\n"
+            f"To: undisclosed-recipients:;\r\n"
+            f"Subject: Performance Test {token} (streaming)\r\n"
+            f"Date: {formatdate(localtime=True)}\r\n"
+            f"Message-ID: <{token}@kumoload.test>\r\n"
+            f"X-Test-ID: {token}\r\n"
+            f"{extra}"
+            f"MIME-Version: 1.0\r\n"
+            f"Content-Type: text/plain; charset=\"us-ascii\"\r\n"
+            f"Content-Transfer-Encoding: 7bit\r\n"
+            f"\r\n"
+        ).encode("ascii")
+
+    def chunks(self, head: bytes, size: int) -> Iterator[bytes]:
+        """Blocs du message (CRLF, sans dot-stuffing nécessaire) totalisant `size` octets"""
+        chunk_size, block_size, filler = self.chunk_size, self._block_size, self._filler
+        # Remplissage restant, CRLF final compris (au moins 2 octets)
+        remaining = max(size - len(head), 2)
+        pending, offset = head, 0
+        while remaining:
+            length = min(max(chunk_size - len(pending), 0), remaining)
+            if 0 < remaining - length < 2:
+                # Le dernier bloc doit contenir au moins le CRLF final
+                length = remaining - 2
+            if 0 < length < remaining and filler[offset + length - 1] == 0x0D:
+                # Jamais de coupe entre CR et LF: le bloc suivant commencerait par un LF orphelin,
+                # et un dernier bloc réduit au CRLF final laisserait ce CR seul
+                length -= 1
+            if length == remaining:
+                piece = _end_line(filler[offset:offset + length - 2])
+            else:
+                piece = filler[offset:offset + length]
+            yield pending + bytes(piece) if pending else piece
+            pending, offset, remaining = b"", (offset + length) % block_size, remaining - length
+
+    def smtp_data(self, head: bytes, size: int) -> StreamedData:
+        return StreamedData(len(head) + max(size - len(head), 2), self.chunks(head, size))
+
+    def http_body(self, head: bytes, size: int, envelope_sender: str, recipients: bytes) -> StreamedBody:
+        """Payload JSON /api/inject/v1 dont le contenu MIME est échappé bloc par bloc"""
+        prefix = b'{"envelope_sender": ' + json.dumps(envelope_sender).encode("utf-8") + b', "content": "'
+        suffix = b'", "recipients": ' + recipients + b"}"
+
+        def generate() -> Iterator[bytes]:
+            yield prefix
+            for chunk in self.chunks(head, size):
+                # Contenu 7 bits: échappement JSON de l'antislash, des guillemets (en-têtes) et de CRLF
+                yield (bytes(chunk).replace(b"\\", b"\\\\").replace(b'"', b'\\"')
+                       .replace(b"\r", b"\\r").replace(b"\n", b"\\n"))
+            yield suffix
+
+        return StreamedBody(generate())
+
+    def describe(self) -> str:
+        low = min(low for low, _, _ in self.distribution)
+        high = max(high for _, high, _ in self.distribution)
+        sizes = format_size(low) if low == high else f"{format_size(low)} à {format_size(high)}"
+        return f"messages de {sizes} ({self.size_spec}), blocs de {format_size(self.chunk_size)}"
+
+# ============================================================================
+# VÉRIFICATION DU DÉCOUPAGE
+# ============================================================================
+
+def framing_errors(stream: MessageStream, head: bytes, size: int) -> List[str]:
+    """Défauts du message reconstitué à partir de ses blocs: taille, CR ou LF orphelin, fin sans CRLF"""
+    data = b"".join(bytes(chunk) for chunk in stream.chunks(head, size))
+    errors = []
+    if len(data) != max(size, len(head) + 2):
+        errors.append(f"{len(data)} octets au lieu de {size}")
+    # CRLF masqués: il ne doit rester aucun CR ni LF
+    masked = data.replace(b"\r\n", b"  ")
+    for byte, name in ((b"\r", "CR"), (b"\n", "LF")):
+        position = masked.find(byte)
+        if position >= 0:
+            errors.append(f"{name} orphelin à l'octet {position}")
+    if not data.endswith(b"\r\n"):
+        errors.append("pas de CRLF final")
+    return errors
+
+
+def boundary_sizes(chunk_size: int, blocks: int) -> List[int]:
+    """Tailles où le dernier bloc tombe sur une frontière: k × chunk_size + 2 ± 3"""
+    return [k * chunk_size + 2 + delta for k in range(1, blocks + 1) for delta in range(-3, 4)]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Vérifie le découpage en blocs des messages en streaming")
+    parser.add_argument("--chunk-size", default="4KB", help="Taille des blocs (défaut: 4KB)")
+    parser.add_argument("--blocks", type=int, default=64,
+                        help="Frontières vérifiées: k × chunk_size + 2 ± 3 pour k de 1 à N (défaut: 64)")
+    parser.add_argument("--random", type=int, default=200, help="Tailles aléatoires vérifiées en plus (défaut: 200)")
+    parser.add_argument("--max-size", default="1MB", help="Taille maximale des tirages aléatoires (défaut: 1MB)")
+    args = parser.parse_args(argv)
+
+    try:
+        chunk_size, max_size = parse_size(args.chunk_size), parse_size(args.max_size)
+    except ValueError as e:
+        print(f"✗ Erreur: {e}")
+        return 1
+    max_size = max(max_size, MIN_STREAM_SIZE)
+    stream = MessageStream(f"{MIN_STREAM_SIZE}-{max_size}", chunk_size)
+    head = stream.head("0" * 24, "Performance Test <perf-test@talk.stir.com>")
+    rng = random.Random(0)
+    sizes = boundary_sizes(stream.chunk_size, args.blocks)
+    sizes += [rng.randint(MIN_STREAM_SIZE, max_size) for _ in range(args.random)]
+    failures = 0
+    for size in sizes:
+        errors = framing_errors(stream, head, size)
+        if errors:
+            failures += 1
+            print(f"✗ {size} octets: {', '.join(errors)}")
+    if failures:
+        print(f"✗ {failures}/{len(sizes)} tailles mal découpées (blocs de {format_size(stream.chunk_size)})")
+        return 1
+    print(f"✓ {len(sizes)} tailles vérifiées (blocs de {format_size(stream.chunk_size)}): CRLF uniquement, "
+          f"taille exacte")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
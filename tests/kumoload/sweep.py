@@ -0,0 +1,328 @@
+"""
+Campagne de mesures: matrice de configurations, baseline et détection des régressions
+
+Chaque combinaison des paramètres de la matrice est exécutée par le script de performance du
+protocole (test_performance_smtp.py ou test_performance_http.py, moteur async) autant de fois que
+--repeat; chaque run produit un enregistrement JSON (--result-json du script) ajouté au fichier
+de résultats. Les résultats peuvent devenir la baseline (--save-baseline) ou lui être comparés
+(--baseline): une variation n'est signalée que si elle dépasse à la fois un seuil relatif et le
+bruit mesuré entre répétitions. Usage typique: baseline avant une modification du chart
+(shaping.toml, spool RocksDB...), puis comparaison après.
+
+Paramètres de la matrice (--param nom=v1,v2, répétable):
+    protocol       smtp, http
+    concurrency    sessions SMTP (--sessions) ou injections HTTP simultanées (--concurrency)
+    message_size   distribution de tailles du corpus pré-rendu (--corpus --message-size)
+    recipients     destinataires par requête HTTP (--batch-size); 1 seulement en SMTP
+    autre          transmis tel quel au script: rate=5000 -> --rate 5000, pipelining=1 -> --pipelining
+
+Usage:
+    python3 -m kumoload.sweep --param protocol=smtp,http --param concurrency=100,500 --messages 20000 \\
+        --repeat 3 --results avant.jsonl --save-baseline baseline.json
+    python3 -m kumoload.sweep ... --results apres.jsonl --baseline baseline.json
+    python3 -m kumoload.sweep --from-results apres.jsonl --baseline baseline.json
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import itertools
+import subprocess
+import statistics
+import tempfile
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+FORMAT = "kumoload-sweep-baseline-v1"
+
+SCRIPTS = {"smtp": "test_performance_smtp.py", "http": "test_performance_http.py"}
+TESTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Taille du corpus pré-rendu quand message_size fait partie de la matrice
+CORPUS_SIZE = 64
+
+# Options sans valeur des scripts: pipelining=1 -> --pipelining
+FLAGS = ("pipelining", "chunking", "local", "metrics", "verbose")
+
+# Régression signalée si la variation dépasse ce seuil relatif...
+DEFAULT_MIN_CHANGE = 0.05
+# ... et NOISE_SIGMAS écarts-types de la différence des moyennes (bruit entre répétitions)
+DEFAULT_NOISE_SIGMAS = 2.0
+
+# ============================================================================
+# MATRICE
+# ============================================================================
+
+def parse_params(specs: Sequence[str]) -> Dict[str, List[str]]:
+    """{"nom": [valeurs]} depuis des spécifications nom=v1,v2"""
+    params: Dict[str, List[str]] = {}
+    for spec in specs:
+        name, sep, values = spec.partition("=")
+        name = name.strip().replace("-", "_")
+        if not sep or not name or not values.strip():
+            raise ValueError(f"Paramètre invalide: {spec!r} (attendu: nom=v1,v2)")
+        params[name] = [value.strip() for value in values.split(",") if value.strip()]
+    params.setdefault("protocol", ["smtp"])
+    unknown = set(params["protocol"]) - set(SCRIPTS)
+    if unknown:
+        raise ValueError(f"Protocole inconnu: {', '.join(sorted(unknown))} (attendu: smtp, http)")
+    return params
+
+
+def config_key(config: Dict[str, str]) -> str:
+    """Clé stable d'une configuration (jointure résultats / baseline)"""
+    return " ".join(f"{name}={config[name]}" for name in sorted(config))
+
+
+def expand(params: Dict[str, List[str]]) -> Tuple[List[Dict[str, str]], List[str]]:
+    """Configurations de la matrice, et configurations écartées (sans objet pour le protocole)"""
+    names = list(params)
+    configs, skipped = [], []
+    for values in itertools.product(*(params[name] for name in names)):
+        config = dict(zip(names, values))
+        if config["protocol"] == "smtp" and config.get("recipients", "1") != "1":
+            skipped.append(config_key(config))
+            continue
+        configs.append(config)
+    return configs, skipped
+
+
+def build_command(config: Dict[str, str], messages: int, extra: Sequence[str], result_path: str) -> List[str]:
+    """Ligne de commande du script de performance pour une configuration"""
+    protocol = config["protocol"]
+    command = [sys.executable, os.path.join(TESTS_DIR, SCRIPTS[protocol]), str(messages), "--engine", "async"]
+    for name, value in config.items():
+        if name == "protocol":
+            continue
+        if name == "concurrency":
+            command += ["--sessions" if protocol == "smtp" else "--concurrency", value]
+        elif name == "message_size":
+            if "corpus" not in config:
+                command += ["--corpus", str(CORPUS_SIZE)]
+            command += ["--message-size", value]
+        elif name == "recipients":
+            if protocol == "http":
+                command += ["--batch-size", value]
+        elif name in FLAGS:
+            if value.lower() in ("1", "true", "yes"):
+                command.append(f"--{name}")
+        else:
+            command += [f"--{name.replace('_', '-')}", value]
+    return command + list(extra) + ["--report-interval", "0", "--result-json", result_path]
+
+# ============================================================================
+# EXÉCUTION
+# ============================================================================
+
+def run_config(config: Dict[str, str], messages: int, extra: Sequence[str], log_path: Optional[str],
+               timeout: Optional[float]) -> Tuple[Optional[dict], int, Optional[str]]:
+    """Exécute un run: (résultat --result-json, code de retour, erreur)"""
+    handle, result_path = tempfile.mkstemp(prefix="kumoload-sweep-", suffix=".json")
+    os.close(handle)
+    command = build_command(config, messages, extra, result_path)
+    try:
+        with open(log_path, "a") if log_path else open(os.devnull, "w") as log:
+            log.write(f"\n$ {' '.join(command)}\n")
+            log.flush()
+            completed = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT, cwd=TESTS_DIR, timeout=timeout)
+        with open(result_path) as f:
+            content = f.read()
+        if not content:
+            return None, completed.returncode, f"aucun résultat (code de retour {completed.returncode})"
+        return json.loads(content), completed.returncode, None
+    except subprocess.TimeoutExpired:
+        return None, -1, f"délai dépassé ({timeout:g} s)"
+    except (OSError, ValueError) as e:
+        return None, -1, str(e)
+    finally:
+        os.unlink(result_path)
+
+
+def run_sweep(configs: List[Dict[str, str]], messages: int, repeat: int, extra: Sequence[str], results_path: str,
+              label: str, log_path: Optional[str], timeout: Optional[float]) -> List[dict]:
+    """Exécute toutes les configurations `repeat` fois et ajoute chaque enregistrement au fichier de résultats"""
+    records = []
+    total = len(configs) * repeat
+    done = 0
+    with open(results_path, "a") as out:
+        for config in configs:
+            key = config_key(config)
+            for run in range(1, repeat + 1):
+                done += 1
+                started = time.time()
+                result, exit_code, error = run_config(config, messages, extra, log_path, timeout)
+                record = {"key": key, "config": config, "run": run, "label": label,
+                          "timestamp": datetime.now().isoformat(timespec="seconds"), "exit_code": exit_code,
+                          "elapsed_s": round(time.time() - started, 1), "result": result, "error": error}
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                records.append(record)
+                if result is None:
+                    print(f"✗ [{done}/{total}] {key} (run {run}): {error}", flush=True)
+                else:
+                    print(f"{'✓' if not result['failed'] else '⚠'} [{done}/{total}] {key} (run {run}): "
+                          f"{result['throughput']:.1f} msg/s, P99 {result['latency_ms']['p99']:.1f} ms, "
+                          f"{result['failed']} échec(s)", flush=True)
+    return records
+
+
+def load_results(path: str) -> List[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# ============================================================================
+# BASELINE ET COMPARAISON
+# ============================================================================
+
+def aggregate(records: Sequence[dict]) -> Dict[str, dict]:
+    """Par configuration: débits et P99 de chaque run réussi"""
+    configs: Dict[str, dict] = {}
+    for record in records:
+        if record.get("result") is None:
+            continue
+        entry = configs.setdefault(record["key"], {"config": record["config"], "throughput": [], "p99_ms": []})
+        entry["throughput"].append(record["result"]["throughput"])
+        entry["p99_ms"].append(record["result"]["latency_ms"]["p99"])
+    return configs
+
+
+def save_baseline(path: str, records: Sequence[dict], label: str):
+    with open(path, "w") as f:
+        json.dump({"format": FORMAT, "label": label, "created": datetime.now().isoformat(timespec="seconds"),
+                   "configs": aggregate(records)}, f, indent=2)
+
+
+def load_baseline(path: str) -> dict:
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("format") != FORMAT:
+        raise ValueError(f"{path}: format de baseline inconnu ({data.get('format')!r})")
+    return data
+
+
+def _mean_sd(values: Sequence[float]) -> Tuple[float, float]:
+    return statistics.fmean(values), statistics.stdev(values) if len(values) > 1 else 0.0
+
+
+def significant_change(baseline: Sequence[float], current: Sequence[float], min_change: float,
+                       noise_sigmas: float) -> Tuple[float, bool]:
+    """
+    (variation relative, significative) entre deux séries de mesures
+
+    Significative si |variation| dépasse min_change ET noise_sigmas écarts-types de la différence
+    des moyennes (sqrt(s1²/n1 + s2²/n2), écarts-types mesurés entre répétitions).
+    """
+    base_mean, base_sd = _mean_sd(baseline)
+    mean, sd = _mean_sd(current)
+    if base_mean == 0:
+        return 0.0, False
+    change = (mean - base_mean) / base_mean
+    noise = math.sqrt(base_sd ** 2 / len(baseline) + sd ** 2 / len(current))
+    return change, abs(change) > min_change and abs(mean - base_mean) > noise_sigmas * noise
+
+
+def compare(baseline: dict, records: Sequence[dict], min_change: float, noise_sigmas: float) -> Tuple[List[str], int]:
+    """Tableau de comparaison avec la baseline et nombre de régressions (débit en baisse ou P99 en hausse)"""
+    current = aggregate(records)
+    reference = baseline["configs"]
+    lines = [f"  Baseline: {baseline.get('label') or '-'} ({baseline.get('created', '?')}), seuil {min_change * 100:g}% "
+             f"et {noise_sigmas:g} σ du bruit entre répétitions",
+             "",
+             f"  {'configuration':<50} {'baseline msg/s':>17}   {'actuel msg/s':>17}   {'Δ débit':>7} {'Δ P99':>8}"]
+    regressions = 0
+    for key in sorted(set(current) | set(reference)):
+        if key not in current or key not in reference:
+            where = "absente des résultats" if key not in current else "absente de la baseline"
+            lines.append(f"  {key[:50]:<50} {where}")
+            continue
+        base, now = reference[key], current[key]
+        throughput, throughput_flag = significant_change(base["throughput"], now["throughput"], min_change, noise_sigmas)
+        p99, p99_flag = significant_change(base["p99_ms"], now["p99_ms"], min_change, noise_sigmas)
+        verdicts = []
+        if throughput_flag:
+            verdicts.append("✗ débit" if throughput < 0 else "↑ débit")
+        if p99_flag:
+            verdicts.append("✗ P99" if p99 > 0 else "↑ P99")
+        if (throughput_flag and throughput < 0) or (p99_flag and p99 > 0):
+            regressions += 1
+        base_mean, base_sd = _mean_sd(base["throughput"])
+        mean, sd = _mean_sd(now["throughput"])
+        lines.append(f"  {key[:50]:<50} {base_mean:>10.1f} ±{base_sd:<8.1f}{mean:>10.1f} ±{sd:<8.1f}"
+                     f"{throughput * 100:>+7.1f}% {p99 * 100:>+7.1f}%  {', '.join(verdicts) or '✓'}")
+    return lines, regressions
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Campagne de mesures: matrice de configurations et comparaison "
+                                                 "à une baseline")
+    parser.add_argument("--param", action="append", default=[],
+                        help="Paramètre de la matrice nom=v1,v2 (protocol, concurrency, message_size, recipients "
+                             "ou option du script), répétable")
+    parser.add_argument("--messages", type=int, default=int(os.getenv("SWEEP_MESSAGES", 10000)),
+                        help="Messages par run (défaut: 10000)")
+    parser.add_argument("--repeat", type=int, default=int(os.getenv("SWEEP_REPEAT", 3)),
+                        help="Runs par configuration, pour mesurer le bruit (défaut: 3)")
+    parser.add_argument("--extra", default=os.getenv("SWEEP_EXTRA", ""),
+                        help="Options ajoutées à chaque run, ex. --extra=\"--local --rate 5000\"")
+    parser.add_argument("--results", default=os.getenv("SWEEP_RESULTS", "sweep-results.jsonl"),
+                        help="Fichier JSONL des résultats, complété à chaque run (défaut: sweep-results.jsonl)")
+    parser.add_argument("--from-results", help="Compare un fichier de résultats existant sans lancer de run")
+    parser.add_argument("--label", default="", help="Libellé de la campagne (ex. \"shaping.toml v2\")")
+    parser.add_argument("--log", help="Sortie complète des scripts (défaut: ignorée)")
+    parser.add_argument("--timeout", type=float, help="Durée maximale d'un run en secondes")
+    parser.add_argument("--baseline", help="Baseline à laquelle comparer les résultats")
+    parser.add_argument("--save-baseline", help="Écrit la baseline issue de ces résultats")
+    parser.add_argument("--min-change", type=float, default=DEFAULT_MIN_CHANGE,
+                        help=f"Variation relative minimale signalée (défaut: {DEFAULT_MIN_CHANGE})")
+    parser.add_argument("--noise-sigmas", type=float, default=DEFAULT_NOISE_SIGMAS,
+                        help=f"Écarts-types de bruit à dépasser (défaut: {DEFAULT_NOISE_SIGMAS:g})")
+    parser.add_argument("--dry-run", action="store_true", help="Affiche les commandes sans les exécuter")
+    args = parser.parse_args(argv)
+
+    try:
+        baseline = load_baseline(args.baseline) if args.baseline else None
+        if args.from_results:
+            records = load_results(args.from_results)
+        else:
+            configs, skipped = expand(parse_params(args.param))
+            extra = args.extra.split()
+            print(f"Matrice: {len(configs)} configuration(s) × {args.repeat} run(s), {args.messages} messages par run")
+            for key in skipped:
+                print(f"⚠ Écartée (plusieurs destinataires par requête: HTTP uniquement): {key}")
+            if args.dry_run:
+                for config in configs:
+                    print("  " + " ".join(build_command(config, args.messages, extra, "RESULTAT.json")))
+                return 0
+            records = run_sweep(configs, args.messages, max(1, args.repeat), extra, args.results, args.label,
+                                args.log, args.timeout)
+            print(f"✓ Résultats ajoutés à {args.results}")
+    except (OSError, ValueError) as e:
+        print(f"✗ Erreur: {e}")
+        return 1
+
+    failed = sum(1 for record in records if record.get("result") is None)
+    if failed:
+        print(f"⚠ {failed} run(s) sans résultat (voir --log)")
+    if args.save_baseline:
+        save_baseline(args.save_baseline, records, args.label)
+        print(f"✓ Baseline écrite: {args.save_baseline} ({len(aggregate(records))} configurations)")
+    if baseline is None:
+        return 1 if failed else 0
+    lines, regressions = compare(baseline, records, args.min_change, args.noise_sigmas)
+    print("\nComparaison avec la baseline:")
+    print("\n".join(lines))
+    if regressions:
+        print(f"\n✗ {regressions} configuration(s) en régression")
+        return 1
+    print("\n✓ Aucune régression significative")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
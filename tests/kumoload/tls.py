@@ -0,0 +1,127 @@
+"""
+STARTTLS: politique TLS du client, reprise de session et certificat auto-signé du sink
+
+Les expéditeurs réels passent en TLS par STARTTLS; ce module construit le contexte client
+(versions min/max, suites de chiffrement TLS 1.2, vérification optionnelle) et un cache de
+sessions côté client: avec --tls-resume, une connexion reprend la session TLS obtenue par la
+précédente vers le même serveur (handshake abrégé, sans échange de clés complet).
+
+asyncio n'accepte pas de session à reprendre dans start_tls(): ResumingSSLContext la fournit
+à wrap_bio(), appelé par asyncio pour chaque connexion, d'après le nom du serveur.
+
+Le sink local (python3 -m kumoload.sink --starttls) utilise un certificat auto-signé généré
+par le binaire openssl si aucun certificat n'est fourni.
+"""
+
+import os
+import ssl
+import subprocess
+import tempfile
+from typing import Dict, Optional, Tuple
+
+from kumoload.phases import PhaseTimings
+
+TLS_VERSIONS = {"1.2": ssl.TLSVersion.TLSv1_2, "1.3": ssl.TLSVersion.TLSv1_3}
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """Contexte client qui reprend la dernière session TLS négociée avec chaque serveur"""
+
+    def __init__(self, protocol: int = ssl.PROTOCOL_TLS_CLIENT):
+        self.sessions: Dict[Optional[str], ssl.SSLSession] = {}
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        if session is None and not server_side:
+            session = self.sessions.get(server_hostname)
+        return super().wrap_bio(incoming, outgoing, server_side, server_hostname, session)
+
+    def remember(self, server_hostname: Optional[str], ssl_object: ssl.SSLObject):
+        """Conserve la session de la connexion (en TLS 1.3, après réception du ticket)"""
+        session = ssl_object.session
+        if session is not None and (session.has_ticket or ssl_object.version() != "TLSv1.3"):
+            self.sessions[server_hostname] = session
+
+
+def client_context(min_version: str = "1.2", max_version: str = "1.3", ciphers: Optional[str] = None,
+                   cafile: Optional[str] = None, resume: bool = False) -> ssl.SSLContext:
+    """
+    Contexte TLS du client STARTTLS
+
+    Sans `cafile`, le certificat du serveur n'est pas vérifié (kumod de test, sink auto-signé).
+    `ciphers` (syntaxe OpenSSL) ne s'applique qu'à TLS 1.2: Python ne permet pas de restreindre
+    les suites TLS 1.3.
+    """
+    try:
+        versions = TLS_VERSIONS[min_version], TLS_VERSIONS[max_version]
+    except KeyError as e:
+        raise ValueError(f"Version TLS inconnue: {e.args[0]} ({', '.join(TLS_VERSIONS)})")
+    if versions[0] > versions[1]:
+        raise ValueError(f"Version TLS minimale {min_version} supérieure à la maximale {max_version}")
+    context = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT) if resume else ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.minimum_version, context.maximum_version = versions
+    if ciphers:
+        try:
+            context.set_ciphers(ciphers)
+        except ssl.SSLError:
+            raise ValueError(f"Aucune suite de chiffrement ne correspond à {ciphers!r}")
+    if cafile:
+        context.load_verify_locations(cafile)
+    else:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def describe_context(context: ssl.SSLContext) -> str:
+    names = {version: name for name, version in TLS_VERSIONS.items()}
+    low, high = names.get(context.minimum_version, "?"), names.get(context.maximum_version, "?")
+    versions = f"TLS {low}" if low == high else f"TLS {low} à {high}"
+    resume = ", reprise de session" if isinstance(context, ResumingSSLContext) else ""
+    verify = "certificat vérifié" if context.verify_mode == ssl.CERT_REQUIRED else "certificat non vérifié"
+    return f"{versions}, {verify}{resume}"
+
+# ============================================================================
+# SINK
+# ============================================================================
+
+def generate_self_signed(directory: Optional[str] = None, hostname: str = "localhost") -> Tuple[str, str]:
+    """Génère un certificat auto-signé (openssl req), retourne (certificat, clé)"""
+    directory = directory or tempfile.mkdtemp(prefix="kumoload-tls-")
+    cert, key = os.path.join(directory, "sink.crt"), os.path.join(directory, "sink.key")
+    try:
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "30",
+                        "-keyout", key, "-out", cert, "-subj", f"/CN={hostname}",
+                        "-addext", f"subjectAltName=DNS:{hostname},IP:127.0.0.1"],
+                       check=True, capture_output=True, timeout=60)
+    except (OSError, subprocess.SubprocessError) as e:
+        raise RuntimeError(f"Génération du certificat auto-signé impossible (openssl): {e}")
+    return cert, key
+
+
+def server_context(certfile: str, keyfile: str) -> ssl.SSLContext:
+    """Contexte TLS du sink (tickets de session TLS 1.3 et cache de sessions TLS 1.2 actifs par défaut)"""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(certfile, keyfile)
+    return context
+
+# ============================================================================
+# RAPPORT
+# ============================================================================
+
+def format_handshakes(timings: PhaseTimings) -> str:
+    """Handshakes complets vs repris: nombre, taux de reprise et latences"""
+    full, resumed = timings.histograms["tls_full"], timings.histograms["tls_resumed"]
+    total = full.count + resumed.count
+    if not total:
+        return "  Aucun handshake TLS"
+    lines = [f"  Handshakes: {total} ({full.count} complets, {resumed.count} repris, "
+             f"reprise {resumed.count * 100 / total:.1f}%)"]
+    for label, hist in (("complet", full), ("repris", resumed)):
+        if hist.count:
+            lines.append(f"  {label:<8} moyenne {hist.mean:.2f} ms, P50 {hist.percentile(50):.2f} ms, "
+                         f"P99 {hist.percentile(99):.2f} ms, max {hist.max:.2f} ms")
+    if full.count and resumed.count and resumed.mean:
+        lines.append(f"  Gain de la reprise: {(1 - resumed.mean / full.mean) * 100:.0f}% sur la moyenne "
+                     f"({full.mean - resumed.mean:.2f} ms par connexion)")
+    return "\n".join(lines)
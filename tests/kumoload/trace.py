@@ -0,0 +1,277 @@
+"""
+Traces de trafic de production: chargement, description et extraction depuis les logs kumod
+
+Une trace est un fichier JSONL, un événement (message) par ligne:
+    {"t": 12.345, "size": 20480, "domain": "gmail.com", "tenant": "StirTalk", "protocol": "smtp"}
+
+    t          décalage en secondes (ou horodatage epoch: la trace est ramenée à son premier événement)
+    size       taille du message en octets (défaut: 4KB)
+    domain     domaine destinataire (défaut: kumoload.test)
+    tenant     en-tête X-Tenant, optionnel (comme campaign pour X-Campaign)
+    protocol   smtp ou http (défaut: smtp); chaque script ne rejoue que les événements de son protocole
+
+Les événements sont triés par instant et numérotés 1..N: le numéro d'événement sert de numéro de
+message (jeton X-Test-ID, répartition entre processus). Les tailles sont regroupées par classes de
+±2.5% pour pré-rendre un corpus d'une entrée par classe.
+
+Le rejeu (ordonnanceur runner.run_trace_loop) déclenche chaque événement à l'instant
+début + t / vitesse: les instants sont absolus, un retard est rattrapé sans décaler la suite.
+
+Usage:
+    python3 -m kumoload.trace TRACE.jsonl                        description (débit de pointe, protocoles...)
+    python3 -m kumoload.trace --from-logs /var/log/kumomta -o TRACE.jsonl
+                                                                 extraction des Reception des logs kumod
+"""
+
+import sys
+import math
+import json
+import array
+import argparse
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from kumoload.corpus import format_size
+from kumoload.histogram import format_summary
+from kumoload.logs import iter_lines, list_segments, open_segment, parse_queue
+from kumoload.mix import CAMPAIGN_HEADER, TENANT_HEADER
+from kumoload.runner import TraceLoopStats
+
+PROTOCOLS = ("smtp", "http")
+DEFAULT_SIZE = 4096
+DEFAULT_DOMAIN = "kumoload.test"
+
+# Classes de tailles: rapport entre deux classes consécutives (précision ±2.5%)
+SIZE_CLASS_RATIO = 1.05
+
+# Protocole de réception des enregistrements kumod (reception_protocol)
+KUMOD_PROTOCOLS = {"ESMTP": "smtp", "SMTP": "smtp", "HTTP": "http"}
+
+
+def size_class(size: int) -> int:
+    return round(math.log(max(1, size)) / math.log(SIZE_CLASS_RATIO))
+
+
+class Trace:
+    """Événements triés par instant, en tableaux typés; valeurs textuelles internées"""
+
+    def __init__(self):
+        self.offsets = array.array("d")
+        self.sizes = array.array("q")
+        self.size_classes = array.array("I")
+        self.class_sizes: List[int] = []
+        self.domains = array.array("I")
+        self.tenants = array.array("I")
+        self.campaigns = array.array("I")
+        # Valeurs internées; "" = pas d'en-tête X-Tenant / X-Campaign
+        self.names: List[str] = []
+        self._name_index: Dict[str, int] = {}
+        self.protocol: Optional[str] = None
+        self.other_protocols = 0
+        self.invalid = 0
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def _intern(self, name: str) -> int:
+        index = self._name_index.get(name)
+        if index is None:
+            index = self._name_index[name] = len(self.names)
+            self.names.append(name)
+        return index
+
+    @classmethod
+    def load(cls, path: str, protocol: Optional[str] = None) -> "Trace":
+        """Charge une trace; avec `protocol`, les événements des autres protocoles sont écartés (comptés)"""
+        trace = cls()
+        trace.protocol = protocol
+        events = []
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    event = json.loads(line)
+                    offset = float(event["t"] if "t" in event else event["offset"])
+                    size = int(event.get("size") or DEFAULT_SIZE)
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    trace.invalid += 1
+                    continue
+                event_protocol = str(event.get("protocol") or "smtp").lower()
+                if event_protocol not in PROTOCOLS:
+                    trace.invalid += 1
+                    continue
+                if protocol is not None and event_protocol != protocol:
+                    trace.other_protocols += 1
+                    continue
+                events.append((offset, size, event.get("domain") or DEFAULT_DOMAIN,
+                               event.get("tenant") or "", event.get("campaign") or ""))
+        events.sort(key=lambda event: event[0])
+        first = events[0][0] if events else 0.0
+        classes: Dict[int, int] = {}
+        for offset, size, domain, tenant, campaign in events:
+            key = size_class(size)
+            index = classes.get(key)
+            if index is None:
+                index = classes[key] = len(trace.class_sizes)
+                trace.class_sizes.append(max(1, round(SIZE_CLASS_RATIO ** key)))
+            trace.offsets.append(offset - first)
+            trace.sizes.append(size)
+            trace.size_classes.append(index)
+            trace.domains.append(trace._intern(domain))
+            trace.tenants.append(trace._intern(tenant))
+            trace.campaigns.append(trace._intern(campaign))
+        return trace
+
+    # Accès par numéro de message (1..N)
+
+    def offset(self, message_num: int) -> float:
+        return self.offsets[message_num - 1]
+
+    def size_class_of(self, message_num: int) -> int:
+        return self.size_classes[message_num - 1]
+
+    def domain(self, message_num: int) -> str:
+        return self.names[self.domains[message_num - 1]]
+
+    def recipient(self, message_num: int) -> str:
+        return f"u{message_num}@{self.domain(message_num)}"
+
+    def headers(self, message_num: int) -> Dict[str, str]:
+        headers = {}
+        tenant, campaign = self.names[self.tenants[message_num - 1]], self.names[self.campaigns[message_num - 1]]
+        if tenant:
+            headers[TENANT_HEADER] = tenant
+        if campaign:
+            headers[CAMPAIGN_HEADER] = campaign
+        return headers
+
+    def queue_name(self, message_num: int) -> str:
+        """Nom de la queue planifiée kumod: [campagne:][tenant@]domaine"""
+        tenant, campaign = self.names[self.tenants[message_num - 1]], self.names[self.campaigns[message_num - 1]]
+        queue = f"{tenant}@{self.domain(message_num)}" if tenant else self.domain(message_num)
+        return f"{campaign}:{queue}" if campaign else queue
+
+    @property
+    def duration(self) -> float:
+        return self.offsets[-1] if self.offsets else 0.0
+
+    def peak_rate(self, window: float = 1.0) -> Tuple[float, float]:
+        """(débit maximal en événements/s sur une fenêtre de `window` s, décalage de cette fenêtre)"""
+        counts: Dict[int, int] = {}
+        for offset in self.offsets:
+            slot = int(offset // window)
+            counts[slot] = counts.get(slot, 0) + 1
+        if not counts:
+            return 0.0, 0.0
+        slot, count = max(counts.items(), key=lambda item: item[1])
+        return count / window, slot * window
+
+    def describe(self) -> str:
+        if not self.offsets:
+            return "aucun événement"
+        peak, at = self.peak_rate()
+        mean = len(self) / self.duration if self.duration else float(len(self))
+        domains = len({index for index in self.domains})
+        tenants = len({index for index in self.tenants if self.names[index]})
+        return (f"{len(self)} événements sur {self.duration:.1f} s (moyenne {mean:.1f}/s, pointe {peak:.0f}/s "
+                f"à t={at:g} s), {domains} domaines, {tenants} tenants, tailles de "
+                f"{format_size(min(self.sizes))} à {format_size(max(self.sizes))} "
+                f"({len(self.class_sizes)} classes)")
+
+# ============================================================================
+# RAPPORT DE REJEU
+# ============================================================================
+
+def format_replay_report(trace: Trace, timing: TraceLoopStats) -> str:
+    """Écart entre les instants d'envoi effectifs et ceux de la trace"""
+    expected = trace.duration / timing.speed
+    lines = [
+        f"  Événements rejoués:     {timing.scheduled} (vitesse x{timing.speed:g})",
+        f"  Durée prévue:           {expected:.2f} s (trace: {trace.duration:.2f} s)",
+        f"  Durée réelle:           {timing.duration:.2f} s (dernière réponse comprise)",
+    ]
+    if trace.other_protocols:
+        lines.append(f"  Autres protocoles:      {trace.other_protocols} événements écartés (non {trace.protocol})")
+    if trace.invalid:
+        lines.append(f"  Lignes invalides:       {trace.invalid}")
+    if not timing.lateness.count:
+        return "\n".join(lines)
+    lines.append("  Retard du départ effectif sur l'instant de la trace:")
+    lines.append(format_summary(timing.lateness, indent="    "))
+    for threshold in sorted(timing.late):
+        count = timing.late[threshold]
+        lines.append(f"  {f'En retard > {threshold:g} ms:':<24}{count} ({count * 100 / timing.lateness.count:.2f}%)")
+    return "\n".join(lines)
+
+# ============================================================================
+# EXTRACTION DEPUIS LES LOGS KUMOD
+# ============================================================================
+
+def iter_receptions(paths: Sequence[str]) -> Iterator[dict]:
+    """Événements de trace des enregistrements Reception (format JSON) des segments kumod"""
+    for path in list_segments(paths):
+        stream = open_segment(path)
+        try:
+            for line in iter_lines(stream):
+                if b'"Reception"' not in line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("type") != "Reception" or "timestamp" not in record:
+                    continue
+                campaign, tenant, domain = parse_queue(record.get("queue") or "")
+                event = {"t": float(record["timestamp"]), "size": int(record.get("size") or DEFAULT_SIZE),
+                         "domain": domain or DEFAULT_DOMAIN,
+                         "protocol": KUMOD_PROTOCOLS.get(str(record.get("reception_protocol")).upper(), "smtp")}
+                if tenant:
+                    event["tenant"] = tenant
+                if campaign:
+                    event["campaign"] = campaign
+                yield event
+        finally:
+            stream.close()
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Traces de trafic: description ou extraction depuis les logs kumod")
+    parser.add_argument("paths", nargs="+", help="Trace JSONL, ou segments/répertoires de logs avec --from-logs")
+    parser.add_argument("--from-logs", action="store_true",
+                        help="Extrait une trace des enregistrements Reception des logs kumod (configure_local_logs)")
+    parser.add_argument("-o", "--output", help="Trace extraite (défaut: sortie standard)")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.from_logs:
+            events = sorted(iter_receptions(args.paths), key=lambda event: event["t"])
+            out = open(args.output, "w") if args.output else sys.stdout
+            try:
+                first = events[0]["t"] if events else 0.0
+                for event in events:
+                    event["t"] = round(event["t"] - first, 6)
+                    out.write(json.dumps(event) + "\n")
+            finally:
+                if args.output:
+                    out.close()
+            print(f"✓ {len(events)} réceptions extraites" + (f": {args.output}" if args.output else ""),
+                  file=sys.stderr)
+            return 0
+        for path in args.paths:
+            for protocol in PROTOCOLS:
+                trace = Trace.load(path, protocol)
+                if len(trace):
+                    print(f"{path} [{protocol}]: {trace.describe()}")
+            if trace.invalid:
+                print(f"⚠ {path}: {trace.invalid} lignes invalides")
+    except (OSError, RuntimeError) as e:
+        print(f"✗ Erreur: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+Répartition d'un run sur plusieurs processus
+
+Chaque processus reçoit une tranche contiguë de l'espace des messages et sa part de la
+concurrence (threads, sessions, débit), exécute son propre moteur d'envoi et renvoie
+ses compteurs (RunStats.to_dict()) au processus principal pour fusion.
+"""
+
+import queue
+import signal
+import multiprocessing
+from typing import Any, Callable, List
+
+# Canal de progression du processus worker courant (rapport d'intervalle), None hors worker
+_progress_channel = None
+
+
+def shard_range(total: int, shards: int, index: int, start: int = 1) -> range:
+    """Tranche contiguë n°`index` (sur `shards`) de la plage [start, start + total)"""
+    base, extra = divmod(total, shards)
+    first = start + index * base + min(index, extra)
+    return range(first, first + base + (1 if index < extra else 0))
+
+
+def split_evenly(total: float, shards: int, index: int, minimum: int = 1):
+    """Part du worker `index` dans un total (concurrence, débit), au moins `minimum` si entier"""
+    if isinstance(total, float):
+        return total / shards
+    base, extra = divmod(total, shards)
+    return max(minimum, base + (1 if index < extra else 0))
+
+
+def process_context():
+    """Contexte multiprocessing: fork si disponible (le corpus pré-rendu est hérité), sinon spawn"""
+    method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+def progress_channel():
+    """Canal de progression transmis par run_in_processes (None dans le processus principal)"""
+    return _progress_channel
+
+
+def _worker_main(target, index: int, processes: int, results, progress):
+    global _progress_channel
+    # Le processus principal gère Ctrl+C et le nettoyage du port-forward:
+    # les workers ignorent SIGINT et reprennent le comportement par défaut pour SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    _progress_channel = progress
+    try:
+        results.put((index, target(index, processes), None))
+    except BaseException as e:
+        results.put((index, None, repr(e)))
+
+
+def run_in_processes(target: Callable[[int, int], Any], processes: int, progress=None) -> List[Any]:
+    """
+    Exécute target(index, processes) dans `processes` processus et retourne leurs résultats
+
+    Un processus par tranche (jamais deux tranches à la suite dans le même processus).
+    `progress` (optionnel) est transmis aux workers, ex. un canal contenant une process_context().Queue().
+    """
+    context = process_context()
+    results = context.Queue()
+    workers = [context.Process(target=_worker_main, args=(target, index, processes, results, progress), daemon=True)
+               for index in range(processes)]
+    for worker in workers:
+        worker.start()
+
+    collected = {}
+    while len(collected) < processes:
+        try:
+            index, value, error = results.get(timeout=1)
+        except queue.Empty:
+            dead = [w.pid for w in workers if w.exitcode not in (None, 0)]
+            if dead:
+                raise RuntimeError(f"Processus worker arrêté anormalement (PID {', '.join(map(str, dead))})")
+            continue
+        if error is not None:
+            raise RuntimeError(f"Processus worker {index}: {error}")
+        collected[index] = value
+    for worker in workers:
+        worker.join()
+    return [collected[index] for index in range(processes)]
@@ -4,86 +4,311 @@ Script de test de performance pour le listener HTTP de KumoMTA
 Ce script envoie plusieurs messages via l'API HTTP pour tester les queues, spools et générer des métriques
 
 Usage:
-    python3 test_performance_http.py [nombre_de_messages] [nombre_de_threads]
+    python3 test_performance_http.py [nombre_de_messages] [nombre_de_threads] [options]
     ou
     NUM_MESSAGES=100 MAX_THREADS=10 python3 test_performance_http.py
 
 Paramètres:
-    nombre_de_messages: Nombre de messages à envoyer (défaut: 50)
+    nombre_de_messages: Nombre de messages à envoyer (défaut: 50, sans limite avec --duration)
     nombre_de_threads: Nombre de threads pour la parallélisation (défaut: 5)
+
+Options:
+    --engine async: Moteur asyncio avec connexions keep-alive (défaut: threads)
+    --concurrency N: Nombre d'injections simultanées en mode async (défaut: 1000)
+    --pool-size N: Nombre de connexions keep-alive par endpoint (défaut: threads ou concurrency)
+    --batch-size N: Nombre de destinataires par requête, contenu partagé avec substitutions (défaut: 1)
+    --rate R: Boucle ouverte à R messages/s, latence mesurée depuis l'instant prévu (mode async)
+    --max-in-flight N: Plafond de requêtes en cours en boucle ouverte (défaut: 10000)
+    --ramp SPEC: Rampe de débits (ex. 1000:500:10000, 1000:x2:16000) jusqu'au dépassement d'un SLO (mode async)
+    --step-duration S: Durée de chaque palier de la rampe (défaut: 30)
+    --slo-p99 MS: SLO de latence P99 d'un palier (défaut: 500)
+    --slo-error-rate R: SLO de taux d'erreur d'un palier (défaut: 0.01)
+    --ramp-out FICHIER: Exporte les paliers et le coude en JSON
+    --local: Cible localhost:LOCAL_HTTP_PORT sans Kubernetes (ex. sink local: python3 -m kumoload.sink)
+    --endpoints SPEC: Injection directe sans port-forward: pods (IP des pods kumod), liste hôte[:port],... ou @fichier (mode async)
+    --endpoint-policy P: Répartition entre endpoints: round-robin ou least-loaded (défaut: round-robin)
+    --phases: Histogramme par phase (connect, envoi, premier octet, total) (mode async)
+    --corpus N: Pré-rend N messages avant le run (jeton unique inséré à l'envoi, sans copie en mode async)
+    --message-size SPEC: Distribution des tailles du corpus, ex. 4KB, 2KB-2MB, 2KB:70,2MB:30 (défaut: 4KB)
+    --stream SPEC: Gros messages générés à la volée et envoyés en HTTP chunked, ex. 1MB-50MB, débit en Mo/s (mode async)
+    --stream-chunk TAILLE: Taille des blocs HTTP chunked en streaming (défaut: 256KB)
+    --trace FICHIER: Rejoue une trace JSONL (instant, taille, domaine, tenant, protocole), voir kumoload.trace (mode async)
+    --trace-speed X: Vitesse du rejeu, 2 = deux fois plus vite que la trace (défaut: 1)
+    --schedule SPEC: Envois programmés (en-tête X-Schedule), ex. herd:10m, uniform:5m:30m; libération mesurée avec --metrics
+    --mix SPEC: Mix de trafic pondéré (modèles test_payload_*.json, X-Tenant, X-Campaign, N domaines Zipf), voir kumoload.mix
+    --duration D: Durée maximale du run (90s, 10m, 2h), le nombre de messages devient un plafond
+    --processes N: Répartit les messages sur N processus, compteurs et histogrammes fusionnés (défaut: 1)
+    --report-interval S: Rapport en direct (débit, erreurs, percentiles) toutes les S secondes (défaut: 1, 0 = jamais)
+    --timeseries FICHIER: Série temporelle des intervalles en JSONL (ou CSV si .csv)
+    --verbose: Affiche une ligne par message ou par requête (débogage)
+    --metrics: Relève les métriques kumod (queues, mémoire, connexions) pendant le run et jusqu'au vidage des queues
+    --metrics-url URL: Endpoint Prometheus (défaut: http://localhost:LOCAL_METRICS_PORT/metrics)
+    --drain-timeout S: Attente maximale du vidage des queues après l'injection (défaut: 300)
+    --metrics-out FICHIER: Relevés alignés sur l'injection en JSONL (ou CSV si .csv)
+    --e2e-log FICHIER: Enregistre l'instant d'acceptation de chaque jeton X-Test-ID (JSONL)
+    --deliveries FICHIER: Livraisons (journal du sink ou logs kumod) à joindre: latence de bout en bout par queue
+    --histogram-out FICHIER: Exporte l'histogramme des latences en JSON (fusionnable)
+    --records FICHIER: Détail par message en colonnes typées, vidé par blocs (python3 -m kumoload.records)
+    --result-json FICHIER: Exporte le résultat du run en JSON structuré (python3 -m kumoload.sweep)
 """
 
 import os
 import sys
 import json
 import time
+import asyncio
+import argparse
+import functools
 import random
-import subprocess
 import signal
-import statistics
 import threading
 from datetime import datetime
-from typing import List, Tuple, Optional
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-# Vérifier et installer les dépendances
-def setup_environment():
-    """Configure l'environnement virtuel et installe les dépendances"""
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    venv_dir = os.path.join(script_dir, '.venv')
-    requirements_file = os.path.join(script_dir, 'requirements.txt')
-    
-    # Vérifier si on est déjà dans un venv
-    in_venv = hasattr(sys, 'real_prefix') or (hasattr(sys, 'base_prefix') and sys.base_prefix != sys.prefix)
-    
-    if not in_venv:
-        # Créer un venv si nécessaire
-        if not os.path.exists(venv_dir):
-            print("⏳ Création de l'environnement virtuel...")
-            subprocess.run([sys.executable, '-m', 'venv', venv_dir], check=True)
-            print("✓ Environnement virtuel créé")
-        
-        # Activer le venv
-        if sys.platform == 'win32':
-            python_exe = os.path.join(venv_dir, 'Scripts', 'python.exe')
-        else:
-            python_exe = os.path.join(venv_dir, 'bin', 'python')
-        
-        # Réexécuter le script avec le Python du venv
-        if os.path.exists(python_exe) and sys.executable != python_exe:
-            print("⏳ Activation de l'environnement virtuel...")
-            os.execv(python_exe, [python_exe] + sys.argv)
-            return  # Ne revient jamais ici car execv remplace le processus
-        elif not os.path.exists(python_exe):
-            print("⚠ Impossible de trouver le Python du venv, utilisation du Python système")
-    
-    # Installer les dépendances
-    if os.path.exists(requirements_file):
-        print("⏳ Vérification des dépendances...")
-        try:
-            import requests
-            print("✓ Dépendances déjà installées")
-        except ImportError:
-            print("⏳ Installation des dépendances...")
-            pip_cmd = [sys.executable, '-m', 'pip', 'install', '-q', '-r', requirements_file]
-            subprocess.run(pip_cmd, check=True)
-            print("✓ Dépendances installées")
+from typing import List, Sequence, Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+from kumoload.k8s import cleanup_port_forwards, require_service, setup_environment, setup_port_forward
 
 # Appeler setup_environment avant les imports
-setup_environment()
+setup_environment(__file__, requirements='requirements.txt', module='requests')
 
 # Imports après vérification de l'environnement
 import requests
-from requests.auth import HTTPBasicAuth
+from requests.adapters import HTTPAdapter
+
+from kumoload.http_async import HTTPConnectionPool, basic_auth_header, post_with_timing, request_with_timing
+from kumoload.corpus import Corpus, CorpusEntry, format_size, make_token
+from kumoload.stream import MessageStream
+from kumoload.schedule import SendSchedule, format_release, parse_duration, release_record
+from kumoload.endpoints import (DEFAULT_POD_SELECTOR, POLICIES, Endpoint, EndpointPools, EndpointStats,
+                                check_endpoints, resolve_endpoints)
+from kumoload.phases import HTTP_PHASES, PhaseTimings
+from kumoload.e2e import AcceptanceLog, DeliveryReader, EndToEndCollector
+from kumoload.records import DEFAULT_SPILL_ROWS, SHARED_APPEND, MessageRecords, truncate as truncate_records
+from kumoload.histogram import format_summary
+from kumoload.metrics import MetricsScraper
+from kumoload.mix import TALLY_SAMPLES, MixTally, TrafficMix
+from kumoload.ramp import SaturationFinder, parse_ramp
+from kumoload.runner import (UNBOUNDED_MESSAGES, RunLimit, TraceLoopStats, run_bounded, run_closed_loop, run_open_loop,
+                             run_trace_loop, raise_nofile_limit)
+from kumoload.reporter import CounterRegistry, IntervalPublisher, LiveReporter, ProgressChannel
+from kumoload.stats import RunStats, run_record
+from kumoload.trace import Trace, format_replay_report
+from kumoload.workers import process_context, progress_channel, run_in_processes, shard_range, split_evenly
 
 # ============================================================================
 # CONFIGURATION
 # ============================================================================
 
+def parse_args() -> argparse.Namespace:
+    """Lit les arguments de la ligne de commande (les variables d'environnement restent prioritaires)"""
+    parser = argparse.ArgumentParser(description="Test de performance du listener HTTP KumoMTA")
+    parser.add_argument('num_messages', nargs='?', type=int,
+                        help="Nombre de messages à envoyer (défaut: 50, sans limite avec --duration)")
+    parser.add_argument('num_threads', nargs='?', type=int, default=5,
+                        help="Nombre de threads pour la parallélisation (défaut: 5)")
+    parser.add_argument('--engine', choices=['threads', 'async'], default=os.getenv('HTTP_ENGINE', 'threads'),
+                        help="Moteur d'envoi: threads (requests.Session) ou async (asyncio, keep-alive)")
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('HTTP_CONCURRENCY', 1000)),
+                        help="Nombre d'injections simultanées en mode async (défaut: 1000)")
+    parser.add_argument('--pool-size', type=int, default=int(os.getenv('HTTP_POOL_SIZE', 0)),
+                        help="Nombre de connexions keep-alive par endpoint (défaut: nombre de threads ou concurrency)")
+    parser.add_argument('--batch-size', type=int, default=int(os.getenv('HTTP_BATCH_SIZE', 1)),
+                        help="Nombre de destinataires par requête avec contenu template partagé (défaut: 1)")
+    parser.add_argument('--rate', type=float, default=float(os.getenv('RATE', 0)),
+                        help="Boucle ouverte: débit cible en messages/s, indépendant des réponses (mode async)")
+    parser.add_argument('--max-in-flight', type=int, default=int(os.getenv('MAX_IN_FLIGHT', 10000)),
+                        help="Plafond de requêtes en cours en boucle ouverte (défaut: 10000)")
+    parser.add_argument('--ramp', type=parse_ramp, default=os.getenv('RAMP'),
+                        help="Recherche du point de saturation: paliers de débit début:pas:fin (1000:500:10000), "
+                             "début:xfacteur:fin ou liste, jusqu'au dépassement d'un SLO (mode async)")
+    parser.add_argument('--step-duration', type=float, default=float(os.getenv('RAMP_STEP_DURATION', 30)),
+                        help="Durée de chaque palier de la rampe en secondes (défaut: 30)")
+    parser.add_argument('--slo-p99', type=float, default=float(os.getenv('SLO_P99_MS', 500)),
+                        help="SLO de la rampe: latence P99 maximale d'un palier en ms (défaut: 500)")
+    parser.add_argument('--slo-error-rate', type=float, default=float(os.getenv('SLO_ERROR_RATE', 0.01)),
+                        help="SLO de la rampe: taux d'erreur maximal d'un palier (défaut: 0.01)")
+    parser.add_argument('--ramp-out', default=os.getenv('RAMP_OUT'),
+                        help="Exporte les paliers de la rampe et le coude en JSON")
+    parser.add_argument('--local', action='store_true', default=os.getenv('LOCAL_TARGET') == '1',
+                        help="Cible localhost:LOCAL_HTTP_PORT sans kubectl ni port-forward (ex. python3 -m kumoload.sink)")
+    parser.add_argument('--endpoints', default=os.getenv('ENDPOINTS'),
+                        help="Injection directe sans port-forward: 'pods' (IP des pods kumod via kubectl), "
+                             "liste hôte[:port],... ou @fichier, un pool de connexions par endpoint (mode async)")
+    parser.add_argument('--endpoint-policy', choices=POLICIES, default=os.getenv('ENDPOINT_POLICY', 'round-robin'),
+                        help="Répartition des requêtes entre endpoints: round-robin (parts égales) ou least-loaded "
+                             "(moins de requêtes en cours)")
+    parser.add_argument('--phases', action='store_true', default=os.getenv('PHASE_TIMINGS') == '1',
+                        help="Histogramme de latence par phase (connect, envoi, premier octet, total) pour situer un ralentissement "
+                             "(réseau, hooks Lua, spool), mode async")
+    parser.add_argument('--corpus', type=int, default=int(os.getenv('CORPUS_SIZE', 0)),
+                        help="Pré-rend N messages avant le run, seul un jeton unique est inséré à l'envoi (défaut: 0, désactivé)")
+    parser.add_argument('--message-size', default=os.getenv('MESSAGE_SIZE', '4KB'),
+                        help="Distribution des tailles du corpus: 4KB, 2KB-2MB ou 2KB:70,50KB:25,2MB:5 (défaut: 4KB)")
+    parser.add_argument('--stream', default=os.getenv('STREAM_SIZES'),
+                        help="Gros messages (ex. 1MB-50MB, 1MB:80,50MB:20) générés par blocs pendant l'envoi, sans les "
+                             "garder en mémoire: sollicite le spool de kumod, débit rapporté en Mo/s (mode async)")
+    parser.add_argument('--stream-chunk', default=os.getenv('STREAM_CHUNK', '256KB'),
+                        help="Taille des blocs envoyés en streaming (Transfer-Encoding: chunked, défaut: 256KB)")
+    parser.add_argument('--trace', default=os.getenv('TRACE'),
+                        help="Rejoue une trace JSONL de production (t, size, domain, tenant, protocol): événements HTTP, "
+                             "à leurs instants (mode async)")
+    parser.add_argument('--trace-speed', type=float, default=float(os.getenv('TRACE_SPEED', 1)),
+                        help="Vitesse du rejeu de la trace: 1 = temps réel, 2 = deux fois plus vite (défaut: 1)")
+    parser.add_argument('--schedule', default=os.getenv('SCHEDULE_SPEC'),
+                        help="Envois programmés: échéance X-Schedule tirée de herd:10m[:60s], uniform:5m:30m, "
+                             "normal:20m:5m ou exp:10m (depuis le début du run, une par requête); libération mesurée "
+                             "avec --metrics")
+    parser.add_argument('--mix', default=os.getenv('TRAFFIC_MIX'),
+                        help="Mix de trafic: fichier JSON ou spécification en ligne, ex. templates=generic:50,gmail.com:50;"
+                             "tenants=StirTalk:30,default-tenant:70;campaigns=20;domains=10000;zipf=1.1")
+    parser.add_argument('--duration', default=os.getenv('DURATION'),
+                        help="Durée maximale du run (90s, 10m, 2h): arrêt à l'échéance ou au nombre de messages")
+    parser.add_argument('--processes', type=int, default=int(os.getenv('PROCESSES', 1)),
+                        help="Répartit les messages sur N processus (threads, connexions et débit partagés entre eux)")
+    parser.add_argument('--report-interval', type=float, default=float(os.getenv('REPORT_INTERVAL', 1)),
+                        help="Affiche débit, taux d'erreur et percentiles toutes les N secondes, 0 = jamais (défaut: 1)")
+    parser.add_argument('--timeseries', default=os.getenv('TIMESERIES_OUT'),
+                        help="Écrit la série temporelle des intervalles (JSONL, ou CSV si le fichier finit par .csv)")
+    parser.add_argument('--verbose', action='store_true', default=os.getenv('VERBOSE') == '1',
+                        help="Affiche une ligne par message ou par requête (débogage, ralentit les gros runs)")
+    parser.add_argument('--metrics', action='store_true', default=os.getenv('METRICS_SCRAPE') == '1',
+                        help="Relève les métriques Prometheus de kumod pendant le run et jusqu'au vidage des queues")
+    parser.add_argument('--metrics-url', default=os.getenv('METRICS_URL'),
+                        help="Endpoint des métriques (défaut: http://localhost:LOCAL_METRICS_PORT/metrics)")
+    parser.add_argument('--metrics-interval', type=float, default=float(os.getenv('METRICS_INTERVAL', 1)),
+                        help="Intervalle entre deux relevés en secondes (défaut: 1)")
+    parser.add_argument('--drain-timeout', type=float, default=float(os.getenv('DRAIN_TIMEOUT', 300)),
+                        help="Attente maximale du vidage des queues après l'injection, 0 = pas d'attente (défaut: 300)")
+    parser.add_argument('--metrics-out', default=os.getenv('METRICS_OUT'),
+                        help="Exporte les relevés alignés sur l'injection (JSONL, ou CSV si le fichier finit par .csv)")
+    parser.add_argument('--e2e-log', default=os.getenv('E2E_LOG'),
+                        help="Enregistre l'instant d'acceptation de chaque jeton X-Test-ID en JSONL (python3 -m kumoload.e2e)")
+    parser.add_argument('--deliveries', action='append',
+                        default=[path for path in os.getenv('E2E_DELIVERIES', '').split(',') if path],
+                        help="Livraisons à joindre aux acceptations (journal du sink --delivery-log ou logs kumod), répétable")
+    parser.add_argument('--e2e-wait', type=float, default=float(os.getenv('E2E_WAIT', 30)),
+                        help="Attente maximale des livraisons après le run en secondes (défaut: 30)")
+    parser.add_argument('--e2e-histogram-out', default=os.getenv('E2E_HISTOGRAM_OUT'),
+                        help="Exporte les histogrammes de bout en bout par queue en JSON")
+    parser.add_argument('--records', default=os.getenv('RECORDS'),
+                        help="Détail par message (statut, code, latence, erreur) en fichier colonnaire (python3 -m kumoload.records)")
+    parser.add_argument('--records-spill', type=int, default=int(os.getenv('RECORDS_SPILL', DEFAULT_SPILL_ROWS)),
+                        help=f"Lignes gardées en mémoire avant l'écriture d'un bloc dans --records (défaut: {DEFAULT_SPILL_ROWS})")
+    parser.add_argument('--histogram-out', default=os.getenv('HISTOGRAM_OUT'),
+                        help="Exporte l'histogramme des latences en JSON (fusionnable avec python3 -m kumoload.histogram)")
+    parser.add_argument('--result-json', default=os.getenv('RESULT_JSON'),
+                        help="Exporte le résultat du run (configuration, débit, percentiles) en JSON structuré")
+    parser.add_argument('--histogram-digits', type=int, default=int(os.getenv('HISTOGRAM_DIGITS', 3)),
+                        help="Précision de l'histogramme en chiffres significatifs, 1 à 5 (défaut: 3)")
+    return parser.parse_args()
+
+ARGS = parse_args()
+
 # Nombre de messages à envoyer (par défaut: 50)
 # Usage: python3 test_performance_http.py [nombre_de_messages] [nombre_de_threads]
-NUM_MESSAGES = int(os.getenv('NUM_MESSAGES', sys.argv[1] if len(sys.argv) > 1 else 50))
-MAX_THREADS = int(os.getenv('MAX_THREADS', sys.argv[2] if len(sys.argv) > 2 else 5))
+NUM_MESSAGES = int(os.getenv('NUM_MESSAGES', ARGS.num_messages if ARGS.num_messages is not None else 50))
+MAX_THREADS = int(os.getenv('MAX_THREADS', ARGS.num_threads))
+
+# Moteur d'envoi et taille du pool de connexions keep-alive
+ENGINE = ARGS.engine
+HTTP_CONCURRENCY = ARGS.concurrency
+HTTP_POOL_SIZE = ARGS.pool_size or (HTTP_CONCURRENCY if ENGINE == 'async' else MAX_THREADS)
+
+# Mode lot: N destinataires par requête (1 = un message formaté par requête)
+HTTP_BATCH_SIZE = max(1, ARGS.batch_size)
+
+# Recherche du point de saturation: paliers de débit en boucle ouverte jusqu'au dépassement d'un SLO
+# (chaque palier couvre des lots entiers de HTTP_BATCH_SIZE destinataires)
+RAMP = (SaturationFinder(ARGS.ramp, ARGS.step_duration, ARGS.slo_p99, ARGS.slo_error_rate, HTTP_BATCH_SIZE)
+        if ARGS.ramp else None)
+RAMP_OUT = ARGS.ramp_out
+if RAMP is not None:
+    # Messages de tous les paliers (la rampe s'arrête au premier palier hors SLO)
+    NUM_MESSAGES = RAMP.total_messages
+# Durée maximale du run: sans nombre de messages explicite, seule l'échéance arrête l'injection
+try:
+    DURATION = parse_duration(ARGS.duration) if ARGS.duration else 0.0
+except ValueError as e:
+    sys.exit(f"✗ Erreur: {e}")
+if DURATION > 0 and ((ARGS.num_messages is None and 'NUM_MESSAGES' not in os.environ) or NUM_MESSAGES <= 0):
+    NUM_MESSAGES = UNBOUNDED_MESSAGES
+NUM_BATCHES = (NUM_MESSAGES + HTTP_BATCH_SIZE - 1) // HTTP_BATCH_SIZE
+
+# Boucle ouverte (débit constant) si RATE > 0
+RATE = ARGS.rate
+MAX_IN_FLIGHT = ARGS.max_in_flight
+
+# Cible locale (sink kumoload ou kumod hors cluster): pas de kubectl ni de port-forward
+LOCAL_TARGET = ARGS.local
+
+# Corpus de messages pré-rendus (0 = payload construit à chaque envoi)
+CORPUS_SIZE = ARGS.corpus
+MESSAGE_SIZE = ARGS.message_size
+
+# Gros messages générés bloc par bloc pendant l'envoi (None = corpus ou payload construit à chaque envoi)
+try:
+    STREAM = MessageStream.from_spec(ARGS.stream, ARGS.stream_chunk) if ARGS.stream else None
+except ValueError as e:
+    sys.exit(f"✗ Erreur: {e}")
+
+# Envois programmés: échéance X-Schedule de chaque requête (instant de référence fixé dans main)
+try:
+    SCHEDULE = SendSchedule(ARGS.schedule) if ARGS.schedule else None
+except ValueError as e:
+    sys.exit(f"✗ Erreur: {e}")
+
+# Mix de trafic: modèles de payload, tenants, campagnes et domaines pondérés (None = 3 domaines fixes);
+# les destinataires d'un lot partagent modèle, tenant et campagne (contenu commun)
+try:
+    MIX = TrafficMix.from_spec(ARGS.mix, HTTP_BATCH_SIZE) if ARGS.mix else None
+except (OSError, ValueError) as e:
+    sys.exit(f"✗ Erreur: {e}")
+
+# Rejeu d'une trace de production: chaque événement HTTP est un message (taille, domaine, tenant, instant)
+try:
+    TRACE = Trace.load(ARGS.trace, 'http') if ARGS.trace else None
+except OSError as e:
+    sys.exit(f"✗ Erreur: {e}")
+TRACE_SPEED = ARGS.trace_speed
+# Délai avant le premier événement avec --processes (démarrage des processus workers)
+TRACE_START_DELAY = 1.0
+if TRACE is not None:
+    # Un message par requête (--batch-size 1 exigé dans main)
+    NUM_MESSAGES = NUM_BATCHES = len(TRACE)
+    # Corpus pré-rendu d'une entrée par classe de tailles de la trace
+    CORPUS_SIZE = len(TRACE.class_sizes)
+
+# Nombre de processus workers (chacun avec sa boucle asyncio ou son pool de threads)
+PROCESSES = max(1, ARGS.processes)
+
+# Rapport d'intervalle en direct, série temporelle et affichage par message (débogage)
+REPORT_INTERVAL = ARGS.report_interval
+TIMESERIES_OUT = ARGS.timeseries
+VERBOSE = ARGS.verbose
+
+# Relevé des métriques kumod (endpoint /metrics du listener HTTP) et attente du vidage des queues
+METRICS_SCRAPE = ARGS.metrics or bool(ARGS.metrics_url)
+METRICS_INTERVAL = ARGS.metrics_interval
+DRAIN_TIMEOUT = ARGS.drain_timeout
+METRICS_OUT = ARGS.metrics_out
+
+# Latence de bout en bout: acceptations (jeton X-Test-ID) jointes aux livraisons
+E2E_LOG = ARGS.e2e_log
+E2E_DELIVERIES = ARGS.deliveries
+E2E_WAIT = ARGS.e2e_wait
+E2E_HISTOGRAM_OUT = ARGS.e2e_histogram_out
+E2E_ENABLED = bool(E2E_LOG or E2E_DELIVERIES)
+
+# Histogramme des latences (mémoire constante) et export JSON optionnel
+HISTOGRAM_OUT = ARGS.histogram_out
+
+# Détail par message (colonnes typées, vidées par blocs de RECORDS_SPILL lignes dans RECORDS)
+RECORDS = ARGS.records
+RECORDS_SPILL = ARGS.records_spill
+HISTOGRAM_DIGITS = ARGS.histogram_digits
+
+# Résultat structuré du run (campagnes de mesures: python3 -m kumoload.sweep)
+RESULT_JSON = ARGS.result_json
 
 # Configuration Kubernetes par défaut
 NAMESPACE = os.getenv('NAMESPACE', 'kumomta')
@@ -92,146 +317,97 @@ SERVICE_NAME = os.getenv('SERVICE_NAME', RELEASE_NAME)
 HTTP_PORT = int(os.getenv('HTTP_PORT', 8000))
 LOCAL_HTTP_PORT = int(os.getenv('LOCAL_HTTP_PORT', 8000))
 
+# Métriques kumod: servies par le listener HTTP (même port-forward que l'injection par défaut)
+LOCAL_METRICS_PORT = int(os.getenv('LOCAL_METRICS_PORT', LOCAL_HTTP_PORT))
+METRICS_URL = ARGS.metrics_url or f"http://localhost:{LOCAL_METRICS_PORT}/metrics"
+
 # Authentification HTTP
 HTTP_USER = os.getenv('HTTP_USER', 'user1')
 HTTP_PASSWORD = os.getenv('HTTP_PASSWORD', 'default-password')
 
-# Domaines pour générer les adresses destinataires
+# Injection directe vers les pods kumod (ou une liste d'endpoints), résolue dans main
+POD_SELECTOR = os.getenv('POD_SELECTOR', DEFAULT_POD_SELECTOR)
+ENDPOINT_POLICY = ARGS.endpoint_policy
+ENDPOINTS: Optional[List[Endpoint]] = None
+
+# Décomposition de la latence par phase du protocole (--phases)
+PHASES_ENABLED = ARGS.phases
+
+# Domaines pour générer les adresses destinataires (sans --mix)
 DOMAINS = ['gmail.com', 'yahoo.com', 'hotmail.com']
 
-# Variables globales pour le port-forward
-port_forward_process = None
-use_existing_pf = False
+# Chemin de l'API d'injection
+INJECT_PATH = "/api/inject/v1"
+
+# Session HTTP keep-alive partagée par les threads (créée dans main)
+http_session: Optional[requests.Session] = None
 
-# Lock pour thread-safety des statistiques
+# Lock pour l'affichage par message (--verbose uniquement)
 stats_lock = threading.Lock()
 
+# Corpus pré-rendu (créé avant le run, hérité par les processus workers)
+corpus: Optional[Corpus] = None
+
+# Acceptations du processus courant (--e2e-log, --deliveries)
+acceptance: Optional[AcceptanceLog] = None
+
+# Détail par message du processus courant (--records)
+message_records: Optional[MessageRecords] = None
+
+# Fin anticipée du run (--duration, Ctrl+C): créée par main avant le fork des processus workers
+run_limit = RunLimit()
+
+# Plages effectivement envoyées par chaque moteur (début de chaque tranche si le run a été écourté)
+sent_items: List[range] = []
+
+# Répartition effective du mix de trafic (calculée une fois après le run)
+mix_counts: Optional[MixTally] = None
+
+# Précision du rejeu de la trace dans le processus courant (--trace)
+trace_timing: Optional[TraceLoopStats] = None
+
+# Débit et latence par endpoint dans le processus courant (--endpoints)
+endpoint_stats: Optional[EndpointStats] = None
+
+# Histogrammes par phase dans le processus courant (--phases)
+phase_timings: Optional[PhaseTimings] = None
+
 # ============================================================================
 # FONCTIONS UTILITAIRES
 # ============================================================================
 
-def generate_random_email() -> str:
-    """Génère une adresse email aléatoire sur un des domaines spécifiés"""
+def generate_random_email(message_num: int) -> str:
+    """Génère l'adresse destinataire d'un message: tirée du mix, sinon aléatoire sur un des domaines spécifiés"""
+    if TRACE is not None:
+        return TRACE.recipient(message_num)
+    if MIX is not None:
+        return MIX.recipient(message_num)
     domain = random.choice(DOMAINS)
     username = f"test{int(time.time())}{random.randint(1000, 9999)}"
     return f"{username}@{domain}"
 
-def check_kubectl() -> bool:
-    """Vérifie que kubectl est disponible"""
-    try:
-        subprocess.run(['kubectl', 'version', '--client'], 
-                      capture_output=True, check=True)
-        return True
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        return False
-
-def find_service(namespace: str, release_name: str) -> Optional[str]:
-    """Trouve le service Kubernetes"""
-    try:
-        # Essayer d'abord avec le nom exact
-        result = subprocess.run(
-            ['kubectl', 'get', 'service', SERVICE_NAME, '-n', namespace],
-            capture_output=True, text=True
-        )
-        if result.returncode == 0:
-            return SERVICE_NAME
-        
-        # Chercher automatiquement
-        result = subprocess.run(
-            ['kubectl', 'get', 'services', '-n', namespace, '-o', 'jsonpath={.items[*].metadata.name}'],
-            capture_output=True, text=True
-        )
-        if result.returncode == 0:
-            services = result.stdout.strip().split()
-            for svc in services:
-                if svc == release_name or svc == f"{release_name}-kumomta":
-                    return svc
-    except Exception:
-        pass
-    return None
-
-def check_port_in_use(port: int) -> Tuple[bool, Optional[int], bool]:
-    """Vérifie si le port est utilisé et si c'est un port-forward kubectl"""
-    try:
-        result = subprocess.run(
-            ['lsof', '-ti', f':{port}'],
-            capture_output=True, text=True
-        )
-        if result.returncode == 0:
-            pid = int(result.stdout.strip().split()[0])
-            # Vérifier si c'est un port-forward kubectl
-            ps_result = subprocess.run(
-                ['ps', '-p', str(pid), '-o', 'command='],
-                capture_output=True, text=True
-            )
-            is_kubectl_pf = 'kubectl' in ps_result.stdout and 'port-forward' in ps_result.stdout
-            return True, pid, is_kubectl_pf
-    except Exception:
-        pass
-    return False, None, False
-
-def setup_port_forward(namespace: str, service: str, local_port: int, remote_port: int) -> Optional[subprocess.Popen]:
-    """Configure le port-forward Kubernetes"""
-    global use_existing_pf, port_forward_process
-    
-    # Vérifier si le port est déjà utilisé
-    in_use, pid, is_kubectl = check_port_in_use(local_port)
-    
-    if in_use and is_kubectl:
-        print(f"✓ Réutilisation du port-forward existant (PID: {pid})")
-        use_existing_pf = True
-        port_forward_process = None  # On ne gère pas ce processus
-        return None
-    elif in_use:
-        response = input(f"⚠ Le port {local_port} est utilisé par un autre processus (PID: {pid}). Voulez-vous le tuer? (y/N): ")
-        if response.lower() == 'y':
-            try:
-                os.kill(pid, signal.SIGTERM)
-                time.sleep(1)
-                print(f"✓ Ancien processus arrêté")
-            except Exception as e:
-                print(f"✗ Erreur lors de l'arrêt du processus: {e}")
-                return None
-        else:
-            print("Test annulé. Utilisez un autre port avec: LOCAL_HTTP_PORT=<autre-port>")
-            sys.exit(0)
-    
-    # Démarrer le port-forward
-    print(f"⏳ Démarrage du port-forward (port {local_port})...")
-    try:
-        process = subprocess.Popen(
-            ['kubectl', 'port-forward', '-n', namespace, f'service/{service}', f'{local_port}:{remote_port}'],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        time.sleep(3)  # Attendre que le port-forward soit prêt
-        
-        # Vérifier que le processus est toujours actif
-        if process.poll() is None:
-            print(f"✓ Port-forward actif (PID: {process.pid})")
-            return process
-        else:
-            stdout, stderr = process.communicate()
-            print(f"✗ Le port-forward a échoué")
-            print(f"  Erreur: {stderr.decode()}")
-            return None
-    except Exception as e:
-        print(f"✗ Erreur lors du démarrage du port-forward: {e}")
-        return None
+def create_http_session(pool_size: int) -> requests.Session:
+    """Crée une session keep-alive partagée par les threads, avec l'en-tête d'authentification pré-calculé"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'Authorization': basic_auth_header(HTTP_USER, HTTP_PASSWORD),
+        'Content-Type': 'application/json',
+    })
+    return session
 
-def cleanup_port_forward():
-    """Nettoie le port-forward"""
-    global port_forward_process, use_existing_pf
-    if not use_existing_pf and port_forward_process:
-        print("\n⏳ Nettoyage du port-forward...")
-        try:
-            port_forward_process.terminate()
-            port_forward_process.wait(timeout=5)
-        except Exception:
-            port_forward_process.kill()
-
-def send_http_message(message_num: int, to_email: str) -> Tuple[bool, float, Optional[str]]:
-    """Envoie un message via l'API HTTP et retourne (succès, temps_ms, erreur)"""
+def build_http_payload(message_num: int, to_email: str) -> dict:
+    """Construit le payload JSON d'injection (modèle de payload tiré avec --mix)"""
+    if MIX is not None:
+        draw = MIX.draw(message_num)
+        return {
+            "envelope_sender": draw.template.from_email,
+            "content": draw.template.content(make_token(message_num).decode('ascii'),
+                                             {**draw.headers, **schedule_headers(message_num)},
+                                             timestamp=datetime.now().strftime('%Y%m%d-%H%M%S')),
+            "recipients": [{"email": to_email}]
+        }
     from_email = "perf-test@talk.stir.com"
     from_name = "Performance Test"
     subject = f"Performance Test #{message_num} - {datetime.now().strftime('%Y%m%d-%H%M%S')}"
@@ -254,7 +430,8 @@ Mode: SINK (messages will not be delivered)"""
                 "email": from_email,
                 "name": from_name
             },
-            "subject": subject
+            "subject": subject,
+            "headers": {"X-Test-ID": make_token(message_num).decode('ascii'), **schedule_headers(message_num)}
         },
         "recipients": [
             {
@@ -262,18 +439,184 @@ Mode: SINK (messages will not be delivered)"""
             }
         ]
     }
+    return payload
+
+def schedule_headers(message_num: int) -> dict:
+    """En-tête X-Schedule du message, ou du lot dont il est le premier (--schedule), vide sinon"""
+    return SCHEDULE.headers(message_num) if SCHEDULE is not None else {}
+
+def schedule_payload_line(message_num: int) -> bytes:
+    """En-tête X-Schedule placé devant le MIME pré-rendu ou généré (chaîne JSON échappée)"""
+    if SCHEDULE is None:
+        return b""
+    lines = "".join(f"{name}: {value}\r\n" for name, value in schedule_headers(message_num).items())
+    return json.dumps(lines)[1:-1].encode('utf-8')
+
+# Contenu partagé par tous les destinataires d'un lot: kumod applique les substitutions
+# (globales et par destinataire) au template, le driver n'a plus à formater chaque corps
+FROM_EMAIL = "perf-test@talk.stir.com"
+FROM_NAME = "Performance Test"
+CONTENT_TEMPLATE = {
+    "text_body": """Performance test message #{{ message_num }}
+
+This is a performance test message sent via HTTP API (batch #{{ batch_num }}).
+Timestamp: {{ timestamp }}
+Message ID: {{ message_num }}
+Recipient: {{ recipient }}
+
+This message is used to test queues, spools and generate metrics.
+Mode: SINK (messages will not be delivered)""",
+    "from": {
+        "email": FROM_EMAIL,
+        "name": FROM_NAME
+    },
+    "subject": "Performance Test #{{ message_num }} - {{ run_id }}",
+    "headers": {"X-Test-ID": "{{ test_id }}"}
+}
+RUN_ID = datetime.now().strftime('%Y%m%d-%H%M%S')
+
+def get_corpus() -> Corpus:
+    """Rend le corpus une seule fois par processus (avant le fork des workers dans main)"""
+    global corpus
+    if corpus is None:
+        corpus = Corpus(CORPUS_SIZE, MESSAGE_SIZE, 'http', from_header=f"{FROM_NAME} <{FROM_EMAIL}>",
+                        sizes=TRACE.class_sizes if TRACE is not None else None)
+    return corpus
+
+def corpus_entry(message_num: int) -> CorpusEntry:
+    """Entrée du corpus d'un message: classe de taille de l'événement (--trace), sinon rotation sur le corpus"""
+    if TRACE is not None:
+        return get_corpus().entries[TRACE.size_class_of(message_num)]
+    return get_corpus().entry(message_num)
+
+CORPUS_PAYLOAD_HEAD = f'{{"envelope_sender": "{FROM_EMAIL}", "content": "'.encode('utf-8')
+
+@functools.lru_cache(maxsize=None)
+def extra_payload_head(envelope_sender: str, headers: Tuple[Tuple[str, str], ...]) -> bytes:
+    """Début du payload corpus avec expéditeur et en-têtes X-Tenant/X-Campaign (--mix, --trace)
+    placés devant le MIME pré-rendu (chaîne JSON échappée)"""
+    lines = "".join(f"{name}: {value}\r\n" for name, value in headers)
+    return (f'{{"envelope_sender": {json.dumps(envelope_sender)}, "content": "'
+            f'{json.dumps(lines)[1:-1]}').encode('utf-8')
+
+def build_corpus_body(message_num: int, to_emails: List[str]) -> list:
+    """Segments du payload JSON: MIME pré-rendu (jeton inséré) + liste des destinataires"""
+    entry = corpus_entry(message_num)
+    recipients = json.dumps([{"email": to_email} for to_email in to_emails]).encode('utf-8')
+    if TRACE is not None:
+        head = extra_payload_head(FROM_EMAIL, tuple(TRACE.headers(message_num).items()))
+    elif MIX is not None:
+        draw = MIX.draw(message_num)
+        head = extra_payload_head(draw.template.from_email, tuple(draw.headers.items()))
+    else:
+        head = CORPUS_PAYLOAD_HEAD
+    if SCHEDULE is not None:
+        head += schedule_payload_line(message_num)
+    return [head, *entry.json.segments(make_token(message_num)),
+            b'", "recipients": ' + recipients + b'}']
+
+def build_stream_body(message_num: int, to_emails: List[str]):
+    """Payload JSON généré bloc par bloc (--stream): jeton et en-têtes du mix en tête, taille tirée pour ce message"""
+    recipients = json.dumps([{"email": to_email} for to_email in to_emails]).encode('utf-8')
+    sender, headers = FROM_EMAIL, {}
+    if MIX is not None:
+        draw = MIX.draw(message_num)
+        sender, headers = draw.template.from_email, draw.headers
+    headers = {**headers, **schedule_headers(message_num)}.items()
+    head = STREAM.head(make_token(message_num).decode('ascii'), f"{FROM_NAME} <{sender}>", headers)
+    return STREAM.http_body(head, STREAM.size_of(message_num), sender, recipients)
+
+def batch_message_nums(batch_num: int) -> range:
+    """Numéros de message (1..NUM_MESSAGES) couverts par un lot"""
+    first = (batch_num - 1) * HTTP_BATCH_SIZE + 1
+    return range(first, min(first + HTTP_BATCH_SIZE, NUM_MESSAGES + 1))
+
+def batches_message_nums(batches: range) -> range:
+    """Numéros de message couverts par une plage contiguë de lots"""
+    if not batches:
+        return range(0)
+    return range(batch_message_nums(batches[0])[0], batch_message_nums(batches[-1])[-1] + 1)
+
+def build_batch_payload(batch_num: int, message_nums: range, to_emails: List[str]) -> dict:
+    """Construit le payload d'un lot: un template partagé + substitutions par destinataire"""
+    envelope_sender, content = FROM_EMAIL, CONTENT_TEMPLATE
+    if MIX is not None:
+        # Modèle tiré pour le lot: {{TIMESTAMP}} devient une substitution globale de kumod
+        draw = MIX.draw(message_nums[0])
+        envelope_sender, content = draw.template.from_email, draw.template.content("{{ test_id }}", draw.headers)
+    if SCHEDULE is not None:
+        # Une échéance par lot: celle de son premier message
+        content = {**content, "headers": {**content["headers"], **schedule_headers(message_nums[0])}}
+    timestamp = datetime.now()
+    return {
+        "envelope_sender": envelope_sender,
+        "content": content,
+        "substitutions": {
+            "batch_num": batch_num,
+            "run_id": RUN_ID,
+            "timestamp": timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+            "TIMESTAMP": timestamp.strftime('%Y%m%d-%H%M%S'),
+        },
+        "recipients": [
+            {
+                "email": to_email,
+                "substitutions": {"message_num": message_num, "recipient": to_email,
+                                  "test_id": make_token(message_num).decode('ascii')}
+            }
+            for message_num, to_email in zip(message_nums, to_emails)
+        ]
+    }
+
+def accepted_queue(message_num: int, to_email: str) -> str:
+    """Queue d'un message accepté (latence de bout en bout): [campagne:][tenant@]domaine avec --mix ou --trace"""
+    if TRACE is not None:
+        return TRACE.queue_name(message_num)
+    return MIX.queue_name(message_num, to_email) if MIX is not None else to_email.rpartition('@')[2]
+
+def count_accepted(status_code: int, text: str, num_recipients: int) -> Tuple[int, Optional[str], List[str]]:
+    """Interprète la réponse de /api/inject/v1: (destinataires acceptés, erreur, adresses refusées)"""
+    if not 200 <= status_code < 300:
+        return 0, f"HTTP {status_code}: {text[:200]}", []
+    try:
+        data = json.loads(text)
+        accepted = int(data.get('success_count', num_recipients))
+        failed = [str(email) for email in data.get('failed_recipients') or []]
+    except (ValueError, AttributeError, TypeError):
+        return num_recipients, None, []
+    if accepted < num_recipients:
+        return accepted, f"{num_recipients - accepted} destinataire(s) refusé(s): {data.get('errors', [])}"[:200], failed
+    return accepted, None, []
+
+def send_http_batch(batch_num: int, to_emails: List[str]) -> Tuple[int, float, Optional[str], List[str]]:
+    """Envoie un lot via l'API HTTP et retourne (destinataires acceptés, temps_ms, erreur, adresses refusées)"""
+    message_nums = batch_message_nums(batch_num)
+    if CORPUS_SIZE:
+        body = b"".join(build_corpus_body(message_nums[0], to_emails))
+    else:
+        body = json.dumps(build_batch_payload(batch_num, message_nums, to_emails))
+    url = f"http://localhost:{LOCAL_HTTP_PORT}{INJECT_PATH}"
     
-    url = f"http://localhost:{LOCAL_HTTP_PORT}/api/inject/v1"
+    start_time = time.time()
+    try:
+        response = http_session.post(url, data=body, timeout=30)
+        elapsed_ms = (time.time() - start_time) * 1000
+        accepted, error, failed = count_accepted(response.status_code, response.text, len(to_emails))
+        return accepted, elapsed_ms, error, failed
+    except requests.exceptions.RequestException as e:
+        elapsed_ms = (time.time() - start_time) * 1000
+        return 0, elapsed_ms, str(e), []
+
+def send_http_message(message_num: int, to_email: str) -> Tuple[bool, float, Optional[str]]:
+    """Envoie un message via l'API HTTP (session keep-alive) et retourne (succès, temps_ms, erreur)"""
+    if CORPUS_SIZE:
+        body = b"".join(build_corpus_body(message_num, [to_email]))
+    else:
+        body = json.dumps(build_http_payload(message_num, to_email))
+    url = f"http://localhost:{LOCAL_HTTP_PORT}{INJECT_PATH}"
     
     start_time = time.time()
     try:
-        response = requests.post(
-            url,
-            json=payload,
-            auth=HTTPBasicAuth(HTTP_USER, HTTP_PASSWORD),
-            headers={'Content-Type': 'application/json'},
-            timeout=30
-        )
+        response = http_session.post(url, data=body, timeout=30)
         elapsed_ms = (time.time() - start_time) * 1000
         
         # Vérifier le succès (codes 2xx)
@@ -286,162 +629,746 @@ Mode: SINK (messages will not be delivered)"""
         elapsed_ms = (time.time() - start_time) * 1000
         return False, elapsed_ms, str(e)
 
+async def send_http_message_async(pool: HTTPConnectionPool, message_num: int, to_email: str) -> Tuple[bool, float, Optional[str]]:
+    """Envoie un message sur une connexion keep-alive du pool et retourne (succès, temps_ms, erreur)"""
+    if STREAM is not None:
+        body = build_stream_body(message_num, [to_email])
+    elif CORPUS_SIZE:
+        body = build_corpus_body(message_num, [to_email])
+    else:
+        body = json.dumps(build_http_payload(message_num, to_email)).encode('utf-8')
+    return await post_with_timing(pool, INJECT_PATH, body)
+
+async def send_http_batch_async(pool: HTTPConnectionPool, batch_num: int,
+                                to_emails: List[str]) -> Tuple[int, float, Optional[str], List[str]]:
+    """Envoie un lot sur une connexion keep-alive du pool et retourne (acceptés, temps_ms, erreur, adresses refusées)"""
+    message_nums = batch_message_nums(batch_num)
+    if STREAM is not None:
+        body = build_stream_body(message_nums[0], to_emails)
+    elif CORPUS_SIZE:
+        body = build_corpus_body(message_nums[0], to_emails)
+    else:
+        body = json.dumps(build_batch_payload(batch_num, message_nums, to_emails)).encode('utf-8')
+    response, elapsed_ms, error = await request_with_timing(pool, 'POST', INJECT_PATH, body)
+    if response is None:
+        return 0, elapsed_ms, error, []
+    accepted, error, failed = count_accepted(response.status, response.text, len(to_emails))
+    return accepted, elapsed_ms, error, failed
+
+def make_recorders(registry: CounterRegistry):
+    """Retourne (record_result, record_batch_result), appelés par les threads ou par la boucle asyncio"""
+    def record_due(stats: RunStats, due: float, accepted: int):
+        # Dernière échéance acceptée (attente du vidage) et messages injectés après leur échéance
+        stats.set_max('schedule_last_due', due)
+        if time.time() > due:
+            stats.add_counter('schedule_late', accepted)
+    
+    # Enregistre le résultat d'un message (compteurs propres au worker courant, sans verrou global)
+    def record_result(message_num: int, to_email: str, success: bool, elapsed_ms: float, error: Optional[str],
+                      endpoint: int = 0):
+        registry.worker().record(success, elapsed_ms, error)
+        if success and STREAM is not None:
+            # Taille déterministe: recalculée plutôt que conservée avec le message
+            registry.worker().stats.add_counter('bytes_accepted', STREAM.size_of(message_num))
+        if success and SCHEDULE is not None:
+            record_due(registry.worker().stats, SCHEDULE.due_at(message_num), 1)
+        if endpoint_stats is not None:
+            endpoint_stats.record(endpoint, success, elapsed_ms, error)
+        if success and acceptance is not None:
+            acceptance.record(message_num, accepted_queue(message_num, to_email))
+        if message_records is not None:
+            message_records.record(message_num, success, elapsed_ms, error, endpoint)
+        if VERBOSE:
+            with stats_lock:
+                if success:
+                    print(f"✓ Message #{message_num}: SUCCESS ({elapsed_ms:.2f}ms) -> {to_email}")
+                else:
+                    print(f"✗ Message #{message_num}: FAIL ({elapsed_ms:.2f}ms) -> {to_email}")
+                    if error:
+                        print(f"   Erreur: {error[:150]}")
+    
+    # Enregistre le résultat d'un lot: une latence par requête, un résultat par destinataire
+    def record_batch_result(batch_num: int, to_emails: List[str], accepted: int, elapsed_ms: float, error: Optional[str],
+                            endpoint: int = 0, failed_recipients: Sequence[str] = ()):
+        registry.worker().record(accepted == len(to_emails), elapsed_ms, error,
+                                 messages=len(to_emails), accepted=accepted)
+        if accepted and STREAM is not None:
+            # Un contenu par lot, mis en spool pour chaque destinataire accepté
+            registry.worker().stats.add_counter('bytes_accepted',
+                                                STREAM.size_of(batch_message_nums(batch_num)[0]) * accepted)
+        if accepted and SCHEDULE is not None:
+            record_due(registry.worker().stats, SCHEDULE.due_at(batch_message_nums(batch_num)[0]), accepted)
+        if endpoint_stats is not None:
+            endpoint_stats.record(endpoint, accepted == len(to_emails), elapsed_ms, error,
+                                  messages=len(to_emails), accepted=accepted)
+        if accepted and acceptance is not None:
+            # Corpus: un jeton par requête (celui du premier message); sinon un jeton par destinataire accepté,
+            # d'après failed_recipients (un lot partiel n'est pas forcément refusé par la fin)
+            accepted_nums = list(zip(batch_message_nums(batch_num), to_emails))
+            if CORPUS_SIZE:
+                accepted_nums = accepted_nums[:1]
+            elif accepted < len(to_emails):
+                refused = set(failed_recipients)
+                accepted_nums = [(num, email) for num, email in accepted_nums if email not in refused]
+                if len(accepted_nums) != accepted:
+                    # Refus non détaillés (ou adresses en double dans le lot): destinataires indéterminés
+                    accepted_nums = []
+            for message_num, to_email in accepted_nums:
+                acceptance.record(message_num, accepted_queue(message_num, to_email))
+        if message_records is not None:
+            message_records.record(batch_message_nums(batch_num)[0], accepted == len(to_emails), elapsed_ms, error,
+                                   endpoint, messages=len(to_emails), accepted=accepted)
+        if VERBOSE:
+            with stats_lock:
+                if accepted == len(to_emails):
+                    print(f"✓ Requête #{batch_num}: SUCCESS ({elapsed_ms:.2f}ms) -> {accepted}/{len(to_emails)} destinataires")
+                else:
+                    print(f"✗ Requête #{batch_num}: FAIL ({elapsed_ms:.2f}ms) -> {accepted}/{len(to_emails)} destinataires")
+                    if error:
+                        print(f"   Erreur: {error[:150]}")
+    
+    return record_result, record_batch_result
+
+async def run_async_engine(work_items: range, concurrency: int, pool_size: int, rate: float,
+                           stats: RunStats, record_result, record_batch_result, start_at: Optional[float] = None):
+    """Envoie les messages (ou lots) de work_items avec `concurrency` requêtes en vol (un pool par endpoint)"""
+    endpoints = ENDPOINTS or [Endpoint('localhost', LOCAL_HTTP_PORT)]
+    concurrency = min(concurrency, len(work_items))
+    pool_size = min(pool_size, concurrency)
+    raise_nofile_limit(pool_size + len(endpoints) + 64)
+    headers = {
+        'Authorization': basic_auth_header(HTTP_USER, HTTP_PASSWORD),
+        'Content-Type': 'application/json',
+    }
+    pools = EndpointPools(endpoints, lambda endpoint, size: HTTPConnectionPool(
+        endpoint.host, endpoint.port, size, default_headers=headers, phases=phase_timings), pool_size, ENDPOINT_POLICY)
+    
+    async def send_one(message_num: int):
+        to_email = generate_random_email(message_num)
+        endpoint, (success, elapsed_ms, error) = await pools.call(
+            message_num, lambda pool: send_http_message_async(pool, message_num, to_email))
+        record_result(message_num, to_email, success, elapsed_ms, error, endpoint)
+    
+    async def send_batch(batch_num: int):
+        to_emails = [generate_random_email(num) for num in batch_message_nums(batch_num)]
+        endpoint, (accepted, elapsed_ms, error, failed) = await pools.call(
+            batch_num, lambda pool: send_http_batch_async(pool, batch_num, to_emails))
+        record_batch_result(batch_num, to_emails, accepted, elapsed_ms, error, endpoint, failed)
+    
+    # Boucle ouverte: latence vue du producteur, depuis l'instant prévu (attente d'une connexion comprise)
+    async def send_one_scheduled(message_num: int, scheduled: float):
+        to_email = generate_random_email(message_num)
+        endpoint, (success, _, error) = await pools.call(
+            message_num, lambda pool: send_http_message_async(pool, message_num, to_email))
+        record_result(message_num, to_email, success, (time.perf_counter() - scheduled) * 1000, error, endpoint)
+    
+    async def send_batch_scheduled(batch_num: int, scheduled: float):
+        to_emails = [generate_random_email(num) for num in batch_message_nums(batch_num)]
+        endpoint, (accepted, _, error, failed) = await pools.call(
+            batch_num, lambda pool: send_http_batch_async(pool, batch_num, to_emails))
+        record_batch_result(batch_num, to_emails, accepted, (time.perf_counter() - scheduled) * 1000, error, endpoint,
+                            failed)
+    
+    try:
+        if TRACE is not None:
+            # Rejeu: chaque message part à l'instant de son événement (début commun à tous les processus)
+            loop_stats = await run_trace_loop(send_one_scheduled, work_items, TRACE.offset, TRACE_SPEED, MAX_IN_FLIGHT,
+                                              start_at, histogram_digits=HISTOGRAM_DIGITS)
+            trace_timing.merge(loop_stats)
+            stats.set_max('schedule_duration_s', loop_stats.duration)
+        elif rate > 0:
+            send_scheduled = send_batch_scheduled if HTTP_BATCH_SIZE > 1 else send_one_scheduled
+            loop_stats = await run_open_loop(send_scheduled, work_items, rate / HTTP_BATCH_SIZE, MAX_IN_FLIGHT)
+            stats.set_max('schedule_duration_s', loop_stats.duration)
+            stats.set_max('schedule_lag_ms', loop_stats.max_lag_ms)
+        else:
+            await run_closed_loop(send_batch if HTTP_BATCH_SIZE > 1 else send_one, work_items, concurrency)
+    finally:
+        await pools.close()
+    for pool in pools.pools:
+        stats.add_counter('connections_opened', pool.connections_opened)
+
+def run_threads_engine(work_items: range, threads: int, pool_size: int, registry: CounterRegistry,
+                       record_result, record_batch_result):
+    """Envoie les messages (ou lots) de work_items avec un pool de threads et une session keep-alive"""
+    global http_session
+    
+    # Fonction pour envoyer un message (utilisée par les threads)
+    def send_message_wrapper(message_num: int):
+        to_email = generate_random_email(message_num)
+        success, elapsed_ms, error = send_http_message(message_num, to_email)
+        record_result(message_num, to_email, success, elapsed_ms, error)
+        return message_num, success, elapsed_ms
+    
+    # Fonction pour envoyer un lot (utilisée par les threads en mode lot)
+    def send_batch_wrapper(batch_num: int):
+        to_emails = [generate_random_email(num) for num in batch_message_nums(batch_num)]
+        accepted, elapsed_ms, error, failed = send_http_batch(batch_num, to_emails)
+        record_batch_result(batch_num, to_emails, accepted, elapsed_ms, error, failed_recipients=failed)
+        return batch_num, accepted, elapsed_ms
+    
+    http_session = create_http_session(pool_size)
+    wrapper = send_batch_wrapper if HTTP_BATCH_SIZE > 1 else send_message_wrapper
+    max_workers = min(threads, len(work_items))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def on_error(item: int, e: BaseException):
+            message_nums = batch_message_nums(item) if HTTP_BATCH_SIZE > 1 else [item]
+            print(f"✗ Message #{message_nums[0]}: Exception -> {e}")
+            registry.worker().record(False, None, str(e), messages=len(message_nums))
+        
+        # Soumission au fil de l'eau: au plus deux tâches en attente par thread
+        run_bounded(executor, wrapper, work_items, 2 * max_workers, on_error)
+    http_session.close()
+
+def run_engine(work_items: range, stats: RunStats, registry: CounterRegistry,
+               shard_index: int = 0, shard_count: int = 1, rate: float = RATE, start_at: Optional[float] = None):
+    """Exécute le moteur choisi sur une tranche de messages (ou de lots), avec sa part de la concurrence et du débit"""
+    record_result, record_batch_result = make_recorders(registry)
+    pool_size = split_evenly(HTTP_POOL_SIZE, shard_count, shard_index)
+    # Tirage paresseux des lots, interrompu à l'échéance (--duration) ou sur Ctrl+C
+    limited = run_limit.take(work_items)
+    if ENGINE == 'async':
+        concurrency = split_evenly(HTTP_CONCURRENCY, shard_count, shard_index)
+        rate = split_evenly(rate, shard_count, shard_index)
+        asyncio.run(run_async_engine(limited, concurrency, pool_size, rate, stats,
+                                     record_result, record_batch_result, start_at))
+    else:
+        threads = split_evenly(MAX_THREADS, shard_count, shard_index)
+        run_threads_engine(limited, threads, pool_size, registry, record_result, record_batch_result)
+    sent_items.append(limited.sent)
+    stats.merge(registry.checkpoint())
+
+def run_shard(shard_index: int, shard_count: int, work_items: Optional[range] = None, rate: float = RATE,
+              start_at: Optional[float] = None) -> dict:
+    """Point d'entrée d'un processus worker (--processes): retourne ses compteurs (et acceptations) à fusionner"""
+    global acceptance, trace_timing, endpoint_stats, phase_timings, message_records, sent_items
+    acceptance = AcceptanceLog() if E2E_ENABLED else None
+    trace_timing = TraceLoopStats(TRACE_SPEED, HISTOGRAM_DIGITS) if TRACE is not None else None
+    endpoint_stats = EndpointStats(ENDPOINTS, HISTOGRAM_DIGITS) if ENDPOINTS else None
+    phase_timings = PhaseTimings(HTTP_PHASES, HISTOGRAM_DIGITS) if PHASES_ENABLED else None
+    message_records = MessageRecords(RECORDS, RECORDS_SPILL) if RECORDS else None
+    sent_items = []
+    stats = RunStats(HISTOGRAM_DIGITS)
+    registry = CounterRegistry(HISTOGRAM_DIGITS)
+    publisher = None
+    if progress_channel() is not None:
+        publisher = IntervalPublisher(registry, progress_channel()).start()
+    try:
+        work_items = range(1, NUM_BATCHES + 1) if work_items is None else work_items
+        if TRACE is not None:
+            # Rejeu: événements entrelacés (des tranches contiguës rendraient les processus actifs tour à tour)
+            shard = work_items[shard_index::shard_count]
+        else:
+            shard = shard_range(len(work_items), shard_count, shard_index, work_items.start)
+        run_engine(shard, stats, registry, shard_index, shard_count, rate, start_at)
+    finally:
+        if publisher is not None:
+            publisher.stop()
+    if message_records is not None:
+        message_records.flush()
+        stats.add_counter('records', len(message_records))
+    result = stats.to_dict()
+    result['sent'] = [(items.start, items.stop, items.step) for items in sent_items]
+    if acceptance is not None:
+        result['acceptance'] = acceptance.to_dict()
+    if trace_timing is not None:
+        result['trace_timing'] = trace_timing.to_dict()
+    if endpoint_stats is not None:
+        result['endpoints'] = endpoint_stats.to_dict()
+    if phase_timings is not None:
+        result['phases'] = phase_timings.to_dict()
+    return result
+
+def run_load(work_items: range, rate: float, registry: CounterRegistry, progress=None) -> RunStats:
+    """Envoie work_items (messages ou lots) au débit `rate` (0 = boucle fermée), dans ce processus ou répartis sur PROCESSES"""
+    stats = RunStats(HISTOGRAM_DIGITS)
+    if PROCESSES > 1:
+        # Chaque processus traite une tranche contiguë des lots et publie ses intervalles;
+        # le rejeu d'une trace démarre à un instant commun, une fois les processus lancés
+        start_at = time.time() + TRACE_START_DELAY if TRACE is not None else None
+        target = functools.partial(run_shard, work_items=work_items, rate=rate, start_at=start_at)
+        for shard in run_in_processes(target, PROCESSES, progress):
+            stats.merge(RunStats.from_dict(shard))
+            sent_items.extend(range(*items) for items in shard['sent'])
+            if 'acceptance' in shard:
+                acceptance.merge(AcceptanceLog.from_dict(shard['acceptance']))
+            if 'trace_timing' in shard:
+                trace_timing.merge(TraceLoopStats.from_dict(shard['trace_timing']))
+            if 'endpoints' in shard:
+                endpoint_stats.merge(EndpointStats.from_dict(shard['endpoints']))
+            if 'phases' in shard:
+                phase_timings.merge(PhaseTimings.from_dict(shard['phases']))
+    else:
+        run_engine(work_items, stats, registry, rate=rate)
+    return stats
+
+def prepare_kubernetes_target():
+    """Vérifie kubectl et le service, puis ouvre le port-forward"""
+    service = require_service(NAMESPACE, RELEASE_NAME, SERVICE_NAME)
+    
+    # Configurer le port-forward
+    if not setup_port_forward(NAMESPACE, service, LOCAL_HTTP_PORT, HTTP_PORT, 'LOCAL_HTTP_PORT'):
+        print("✗ Impossible de configurer le port-forward")
+        sys.exit(1)
+
+def resolve_direct_endpoints():
+    """Résout --endpoints (découverte des pods via kubectl ou liste explicite) avant le fork des workers"""
+    global ENDPOINTS, METRICS_URL
+    try:
+        ENDPOINTS = resolve_endpoints(ARGS.endpoints, HTTP_PORT, NAMESPACE, POD_SELECTOR)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"✗ Erreur: {e}")
+        sys.exit(1)
+    print(f"✓ Injection directe: {len(ENDPOINTS)} endpoints, sans port-forward")
+    for endpoint in ENDPOINTS:
+        print(f"  {endpoint.label}")
+    if METRICS_SCRAPE and not ARGS.metrics_url:
+        # Pas de port-forward: métriques du listener HTTP du premier pod
+        METRICS_URL = f"http://{ENDPOINTS[0].host}:{ENDPOINTS[0].port}/metrics"
+
+def report_end_to_end(log: AcceptanceLog):
+    """Exporte les acceptations et/ou les joint aux livraisons: latence de bout en bout par queue"""
+    if E2E_LOG:
+        log.save(E2E_LOG)
+        print(f"✓ Acceptations exportées: {E2E_LOG} ({len(log)} jetons)")
+    if not E2E_DELIVERIES:
+        return
+    collector = EndToEndCollector(log.entries(), HISTOGRAM_DIGITS)
+    print(f"\n⏳ Attente des livraisons ({len(log)} jetons, max {E2E_WAIT:g} s)...")
+    try:
+        collector.wait(DeliveryReader(E2E_DELIVERIES), E2E_WAIT)
+    except (OSError, RuntimeError) as e:
+        print(f"✗ Lecture des livraisons impossible: {e}")
+        return
+    print("\nLatence de bout en bout (acceptation → livraison):")
+    print(collector.format_report())
+    if E2E_HISTOGRAM_OUT:
+        collector.save(E2E_HISTOGRAM_OUT)
+        print(f"✓ Histogrammes de bout en bout exportés: {E2E_HISTOGRAM_OUT}")
+
+def save_result(stats: RunStats, run_duration: float, scraper: Optional[MetricsScraper]):
+    """Exporte le résultat du run en JSON structuré (--result-json)"""
+    record = run_record(stats, run_duration, protocol='http', engine=ENGINE,
+                        messages=NUM_MESSAGES if NUM_MESSAGES != UNBOUNDED_MESSAGES else None,
+                        max_duration=ARGS.duration, threads=MAX_THREADS,
+                        concurrency=HTTP_CONCURRENCY, pool_size=HTTP_POOL_SIZE, rate=RATE, processes=PROCESSES,
+                        corpus=CORPUS_SIZE, message_size=MESSAGE_SIZE, stream=ARGS.stream,
+                        stream_chunk=ARGS.stream_chunk if STREAM is not None else None,
+                        recipients=HTTP_BATCH_SIZE, mix=ARGS.mix,
+                        trace=ARGS.trace, trace_speed=TRACE_SPEED if TRACE is not None else None,
+                        endpoints=ARGS.endpoints, endpoint_policy=ENDPOINT_POLICY if ENDPOINTS else None, phases=PHASES_ENABLED,
+                        schedule=ARGS.schedule, records=RECORDS)
+    if run_limit.interrupted:
+        # Ctrl+C: rapport partiel
+        record['interrupted'] = True
+    if scraper is not None:
+        record['drain_s'] = scraper.drain_seconds
+        record['drain_resolution_s'] = scraper.drain_resolution
+        if SCHEDULE is not None:
+            record['schedule'] = release_record(SCHEDULE, scheduled_message_nums(), scraper.samples,
+                                                scraper.baseline, scraper.injection_end)
+    if MIX is not None:
+        record['mix'] = mix_tally().to_dict()
+    if trace_timing is not None:
+        lateness = trace_timing.lateness
+        record['trace'] = {'events': trace_timing.scheduled, 'speed': TRACE_SPEED, 'trace_duration_s': TRACE.duration,
+                           'lateness_ms': {'p50': lateness.percentile(50), 'p99': lateness.percentile(99),
+                                           'p999': lateness.percentile(99.9), 'max': lateness.max},
+                           'late': {f'{threshold:g}ms': count for threshold, count in trace_timing.late.items()}}
+    if endpoint_stats is not None:
+        record['endpoints'] = endpoint_stats.records(run_duration)
+    if phase_timings is not None:
+        record['phases'] = phase_timings.records()
+    if STREAM is not None:
+        ingested = stats.counters.get('bytes_accepted', 0)
+        record['bytes_accepted'] = int(ingested)
+        record['throughput_mb_s'] = round(ingested / 1024 ** 2 / run_duration, 2) if run_duration else 0.0
+    if RAMP is not None:
+        record['ramp'] = {'knee_rate': RAMP.knee.rate if RAMP.knee else None,
+                          'steps': [{key: value for key, value in step.to_dict().items() if key != 'latency'}
+                                    for step in RAMP.executed]}
+    with open(RESULT_JSON, 'w') as f:
+        json.dump(record, f)
+    print(f"✓ Résultat structuré exporté: {RESULT_JSON}")
+
+def mix_tally() -> MixTally:
+    """Répartition effective du mix sur les messages envoyés (tirages déterministes, recomptés sur un échantillon)"""
+    global mix_counts
+    if mix_counts is None:
+        if run_limit.cut_short:
+            # Run écourté (--duration, Ctrl+C): messages ou lots effectivement tirés de chaque tranche
+            work_items = sent_items
+        elif RAMP is None:
+            work_items = [range(1, NUM_BATCHES + 1)]
+        else:
+            work_items = [step.work_items for step in RAMP.executed]
+        message_ranges = [batches_message_nums(items) for items in work_items] if HTTP_BATCH_SIZE > 1 else work_items
+        mix_counts = MixTally.count(MIX, message_ranges, TALLY_SAMPLES)
+    return mix_counts
+
+def start_metrics_scraper() -> Optional[MetricsScraper]:
+    """Relevé initial des métriques kumod puis relevés périodiques (None si l'endpoint est injoignable)"""
+    try:
+        scraper = MetricsScraper(METRICS_URL, METRICS_INTERVAL,
+                                 headers={'Authorization': basic_auth_header(HTTP_USER, HTTP_PASSWORD)}).start()
+    except (OSError, ValueError) as e:
+        print(f"⚠ Métriques kumod injoignables ({METRICS_URL}): {e}")
+        print("  Le test continue sans relevé des métriques\n")
+        return None
+    print(f"✓ Métriques kumod: {METRICS_URL} (queues au départ: {scraper.baseline.queue_depth:.0f} messages)\n")
+    return scraper
+
+def scheduled_message_nums() -> range:
+    """Numéros portant une échéance X-Schedule: le premier message de chaque lot"""
+    return range(1, NUM_MESSAGES + 1, HTTP_BATCH_SIZE)
+
+def wait_for_drain(scraper: MetricsScraper, stats: RunStats):
+    """Fin de l'injection: attend le retour des queues à leur niveau initial, puis arrête le relevé"""
+    scraper.mark_injection_end()
+    if DRAIN_TIMEOUT > 0 and not run_limit.interrupted:
+        timeout = DRAIN_TIMEOUT
+        if SCHEDULE is not None:
+            # Envois programmés: les queues ne se vident qu'après la dernière échéance des messages acceptés
+            last_due = stats.maxima.get('schedule_last_due', scraper.injection_end)
+            timeout += max(0.0, last_due - scraper.injection_end)
+        print(f"\n⏳ Injection terminée, attente du vidage des queues (max {timeout:g} s)...")
+        drain = scraper.wait_drained(timeout)
+        if drain is None:
+            print(f"⚠ Queues non vidées après {timeout:g} s")
+        else:
+            print(f"✓ Queues vidées {drain:.1f} s (± {scraper.drain_resolution:.1f} s) après la fin de l'injection")
+    scraper.stop()
+
 # ============================================================================
 # MAIN
 # ============================================================================
 
 def main():
-    global port_forward_process
-    
     print("=" * 60)
     print("Test de Performance - Listener HTTP KumoMTA")
     print("=" * 60)
-    print(f"Service: {SERVICE_NAME}")
-    print(f"Namespace: {NAMESPACE}")
-    print(f"Port local: {LOCAL_HTTP_PORT}")
-    print(f"Nombre de messages: {NUM_MESSAGES}")
-    print(f"Nombre de threads: {MAX_THREADS}")
+    if not LOCAL_TARGET:
+        print(f"Service: {SERVICE_NAME}")
+        print(f"Namespace: {NAMESPACE}")
+    if ARGS.endpoints:
+        print(f"Endpoints: {ARGS.endpoints} (injection directe, {ENDPOINT_POLICY})")
+    else:
+        print(f"Port local: {LOCAL_HTTP_PORT}")
+    if NUM_MESSAGES == UNBOUNDED_MESSAGES:
+        print("Nombre de messages: sans limite")
+    else:
+        print(f"Nombre de messages: {NUM_MESSAGES}"
+              + (" au plus (rampe)" if RAMP is not None else " au plus" if DURATION > 0 else ""))
+    if DURATION > 0:
+        print(f"Durée maximale: {ARGS.duration} ({DURATION:g} s)")
+    if MIX is not None:
+        print(f"Mix de trafic: {MIX.describe()}")
+    if SCHEDULE is not None:
+        print(f"Envois programmés: {SCHEDULE.describe()}")
+        if not METRICS_SCRAPE:
+            print("⚠ Sans --metrics, la libération des messages programmés n'est pas mesurée")
+    if TRACE is not None:
+        print(f"Trace: {TRACE.describe()}, vitesse x{TRACE_SPEED:g}")
+    if ENGINE == 'async':
+        print(f"Moteur: async ({HTTP_CONCURRENCY} injections en vol, {HTTP_POOL_SIZE} connexions keep-alive)")
+    else:
+        print(f"Nombre de threads: {MAX_THREADS} ({HTTP_POOL_SIZE} connexions keep-alive)")
+    if HTTP_BATCH_SIZE > 1:
+        print(f"Mode lot: {HTTP_BATCH_SIZE} destinataires par requête ({NUM_BATCHES} requêtes)")
+    if RATE > 0:
+        print(f"Boucle ouverte: {RATE:g} msg/s (max {MAX_IN_FLIGHT} requêtes en cours)")
+    if RAMP is not None:
+        print(f"Rampe: {len(RAMP.steps)} paliers de {RAMP.step_duration:g} s, "
+              f"{RAMP.steps[0].rate:g} → {RAMP.steps[-1].rate:g} msg/s")
     print()
     
-    # Vérifications préliminaires
-    if not check_kubectl():
-        print("✗ Erreur: kubectl n'est pas installé ou n'est pas dans le PATH")
+    if DURATION > 0 and (RAMP is not None or TRACE is not None):
+        print("✗ Erreur: --duration est incompatible avec --ramp et --trace, qui fixent eux-mêmes la durée du run")
         sys.exit(1)
     
-    # Trouver le service
-    print("⏳ Vérification du service Kubernetes...")
-    service = find_service(NAMESPACE, RELEASE_NAME)
-    if not service:
-        print(f"✗ Erreur: Le service {SERVICE_NAME} n'existe pas dans le namespace {NAMESPACE}")
+    if TIMESERIES_OUT and REPORT_INTERVAL <= 0:
+        print("✗ Erreur: --timeseries nécessite --report-interval > 0")
         sys.exit(1)
-    print(f"✓ Service trouvé: {service}")
     
-    # Configurer le port-forward
-    port_forward_process = setup_port_forward(NAMESPACE, service, LOCAL_HTTP_PORT, HTTP_PORT)
-    if port_forward_process is None and not use_existing_pf:
-        print("✗ Impossible de configurer le port-forward")
+    if RECORDS and PROCESSES > 1 and not SHARED_APPEND:
+        print("✗ Erreur: --records avec --processes nécessite flock pour partager le fichier (indisponible sous Windows)")
+        sys.exit(1)
+    
+    if (RATE > 0 or RAMP is not None) and ENGINE != 'async':
+        print("✗ Erreur: --rate et --ramp nécessitent --engine async")
+        sys.exit(1)
+    
+    if RAMP is not None and RATE > 0:
+        print("✗ Erreur: --ramp fixe le débit de chaque palier, incompatible avec --rate")
+        sys.exit(1)
+    
+    if TRACE is not None:
+        if ENGINE != 'async' or RATE > 0 or RAMP is not None or MIX is not None or ARGS.corpus or HTTP_BATCH_SIZE > 1:
+            print("✗ Erreur: --trace nécessite --engine async et fixe instants, tailles, domaines et tenants "
+                  "(incompatible avec --rate, --ramp, --mix, --corpus et --batch-size)")
+            sys.exit(1)
+        if not len(TRACE) or TRACE_SPEED <= 0:
+            print(f"✗ Erreur: aucun événement HTTP dans la trace {ARGS.trace}" if not len(TRACE)
+                  else "✗ Erreur: --trace-speed doit être positif")
+            sys.exit(1)
+    
+    if STREAM is not None and (ENGINE != 'async' or ARGS.corpus or TRACE is not None):
+        print("✗ Erreur: --stream nécessite --engine async et génère lui-même les messages "
+              "(incompatible avec --corpus et --trace)")
+        sys.exit(1)
+    
+    if PHASES_ENABLED and ENGINE != 'async':
+        print("✗ Erreur: --phases nécessite --engine async (phases mesurées par le client asyncio)")
         sys.exit(1)
     
+    if ARGS.endpoints and (ENGINE != 'async' or LOCAL_TARGET):
+        print("✗ Erreur: --endpoints nécessite --engine async et remplace --local (connexions directes aux endpoints)")
+        sys.exit(1)
+    
+    if ARGS.endpoints:
+        # Injection directe: un pool de connexions par pod (ou endpoint), sans port-forward
+        resolve_direct_endpoints()
+    elif LOCAL_TARGET:
+        # Sink local (python3 -m kumoload.sink) ou kumod hors cluster: ni kubectl ni port-forward
+        print(f"✓ Mode local: cible localhost:{LOCAL_HTTP_PORT} (sans Kubernetes)")
+    else:
+        prepare_kubernetes_target()
+    
+    # Fin anticipée: échéance --duration et Ctrl+C (événement partagé avec les processus workers)
+    global run_limit
+    run_limit = RunLimit(DURATION, process_context().Event() if PROCESSES > 1 else None)
+    
+    def interrupt(signum, frame):
+        # Pendant l'injection, un premier Ctrl+C arrête les nouveaux envois et garde le rapport
+        if run_limit.running and not run_limit.interrupted:
+            run_limit.stop()
+            print("\n⚠ Interruption: fin des envois en cours puis rapport partiel (Ctrl+C à nouveau pour quitter)",
+                  flush=True)
+            return
+        cleanup_port_forwards()
+        sys.exit(0)
+    
     # Enregistrer le handler de nettoyage
-    signal.signal(signal.SIGINT, lambda s, f: (cleanup_port_forward(), sys.exit(0)))
-    signal.signal(signal.SIGTERM, lambda s, f: (cleanup_port_forward(), sys.exit(0)))
+    signal.signal(signal.SIGINT, interrupt)
+    signal.signal(signal.SIGTERM, lambda s, f: (cleanup_port_forwards(), sys.exit(0)))
     
     try:
         # Test de connexion rapide
-        print("\n⏳ Test de connexion au port HTTP...")
-        try:
-            response = requests.get(f"http://localhost:{LOCAL_HTTP_PORT}", timeout=5)
-            print("✓ Port HTTP accessible")
-        except Exception:
-            print("⚠ Le port ne répond pas encore, mais on continue...")
+        if ENDPOINTS:
+            print(f"\n⏳ Test de connexion aux {len(ENDPOINTS)} endpoints...")
+            unreachable = check_endpoints(ENDPOINTS)
+            for endpoint, error in unreachable:
+                print(f"⚠ {endpoint.label} injoignable: {error}")
+            if not unreachable:
+                print("✓ Endpoints accessibles")
+        else:
+            print("\n⏳ Test de connexion au port HTTP...")
+            try:
+                response = requests.get(f"http://localhost:{LOCAL_HTTP_PORT}", timeout=5)
+                print("✓ Port HTTP accessible")
+            except Exception:
+                print("⚠ Le port ne répond pas encore, mais on continue...")
         
         # Boucle d'envoi des messages avec parallélisation
         print(f"\n{'=' * 60}")
         print("Démarrage du test de performance")
-        print(f"Parallélisation: {MAX_THREADS} threads maximum")
+        if ENGINE == 'async' and RAMP is not None:
+            print(f"Rampe: paliers en boucle ouverte sur {HTTP_POOL_SIZE} connexions, arrêt au premier palier hors SLO "
+                  f"(P99 ≤ {RAMP.slo_p99_ms:g} ms, erreurs ≤ {RAMP.slo_error_rate * 100:g}%)")
+        elif ENGINE == 'async' and TRACE is not None:
+            print(f"Rejeu de la trace sur {HTTP_POOL_SIZE} connexions: instants absolus (rattrapage sans dérive), "
+                  f"latence mesurée depuis l'instant de chaque événement")
+        elif ENGINE == 'async' and RATE > 0:
+            print(f"Boucle ouverte: {RATE:g} msg/s sur {HTTP_POOL_SIZE} connexions, latence mesurée depuis l'instant prévu")
+        elif ENGINE == 'async':
+            print(f"Parallélisation: {min(HTTP_CONCURRENCY, NUM_BATCHES)} injections simultanées (asyncio)")
+        if ENDPOINTS:
+            print(f"Endpoints: {len(ENDPOINTS)} (un pool de connexions par endpoint, répartition {ENDPOINT_POLICY})")
+        else:
+            print(f"Parallélisation: {MAX_THREADS} threads maximum")
+        if PROCESSES > 1:
+            print(f"Processus: {PROCESSES} (concurrence et débit répartis entre les processus)")
         print(f"{'=' * 60}\n")
         
-        results = []
-        success_count = [0]  # Utiliser une liste pour pouvoir modifier dans les threads
-        fail_count = [0]
-        times = []
+        if CORPUS_SIZE:
+            sizes = "classes de tailles de la trace" if TRACE is not None else f"tailles {MESSAGE_SIZE}"
+            print(f"⏳ Rendu du corpus ({CORPUS_SIZE} messages, {sizes})...")
+            try:
+                print(f"✓ Corpus: {get_corpus().describe()}\n")
+            except ValueError as e:
+                print(f"✗ Erreur: {e}")
+                sys.exit(1)
+        if STREAM is not None:
+            print(f"✓ Streaming: {STREAM.describe()}\n")
         
-        # Fonction pour envoyer un message (utilisée par les threads)
-        def send_message_wrapper(message_num: int):
-            to_email = generate_random_email()
-            success, elapsed_ms, error = send_http_message(message_num, to_email)
-            
-            with stats_lock:
-                times.append(elapsed_ms)
-                results.append({
-                    'message_num': message_num,
-                    'status': 'SUCCESS' if success else 'FAIL',
-                    'time_ms': elapsed_ms,
-                    'to_email': to_email,
-                    'error': error
-                })
-                
-                if success:
-                    success_count[0] += 1
-                    print(f"✓ Message #{message_num}: SUCCESS ({elapsed_ms:.2f}ms) -> {to_email}")
-                else:
-                    fail_count[0] += 1
-                    print(f"✗ Message #{message_num}: FAIL ({elapsed_ms:.2f}ms) -> {to_email}")
-                    if message_num <= 5 and error:
-                        print(f"   Erreur: {error[:150]}")
-            
-            return message_num, success, elapsed_ms
+        global acceptance, trace_timing, endpoint_stats, phase_timings, message_records, sent_items
+        acceptance = AcceptanceLog() if E2E_ENABLED else None
+        trace_timing = TraceLoopStats(TRACE_SPEED, HISTOGRAM_DIGITS) if TRACE is not None else None
+        endpoint_stats = EndpointStats(ENDPOINTS, HISTOGRAM_DIGITS) if ENDPOINTS else None
+        phase_timings = PhaseTimings(HTTP_PHASES, HISTOGRAM_DIGITS) if PHASES_ENABLED else None
+        message_records = MessageRecords(RECORDS, RECORDS_SPILL) if RECORDS else None
+        if RECORDS:
+            # Vidé avant le fork: les processus workers y ajoutent leurs blocs
+            truncate_records(RECORDS)
+        sent_items = []
+        stats = RunStats(HISTOGRAM_DIGITS)
+        reporter = None
+        scraper = start_metrics_scraper() if METRICS_SCRAPE else None
         
-        # Utiliser ThreadPoolExecutor pour paralléliser
-        max_workers = min(MAX_THREADS, NUM_MESSAGES)  # Maximum MAX_THREADS threads
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Soumettre toutes les tâches
-            futures = {executor.submit(send_message_wrapper, i): i for i in range(1, NUM_MESSAGES + 1)}
-            
-            # Attendre la completion de toutes les tâches
-            for future in as_completed(futures):
-                try:
-                    future.result()
-                except Exception as e:
-                    message_num = futures[future]
-                    print(f"✗ Message #{message_num}: Exception -> {e}")
-                    with stats_lock:
-                        fail_count[0] += 1
-                        results.append({
-                            'message_num': message_num,
-                            'status': 'FAIL',
-                            'time_ms': 0,
-                            'to_email': 'unknown',
-                            'error': str(e)
-                        })
+        # Unités de travail: lots en mode lot, messages sinon (NUM_BATCHES == NUM_MESSAGES si --batch-size 1)
+        start_run = time.time()
+        run_limit.start(start_run)
+        if SCHEDULE is not None:
+            # Référence des échéances X-Schedule, héritée par les processus workers
+            SCHEDULE.anchor = start_run
+        registry = CounterRegistry(HISTOGRAM_DIGITS)
+        progress = None
+        if REPORT_INTERVAL > 0:
+            if PROCESSES > 1:
+                # Les processus workers publient leurs intervalles sur un canal commun
+                progress = ProgressChannel(process_context(), REPORT_INTERVAL)
+                reporter = LiveReporter.for_channel(progress, timeseries_path=TIMESERIES_OUT,
+                                                    histogram_digits=HISTOGRAM_DIGITS).start()
+            else:
+                reporter = LiveReporter(lambda: [registry.collect()], REPORT_INTERVAL, TIMESERIES_OUT,
+                                        HISTOGRAM_DIGITS).start()
+        try:
+            if RAMP is not None:
+                RAMP.run(lambda rate, work_items: run_load(work_items, rate, registry, progress),
+                         lambda: run_limit.interrupted)
+                for step in RAMP.executed:
+                    stats.merge(step.stats)
+            else:
+                stats.merge(run_load(range(1, NUM_BATCHES + 1), RATE, registry, progress))
+        finally:
+            run_limit.finish()
+            if reporter is not None:
+                reporter.stop()
+        run_duration = time.time() - start_run
+        if run_limit.interrupted:
+            print(f"\n⚠ Run interrompu après {run_duration:.1f} s ({stats.messages} messages): rapport partiel")
+        elif run_limit.cut_short:
+            print(f"\n✓ Durée maximale atteinte ({ARGS.duration}): {stats.messages} messages envoyés")
+        if message_records is not None:
+            # Processus unique: lignes restantes en mémoire (sinon vidées par chaque processus worker)
+            message_records.flush()
+            stats.add_counter('records', len(message_records))
+        if scraper is not None:
+            wait_for_drain(scraper, stats)
         
         # Calcul des statistiques
         print(f"\n{'=' * 60}")
         print("Statistiques")
         print(f"{'=' * 60}\n")
         
-        if times:
-            print(f"Total de messages:     {NUM_MESSAGES}")
-            print(f"Succès:                 {success_count[0]}")
-            print(f"Échecs:                 {fail_count[0]}")
+        if stats.messages:
+            print(f"Total de messages:     {stats.messages if RAMP is not None or run_limit.cut_short else NUM_MESSAGES}")
+            print(f"Succès:                 {stats.success}")
+            print(f"Échecs:                 {stats.failed}")
+            print(f"Durée totale:           {run_duration:.2f} s")
+            print(f"Débit:                  {stats.messages / run_duration if run_duration else 0:.1f} msg/s")
+            if STREAM is not None:
+                ingested = stats.counters.get('bytes_accepted', 0)
+                print(f"Débit (volume):         {ingested / 1024 ** 2 / run_duration if run_duration else 0:.1f} Mo/s "
+                      f"({format_size(ingested)} acceptés)")
+            if PROCESSES > 1:
+                print(f"Processus:              {PROCESSES}")
+            if HTTP_BATCH_SIZE > 1:
+                print(f"Requêtes HTTP:          {stats.requests} ({HTTP_BATCH_SIZE} destinataires par requête)")
+                print(f"Débit requêtes:         {stats.requests / run_duration if run_duration else 0:.1f} req/s")
+            if ENGINE == 'async':
+                print(f"Connexions HTTP ouvertes: {int(stats.counters.get('connections_opened', 0))}")
+            if RATE > 0:
+                print(f"Débit cible:            {RATE:g} msg/s (planifié sur {stats.maxima.get('schedule_duration_s', 0):.2f} s)")
+                print(f"Retard max planning:    {stats.maxima.get('schedule_lag_ms', 0):.2f} ms")
+            if stats.errors:
+                print("Erreurs les plus fréquentes:")
+                for error, count in stats.top_errors():
+                    print(f"  {count:>8} × {error}")
             print()
-            print("Temps de réponse:")
-            print(f"  Minimum:              {min(times):.2f} ms")
-            print(f"  Maximum:              {max(times):.2f} ms")
-            print(f"  Moyenne:              {statistics.mean(times):.2f} ms")
-            print(f"  Médiane:              {statistics.median(times):.2f} ms")
-            
-            if len(times) > 1:
-                sorted_times = sorted(times)
-                p95_idx = int(len(times) * 0.95)
-                p99_idx = int(len(times) * 0.99)
-                if p95_idx >= len(times):
-                    p95_idx = len(times) - 1
-                if p99_idx >= len(times):
-                    p99_idx = len(times) - 1
-                print(f"  P95:                  {sorted_times[p95_idx]:.2f} ms")
-                print(f"  P99:                  {sorted_times[p99_idx]:.2f} ms")
+            if RATE > 0 or RAMP is not None or TRACE is not None:
+                print("Latence depuis l'instant prévu (coordinated omission corrigé):")
+            print("Temps de réponse (par requête):" if HTTP_BATCH_SIZE > 1 else "Temps de réponse:")
+            print(format_summary(stats.latency))
             
             print()
-            success_rate = (success_count[0] * 100) / NUM_MESSAGES
+            success_rate = (stats.success * 100) / (stats.messages if RAMP is not None or run_limit.cut_short
+                                                    else NUM_MESSAGES)
             print(f"Taux de succès:         {success_rate:.1f}%")
+            
+            if RAMP is not None:
+                print("\nRecherche du point de saturation:")
+                print(RAMP.format_report())
+                if RAMP_OUT:
+                    RAMP.save(RAMP_OUT)
+                    print(f"✓ Paliers de la rampe exportés: {RAMP_OUT}")
+            
+            if phase_timings is not None:
+                print("\nDécomposition par phase:")
+                print(phase_timings.format_report())
+            
+            if endpoint_stats is not None:
+                print(f"\nEndpoints (injection directe, répartition {ENDPOINT_POLICY}):")
+                print(endpoint_stats.format_report(run_duration))
+            
+            if trace_timing is not None:
+                print("\nRejeu de la trace:")
+                print(format_replay_report(TRACE, trace_timing))
+            
+            if MIX is not None:
+                print("\nMix de trafic (messages envoyés):")
+                print(mix_tally().format_report())
+            
+            if HISTOGRAM_OUT:
+                stats.latency.save(HISTOGRAM_OUT)
+                print(f"✓ Histogramme des latences exporté: {HISTOGRAM_OUT}")
+            if RECORDS:
+                print(f"✓ Détail par message: {RECORDS} ({int(stats.counters.get('records', 0))} requêtes, "
+                      f"python3 -m kumoload.records {RECORDS}{' --failed' if stats.failed else ''})")
+            if TIMESERIES_OUT and reporter is not None:
+                print(f"✓ Série temporelle exportée: {TIMESERIES_OUT} ({reporter.rows} intervalles)")
+            if scraper is not None:
+                # Chronologie d'injection du reporter (sans rapport d'intervalle: injection supposée régulière)
+                history = reporter.history if reporter is not None else [
+                    (start_run + run_duration, stats.messages, stats.messages / run_duration if run_duration else 0.0)]
+                print(f"\nMétriques kumod ({scraper.url}):")
+                print(scraper.format_report(stats.success, history))
+                if METRICS_OUT:
+                    scraper.save(METRICS_OUT, history)
+                    print(f"✓ Relevés des métriques exportés: {METRICS_OUT}")
+                if SCHEDULE is not None:
+                    print("\nLibération des envois programmés (X-Schedule):")
+                    print(format_release(SCHEDULE, scheduled_message_nums(), scraper.samples, scraper.baseline,
+                                         scraper.injection_end, int(stats.counters.get('schedule_late', 0))))
+            elif SCHEDULE is not None and stats.counters.get('schedule_late'):
+                print(f"\n⚠ {int(stats.counters['schedule_late'])} messages injectés après leur échéance X-Schedule")
+            if acceptance is not None:
+                report_end_to_end(acceptance)
+            if RESULT_JSON:
+                save_result(stats, run_duration, scraper)
         
         # Résumé final
-        if fail_count[0] == 0:
+        if run_limit.interrupted:
+            print(f"\n{'=' * 60}")
+            print(f"⚠ Test de performance interrompu: rapport partiel ({stats.failed} échec(s))")
+            print(f"{'=' * 60}")
+            sys.exit(130)
+        if stats.failed == 0:
             print(f"\n{'=' * 60}")
             print("✓ Test de performance réussi")
             print(f"{'=' * 60}")
             sys.exit(0)
         else:
             print(f"\n{'=' * 60}")
-            print(f"⚠ Test de performance terminé avec {fail_count[0]} échec(s)")
+            print(f"⚠ Test de performance terminé avec {stats.failed} échec(s)")
             print(f"{'=' * 60}")
-            print("\nVérifiez les logs du pod KumoMTA pour plus de détails:")
-            print(f"  kubectl logs -n {NAMESPACE} -l app.kubernetes.io/name=kumomta --tail=100")
+            if not LOCAL_TARGET:
+                print("\nVérifiez les logs du pod KumoMTA pour plus de détails:")
+                print(f"  kubectl logs -n {NAMESPACE} -l app.kubernetes.io/name=kumomta --tail=100")
             sys.exit(1)
     
     finally:
-        cleanup_port_forward()
+        cleanup_port_forwards()
 
 if __name__ == '__main__':
     main()
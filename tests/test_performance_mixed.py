@@ -0,0 +1,757 @@
+#!/usr/bin/env python3
+"""
+Script de test de performance mixte SMTP + HTTP pour KumoMTA
+Ce script injecte simultanément via le listener ESMTP et l'API HTTP d'injection, selon un ratio,
+pour mesurer l'interférence entre les deux protocoles (même spool, mêmes queues)
+
+Usage:
+    python3 test_performance_mixed.py [nombre_de_messages] [options]
+    ou
+    NUM_MESSAGES=10000 PROTOCOL_RATIO=smtp:70,http:30 python3 test_performance_mixed.py
+
+Paramètres:
+    nombre_de_messages: Nombre de messages à envoyer, tous protocoles confondus (défaut: 1000, sans limite avec --duration)
+
+Options:
+    --ratio SPEC: Répartition des messages entre protocoles, ex. smtp:70,http:30, 70:30 ou 0.7 (défaut: 50:50)
+    --sessions N: Nombre de sessions SMTP simultanées (défaut: 100)
+    --messages-per-session N: Transactions par session avant QUIT (défaut: 10)
+    --pipelining: Utilise ESMTP PIPELINING si le serveur l'annonce
+    --chunking: Utilise ESMTP CHUNKING/BDAT si le serveur l'annonce
+    --concurrency N: Nombre d'injections HTTP simultanées (défaut: 100)
+    --pool-size N: Nombre de connexions HTTP keep-alive (défaut: concurrency)
+    --rate R: Boucle ouverte à R messages/s (tous protocoles), latence mesurée depuis l'instant prévu
+    --max-in-flight N: Plafond d'envois en cours en boucle ouverte (défaut: 10000)
+    --duration D: Durée maximale du run (90s, 10m, 2h), de chaque phase avec --isolation; Ctrl+C arrête proprement
+    --isolation: Mesure d'abord chaque protocole seul (même part du débit ou même concurrence), puis le run mixte
+    --local: Cible localhost:LOCAL_SMTP_PORT et localhost:LOCAL_HTTP_PORT sans Kubernetes (ex. python3 -m kumoload.sink)
+    --corpus N: Pré-rend N messages par protocole avant le run (jeton unique inséré à l'envoi, sans copie)
+    --message-size SPEC: Distribution des tailles du corpus, ex. 4KB, 2KB-2MB, 2KB:70,2MB:30 (défaut: 4KB)
+    --processes N: Répartit les messages sur N processus, compteurs et histogrammes fusionnés (défaut: 1)
+    --report-interval S: Rapport en direct (tous protocoles) toutes les S secondes (défaut: 1, 0 = jamais)
+    --timeseries FICHIER: Série temporelle des intervalles en JSONL (ou CSV si .csv)
+    --metrics: Relève les métriques kumod (queues, mémoire, connexions) pendant le run et jusqu'au vidage des queues
+    --metrics-url URL: Endpoint Prometheus (défaut: http://localhost:LOCAL_HTTP_PORT/metrics)
+    --drain-timeout S: Attente maximale du vidage des queues après l'injection (défaut: 300)
+    --histogram-out FICHIER: Exporte l'histogramme combiné du run mixte en JSON (fusionnable)
+    --result-json FICHIER: Exporte le résultat (combiné, par protocole, interférence) en JSON structuré
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import functools
+import random
+import signal
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+from email.mime.text import MIMEText
+
+from kumoload.k8s import cleanup_port_forwards, require_service, setup_environment, setup_port_forward
+
+# Appeler setup_environment avant les imports (les clients asyncio SMTP et HTTP n'utilisent que la bibliothèque standard)
+setup_environment(__file__, ready="✓ Environnement prêt (bibliothèque standard uniquement)")
+
+from kumoload.smtp_async import MessageData, SMTPSessionPool, send_with_timing
+from kumoload.http_async import HTTPConnectionPool, basic_auth_header, post_with_timing
+from kumoload.corpus import Corpus, make_token
+from kumoload.histogram import format_summary
+from kumoload.interference import (PROTOCOLS, ProtocolSplit, combine, format_interference, format_protocol_table,
+                                   interference_record)
+from kumoload.metrics import MetricsScraper
+from kumoload.runner import UNBOUNDED_MESSAGES, RunLimit, run_closed_loop, run_open_loop, raise_nofile_limit
+from kumoload.reporter import CounterRegistry, IntervalPublisher, LiveReporter, ProgressChannel
+from kumoload.schedule import parse_duration
+from kumoload.stats import RunStats, run_record
+from kumoload.workers import process_context, progress_channel, run_in_processes, shard_range, split_evenly
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+def parse_args() -> argparse.Namespace:
+    """Lit les arguments de la ligne de commande (les variables d'environnement restent prioritaires)"""
+    parser = argparse.ArgumentParser(description="Test de performance mixte SMTP + HTTP KumoMTA")
+    parser.add_argument('num_messages', nargs='?', type=int,
+                        help="Nombre de messages à envoyer, tous protocoles confondus (défaut: 1000, sans limite avec --duration)")
+    parser.add_argument('--ratio', default=os.getenv('PROTOCOL_RATIO', 'smtp:50,http:50'),
+                        help="Répartition des messages: smtp:70,http:30, 70:30 (SMTP:HTTP) ou 0.7 (part SMTP)")
+    parser.add_argument('--sessions', type=int, default=int(os.getenv('SMTP_SESSIONS', 100)),
+                        help="Nombre de sessions SMTP simultanées (défaut: 100)")
+    parser.add_argument('--messages-per-session', type=int, default=int(os.getenv('MESSAGES_PER_SESSION', 10)),
+                        help="Nombre de transactions par session avant QUIT (défaut: 10)")
+    parser.add_argument('--pipelining', action='store_true', default=os.getenv('SMTP_PIPELINING') == '1',
+                        help="Utilise ESMTP PIPELINING si le serveur l'annonce")
+    parser.add_argument('--chunking', action='store_true', default=os.getenv('SMTP_CHUNKING') == '1',
+                        help="Utilise ESMTP CHUNKING/BDAT si le serveur l'annonce")
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('HTTP_CONCURRENCY', 100)),
+                        help="Nombre d'injections HTTP simultanées (défaut: 100)")
+    parser.add_argument('--pool-size', type=int, default=int(os.getenv('HTTP_POOL_SIZE', 0)),
+                        help="Nombre de connexions HTTP keep-alive (défaut: concurrency)")
+    parser.add_argument('--rate', type=float, default=float(os.getenv('RATE', 0)),
+                        help="Boucle ouverte: débit cible en messages/s tous protocoles, un seul ordonnanceur")
+    parser.add_argument('--max-in-flight', type=int, default=int(os.getenv('MAX_IN_FLIGHT', 10000)),
+                        help="Plafond d'envois en cours en boucle ouverte (défaut: 10000)")
+    parser.add_argument('--duration', default=os.getenv('DURATION'),
+                        help="Durée maximale du run, de chaque phase avec --isolation (90s, 10m, 2h)")
+    parser.add_argument('--isolation', action='store_true', default=os.getenv('ISOLATION') == '1',
+                        help="Mesure chaque protocole seul avant le run mixte (écart des percentiles = interférence)")
+    parser.add_argument('--local', action='store_true', default=os.getenv('LOCAL_TARGET') == '1',
+                        help="Cible localhost sans kubectl ni port-forward (ex. python3 -m kumoload.sink)")
+    parser.add_argument('--corpus', type=int, default=int(os.getenv('CORPUS_SIZE', 0)),
+                        help="Pré-rend N messages par protocole avant le run, seul un jeton unique est inséré à l'envoi")
+    parser.add_argument('--message-size', default=os.getenv('MESSAGE_SIZE', '4KB'),
+                        help="Distribution des tailles du corpus: 4KB, 2KB-2MB ou 2KB:70,50KB:25,2MB:5 (défaut: 4KB)")
+    parser.add_argument('--processes', type=int, default=int(os.getenv('PROCESSES', 1)),
+                        help="Répartit les messages sur N processus (sessions, connexions et débit partagés entre eux)")
+    parser.add_argument('--report-interval', type=float, default=float(os.getenv('REPORT_INTERVAL', 1)),
+                        help="Affiche débit, taux d'erreur et percentiles toutes les N secondes, 0 = jamais (défaut: 1)")
+    parser.add_argument('--timeseries', default=os.getenv('TIMESERIES_OUT'),
+                        help="Écrit la série temporelle des intervalles (JSONL, ou CSV si le fichier finit par .csv)")
+    parser.add_argument('--metrics', action='store_true', default=os.getenv('METRICS_SCRAPE') == '1',
+                        help="Relève les métriques Prometheus de kumod pendant le run et jusqu'au vidage des queues")
+    parser.add_argument('--metrics-url', default=os.getenv('METRICS_URL'),
+                        help="Endpoint des métriques (défaut: http://localhost:LOCAL_HTTP_PORT/metrics)")
+    parser.add_argument('--metrics-interval', type=float, default=float(os.getenv('METRICS_INTERVAL', 1)),
+                        help="Intervalle entre deux relevés en secondes (défaut: 1)")
+    parser.add_argument('--drain-timeout', type=float, default=float(os.getenv('DRAIN_TIMEOUT', 300)),
+                        help="Attente maximale du vidage des queues après l'injection, 0 = pas d'attente (défaut: 300)")
+    parser.add_argument('--histogram-out', default=os.getenv('HISTOGRAM_OUT'),
+                        help="Exporte l'histogramme combiné du run mixte en JSON (fusionnable avec python3 -m kumoload.histogram)")
+    parser.add_argument('--result-json', default=os.getenv('RESULT_JSON'),
+                        help="Exporte le résultat du run (combiné, par protocole, interférence) en JSON structuré")
+    parser.add_argument('--histogram-digits', type=int, default=int(os.getenv('HISTOGRAM_DIGITS', 3)),
+                        help="Précision de l'histogramme en chiffres significatifs, 1 à 5 (défaut: 3)")
+    return parser.parse_args()
+
+ARGS = parse_args()
+
+# Nombre de messages à envoyer, tous protocoles confondus (par défaut: 1000)
+NUM_MESSAGES = int(os.getenv('NUM_MESSAGES', ARGS.num_messages if ARGS.num_messages is not None else 1000))
+
+# Durée maximale du run: sans nombre de messages explicite, seule l'échéance arrête l'injection
+try:
+    DURATION = parse_duration(ARGS.duration) if ARGS.duration else 0.0
+except ValueError as e:
+    sys.exit(f"✗ Erreur: {e}")
+if DURATION > 0 and ((ARGS.num_messages is None and 'NUM_MESSAGES' not in os.environ) or NUM_MESSAGES <= 0):
+    NUM_MESSAGES = UNBOUNDED_MESSAGES
+
+# Répartition des messages entre SMTP et HTTP (entrelacés, déterministe par numéro de message)
+try:
+    SPLIT = ProtocolSplit.from_spec(ARGS.ratio)
+except ValueError as e:
+    sys.exit(f"✗ Erreur: {e}")
+
+# Sessions SMTP persistantes et injections HTTP keep-alive
+SMTP_SESSIONS = ARGS.sessions
+MESSAGES_PER_SESSION = ARGS.messages_per_session
+SMTP_PIPELINING = ARGS.pipelining
+SMTP_CHUNKING = ARGS.chunking
+HTTP_CONCURRENCY = ARGS.concurrency
+HTTP_POOL_SIZE = ARGS.pool_size or HTTP_CONCURRENCY
+
+# Boucle ouverte (un seul ordonnanceur pour les deux protocoles) si RATE > 0
+RATE = ARGS.rate
+MAX_IN_FLIGHT = ARGS.max_in_flight
+
+# Phases isolées (chaque protocole seul) avant le run mixte
+ISOLATION = ARGS.isolation
+
+# Cible locale (sink kumoload ou kumod hors cluster): pas de kubectl ni de port-forward
+LOCAL_TARGET = ARGS.local
+
+# Corpus de messages pré-rendus par protocole (0 = message construit à chaque envoi)
+CORPUS_SIZE = ARGS.corpus
+MESSAGE_SIZE = ARGS.message_size
+
+# Nombre de processus workers (chacun avec sa boucle asyncio et ses pools SMTP/HTTP)
+PROCESSES = max(1, ARGS.processes)
+
+# Rapport d'intervalle en direct et série temporelle (tous protocoles)
+REPORT_INTERVAL = ARGS.report_interval
+TIMESERIES_OUT = ARGS.timeseries
+
+# Relevé des métriques kumod (endpoint /metrics du listener HTTP) et attente du vidage des queues
+METRICS_SCRAPE = ARGS.metrics or bool(ARGS.metrics_url)
+METRICS_INTERVAL = ARGS.metrics_interval
+DRAIN_TIMEOUT = ARGS.drain_timeout
+
+# Histogramme des latences et résultat structuré
+HISTOGRAM_OUT = ARGS.histogram_out
+HISTOGRAM_DIGITS = ARGS.histogram_digits
+RESULT_JSON = ARGS.result_json
+
+# Configuration Kubernetes par défaut
+NAMESPACE = os.getenv('NAMESPACE', 'kumomta')
+RELEASE_NAME = os.getenv('RELEASE_NAME', 'kumomta')
+SERVICE_NAME = os.getenv('SERVICE_NAME', RELEASE_NAME)
+SMTP_PORT = int(os.getenv('SMTP_PORT', 2500))
+LOCAL_SMTP_PORT = int(os.getenv('LOCAL_SMTP_PORT', 2500))
+HTTP_PORT = int(os.getenv('HTTP_PORT', 8000))
+LOCAL_HTTP_PORT = int(os.getenv('LOCAL_HTTP_PORT', 8000))
+
+# Métriques kumod: servies par le listener HTTP (même port-forward que l'injection)
+METRICS_URL = ARGS.metrics_url or f"http://localhost:{LOCAL_HTTP_PORT}/metrics"
+
+# Authentification HTTP
+HTTP_USER = os.getenv('HTTP_USER', 'user1')
+HTTP_PASSWORD = os.getenv('HTTP_PASSWORD', 'default-password')
+
+# Domaines pour générer les adresses destinataires
+DOMAINS = ['gmail.com', 'yahoo.com', 'hotmail.com']
+
+# Chemin de l'API d'injection
+INJECT_PATH = "/api/inject/v1"
+
+FROM_EMAIL = "perf-test@talk.stir.com"
+FROM_NAME = "Performance Test"
+
+# Corpus pré-rendus par protocole (créés avant le run, hérités par les processus workers)
+corpora: Dict[str, Corpus] = {}
+
+# Fin anticipée de chaque phase (--duration, Ctrl+C): créée par main avant le fork des processus workers
+run_limit = RunLimit()
+
+# ============================================================================
+# FONCTIONS UTILITAIRES
+# ============================================================================
+
+def generate_random_email() -> str:
+    """Génère une adresse email aléatoire sur un des domaines spécifiés"""
+    domain = random.choice(DOMAINS)
+    username = f"test{int(time.time())}{random.randint(1000, 9999)}"
+    return f"{username}@{domain}"
+
+def prepare_kubernetes_target():
+    """Vérifie kubectl et le service, puis ouvre les port-forwards SMTP et HTTP"""
+    service = require_service(NAMESPACE, RELEASE_NAME, SERVICE_NAME)
+
+    for local_port, remote_port, variable in ((LOCAL_SMTP_PORT, SMTP_PORT, 'LOCAL_SMTP_PORT'),
+                                              (LOCAL_HTTP_PORT, HTTP_PORT, 'LOCAL_HTTP_PORT')):
+        if not setup_port_forward(NAMESPACE, service, local_port, remote_port, variable):
+            print("✗ Impossible de configurer le port-forward")
+            cleanup_port_forwards()
+            sys.exit(1)
+
+def check_port(port: int) -> bool:
+    """Test de connexion TCP rapide"""
+    try:
+        socket.create_connection(('localhost', port), timeout=5).close()
+        return True
+    except OSError:
+        return False
+
+# ============================================================================
+# MESSAGES
+# ============================================================================
+
+def build_smtp_message(message_num: int, to_email: str) -> bytes:
+    """Construit le message MIME de test envoyé par SMTP"""
+    msg = MIMEText(f"""Performance test message #{message_num}
+
+This is a mixed SMTP + HTTP performance test message sent via SMTP.
+Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+Message ID: {message_num}
+Recipient: {to_email}
+
+This message is used to test queues, spools and generate metrics.
+Mode: SINK (messages will not be delivered)""")
+    msg['From'] = f"{FROM_NAME} <{FROM_EMAIL}>"
+    msg['To'] = to_email
+    msg['Subject'] = f"Performance Test #{message_num} - {datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    msg['X-Test-ID'] = make_token(message_num).decode('ascii')
+    return msg.as_string().encode('utf-8')
+
+def build_http_payload(message_num: int, to_email: str) -> dict:
+    """Construit le payload JSON d'injection envoyé par HTTP"""
+    return {
+        "envelope_sender": FROM_EMAIL,
+        "content": {
+            "text_body": f"""Performance test message #{message_num}
+
+This is a mixed SMTP + HTTP performance test message sent via HTTP API.
+Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+Message ID: {message_num}
+Recipient: {to_email}
+
+This message is used to test queues, spools and generate metrics.
+Mode: SINK (messages will not be delivered)""",
+            "from": {"email": FROM_EMAIL, "name": FROM_NAME},
+            "subject": f"Performance Test #{message_num} - {datetime.now().strftime('%Y%m%d-%H%M%S')}",
+            "headers": {"X-Test-ID": make_token(message_num).decode('ascii')}
+        },
+        "recipients": [{"email": to_email}]
+    }
+
+def get_corpus(protocol: str) -> Corpus:
+    """Rend le corpus d'un protocole une seule fois par processus (avant le fork des workers dans main)"""
+    if protocol not in corpora:
+        corpora[protocol] = Corpus(CORPUS_SIZE, MESSAGE_SIZE, protocol, from_header=f"{FROM_NAME} <{FROM_EMAIL}>")
+    return corpora[protocol]
+
+CORPUS_PAYLOAD_HEAD = f'{{"envelope_sender": "{FROM_EMAIL}", "content": "'.encode('utf-8')
+
+def smtp_data(message_num: int, to_email: str) -> MessageData:
+    """Contenu DATA/BDAT: message du corpus (jeton inséré, sans copie) ou message construit"""
+    if CORPUS_SIZE:
+        return get_corpus('smtp').entry(message_num).smtp_data(make_token(message_num))
+    return build_smtp_message(message_num, to_email)
+
+def http_body(message_num: int, to_email: str):
+    """Corps de la requête d'injection: segments du corpus (MIME pré-rendu) ou payload JSON construit"""
+    if CORPUS_SIZE:
+        recipients = json.dumps([{"email": to_email}]).encode('utf-8')
+        return [CORPUS_PAYLOAD_HEAD, *get_corpus('http').entry(message_num).json.segments(make_token(message_num)),
+                b'", "recipients": ' + recipients + b'}']
+    return json.dumps(build_http_payload(message_num, to_email)).encode('utf-8')
+
+# ============================================================================
+# MOTEUR D'ENVOI
+# ============================================================================
+
+async def run_async_engine(message_nums: range, protocols: Sequence[str], sessions: int, concurrency: int,
+                           rate: float, stats: Dict[str, RunStats], registries: Dict[str, CounterRegistry]):
+    """
+    Envoie les messages des protocoles donnés: pools SMTP et HTTP dans une même boucle asyncio
+
+    Un seul ordonnanceur consomme les numéros de message des deux protocoles entrelacés: le mix
+    reste au ratio pendant tout le run, sans fin de run à un seul protocole.
+    Boucle fermée: sessions + injections workers, chaque protocole limité à sa concurrence.
+    Boucle ouverte: les messages sont déclenchés à débit constant.
+    """
+    counts = SPLIT.count(message_nums)
+    sessions = min(sessions, counts['smtp']) if 'smtp' in protocols else 0
+    concurrency = min(concurrency, counts['http']) if 'http' in protocols else 0
+    pool_size = min(HTTP_POOL_SIZE, concurrency)
+    raise_nofile_limit(sessions + pool_size + 64)
+    smtp_pool = SMTPSessionPool('localhost', LOCAL_SMTP_PORT, sessions, MESSAGES_PER_SESSION,
+                                pipelining=SMTP_PIPELINING, chunking=SMTP_CHUNKING) if sessions else None
+    http_pool = HTTPConnectionPool('localhost', LOCAL_HTTP_PORT, pool_size, default_headers={
+        'Authorization': basic_auth_header(HTTP_USER, HTTP_PASSWORD),
+        'Content-Type': 'application/json',
+    }) if pool_size else None
+
+    async def send(message_num: int) -> Tuple[str, bool, float, Optional[str]]:
+        to_email = generate_random_email()
+        if SPLIT.protocol_of(message_num) == 'smtp':
+            success, elapsed_ms, error = await send_with_timing(smtp_pool, FROM_EMAIL, [to_email],
+                                                                smtp_data(message_num, to_email))
+            return 'smtp', success, elapsed_ms, error
+        success, elapsed_ms, error = await post_with_timing(http_pool, INJECT_PATH, http_body(message_num, to_email))
+        return 'http', success, elapsed_ms, error
+
+    async def send_one(message_num: int):
+        protocol, success, elapsed_ms, error = await send(message_num)
+        registries[protocol].worker().record(success, elapsed_ms, error)
+
+    async def send_scheduled(message_num: int, scheduled: float):
+        protocol, success, _, error = await send(message_num)
+        # Latence vue du producteur: depuis l'instant prévu, attente d'une session ou connexion libre comprise
+        registries[protocol].worker().record(success, (time.perf_counter() - scheduled) * 1000, error)
+
+    # Tirage paresseux des messages, interrompu à l'échéance (--duration) ou sur Ctrl+C
+    items = SPLIT.select(run_limit.take(message_nums), protocols)
+    try:
+        if rate > 0:
+            loop_stats = await run_open_loop(send_scheduled, items, rate, MAX_IN_FLIGHT)
+            for protocol in protocols:
+                stats[protocol].set_max('schedule_duration_s', loop_stats.duration)
+                stats[protocol].set_max('schedule_lag_ms', loop_stats.max_lag_ms)
+        else:
+            # Créneaux par protocole: l'attente d'une session ou d'une injection libre n'est pas comptée
+            slots = {'smtp': asyncio.Semaphore(max(1, sessions)), 'http': asyncio.Semaphore(max(1, concurrency))}
+
+            async def send_in_slot(message_num: int):
+                async with slots[SPLIT.protocol_of(message_num)]:
+                    await send_one(message_num)
+
+            await run_closed_loop(send_in_slot, items, sessions + concurrency)
+    finally:
+        if smtp_pool is not None:
+            await smtp_pool.close()
+        if http_pool is not None:
+            await http_pool.close()
+
+    if smtp_pool is not None:
+        stats['smtp'].add_counter('sessions_opened', smtp_pool.sessions_opened)
+        stats['smtp'].add_counter('round_trips_saved', smtp_pool.round_trips_saved)
+    if http_pool is not None:
+        stats['http'].add_counter('connections_opened', http_pool.connections_opened)
+
+def new_protocol_stats() -> Dict[str, RunStats]:
+    return {protocol: RunStats(HISTOGRAM_DIGITS) for protocol in PROTOCOLS}
+
+def run_engine(message_nums: range, protocols: Sequence[str], rate: float, stats: Dict[str, RunStats],
+               registries: Dict[str, CounterRegistry], shard_index: int = 0, shard_count: int = 1):
+    """Exécute le moteur sur une tranche de messages, avec sa part de la concurrence et du débit"""
+    sessions = split_evenly(SMTP_SESSIONS, shard_count, shard_index)
+    concurrency = split_evenly(HTTP_CONCURRENCY, shard_count, shard_index)
+    rate = split_evenly(rate, shard_count, shard_index)
+    asyncio.run(run_async_engine(message_nums, protocols, sessions, concurrency, rate, stats, registries))
+    for protocol, registry in registries.items():
+        stats[protocol].merge(registry.checkpoint())
+
+def run_shard(shard_index: int, shard_count: int, message_nums: range, protocols: Sequence[str],
+              rate: float) -> dict:
+    """Point d'entrée d'un processus worker (--processes): retourne ses compteurs par protocole à fusionner"""
+    stats = new_protocol_stats()
+    registries = {protocol: CounterRegistry(HISTOGRAM_DIGITS) for protocol in PROTOCOLS}
+    publishers = []
+    if progress_channel() is not None:
+        publishers = [IntervalPublisher(registry, progress_channel()).start() for registry in registries.values()]
+    try:
+        shard = shard_range(len(message_nums), shard_count, shard_index, message_nums.start)
+        run_engine(shard, protocols, rate, stats, registries, shard_index, shard_count)
+    finally:
+        for publisher in publishers:
+            publisher.stop()
+    return {protocol: protocol_stats.to_dict() for protocol, protocol_stats in stats.items()}
+
+def run_phase(message_nums: range, protocols: Sequence[str], rate: float, registries: Dict[str, CounterRegistry],
+              progress=None) -> Dict[str, RunStats]:
+    """Envoie les messages des protocoles donnés, dans ce processus ou répartis sur PROCESSES"""
+    stats = new_protocol_stats()
+    if PROCESSES > 1:
+        target = functools.partial(run_shard, message_nums=message_nums, protocols=protocols, rate=rate)
+        for shard in run_in_processes(target, PROCESSES, progress):
+            for protocol, data in shard.items():
+                stats[protocol].merge(RunStats.from_dict(data))
+    else:
+        run_engine(message_nums, protocols, rate, stats, registries)
+    return stats
+
+class Phase:
+    """Une phase du run: protocoles actifs, plage de numéros de message, débit et résultats"""
+
+    def __init__(self, name: str, protocols: Sequence[str], message_nums: range, rate: float):
+        self.name = name
+        self.protocols = list(protocols)
+        self.message_nums = message_nums
+        self.rate = rate
+        self.stats: Dict[str, RunStats] = {}
+        self.duration = 0.0
+        # Phase arrêtée avant la fin de sa plage (échéance --duration ou Ctrl+C)
+        self.cut_short = False
+
+    @property
+    def messages(self) -> int:
+        counts = SPLIT.count(self.message_nums)
+        return sum(counts[protocol] for protocol in self.protocols)
+
+    @property
+    def active_stats(self) -> Dict[str, RunStats]:
+        return {protocol: self.stats[protocol] for protocol in self.protocols}
+
+def plan_phases() -> List[Phase]:
+    """
+    Phases du run: chaque protocole seul (--isolation), puis le run mixte
+
+    Chaque phase a sa propre plage de numéros (jetons X-Test-ID uniques) et envoie exactement les
+    messages de ses protocoles que le run mixte enverrait: même volume, même part du débit.
+    Sans limite de messages (--duration seule), les phases se partagent l'espace des numéros.
+    """
+    phases = []
+    span = NUM_MESSAGES
+    if NUM_MESSAGES == UNBOUNDED_MESSAGES:
+        span //= len(SPLIT.active) + 1 if ISOLATION else 1
+    if ISOLATION:
+        for protocol in SPLIT.active:
+            first = len(phases) * span + 1
+            phases.append(Phase(f"{protocol.upper()} seul", [protocol], range(first, first + span),
+                                RATE * SPLIT.shares[protocol]))
+    first = len(phases) * span + 1
+    phases.append(Phase("Mixte", SPLIT.active, range(first, first + span), RATE))
+    return phases
+
+def save_result(phases: List[Phase], scraper: Optional[MetricsScraper]):
+    """Exporte le résultat du run mixte en JSON structuré (--result-json): combiné, par protocole, interférence"""
+    mixed = phases[-1]
+    record = run_record(combine(mixed.active_stats), mixed.duration, protocol='mixed', engine='async',
+                        messages=NUM_MESSAGES if NUM_MESSAGES != UNBOUNDED_MESSAGES else None,
+                        max_duration=DURATION or None, ratio=SPLIT.shares, sessions=SMTP_SESSIONS,
+                        messages_per_session=MESSAGES_PER_SESSION, pipelining=SMTP_PIPELINING,
+                        chunking=SMTP_CHUNKING, concurrency=HTTP_CONCURRENCY, pool_size=HTTP_POOL_SIZE, rate=RATE,
+                        processes=PROCESSES, corpus=CORPUS_SIZE, message_size=MESSAGE_SIZE, isolation=ISOLATION)
+    record['protocols'] = {protocol: run_record(stats, mixed.duration) for protocol, stats in mixed.active_stats.items()}
+    for protocol_record in record['protocols'].values():
+        del protocol_record['config']
+    if run_limit.interrupted:
+        # Ctrl+C: rapport partiel
+        record['interrupted'] = True
+    if ISOLATION:
+        record['isolation'] = {phase.protocols[0]: run_record(phase.stats[phase.protocols[0]], phase.duration)
+                               for phase in phases[:-1]}
+        for protocol_record in record['isolation'].values():
+            del protocol_record['config']
+        record['interference'] = interference_record(
+            {phase.protocols[0]: phase.stats[phase.protocols[0]] for phase in phases[:-1]}, mixed.stats)
+    if scraper is not None:
+        record['drain_s'] = scraper.drain_seconds
+        record['drain_resolution_s'] = scraper.drain_resolution
+    with open(RESULT_JSON, 'w') as f:
+        json.dump(record, f)
+    print(f"✓ Résultat structuré exporté: {RESULT_JSON}")
+
+def start_metrics_scraper() -> Optional[MetricsScraper]:
+    """Relevé initial des métriques kumod puis relevés périodiques (None si l'endpoint est injoignable)"""
+    try:
+        scraper = MetricsScraper(METRICS_URL, METRICS_INTERVAL).start()
+    except (OSError, ValueError) as e:
+        print(f"⚠ Métriques kumod injoignables ({METRICS_URL}): {e}")
+        print("  Le test continue sans relevé des métriques\n")
+        return None
+    print(f"✓ Métriques kumod: {METRICS_URL} (queues au départ: {scraper.baseline.queue_depth:.0f} messages)\n")
+    return scraper
+
+def wait_for_drain(scraper: MetricsScraper):
+    """Fin de l'injection: attend le retour des queues à leur niveau initial, puis arrête le relevé"""
+    scraper.mark_injection_end()
+    if DRAIN_TIMEOUT > 0 and not run_limit.interrupted:
+        print(f"\n⏳ Injection terminée, attente du vidage des queues (max {DRAIN_TIMEOUT:g} s)...")
+        drain = scraper.wait_drained(DRAIN_TIMEOUT)
+        if drain is None:
+            print(f"⚠ Queues non vidées après {DRAIN_TIMEOUT:g} s")
+        else:
+            print(f"✓ Queues vidées {drain:.1f} s (± {scraper.drain_resolution:.1f} s) après la fin de l'injection")
+    scraper.stop()
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main():
+    print("=" * 60)
+    print("Test de Performance - Injection mixte SMTP + HTTP KumoMTA")
+    print("=" * 60)
+    if not LOCAL_TARGET:
+        print(f"Service: {SERVICE_NAME}")
+        print(f"Namespace: {NAMESPACE}")
+    print(f"Ports locaux: SMTP {LOCAL_SMTP_PORT}, HTTP {LOCAL_HTTP_PORT}")
+    if NUM_MESSAGES == UNBOUNDED_MESSAGES:
+        print(f"Nombre de messages: sans limite ({SPLIT.describe()})")
+    else:
+        print(f"Nombre de messages: {NUM_MESSAGES}{' au plus' if DURATION > 0 else ''} ({SPLIT.describe()})")
+    if DURATION > 0:
+        print(f"Durée maximale: {ARGS.duration} ({DURATION:g} s{' par phase' if ISOLATION else ''})")
+    print(f"SMTP: {SMTP_SESSIONS} sessions, {MESSAGES_PER_SESSION} messages/session")
+    print(f"HTTP: {HTTP_CONCURRENCY} injections en vol, {HTTP_POOL_SIZE} connexions keep-alive")
+    if RATE > 0:
+        print(f"Boucle ouverte: {RATE:g} msg/s tous protocoles (max {MAX_IN_FLIGHT} envois en cours)")
+    extensions = [name for name, enabled in (('PIPELINING', SMTP_PIPELINING), ('CHUNKING', SMTP_CHUNKING)) if enabled]
+    if extensions:
+        print(f"Extensions ESMTP demandées: {', '.join(extensions)}")
+    print()
+
+    if TIMESERIES_OUT and REPORT_INTERVAL <= 0:
+        print("✗ Erreur: --timeseries nécessite --report-interval > 0")
+        sys.exit(1)
+
+    if NUM_MESSAGES <= 0:
+        print("✗ Erreur: le nombre de messages doit être positif")
+        sys.exit(1)
+
+    if LOCAL_TARGET:
+        # Sink local (python3 -m kumoload.sink) ou kumod hors cluster: ni kubectl ni port-forward
+        print(f"✓ Mode local: cible localhost:{LOCAL_SMTP_PORT} (SMTP) et localhost:{LOCAL_HTTP_PORT} (HTTP)")
+    else:
+        prepare_kubernetes_target()
+
+    # Fin anticipée: échéance --duration et Ctrl+C (événement partagé avec les processus workers)
+    global run_limit
+    run_limit = RunLimit(DURATION, process_context().Event() if PROCESSES > 1 else None)
+
+    def interrupt(signum, frame):
+        # Pendant l'injection, un premier Ctrl+C arrête les nouveaux envois et garde le rapport
+        if run_limit.running and not run_limit.interrupted:
+            run_limit.stop()
+            print("\n⚠ Interruption: fin des envois en cours puis rapport partiel (Ctrl+C à nouveau pour quitter)",
+                  flush=True)
+            return
+        cleanup_port_forwards()
+        sys.exit(0)
+
+    # Enregistrer le handler de nettoyage
+    signal.signal(signal.SIGINT, interrupt)
+    signal.signal(signal.SIGTERM, lambda s, f: (cleanup_port_forwards(), sys.exit(0)))
+
+    try:
+        # Test de connexion rapide
+        print("\n⏳ Test de connexion aux ports SMTP et HTTP...")
+        for name, port in (('SMTP', LOCAL_SMTP_PORT), ('HTTP', LOCAL_HTTP_PORT)):
+            if check_port(port):
+                print(f"✓ Port {name} accessible")
+            else:
+                print(f"⚠ Le port {name} ne répond pas encore, mais on continue...")
+
+        phases = plan_phases()
+        print(f"\n{'=' * 60}")
+        print("Démarrage du test de performance")
+        if RATE > 0:
+            print(f"Boucle ouverte: un seul ordonnanceur, protocoles entrelacés, latence mesurée depuis l'instant prévu")
+        else:
+            print(f"Boucle fermée: {SMTP_SESSIONS} sessions SMTP et {HTTP_CONCURRENCY} injections HTTP simultanées")
+        if ISOLATION:
+            print(f"Phases: {', '.join(phase.name for phase in phases)} (écart seul/mixte = interférence)")
+        if PROCESSES > 1:
+            print(f"Processus: {PROCESSES} (concurrence et débit répartis entre les processus)")
+        print(f"{'=' * 60}\n")
+
+        if CORPUS_SIZE:
+            print(f"⏳ Rendu des corpus ({CORPUS_SIZE} messages par protocole, tailles {MESSAGE_SIZE})...")
+            try:
+                for protocol in SPLIT.active:
+                    print(f"✓ Corpus {protocol.upper()}: {get_corpus(protocol).describe()}")
+                print()
+            except ValueError as e:
+                print(f"✗ Erreur: {e}")
+                sys.exit(1)
+
+        scraper = start_metrics_scraper() if METRICS_SCRAPE else None
+        registries = {protocol: CounterRegistry(HISTOGRAM_DIGITS) for protocol in PROTOCOLS}
+        start_run = time.time()
+        reporter = None
+        progress = None
+        if REPORT_INTERVAL > 0:
+            if PROCESSES > 1:
+                # Les processus workers publient leurs intervalles (un par protocole) sur un canal commun
+                progress = ProgressChannel(process_context(), REPORT_INTERVAL)
+                reporter = LiveReporter.for_channel(progress, timeseries_path=TIMESERIES_OUT,
+                                                    histogram_digits=HISTOGRAM_DIGITS).start()
+            else:
+                reporter = LiveReporter(lambda: [registry.collect() for registry in registries.values()],
+                                        REPORT_INTERVAL, TIMESERIES_OUT, HISTOGRAM_DIGITS).start()
+        try:
+            for phase in phases:
+                if run_limit.interrupted:
+                    # Ctrl+C pendant une phase isolée: les phases suivantes ne sont pas lancées
+                    phase.stats = new_protocol_stats()
+                    continue
+                if len(phases) > 1:
+                    rate = f", {phase.rate:g} msg/s" if phase.rate > 0 else ""
+                    volume = "sans limite de messages" if NUM_MESSAGES == UNBOUNDED_MESSAGES else f"{phase.messages} messages"
+                    print(f"\n⏳ Phase {phase.name}: {volume}{rate}", flush=True)
+                started = time.time()
+                # L'échéance --duration part au début de chaque phase
+                run_limit.start(started)
+                try:
+                    phase.stats = run_phase(phase.message_nums, phase.protocols, phase.rate, registries, progress)
+                finally:
+                    run_limit.finish()
+                phase.duration = time.time() - started
+                phase.cut_short = run_limit.cut_short
+        finally:
+            if reporter is not None:
+                reporter.stop()
+        run_duration = time.time() - start_run
+        mixed = phases[-1]
+        combined = combine(mixed.active_stats)
+        if run_limit.interrupted:
+            sent = sum(stats.messages for phase in phases for stats in phase.active_stats.values())
+            print(f"\n⚠ Run interrompu après {run_duration:.1f} s ({sent} messages): rapport partiel")
+        elif any(phase.cut_short for phase in phases):
+            print(f"\n✓ Durée maximale atteinte ({ARGS.duration}): {combined.messages} messages envoyés "
+                  f"dans le run mixte")
+        if scraper is not None:
+            wait_for_drain(scraper)
+
+        # Calcul des statistiques
+        print(f"\n{'=' * 60}")
+        print("Statistiques")
+        print(f"{'=' * 60}\n")
+
+        total_failed = sum(stats.failed for phase in phases for stats in phase.active_stats.values())
+        if combined.messages:
+            smtp_counters = mixed.stats['smtp'].counters
+            http_counters = mixed.stats['http'].counters
+            print(f"Total de messages:     {combined.messages}")
+            print(f"Succès:                 {combined.success}")
+            print(f"Échecs:                 {combined.failed}")
+            print(f"Durée totale:           {mixed.duration:.2f} s")
+            print(f"Débit:                  {combined.messages / mixed.duration if mixed.duration else 0:.1f} msg/s")
+            if PROCESSES > 1:
+                print(f"Processus:              {PROCESSES}")
+            if 'smtp' in mixed.protocols:
+                print(f"Sessions SMTP ouvertes: {int(smtp_counters.get('sessions_opened', 0))}")
+            if 'http' in mixed.protocols:
+                print(f"Connexions HTTP ouvertes: {int(http_counters.get('connections_opened', 0))}")
+            if RATE > 0:
+                maxima = combined.maxima
+                print(f"Débit cible:            {RATE:g} msg/s (planifié sur {maxima.get('schedule_duration_s', 0):.2f} s)")
+                print(f"Retard max planning:    {maxima.get('schedule_lag_ms', 0):.2f} ms")
+            if combined.errors:
+                print("Erreurs les plus fréquentes:")
+                for error, count in combined.top_errors():
+                    print(f"  {count:>8} × {error}")
+            print()
+            if RATE > 0:
+                print("Latence depuis l'instant prévu (coordinated omission corrigé):")
+            for protocol, stats in mixed.active_stats.items():
+                print(f"Temps de réponse {protocol.upper()}:")
+                print(format_summary(stats.latency))
+            print("Temps de réponse combinés:")
+            print(format_summary(combined.latency))
+
+            print()
+            print(f"Taux de succès:         {combined.success * 100 / combined.messages:.1f}%")
+
+            print("\nPar protocole (run mixte):")
+            print(format_protocol_table(mixed.active_stats, mixed.duration))
+
+            if ISOLATION:
+                for phase in phases[:-1]:
+                    print(f"\nPhase {phase.name} ({phase.duration:.2f} s):")
+                    print(format_protocol_table(phase.active_stats, phase.duration))
+                print("\nInterférence (chaque protocole seul, puis pendant le run mixte):")
+                print(format_interference({phase.protocols[0]: phase.stats[phase.protocols[0]]
+                                           for phase in phases[:-1]}, mixed.stats))
+
+            if HISTOGRAM_OUT:
+                combined.latency.save(HISTOGRAM_OUT)
+                print(f"✓ Histogramme des latences (combiné) exporté: {HISTOGRAM_OUT}")
+            if TIMESERIES_OUT and reporter is not None:
+                print(f"✓ Série temporelle exportée: {TIMESERIES_OUT} ({reporter.rows} intervalles)")
+            if scraper is not None:
+                history = reporter.history if reporter is not None else [
+                    (start_run + run_duration, combined.messages, combined.messages / run_duration if run_duration else 0.0)]
+                print(f"\nMétriques kumod ({scraper.url}):")
+                print(scraper.format_report(sum(phase_stats.success for phase in phases
+                                                for phase_stats in phase.active_stats.values()), history))
+            if RESULT_JSON:
+                save_result(phases, scraper)
+        elif ISOLATION:
+            # Interrompu avant le run mixte: phases isolées déjà envoyées
+            for phase in phases[:-1]:
+                if any(stats.requests for stats in phase.active_stats.values()):
+                    print(f"Phase {phase.name} ({phase.duration:.2f} s):")
+                    print(format_protocol_table(phase.active_stats, phase.duration))
+
+        # Résumé final
+        if run_limit.interrupted:
+            print(f"\n{'=' * 60}")
+            print(f"⚠ Test de performance interrompu: rapport partiel ({total_failed} échec(s))")
+            print(f"{'=' * 60}")
+            sys.exit(130)
+        if total_failed == 0:
+            print(f"\n{'=' * 60}")
+            print("✓ Test de performance réussi")
+            print(f"{'=' * 60}")
+            sys.exit(0)
+        else:
+            print(f"\n{'=' * 60}")
+            print(f"⚠ Test de performance terminé avec {total_failed} échec(s)")
+            print(f"{'=' * 60}")
+            if not LOCAL_TARGET:
+                print("\nVérifiez les logs du pod KumoMTA pour plus de détails:")
+                print(f"  kubectl logs -n {NAMESPACE} -l app.kubernetes.io/name=kumomta --tail=100")
+            sys.exit(1)
+
+    finally:
+        cleanup_port_forwards()
+
+if __name__ == '__main__':
+    main()